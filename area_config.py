@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The area_config module contains the RelationConfig class, to be used by the areas module."""
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import cast
+import hashlib
+import json
+
+import util
+
+
+class RelationConfig:
+    """A relation configuration comes directly from static data, not a result of some external query."""
+    def __init__(self, parent_config: Dict[str, Any], my_config: Dict[str, Any]) -> None:
+        self.__parent = parent_config
+        self.__dict = my_config
+
+    def __get_property(self, key: str) -> Any:
+        """Gets the value of a property transparently."""
+        if key in self.__dict.keys():
+            return self.__dict[key]
+
+        if key in self.__parent.keys():
+            return self.__parent[key]
+
+        return None
+
+    def get_fingerprint(self) -> str:
+        """Gets a hash of the configuration, which changes when any property (except being active) changes."""
+        properties = [{key: value for key, value in config.items() if key != "inactive"}
+                      for config in (self.__parent, self.__dict)]
+        buf = json.dumps(properties, sort_keys=True, default=str)
+        return hashlib.sha256(buf.encode("utf-8")).hexdigest()
+
+    def set_active(self, active: bool) -> None:
+        """Sets if the relation is active."""
+        self.__dict["inactive"] = not active
+
+    def is_active(self) -> bool:
+        """Gets if the relation is active."""
+        return not cast(bool, self.__get_property("inactive"))
+
+    def get_osmrelation(self) -> int:
+        """Gets the OSM relation object's ID."""
+        return cast(int, self.__get_property("osmrelation"))
+
+    def get_refcounty(self) -> str:
+        """Gets the relation's refcounty identifier from reference."""
+        return cast(str, self.__get_property("refcounty"))
+
+    def get_refsettlement(self) -> str:
+        """Gets the relation's refsettlement identifier from reference."""
+        return cast(str, self.__get_property("refsettlement"))
+
+    def get_alias(self) -> List[str]:
+        """Gets the alias(es) of the relation: alternative names which are also accepted."""
+        return cast(List[str], self.__get_property("alias"))
+
+    def should_check_missing_streets(self) -> str:
+        """Return value can be 'yes', 'no' and 'only'."""
+        if self.__get_property("missing-streets"):
+            return cast(str, self.__get_property("missing-streets"))
+
+        return "yes"
+
+    def should_check_housenumber_letters(self) -> bool:
+        """Do we care if 42/B is missing when 42/A is provided?."""
+        if self.__get_property("housenumber-letters"):
+            return cast(bool, self.__get_property("housenumber-letters"))
+
+        return False
+
+    def set_housenumber_letters(self, housenumber_letters: bool) -> None:
+        """Sets the housenumber_letters property from code."""
+        self.__dict["housenumber-letters"] = housenumber_letters
+
+    def set_letter_suffix_style(self, letter_suffix_style: util.LetterSuffixStyle) -> None:
+        """Sets the letter suffix style."""
+        self.__dict["letter-suffix-style"] = letter_suffix_style
+
+    def get_letter_suffix_style(self) -> util.LetterSuffixStyle:
+        """Gets the letter suffix style."""
+        if self.__get_property("letter-suffix-style"):
+            return cast(util.LetterSuffixStyle, self.__get_property("letter-suffix-style"))
+        return util.LetterSuffixStyle.UPPER
+
+    def get_refstreets(self) -> Dict[str, str]:
+        """Returns an OSM name -> ref name map."""
+        if self.__get_property("refstreets"):
+            return cast(Dict[str, str], self.__get_property("refstreets"))
+        return {}
+
+    def set_filters(self, filters: Dict[str, Any]) -> None:
+        """Sets the 'filters' key from code."""
+        self.__dict["filters"] = filters
+
+    def get_filters(self) -> Dict[str, Any]:
+        """Returns a street name -> properties map."""
+        if self.__get_property("filters"):
+            return cast(Dict[str, Any], self.__get_property("filters"))
+        return {}
+
+    def get_filter_street(self, street: str) -> Dict[str, Any]:
+        """Returns a street from relation filters."""
+        filters = self.get_filters()
+        if street in filters.keys():
+            return cast(Dict[str, Any], filters[street])
+
+        return {}
+
+    def get_street_is_even_odd(self, street: str) -> bool:
+        """Determines in a relation's street is interpolation=all or not."""
+        street_props = self.get_filter_street(street)
+        interpolation_all = False
+        if "interpolation" in street_props:
+            if street_props["interpolation"] == "all":
+                interpolation_all = True
+
+        return not interpolation_all
+
+    def get_street_refsettlement(self, street: str) -> List[str]:
+        """Returns a list of refsettlement values specific to a street."""
+        ret = [self.__get_property("refsettlement")]
+        if not self.__get_property("filters"):
+            return ret
+
+        relation_filters = self.get_filters()
+        for filter_street, value in relation_filters.items():
+            if filter_street != street:
+                continue
+
+            if "refsettlement" in value.keys():
+                refsettlement = cast(str, value["refsettlement"])
+                ret = [refsettlement]
+            if "ranges" in value.keys():
+                for street_range in value["ranges"]:
+                    street_range_dict = cast(Dict[str, str], street_range)
+                    if "refsettlement" in street_range_dict.keys():
+                        ret.append(street_range_dict["refsettlement"])
+
+        return sorted(set(ret))
+
+    def get_street_filters(self) -> List[str]:
+        """Gets list of streets which are only in reference, but have to be filtered out."""
+        if self.__get_property("street-filters"):
+            return cast(List[str], self.__get_property("street-filters"))
+        return []
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The area_files module contains file handling functionality, to be used by the areas module."""
+
+from typing import Dict
+from typing import List
+from typing import TextIO
+from typing import Tuple
+from typing import cast
+import os
+import tempfile
+
+import compressed_files
+import config
+import external_sort
+import util
+
+# Street name -> list of (byte offset, length) spans of a TSV file.
+StreetIndex = Dict[str, List[Tuple[int, int]]]
+
+
+def build_street_index(path: str, column: int, has_header: bool) -> StreetIndex:
+    """
+    Builds a street index for a TSV file, where column is the index of the street name column.
+    Adjacent rows of the same street are merged into a single span.
+    """
+    index: StreetIndex = {}
+    offset = 0
+    with compressed_files.open_file(path, "rb") as stream:
+        first = has_header
+        for line in stream:
+            length = len(line)
+            if first:
+                first = False
+                offset += length
+                continue
+            tokens = line.decode("utf-8").strip().split("\t")
+            if len(tokens) > column and tokens[column]:
+                spans = index.setdefault(tokens[column], [])
+                if spans and spans[-1][0] + spans[-1][1] == offset:
+                    spans[-1] = (spans[-1][0], spans[-1][1] + length)
+                else:
+                    spans.append((offset, length))
+            offset += length
+    return index
+
+
+def get_index_path(path: str) -> str:
+    """Builds the file name of the street index of a TSV file."""
+    return path + ".idx"
+
+
+def get_file_fingerprint(path: str) -> str:
+    """Gets a string that changes when the file at path is modified."""
+    stat = os.stat(path)
+    return "%s\t%s" % (stat.st_size, stat.st_mtime_ns)
+
+
+def write_street_index(path: str, index_path: str, column: int, has_header: bool) -> StreetIndex:
+    """
+    Builds a street index for path and writes it to index_path. The index is written to a temporary
+    file first, so concurrent readers never see a partial index.
+    """
+    index = build_street_index(path, column, has_header)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_path)), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as stream:
+            # The first line describes the indexed file, so an outdated index can be detected.
+            stream.write(get_file_fingerprint(path) + "\n")
+            for street in sorted(index.keys()):
+                for offset, length in index[street]:
+                    stream.write("%s\t%s\t%s\n" % (street, offset, length))
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return index
+
+
+def read_street_index(path: str, index_path: str, column: int, has_header: bool) -> StreetIndex:
+    """Reads the street index of path, (re)building it in case it's missing or outdated."""
+    if not os.path.exists(index_path):
+        return write_street_index(path, index_path, column, has_header)
+
+    index: StreetIndex = {}
+    with open(index_path, "r") as stream:
+        if stream.readline().rstrip("\n") != get_file_fingerprint(path):
+            return write_street_index(path, index_path, column, has_header)
+        for line in stream:
+            street, offset, length = line.rstrip("\n").split("\t")
+            index.setdefault(street, []).append((int(offset), int(length)))
+    return index
+
+
+def read_street_lines(path: str, spans: List[Tuple[int, int]]) -> List[str]:
+    """Reads the rows of a single street from a TSV file, based on its spans from a street index. Spans
+    are in file order, so this only seeks forward, which is cheap for compressed files as well."""
+    lines: List[str] = []
+    with compressed_files.open_file(path, "rb") as stream:
+        for offset, length in spans:
+            stream.seek(offset)
+            lines += stream.read(length).decode("utf-8").splitlines()
+    return lines
+
+
+class RelationFiles:
+    """A relation's file interface provides access to files associated with a relation."""
+    def __init__(self, datadir: str, workdir: str, name: str):
+        self.__datadir = datadir
+        self.__workdir = workdir
+        self.__name = name
+
+    def __get_suffix(self) -> str:
+        """Gets the file name suffix of compressed files in the workdir."""
+        return compressed_files.SUFFIXES[compressed_files.get_format(self.__workdir)]
+
+    def get_ref_streets_path(self) -> str:
+        """Build the file name of the reference street list of a relation."""
+        return os.path.join(self.__workdir, "streets-reference-%s.lst" % self.__name + self.__get_suffix())
+
+    def get_ref_streets_stream(self, mode: str) -> TextIO:
+        """Opens the reference street list of a relation."""
+        path = self.get_ref_streets_path()
+        return cast(TextIO, compressed_files.open_file(path, mode))
+
+    def get_osm_streets_path(self) -> str:
+        """Build the file name of the OSM street list of a relation."""
+        return os.path.join(self.__workdir, "streets-%s.csv" % self.__name + self.__get_suffix())
+
+    def get_osm_streets_stream(self, mode: str) -> TextIO:
+        """Opens the OSM street list of a relation."""
+        path = self.get_osm_streets_path()
+        return cast(TextIO, compressed_files.open_file(path, mode))
+
+    def write_osm_streets(self, result_from_overpass: str) -> None:
+        """Writes the result for overpass of Relation.get_osm_streets_query()."""
+        result = util.sort_streets_csv(result_from_overpass)
+        with self.get_osm_streets_stream("w") as sock:
+            sock.write(result)
+
+    def write_osm_streets_file(self, result_path: str) -> None:
+        """Same as write_osm_streets(), but the result is in a file, which is removed."""
+        external_sort.sort_csv_file(result_path, self.get_osm_streets_path(), util.split_street_line,
+                                    config.Config.get_int("sort_memory_limit"))
+        os.unlink(result_path)
+
+    def get_osm_housenumbers_path(self) -> str:
+        """Build the file name of the OSM house number list of a relation."""
+        return os.path.join(self.__workdir, "street-housenumbers-%s.csv" % self.__name + self.__get_suffix())
+
+    def get_osm_housenumbers_stream(self, mode: str) -> TextIO:
+        """Opens the OSM house number list of a relation."""
+        path = self.get_osm_housenumbers_path()
+        return cast(TextIO, compressed_files.open_file(path, mode))
+
+    def write_osm_housenumbers(self, result_from_overpass: str) -> None:
+        """Writes the result for overpass of Relation.get_osm_housenumbers_query()."""
+        result = util.sort_housenumbers_csv(result_from_overpass)
+        with self.get_osm_housenumbers_stream(mode="w") as stream:
+            stream.write(result)
+        write_street_index(self.get_osm_housenumbers_path(), get_index_path(self.get_osm_housenumbers_path()),
+                           column=1, has_header=True)
+
+    def write_osm_housenumbers_file(self, result_path: str) -> None:
+        """Same as write_osm_housenumbers(), but the result is in a file, which is removed."""
+        external_sort.sort_csv_file(result_path, self.get_osm_housenumbers_path(), util.split_housenumber_line,
+                                    config.Config.get_int("sort_memory_limit"))
+        os.unlink(result_path)
+        write_street_index(self.get_osm_housenumbers_path(), get_index_path(self.get_osm_housenumbers_path()),
+                           column=1, has_header=True)
+
+    def get_osm_housenumbers_street_lines(self, street: str) -> List[str]:
+        """Gets the rows of a single OSM street from the OSM house number list, without reading all of it."""
+        path = self.get_osm_housenumbers_path()
+        index = read_street_index(path, get_index_path(path), column=1, has_header=True)
+        return read_street_lines(path, index.get(street, []))
+
+    def get_ref_housenumbers_path(self) -> str:
+        """Build the file name of the reference house number list of a relation."""
+        return os.path.join(self.__workdir, "street-housenumbers-reference-%s.lst" % self.__name + self.__get_suffix())
+
+    def get_ref_housenumbers_stream(self, mode: str) -> TextIO:
+        """Opens the reference house number list of a relation."""
+        return cast(TextIO, compressed_files.open_file(self.get_ref_housenumbers_path(), mode))
+
+    def write_ref_housenumbers(self, lines: List[str]) -> None:
+        """Writes the result of Relation.build_ref_housenumbers(), lines are expected to be sorted."""
+        with self.get_ref_housenumbers_stream("w") as sock:
+            for line in lines:
+                sock.write(line + "\n")
+        write_street_index(self.get_ref_housenumbers_path(), get_index_path(self.get_ref_housenumbers_path()),
+                           column=0, has_header=False)
+
+    def get_ref_housenumbers_street_lines(self, street: str) -> List[str]:
+        """Gets the rows of a single ref street from the reference house number list, without reading all of
+        it."""
+        path = self.get_ref_housenumbers_path()
+        index = read_street_index(path, get_index_path(path), column=0, has_header=False)
+        return read_street_lines(path, index.get(street, []))
+
+    def get_housenumbers_percent_path(self) -> str:
+        """Builds the file name of the house number percent file of a relation."""
+        return os.path.join(self.__workdir, "%s.percent" % self.__name)
+
+    def get_housenumbers_percent_stream(self, mode: str) -> TextIO:
+        """Opens the house number percent file of a relation."""
+        return cast(TextIO, open(self.get_housenumbers_percent_path(), mode=mode))
+
+    def get_streets_percent_path(self) -> str:
+        """Builds the file name of the street percent file of a relation."""
+        return os.path.join(self.__workdir, "%s-streets.percent" % self.__name)
+
+    def get_streets_percent_stream(self, mode: str) -> TextIO:
+        """Opens the street percent file of a relation."""
+        return cast(TextIO, open(self.get_streets_percent_path(), mode=mode))
+
+    def get_state_path(self, kind: str) -> str:
+        """
+        Builds the file name of a small state file of a relation. Known kinds: 'osm-base' (the state of
+        the last OSM fetch), 'dirty-streets' (the streets which changed since the house number stats
+        were calculated), 'street-stats' (the per-street house number stats), 'boundary' (the cached
+        boundary polygon), 'query-durations' (the durations of the last OSM queries), 'artifacts' (the
+        recorded inputs of the files derived for the relation) and 'osc' (the last applied replication
+        diff).
+        """
+        return os.path.join(self.__workdir, "%s.%s" % (self.__name, kind))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
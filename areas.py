@@ -6,225 +6,28 @@
 
 """The areas module contains the Relations class and associated functionality."""
 
+import functools
+import itertools
 import os
 from typing import Any
 from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import Optional
-from typing import TextIO
 from typing import Tuple
 from typing import cast
 import pickle
 import yattag
 
 from i18n import translate as _
+import area_config
+import area_files
 import config
+import dataset_cache
 import ranges
 import util
 
 
-class RelationFiles:
-    """A relation's file interface provides access to files associated with a relation."""
-    def __init__(self, datadir: str, workdir: str, name: str):
-        self.__datadir = datadir
-        self.__workdir = workdir
-        self.__name = name
-
-    def get_ref_streets_path(self) -> str:
-        """Build the file name of the reference street list of a relation."""
-        return os.path.join(self.__workdir, "streets-reference-%s.lst" % self.__name)
-
-    def get_ref_streets_stream(self, mode: str) -> TextIO:
-        """Opens the reference street list of a relation."""
-        path = self.get_ref_streets_path()
-        return cast(TextIO, open(path, mode=mode))
-
-    def get_osm_streets_path(self) -> str:
-        """Build the file name of the OSM street list of a relation."""
-        return os.path.join(self.__workdir, "streets-%s.csv" % self.__name)
-
-    def get_osm_streets_stream(self, mode: str) -> TextIO:
-        """Opens the OSM street list of a relation."""
-        path = self.get_osm_streets_path()
-        return cast(TextIO, open(path, mode=mode))
-
-    def write_osm_streets(self, result_from_overpass: str) -> None:
-        """Writes the result for overpass of Relation.get_osm_streets_query()."""
-        result = util.sort_streets_csv(result_from_overpass)
-        with self.get_osm_streets_stream("w") as sock:
-            sock.write(result)
-
-    def get_osm_housenumbers_path(self) -> str:
-        """Build the file name of the OSM house number list of a relation."""
-        return os.path.join(self.__workdir, "street-housenumbers-%s.csv" % self.__name)
-
-    def get_osm_housenumbers_stream(self, mode: str) -> TextIO:
-        """Opens the OSM house number list of a relation."""
-        path = self.get_osm_housenumbers_path()
-        return cast(TextIO, open(path, mode=mode))
-
-    def write_osm_housenumbers(self, result_from_overpass: str) -> None:
-        """Writes the result for overpass of Relation.get_osm_housenumbers_query()."""
-        result = util.sort_housenumbers_csv(result_from_overpass)
-        with self.get_osm_housenumbers_stream(mode="w") as stream:
-            stream.write(result)
-
-    def get_ref_housenumbers_path(self) -> str:
-        """Build the file name of the reference house number list of a relation."""
-        return os.path.join(self.__workdir, "street-housenumbers-reference-%s.lst" % self.__name)
-
-    def get_ref_housenumbers_stream(self, mode: str) -> TextIO:
-        """Opens the reference house number list of a relation."""
-        return cast(TextIO, open(self.get_ref_housenumbers_path(), mode=mode))
-
-    def get_housenumbers_percent_path(self) -> str:
-        """Builds the file name of the house number percent file of a relation."""
-        return os.path.join(self.__workdir, "%s.percent" % self.__name)
-
-    def get_housenumbers_percent_stream(self, mode: str) -> TextIO:
-        """Opens the house number percent file of a relation."""
-        return cast(TextIO, open(self.get_housenumbers_percent_path(), mode=mode))
-
-    def get_streets_percent_path(self) -> str:
-        """Builds the file name of the street percent file of a relation."""
-        return os.path.join(self.__workdir, "%s-streets.percent" % self.__name)
-
-    def get_streets_percent_stream(self, mode: str) -> TextIO:
-        """Opens the street percent file of a relation."""
-        return cast(TextIO, open(self.get_streets_percent_path(), mode=mode))
-
-
-class RelationConfig:
-    """A relation configuration comes directly from static data, not a result of some external query."""
-    def __init__(self, parent_config: Dict[str, Any], my_config: Dict[str, Any]) -> None:
-        self.__parent = parent_config
-        self.__dict = my_config
-
-    def __get_property(self, key: str) -> Any:
-        """Gets the value of a property transparently."""
-        if key in self.__dict.keys():
-            return self.__dict[key]
-
-        if key in self.__parent.keys():
-            return self.__parent[key]
-
-        return None
-
-    def set_active(self, active: bool) -> None:
-        """Sets if the relation is active."""
-        self.__dict["inactive"] = not active
-
-    def is_active(self) -> bool:
-        """Gets if the relation is active."""
-        return not cast(bool, self.__get_property("inactive"))
-
-    def get_osmrelation(self) -> int:
-        """Gets the OSM relation object's ID."""
-        return cast(int, self.__get_property("osmrelation"))
-
-    def get_refcounty(self) -> str:
-        """Gets the relation's refcounty identifier from reference."""
-        return cast(str, self.__get_property("refcounty"))
-
-    def get_refsettlement(self) -> str:
-        """Gets the relation's refsettlement identifier from reference."""
-        return cast(str, self.__get_property("refsettlement"))
-
-    def get_alias(self) -> List[str]:
-        """Gets the alias(es) of the relation: alternative names which are also accepted."""
-        return cast(List[str], self.__get_property("alias"))
-
-    def should_check_missing_streets(self) -> str:
-        """Return value can be 'yes', 'no' and 'only'."""
-        if self.__get_property("missing-streets"):
-            return cast(str, self.__get_property("missing-streets"))
-
-        return "yes"
-
-    def should_check_housenumber_letters(self) -> bool:
-        """Do we care if 42/B is missing when 42/A is provided?."""
-        if self.__get_property("housenumber-letters"):
-            return cast(bool, self.__get_property("housenumber-letters"))
-
-        return False
-
-    def set_housenumber_letters(self, housenumber_letters: bool) -> None:
-        """Sets the housenumber_letters property from code."""
-        self.__dict["housenumber-letters"] = housenumber_letters
-
-    def set_letter_suffix_style(self, letter_suffix_style: util.LetterSuffixStyle) -> None:
-        """Sets the letter suffix style."""
-        self.__dict["letter-suffix-style"] = letter_suffix_style
-
-    def get_letter_suffix_style(self) -> util.LetterSuffixStyle:
-        """Gets the letter suffix style."""
-        if self.__get_property("letter-suffix-style"):
-            return cast(util.LetterSuffixStyle, self.__get_property("letter-suffix-style"))
-        return util.LetterSuffixStyle.UPPER
-
-    def get_refstreets(self) -> Dict[str, str]:
-        """Returns an OSM name -> ref name map."""
-        if self.__get_property("refstreets"):
-            return cast(Dict[str, str], self.__get_property("refstreets"))
-        return {}
-
-    def set_filters(self, filters: Dict[str, Any]) -> None:
-        """Sets the 'filters' key from code."""
-        self.__dict["filters"] = filters
-
-    def get_filters(self) -> Dict[str, Any]:
-        """Returns a street name -> properties map."""
-        if self.__get_property("filters"):
-            return cast(Dict[str, Any], self.__get_property("filters"))
-        return {}
-
-    def get_filter_street(self, street: str) -> Dict[str, Any]:
-        """Returns a street from relation filters."""
-        filters = self.get_filters()
-        if street in filters.keys():
-            return cast(Dict[str, Any], filters[street])
-
-        return {}
-
-    def get_street_is_even_odd(self, street: str) -> bool:
-        """Determines in a relation's street is interpolation=all or not."""
-        street_props = self.get_filter_street(street)
-        interpolation_all = False
-        if "interpolation" in street_props:
-            if street_props["interpolation"] == "all":
-                interpolation_all = True
-
-        return not interpolation_all
-
-    def get_street_refsettlement(self, street: str) -> List[str]:
-        """Returns a list of refsettlement values specific to a street."""
-        ret = [self.__get_property("refsettlement")]
-        if not self.__get_property("filters"):
-            return ret
-
-        relation_filters = self.get_filters()
-        for filter_street, value in relation_filters.items():
-            if filter_street != street:
-                continue
-
-            if "refsettlement" in value.keys():
-                refsettlement = cast(str, value["refsettlement"])
-                ret = [refsettlement]
-            if "ranges" in value.keys():
-                for street_range in value["ranges"]:
-                    street_range_dict = cast(Dict[str, str], street_range)
-                    if "refsettlement" in street_range_dict.keys():
-                        ret.append(street_range_dict["refsettlement"])
-
-        return sorted(set(ret))
-
-    def get_street_filters(self) -> List[str]:
-        """Gets list of streets which are only in reference, but have to be filtered out."""
-        if self.__get_property("street-filters"):
-            return cast(List[str], self.__get_property("street-filters"))
-        return []
-
-
 class Relation:
     """A relation is a closed polygon on the map."""
     def __init__(
@@ -237,23 +40,23 @@ class Relation:
         self.__workdir = workdir
         self.__name = name
         my_config: Dict[str, Any] = {}
-        self.__file = RelationFiles(config.get_abspath("data"), workdir, name)
+        self.__file = area_files.RelationFiles(config.get_abspath("data"), workdir, name)
         relation_path = "relation-%s.yaml" % name
         # Intentionally don't require this cache to be present, it's fine to omit it for simple
         # relations.
         if relation_path in yaml_cache:
             my_config = yaml_cache[relation_path]
-        self.__config = RelationConfig(parent_config, my_config)
+        self.__config = area_config.RelationConfig(parent_config, my_config)
 
     def get_name(self) -> str:
         """Gets the name of the relation."""
         return self.__name
 
-    def get_files(self) -> RelationFiles:
+    def get_files(self) -> area_files.RelationFiles:
         """Gets access to the file interface."""
         return self.__file
 
-    def get_config(self) -> RelationConfig:
+    def get_config(self) -> area_config.RelationConfig:
         """Gets access to the config interface."""
         return self.__config
 
@@ -298,6 +101,11 @@ class Relation:
 
     def get_osm_streets(self) -> List[str]:
         """Reads list of streets for an area from OSM."""
+        paths = [self.get_files().get_osm_streets_path(), self.get_files().get_osm_housenumbers_path()]
+        return list(dataset_cache.CACHE.get("osm-streets", paths, self.__read_osm_streets))
+
+    def __read_osm_streets(self) -> List[str]:
+        """Reads list of streets for an area from OSM, without caching."""
         ret: List[str] = []
         with self.get_files().get_osm_streets_stream("r") as sock:
             ret += util.get_nth_column(sock, 1)
@@ -315,19 +123,8 @@ class Relation:
     def get_osm_housenumbers(self, street_name: str) -> List[util.HouseNumber]:
         """Gets the OSM house number list of a street."""
         house_numbers: List[util.HouseNumber] = []
-        with self.get_files().get_osm_housenumbers_stream(mode="r") as sock:
-            first = True
-            for line in sock.readlines():
-                if first:
-                    first = False
-                    continue
-                tokens = line.strip().split('\t')
-                if len(tokens) < 3:
-                    continue
-                if tokens[1] != street_name:
-                    continue
-                for house_number in tokens[2].split(';'):
-                    house_numbers += normalize(self, house_number, street_name, self.get_street_ranges())
+        for house_number in self.__get_osm_housenumber_values().get(street_name, []):
+            house_numbers += normalize(self, house_number, street_name, self.get_street_ranges())
         return util.sort_numerically(set(house_numbers))
 
     def build_ref_streets(self, reference: Dict[str, Dict[str, List[str]]]) -> List[str]:
@@ -385,61 +182,115 @@ class Relation:
 
         return ret
 
-    @staticmethod
-    def __get_ref_suffix(index: int) -> str:
-        """Determines what suffix should the Nth reference use for hours numbers."""
-        if index == 0:
-            return ""
-
-        return "*"
-
-    def write_ref_housenumbers(self, references: List[str]) -> None:
+    def write_ref_housenumbers(self, references: List[str], shared: bool = False) -> None:
         """
         Writes known house numbers (not their coordinates) from a reference, based on street names
-        from OSM. Uses build_reference_cache() to build an indexed reference, the result will be
-        used by __get_ref_housenumbers().
+        from OSM. Uses build_reference_caches() to build an indexed reference, or get_reference_caches()
+        if shared is set, so the relations of a batch update share one copy. The result will be used by
+        iter_missing_housenumbers().
         """
-        memory_caches = util.build_reference_caches(references)
-
-        streets = self.get_osm_streets()
+        if shared:
+            memory_caches = util.get_reference_caches(references)
+        else:
+            memory_caches = util.build_reference_caches(references)
 
         lst: List[str] = []
-        for street in streets:
-            for index, memory_cache in enumerate(memory_caches):
-                suffix = Relation.__get_ref_suffix(index)
-                lst += self.build_ref_housenumbers(memory_cache, street, suffix)
+        for street in self.get_osm_streets():
+            lst += build_ref_housenumber_lines(self, memory_caches, street)
 
         lst = sorted(set(lst))
-        with self.get_files().get_ref_housenumbers_stream("w") as sock:
-            for line in lst:
-                sock.write(line + "\n")
+        self.get_files().write_ref_housenumbers(lst)
 
-    def __get_ref_housenumbers(self) -> Dict[str, List[util.HouseNumber]]:
-        """Gets house numbers from reference, produced by write_ref_housenumbers()."""
-        ret: Dict[str, List[util.HouseNumber]] = {}
-        lines: List[str] = []
+    def __iter_direct_ref_housenumber_groups(
+            self,
+            osm_names_by_ref: Dict[str, List[str]]
+    ) -> Iterator[Tuple[str, List[str]]]:
+        """Same as __iter_ref_housenumber_groups(), but without using the .lst file."""
+        memory_caches = util.get_reference_caches(config.Config.get_reference_housenumber_paths())
+        # The result only depends on the ref name, so any of the OSM names is good.
+        return ((ref_street_name, get_direct_ref_values(self, memory_caches, osm_street_names[0]))
+                for ref_street_name, osm_street_names in sorted(osm_names_by_ref.items(),
+                                                                key=lambda item: item[0] + "\t"))
+
+    def __iter_ref_housenumber_groups(self) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Reads house numbers from reference, produced by write_ref_housenumbers(), one street at a
+        time. Yields a ref street name and its raw house number values (with optional comments).
+        """
+        if not dataset_cache.CACHE.is_enabled():
+            # Stream the file, so memory usage is bounded.
+            return self.__read_ref_housenumber_groups()
+        paths = [self.get_files().get_ref_housenumbers_path()]
+        return iter(dataset_cache.CACHE.get("ref-housenumbers", paths,
+                                            lambda: list(self.__read_ref_housenumber_groups())))
+
+    def __read_ref_housenumber_groups(self) -> Iterator[Tuple[str, List[str]]]:
+        """Same as __iter_ref_housenumber_groups(), but without caching."""
         with self.get_files().get_ref_housenumbers_stream("r") as sock:
-            for line in sock.readlines():
-                line = line.strip()
-                lines.append(line)
+            lines = (line.strip() for line in sock)
+            for street, group in itertools.groupby(lines, key=lambda line: line.split("\t")[0]):
+                yield street, [line[len(street) + 1:] for line in group]
+
+    def __get_osm_housenumber_values(self) -> Dict[str, List[str]]:
+        """Reads the OSM house number list in a single pass: street name -> raw house numbers."""
+        paths = [self.get_files().get_osm_housenumbers_path()]
+        return dataset_cache.CACHE.get("osm-housenumbers", paths, self.__read_osm_housenumber_values)
+
+    def __read_osm_housenumber_values(self) -> Dict[str, List[str]]:
+        """Same as __get_osm_housenumber_values(), but without caching."""
+        ret: Dict[str, List[str]] = {}
+        with self.get_files().get_osm_housenumbers_stream(mode="r") as sock:
+            first = True
+            for line in sock:
+                if first:
+                    first = False
+                    continue
+                tokens = line.strip().split('\t')
+                if len(tokens) < 3:
+                    continue
+                ret.setdefault(tokens[1], []).extend(tokens[2].split(';'))
+        return ret
+
+    def iter_missing_housenumbers(
+            self
+    ) -> Iterator[Tuple[str, List[util.HouseNumber], List[util.HouseNumber]]]:
+        """
+        Compares ref and osm house numbers street by street.
+        Yields a street name, the house numbers which are only in ref and the ones which are in both.
+        The street-sorted reference is read in lockstep with the street list, so only a single
+        street's house numbers are normalized at a time. Streets are visited in reference order.
+        """
         street_ranges = self.get_street_ranges()
         streets_invalid = self.get_street_invalid()
+        osm_values = self.__get_osm_housenumber_values()
+        # Multiple OSM names may refer to the same ref street.
+        osm_names_by_ref: Dict[str, List[str]] = {}
         for osm_street_name in self.get_osm_streets():
-            house_numbers: List[util.HouseNumber] = []
             ref_street_name = self.get_ref_street_from_osm_street(osm_street_name)
-            prefix = ref_street_name + "\t"
-            street_invalid: List[str] = []
-            if osm_street_name in streets_invalid.keys():
-                street_invalid = streets_invalid[osm_street_name]
-            for line in lines:
-                if line.startswith(prefix):
-                    house_number = line.replace(prefix, '')
-                    normalized = normalize(self, house_number, osm_street_name, street_ranges)
-                    normalized = \
-                        [i for i in normalized if not util.HouseNumber.is_invalid(i.get_number(), street_invalid)]
-                    house_numbers += normalized
-            ret[osm_street_name] = util.sort_numerically(set(house_numbers))
-        return ret
+            osm_names_by_ref.setdefault(ref_street_name, []).append(osm_street_name)
+
+        if config.Config.get_bool("reference_housenumbers_direct"):
+            ref_groups = self.__iter_direct_ref_housenumber_groups(osm_names_by_ref)
+        else:
+            ref_groups = self.__iter_ref_housenumber_groups()
+        ref_group = next(ref_groups, None)
+        # Sort the same way as the lines of the reference file are sorted.
+        for ref_street_name in sorted(osm_names_by_ref.keys(), key=lambda street: street + "\t"):
+            while ref_group and ref_group[0] + "\t" < ref_street_name + "\t":
+                ref_group = next(ref_groups, None)
+            ref_values: List[str] = []
+            if ref_group and ref_group[0] == ref_street_name:
+                ref_values = ref_group[1]
+            for osm_street_name in osm_names_by_ref[ref_street_name]:
+                street_invalid = streets_invalid.get(osm_street_name, [])
+                ref_house_numbers = normalize_street_housenumbers(self, osm_street_name, ref_values, street_ranges,
+                                                                  street_invalid)
+                osm_house_numbers = normalize_street_housenumbers(self, osm_street_name,
+                                                                  osm_values.get(osm_street_name, []),
+                                                                  street_ranges, [])
+                only_in_reference = util.get_only_in_first(ref_house_numbers, osm_house_numbers)
+                in_both = util.get_in_both(ref_house_numbers, osm_house_numbers)
+                yield osm_street_name, only_in_reference, in_both
 
     def get_missing_housenumbers(
             self
@@ -452,19 +303,14 @@ class Relation:
         ongoing_streets = []
         done_streets = []
 
-        street_names = self.get_osm_streets()
-        all_ref_house_numbers = self.__get_ref_housenumbers()
-        for street_name in street_names:
-            ref_house_numbers = all_ref_house_numbers[street_name]
-            osm_house_numbers = self.get_osm_housenumbers(street_name)
-            only_in_reference = util.get_only_in_first(ref_house_numbers, osm_house_numbers)
-            in_both = util.get_in_both(ref_house_numbers, osm_house_numbers)
+        for street_name, only_in_reference, in_both in self.iter_missing_housenumbers():
             if only_in_reference:
                 ongoing_streets.append((street_name, only_in_reference))
             if in_both:
                 done_streets.append((street_name, in_both))
-        # Sort by length.
-        ongoing_streets.sort(key=lambda result: len(result[1]), reverse=True)
+        # Sort by length, then by name.
+        ongoing_streets.sort(key=lambda result: (-len(result[1]), result[0]))
+        done_streets.sort(key=lambda result: result[0])
 
         return ongoing_streets, done_streets
 
@@ -473,7 +319,14 @@ class Relation:
         Calculate a write stat for the house number coverage of a relation.
         Returns a tuple of: todo street count, todo count, done count, percent and table.
         """
-        ongoing_streets, done_streets = self.get_missing_housenumbers()
+        ongoing_streets: List[Tuple[str, List[util.HouseNumber]]] = []
+        done_count = 0
+        # Only keep the streets which are not complete, count the rest as we go.
+        for street_name, only_in_reference, in_both in self.iter_missing_housenumbers():
+            if only_in_reference:
+                ongoing_streets.append((street_name, only_in_reference))
+            done_count += len(util.get_housenumber_ranges(in_both))
+        ongoing_streets.sort(key=lambda result: (-len(result[1]), result[0]))
 
         todo_count = 0
         table = []
@@ -482,32 +335,10 @@ class Relation:
                       util.html_escape(_("House numbers"))])
         for result in ongoing_streets:
             # street_name, only_in_ref
-            row = []
-            row.append(util.html_escape(result[0]))
             number_ranges = util.get_housenumber_ranges(result[1])
-            row.append(util.html_escape(str(len(number_ranges))))
-            number_range_strings = [i.get_number() for i in number_ranges]
-
-            doc = yattag.doc.Doc()
-            if not self.get_config().get_street_is_even_odd(result[0]):
-                for index, item in enumerate(sorted(number_range_strings, key=util.split_house_number)):
-                    if index:
-                        doc.text(", ")
-                    doc.asis(util.color_house_number(item).getvalue())
-            else:
-                util.format_even_odd(number_ranges, doc)
-            row.append(doc)
-
             todo_count += len(number_ranges)
-            table.append(row)
-        done_count = 0
-        for result in done_streets:
-            number_ranges = util.get_housenumber_ranges(result[1])
-            done_count += len(number_ranges)
-        if done_count > 0 or todo_count > 0:
-            percent = "%.2f" % (done_count / (done_count + todo_count) * 100)
-        else:
-            percent = "100.00"
+            table.append(get_missing_housenumbers_row(self, result[0], number_ranges))
+        percent = util.get_percent(done_count, todo_count)
 
         # Write the bottom line to a file, so the index page show it fast.
         with self.get_files().get_housenumbers_percent_stream("w") as stream:
@@ -535,10 +366,7 @@ class Relation:
             streets.append(street)
         todo_count = len(todo_streets)
         done_count = len(done_streets)
-        if done_count > 0 or todo_count > 0:
-            percent = "%.2f" % (done_count / (done_count + todo_count) * 100)
-        else:
-            percent = "100.00"
+        percent = util.get_percent(done_count, todo_count)
 
         # Write the bottom line to a file, so the index page show it fast.
         with self.get_files().get_streets_percent_stream("w") as stream:
@@ -624,6 +452,13 @@ class Relations:
                 continue
             del self.__dict[relation_name]
 
+    def limit_to_names(self, names: List[str]) -> None:
+        """Forget about all relations, except the ones in names."""
+        for relation_name in list(self.__dict.keys()):
+            if relation_name in names:
+                continue
+            del self.__dict[relation_name]
+
     def refcounty_get_name(self, refcounty: str) -> str:
         """Produces a UI name for a refcounty."""
         if refcounty in self.__refcounty_names:
@@ -662,14 +497,17 @@ class Relations:
         return ret
 
 
+# Upper bound for the number of memoized normalize() results, see normalize_cache_info() for sizing.
+NORMALIZE_CACHE_SIZE = 65536
+
+
 def normalize_housenumber_letters(
-        relation: Relation,
         house_numbers: str,
         suffix: str,
-        comment: str
+        comment: str,
+        style: util.LetterSuffixStyle
 ) -> List[util.HouseNumber]:
     """Handles the part of normalize() that deals with housenumber letters."""
-    style = relation.get_config().get_letter_suffix_style()
     normalized = util.HouseNumber.normalize_letter_suffix(house_numbers, suffix, style)
     return [util.HouseNumber(normalized, normalized, comment)]
 
@@ -678,6 +516,24 @@ def normalize(relation: Relation, house_numbers: str, street_name: str,
               normalizers: Dict[str, ranges.Ranges]) -> List[util.HouseNumber]:
     """Strips down string input to bare minimum that can be interpreted as an
     actual number. Think about a/b, a-b, and so on."""
+    normalizer = util.get_normalizer(street_name, normalizers)
+    relation_config = relation.get_config()
+    street_is_even_odd = relation_config.get_street_is_even_odd(street_name)
+    check_housenumber_letters = relation_config.should_check_housenumber_letters()
+    style = relation_config.get_letter_suffix_style()
+    return list(normalize_cached(house_numbers, normalizer, street_is_even_odd, check_housenumber_letters, style))
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_cached(
+        house_numbers: str,
+        normalizer: ranges.Ranges,
+        street_is_even_odd: bool,
+        check_housenumber_letters: bool,
+        style: util.LetterSuffixStyle
+) -> Tuple[util.HouseNumber, ...]:
+    """Implements normalize(), the result only depends on the raw value and the effective relation
+    settings, so it can be shared between streets, relations and references."""
     comment = ""
     if "\t" in house_numbers:
         house_numbers, comment = house_numbers.split("\t")
@@ -691,11 +547,8 @@ def normalize(relation: Relation, house_numbers: str, street_name: str,
     if house_numbers.endswith("*"):
         suffix = house_numbers[-1]
 
-    normalizer = util.get_normalizer(street_name, normalizers)
-
     ret_numbers, ret_numbers_nofilter = util.split_house_number_by_separator(house_numbers, separator, normalizer)
 
-    street_is_even_odd = relation.get_config().get_street_is_even_odd(street_name)
     if separator == "-" and util.should_expand_range(ret_numbers_nofilter, street_is_even_odd):
         start = ret_numbers_nofilter[0]
         stop = ret_numbers_nofilter[1]
@@ -709,10 +562,144 @@ def normalize(relation: Relation, house_numbers: str, street_name: str,
             # Closed interval, but mixed even and odd.
             ret_numbers = [number for number in range(start, stop + 1, 1) if number in normalizer]
 
-    check_housenumber_letters = len(ret_numbers) == 1 and relation.get_config().should_check_housenumber_letters()
+    check_housenumber_letters = len(ret_numbers) == 1 and check_housenumber_letters
     if check_housenumber_letters and util.HouseNumber.has_letter_suffix(house_numbers, suffix):
-        return normalize_housenumber_letters(relation, house_numbers, suffix, comment)
-    return [util.HouseNumber(str(number) + suffix, house_numbers, comment) for number in ret_numbers]
+        return tuple(normalize_housenumber_letters(house_numbers, suffix, comment, style))
+    return tuple(util.HouseNumber(str(number) + suffix, house_numbers, comment) for number in ret_numbers)
+
+
+def normalize_cache_info() -> Tuple[int, int, int, int]:
+    """Returns the hits, misses, maxsize and current size of the normalize() cache."""
+    info = normalize_cached.cache_info()  # pylint: disable=no-value-for-parameter
+    return info.hits, info.misses, info.maxsize or 0, info.currsize
+
+
+def get_ref_suffix(index: int) -> str:
+    """Determines what suffix should the Nth reference use for hours numbers."""
+    if index == 0:
+        return ""
+
+    return "*"
+
+
+def build_ref_housenumber_lines(
+        relation: Relation,
+        memory_caches: List[Dict[str, Dict[str, Dict[str, List[util.HouseNumberRange]]]]],
+        street: str
+) -> List[str]:
+    """Builds the reference house number lines of an OSM street of relation from all references."""
+    lst: List[str] = []
+    for index, memory_cache in enumerate(memory_caches):
+        lst += relation.build_ref_housenumbers(memory_cache, street, get_ref_suffix(index))
+    return lst
+
+
+def get_direct_ref_values(
+        relation: Relation,
+        memory_caches: List[Dict[str, Dict[str, Dict[str, List[util.HouseNumberRange]]]]],
+        osm_street_name: str
+) -> List[str]:
+    """
+    Gets the raw reference house numbers of a street of relation straight from the indexed
+    reference, in the same form as the street groups of the .lst file.
+    """
+    ref_street_name = relation.get_ref_street_from_osm_street(osm_street_name)
+    lines = sorted(set(build_ref_housenumber_lines(relation, memory_caches, osm_street_name)))
+    return [line.strip()[len(ref_street_name) + 1:] for line in lines]
+
+
+def has_ref_housenumbers(relation: Relation) -> bool:
+    """Decides if reference house numbers are available for relation, either directly or via
+    write_ref_housenumbers()."""
+    if config.Config.get_bool("reference_housenumbers_direct"):
+        return True
+    return os.path.exists(relation.get_files().get_ref_housenumbers_path())
+
+
+def get_ref_housenumbers_text(relation: Relation) -> str:
+    """Gets the reference house number list of relation, as written by write_ref_housenumbers()."""
+    if not config.Config.get_bool("reference_housenumbers_direct"):
+        with relation.get_files().get_ref_housenumbers_stream("r") as sock:
+            return sock.read()
+
+    memory_caches = util.get_reference_caches(config.Config.get_reference_housenumber_paths())
+    lst: List[str] = []
+    for street in relation.get_osm_streets():
+        lst += build_ref_housenumber_lines(relation, memory_caches, street)
+    return "".join(line + "\n" for line in sorted(set(lst)))
+
+
+def normalize_street_housenumbers(
+        relation: Relation,
+        street_name: str,
+        values: List[str],
+        street_ranges: Dict[str, ranges.Ranges],
+        street_invalid: List[str]
+) -> List[util.HouseNumber]:
+    """Normalizes the raw house numbers of a single street of relation, without the invalid ones."""
+    house_numbers: List[util.HouseNumber] = []
+    for house_number in values:
+        normalized = normalize(relation, house_number, street_name, street_ranges)
+        if street_invalid:
+            normalized = [i for i in normalized if not util.HouseNumber.is_invalid(i.get_number(), street_invalid)]
+        house_numbers += normalized
+    return util.sort_numerically(set(house_numbers))
+
+
+def get_missing_housenumbers_for_street(
+        relation: Relation,
+        osm_street_name: str
+) -> Tuple[List[util.HouseNumber], List[util.HouseNumber]]:
+    """
+    Compares ref and osm house numbers of a single street of relation, using the street indexes of
+    the house number lists, so only the rows of that street are read.
+    Returns the only in ref and the in both lists.
+    """
+    ref_street_name = relation.get_ref_street_from_osm_street(osm_street_name)
+    ref_values: List[str] = []
+    if config.Config.get_bool("reference_housenumbers_direct"):
+        memory_caches = util.get_reference_caches(config.Config.get_reference_housenumber_paths())
+        ref_values = get_direct_ref_values(relation, memory_caches, osm_street_name)
+    else:
+        for line in relation.get_files().get_ref_housenumbers_street_lines(ref_street_name):
+            ref_values.append(line.strip()[len(ref_street_name) + 1:])
+    osm_values: List[str] = []
+    for line in relation.get_files().get_osm_housenumbers_street_lines(osm_street_name):
+        tokens = line.strip().split('\t')
+        if len(tokens) < 3:
+            continue
+        osm_values += tokens[2].split(';')
+    street_ranges = relation.get_street_ranges()
+    street_invalid = relation.get_street_invalid().get(osm_street_name, [])
+    ref_house_numbers = normalize_street_housenumbers(relation, osm_street_name, ref_values, street_ranges,
+                                                      street_invalid)
+    osm_house_numbers = normalize_street_housenumbers(relation, osm_street_name, osm_values, street_ranges, [])
+    only_in_reference = util.get_only_in_first(ref_house_numbers, osm_house_numbers)
+    in_both = util.get_in_both(ref_house_numbers, osm_house_numbers)
+    return only_in_reference, in_both
+
+
+def get_missing_housenumbers_row(
+        relation: Relation,
+        street_name: str,
+        number_ranges: List[util.HouseNumberRange]
+) -> List[yattag.doc.Doc]:
+    """Produces a table row (street name, missing count, house numbers) for a street of relation."""
+    row = []
+    row.append(util.html_escape(street_name))
+    row.append(util.html_escape(str(len(number_ranges))))
+    number_range_strings = [i.get_number() for i in number_ranges]
+
+    doc = yattag.doc.Doc()
+    if not relation.get_config().get_street_is_even_odd(street_name):
+        for index, item in enumerate(sorted(number_range_strings, key=util.split_house_number)):
+            if index:
+                doc.text(", ")
+            doc.asis(util.color_house_number(item).getvalue())
+    else:
+        util.format_even_odd(number_ranges, doc)
+    row.append(doc)
+    return row
 
 
 def make_turbo_query_for_streets(relation: Relation, table: List[List[yattag.doc.Doc]]) -> str:
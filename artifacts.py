@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The artifacts module records the fingerprints of the inputs of the files cron derives for a relation
+(reference lists, coverage stats), so only the ones with changed inputs are rebuilt.
+"""
+
+from typing import Dict
+import json
+import os
+
+import area_files
+import areas
+import config
+import delta_update
+
+REF_STREETS = "ref-streets"
+REF_HOUSENUMBERS = "ref-housenumbers"
+MISSING_STREETS = "missing-streets"
+MISSING_HOUSENUMBERS = "missing-housenumbers"
+
+
+def get_path(relation: areas.Relation, kind: str) -> str:
+    """Gets the path of an artifact of relation."""
+    files = relation.get_files()
+    paths = {
+        REF_STREETS: files.get_ref_streets_path(),
+        REF_HOUSENUMBERS: files.get_ref_housenumbers_path(),
+        MISSING_STREETS: files.get_streets_percent_path(),
+        MISSING_HOUSENUMBERS: files.get_housenumbers_percent_path(),
+    }
+    return paths[kind]
+
+
+def get_inputs(relation: areas.Relation, kind: str) -> Dict[str, str]:
+    """
+    Gets the fingerprints of the inputs of an artifact of relation. The large reference data is
+    identified by its size and modification time, the files in the workdir by their content, as they
+    are often rewritten with the same content.
+    """
+    files = relation.get_files()
+    direct = config.Config.get_bool("reference_housenumbers_direct")
+    inputs = {"config": relation.get_config().get_fingerprint()}
+    references = []
+    if kind == REF_STREETS:
+        references = [config.Config.get_reference_street_path()]
+    elif kind == REF_HOUSENUMBERS or kind == MISSING_HOUSENUMBERS and direct:
+        references = config.Config.get_reference_housenumber_paths()
+    for path in references:
+        inputs[path] = area_files.get_file_fingerprint(path)
+    derived = []
+    if kind == MISSING_STREETS:
+        derived = [files.get_osm_streets_path(), files.get_ref_streets_path()]
+    elif kind in (REF_HOUSENUMBERS, MISSING_HOUSENUMBERS):
+        # The reference house numbers are looked up for the street names of the OSM lists.
+        derived = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+        if kind == MISSING_HOUSENUMBERS and not direct:
+            derived.append(files.get_ref_housenumbers_path())
+    for path in derived:
+        inputs[os.path.basename(path)] = delta_update.get_file_hash(path)
+    return inputs
+
+
+def read_records(relation: areas.Relation) -> Dict[str, Dict[str, str]]:
+    """Reads the recorded inputs of the artifacts of relation."""
+    path = relation.get_files().get_state_path("artifacts")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as stream:
+        return dict(json.load(stream))
+
+
+def record(relation: areas.Relation, kind: str) -> None:
+    """Records the inputs of an artifact of relation, after it was built. Only done in incremental
+    mode."""
+    if not config.Config.get_bool("cron_incremental"):
+        return
+    records = read_records(relation)
+    records[kind] = get_inputs(relation, kind)
+    with open(relation.get_files().get_state_path("artifacts"), "w") as stream:
+        json.dump(records, stream, sort_keys=True)
+
+
+def is_outdated(relation: areas.Relation, kind: str, update: bool) -> bool:
+    """
+    Decides if an artifact of relation should be built: when it's missing, or if update is set, when
+    its inputs changed since it was built (incremental mode) or always.
+    """
+    if not os.path.exists(get_path(relation, kind)):
+        return True
+    if not update:
+        return False
+    if not config.Config.get_bool("cron_incremental"):
+        return True
+    return read_records(relation).get(kind) != get_inputs(relation, kind)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
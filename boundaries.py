@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The boundaries module provides the boundary polygons of relations. They rarely change, so they are
+cached in the workdir and only fetched from overpass again when the cache is old.
+"""
+
+from typing import Optional
+import os
+import tempfile
+import time
+
+import areas
+import geometry
+import osm_extract
+import overpass_query
+import util
+
+# Cached boundaries older than this are fetched again.
+MAX_AGE_DAYS = 30
+
+
+def get_boundary_query(osmrelation: int) -> str:
+    """Produces a query which returns the boundary of an OSM relation as OSM XML."""
+    return "[timeout:425];\nrel(%s);\n(._;>;);\nout skel;\n" % osmrelation
+
+
+def load_boundary(relation: areas.Relation) -> Optional[geometry.Polygon]:
+    """Loads the cached boundary of relation, if it's not too old."""
+    path = relation.get_files().get_state_path("boundary")
+    if not os.path.exists(path) or time.time() - os.path.getmtime(path) > MAX_AGE_DAYS * 24 * 3600:
+        return None
+    return geometry.Polygon.from_json(util.get_content(path))
+
+
+def fetch_boundary(relation: areas.Relation, tries: int) -> Optional[geometry.Polygon]:
+    """Fetches the boundary of relation and caches it. None if the boundary is not a closed polygon."""
+    path = relation.get_files().get_state_path("boundary")
+    osmrelation = relation.get_config().get_osmrelation()
+    handle, result_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(handle)
+    try:
+        overpass_query.overpass_query_to_file(get_boundary_query(osmrelation), result_path, tries)
+        boundary = osm_extract.Extract(result_path, {osmrelation}, set()).get_boundary(osmrelation)
+    finally:
+        os.unlink(result_path)
+    if boundary:
+        with open(path, "w") as stream:
+            stream.write(boundary.to_json())
+    return boundary
+
+
+def get_boundary(relation: areas.Relation, tries: int) -> Optional[geometry.Polygon]:
+    """Gets the boundary of relation, from the cache if possible."""
+    return load_boundary(relation) or fetch_boundary(relation, tries)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The change_probe module decides if the OSM data of a relation changed since its last fetch, so cron
+can skip unchanged relations.
+"""
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+import calendar
+import hashlib
+import json
+import os
+import time
+import urllib.error
+
+import areas
+import config
+import overpass_query
+import util
+
+# Format of overpass timestamps.
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_osm_base(result_from_overpass: str) -> str:
+    """Gets the timestamp of the OSM data from the JSON result of an overpass query."""
+    result = json.loads(result_from_overpass)
+    return str(result["osm3s"]["timestamp_osm_base"])
+
+
+def parse_count(result_from_overpass: str) -> int:
+    """Gets the total count from the JSON result of an overpass 'out count' query."""
+    result = json.loads(result_from_overpass)
+    return int(result["elements"][0]["tags"]["total"])
+
+
+def query_osm_base() -> str:
+    """Gets the timestamp of the OSM data of the overpass instance."""
+    return parse_osm_base(overpass_query.overpass_query("[out:json];out;", tries=3, cache=False))
+
+
+def get_inputs_fingerprint(relation: areas.Relation) -> str:
+    """Gets a hash of the non-OSM inputs of a relation: its configuration and the reference data."""
+    paths = config.Config.get_reference_housenumber_paths() + [config.Config.get_reference_street_path()]
+    fingerprints = [relation.get_config().get_fingerprint()]
+    for path in paths:
+        stat = os.stat(path)
+        fingerprints.append("%s %s %s" % (path, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha256("\n".join(fingerprints).encode("utf-8")).hexdigest()
+
+
+def read_state(relation: areas.Relation) -> Optional[Dict[str, Any]]:
+    """Reads the state of the last fetch of a relation, if there is one."""
+    path = relation.get_files().get_state_path("osm-base")
+    if not os.path.exists(path):
+        return None
+    with open(path) as stream:
+        return dict(json.load(stream))
+
+
+def write_state(relation: areas.Relation, osm_base: str, full: bool = True) -> None:
+    """
+    Records that the OSM data of a relation was fetched, with the OSM data timestamp osm_base. A not
+    full fetch only updated the last state with the changed objects.
+    """
+    full_osm_base = osm_base
+    if not full:
+        state = read_state(relation)
+        assert state
+        full_osm_base = str(state.get("full_osm_base", state["osm_base"]))
+    state = {"osm_base": osm_base, "full_osm_base": full_osm_base, "inputs": get_inputs_fingerprint(relation)}
+    with open(relation.get_files().get_state_path("osm-base"), "w") as stream:
+        json.dump(state, stream)
+
+
+def is_full_refresh_due(state: Dict[str, Any]) -> bool:
+    """Decides if the relation of state should be fetched fully, as deleted objects are only noticed
+    that way."""
+    osm_base = str(state.get("full_osm_base", state["osm_base"]))
+    age = time.time() - calendar.timegm(time.strptime(osm_base, TIMESTAMP_FORMAT))
+    return age > config.Config.get_int("cron_full_refresh_days") * 24 * 3600
+
+
+def get_changes_query(relation: areas.Relation, osm_base: str) -> str:
+    """Produces a query which counts the objects of a relation, which changed after osm_base."""
+    with open(os.path.join(config.get_abspath("data"), "changes-template.txt")) as stream:
+        query = util.process_template(stream.read(), relation.get_config().get_osmrelation())
+    return query.replace("@NEWER@", osm_base)
+
+
+def is_unchanged(relation: areas.Relation) -> bool:
+    """Decides if the last fetch of a relation is still up to date, so it can be skipped."""
+    state = read_state(relation)
+    if not state:
+        return False
+    files = relation.get_files()
+    if not os.path.exists(files.get_osm_streets_path()) or not os.path.exists(files.get_osm_housenumbers_path()):
+        return False
+    if state["inputs"] != get_inputs_fingerprint(relation):
+        return False
+    if is_full_refresh_due(state):
+        return False
+    try:
+        result = overpass_query.overpass_query(get_changes_query(relation, str(state["osm_base"])), tries=3,
+                                               cache=False)
+        return parse_count(result) == 0
+    except (urllib.error.HTTPError, ValueError, KeyError, IndexError):
+        return False
+
+
+def get_fetched_names(relations: areas.Relations, since: float) -> List[str]:
+    """Gets the names of active relations, where both OSM lists were written after since."""
+    ret: List[str] = []
+    for relation_name in relations.get_active_names():
+        files = relations.get_relation(relation_name).get_files()
+        paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+        if all(os.path.exists(path) and os.path.getmtime(path) >= since for path in paths):
+            ret.append(relation_name)
+    return ret
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The combined_query module merges the streets and house numbers queries of a relation into one
+overpass query and splits its result into the two CSV files locally.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+import os
+import re
+import tempfile
+
+import external_sort
+import util
+
+# Type of the derived element which separates the two result sets.
+MARKER = "osm_gimmisn_marker"
+# Type of the derived element which starts the result set of a relation in a batch.
+RELATION_MARKER = "osm_gimmisn_relation"
+
+SETTINGS = re.compile(r"^\[out:csv\((.*)\)\](.*)$")
+# A statement which resolves an area to a named set.
+AREA = re.compile(r"^area\(.*\)->\.(\w+);$")
+
+
+def get_settings(query: str) -> Tuple[List[str], str, List[str]]:
+    """Returns the CSV columns, the rest of the settings line and the body of a query."""
+    lines = [line for line in query.splitlines() if not line.strip().startswith("//")]
+    for index, line in enumerate(lines):
+        match = SETTINGS.match(line.strip())
+        if match:
+            columns = [column.strip() for column in match.group(1).split(",")]
+            return columns, match.group(2), lines[index + 1:]
+    raise ValueError("query has no CSV settings")
+
+
+def get_header(column: str) -> str:
+    """Returns the header of a CSV column, the way overpass writes it."""
+    column = column.strip('"')
+    if column.startswith("::"):
+        return "@" + column[2:]
+    return column
+
+
+def merge_queries(streets_query: str, housenumbers_query: str) -> Tuple[List[str], str, List[str]]:
+    """
+    Merges the two queries of a relation: returns the union of their columns, the rest of the
+    settings line and a body which separates the two result sets by a derived element of type MARKER.
+    """
+    streets_columns, rest, streets_body = get_settings(streets_query)
+    housenumbers_columns, _rest, housenumbers_body = get_settings(housenumbers_query)
+    columns = list(streets_columns)
+    headers = [get_header(column) for column in columns]
+    for column in housenumbers_columns:
+        if get_header(column) not in headers:
+            columns.append(column)
+            headers.append(get_header(column))
+    if "@type" not in headers:
+        columns.append("::type")
+    # The search area is already resolved for the streets part, don't do it twice.
+    area_lines = [line.strip() for line in streets_body if AREA.match(line.strip())]
+    housenumbers_body = [line for line in housenumbers_body if line.strip() not in area_lines]
+    body = streets_body + ["make " + MARKER + ";", "out;"] + housenumbers_body
+    return columns, rest, body
+
+
+def make_query(streets_query: str, housenumbers_query: str) -> str:
+    """
+    Creates a single query which returns the result of both queries, separated by a derived element
+    of type MARKER. The columns are the union of the columns of the two queries.
+    """
+    columns, rest, body = merge_queries(streets_query, housenumbers_query)
+    lines = ["[out:csv(" + ", ".join(columns) + ")]" + rest] + body
+    return "\n".join(lines) + "\n"
+
+
+def make_batch_query(queries: List[Tuple[str, str, str]]) -> str:
+    """
+    Creates a single query for several relations from (relation name, streets query, house numbers
+    query) tuples. The result of each relation starts with a derived element of type RELATION_MARKER,
+    its name is the relation name. The queries are expected to have the same columns.
+    """
+    lines: List[str] = []
+    for name, streets_query, housenumbers_query in queries:
+        columns, rest, body = merge_queries(streets_query, housenumbers_query)
+        if not lines:
+            if "name" not in [get_header(column) for column in columns]:
+                columns.append("name")
+            lines.append("[out:csv(" + ", ".join(columns) + ")]" + rest)
+        lines += ["make " + RELATION_MARKER + ' name="' + name + '";', "out;"] + body
+    return "\n".join(lines) + "\n"
+
+
+def get_columns(query: str) -> List[str]:
+    """Returns the CSV header of the result of query."""
+    columns, _rest, _body = get_settings(query)
+    return [get_header(column) for column in columns]
+
+
+def split_result(result_path: str, streets_query: str, housenumbers_query: str, directory: str) -> Tuple[str, str]:
+    """
+    Splits the result of make_query() into the results of the two original queries. The results are
+    written to new temp files in directory, their paths are returned.
+    """
+    paths = split_batch_result(result_path, streets_query, housenumbers_query, [""], directory)
+    return paths[""]
+
+
+def split_batch_result(
+        result_path: str,
+        streets_query: str,
+        housenumbers_query: str,
+        names: List[str],
+        directory: str
+) -> Dict[str, Tuple[str, str]]:
+    """
+    Splits the result of make_batch_query() into the results of the original queries of each relation.
+    An empty relation name means the result is from make_query(). The results are written to new temp
+    files in directory, their paths are returned for each relation name.
+    """
+    streets_columns = get_columns(streets_query)
+    housenumbers_columns = get_columns(housenumbers_query)
+    paths: List[str] = []
+    sections: List[Tuple[Optional[str], List[str], str]] = []
+    try:
+        for name in names:
+            for marker, columns in ((RELATION_MARKER + "=" + name if name else None, streets_columns),
+                                    (MARKER, housenumbers_columns)):
+                handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                os.close(handle)
+                paths.append(path)
+                sections.append((marker, columns, path))
+        split_result_to(result_path, sections)
+    except BaseException:
+        for path in paths:
+            os.unlink(path)
+        raise
+    return {name: (paths[2 * index], paths[2 * index + 1]) for index, name in enumerate(names)}
+
+
+def get_marker(headers: List[str], cells: List[str]) -> Optional[str]:
+    """Returns the marker of a row of the result, or None in case it's not a marker row."""
+    cell_type = util.get_array_nth(cells, headers.index("@type")) if "@type" in headers else ""
+    if cell_type == MARKER:
+        return MARKER
+    if cell_type == RELATION_MARKER:
+        name = util.get_array_nth(cells, headers.index("name")) if "name" in headers else ""
+        return RELATION_MARKER + "=" + name
+    return None
+
+
+def open_section(headers: List[str], section: Tuple[Optional[str], List[str], str]) -> Tuple[TextIO, List[int]]:
+    """Opens the file of a section for writing, returns it and the indexes of its columns in headers."""
+    _marker, columns, path = section
+    output = open(path, "w", newline="\n")
+    output.write("\t".join(columns))
+    return output, [headers.index(column) if column in headers else -1 for column in columns]
+
+
+def split_result_to(result_path: str, sections: List[Tuple[Optional[str], List[str], str]]) -> None:
+    """
+    Writes the sections of result_path to files, keeping only the columns of each section. A section is
+    described by the marker which starts it (None for a first section without a marker), its columns
+    and its path.
+    """
+    with open(result_path, "r", newline="\n") as stream:
+        lines = external_sort.read_lines(stream)
+        headers = next(lines, "").split("\t")
+        output: Optional[TextIO] = None
+        indexes: List[int] = []
+        index = 0
+        try:
+            if sections[0][0] is None:
+                output, indexes = open_section(headers, sections[0])
+                index = 1
+            for line in lines:
+                if not line:
+                    if output:
+                        output.write("\n")
+                    continue
+                cells = line.split("\t")
+                marker = get_marker(headers, cells)
+                if marker is None:
+                    if output is None:
+                        raise ValueError("result has rows before the first marker")
+                    row = [util.get_array_nth(cells, i) if i >= 0 else "" for i in indexes]
+                    output.write("\n" + "\t".join(row))
+                    continue
+                if index >= len(sections) or sections[index][0] != marker:
+                    raise ValueError("unexpected marker in result: " + marker)
+                if output:
+                    # End the section with a newline, like a separate query would do.
+                    output.write("\n")
+                    output.close()
+                output, indexes = open_section(headers, sections[index])
+                index += 1
+        finally:
+            if output:
+                output.close()
+    if index < len(sections):
+        raise ValueError("result has no " + str(sections[index][0]) + " marker")
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The compressed_files module provides transparent access to optionally compressed workdir files. The
+format of a workdir is recorded in its 'compression' file, run this module to migrate a workdir to a
+different format.
+"""
+
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import cast
+import argparse
+import gzip
+import importlib.util
+import os
+import re
+import shutil
+import sys
+
+import config
+
+# Format name -> file name suffix.
+SUFFIXES = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+# Name of the format flag file inside a workdir.
+FLAG_NAME = "compression"
+# Per-relation files which are compressed: OSM and reference streets and house numbers.
+RELATION_FILE = re.compile(r"^(streets|street-housenumbers)-.+\.(csv|lst)(\.gz|\.zst)?$")
+# Workdir -> size and modification time of its flag file (None if it does not exist) and the format.
+FORMATS: Dict[str, Tuple[Optional[Tuple[int, int]], str]] = {}
+
+
+def is_zstd_available() -> bool:
+    """Decides if the optional zstandard module is installed."""
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def get_format(workdir: str) -> str:
+    """Gets the format of the relation files in workdir, based on its format flag."""
+    path = os.path.join(workdir, FLAG_NAME)
+    fingerprint: Optional[Tuple[int, int]] = None
+    if os.path.exists(path):
+        stat = os.stat(path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+    if workdir in FORMATS and FORMATS[workdir][0] == fingerprint:
+        return FORMATS[workdir][1]
+    fmt = "none"
+    if fingerprint:
+        with open(path, "r") as stream:
+            fmt = stream.read().strip()
+    if fmt not in SUFFIXES:
+        raise ValueError("unknown compression format in '%s': '%s'" % (path, fmt))
+    FORMATS[workdir] = (fingerprint, fmt)
+    return fmt
+
+
+def get_path_format(path: str) -> str:
+    """Gets the format of a file, based on its name."""
+    for fmt, suffix in SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return fmt
+    return "none"
+
+
+def open_file(path: str, mode: str, fmt: Optional[str] = None, newline: Optional[str] = None) -> IO[Any]:
+    """
+    Opens a file like open() does, but (de)compresses it transparently. The format is detected from
+    the file name, unless it's provided.
+    """
+    if not fmt:
+        fmt = get_path_format(path)
+    if fmt == "gzip":
+        if "b" not in mode:
+            mode += "t"
+        return cast(IO[Any], gzip.open(path, mode, newline=newline))
+    if fmt == "zstd":
+        import zstandard  # type: ignore  # pylint: disable=import-outside-toplevel,import-error
+        return cast(IO[Any], zstandard.open(path, mode, newline=newline))
+    return open(path, mode, newline=newline)
+
+
+def get_uncompressed_size(path: str) -> int:
+    """
+    Gets the size of the content of a file, after decompression, without decompressing it: gzip
+    records it in its trailer (modulo 4 GiB), zstd in its frame header, unless it was written as a
+    stream, in which case the compressed size is the best estimate.
+    """
+    fmt = get_path_format(path)
+    if fmt == "gzip":
+        with open(path, "rb") as stream:
+            stream.seek(-4, os.SEEK_END)
+            return int.from_bytes(stream.read(4), "little")
+    if fmt == "zstd":
+        import zstandard  # pylint: disable=import-outside-toplevel,import-error
+        with open(path, "rb") as stream:
+            # The maximum size of a frame header.
+            header = stream.read(18)
+        size = int(zstandard.frame_content_size(header))
+        if size >= 0:
+            return size
+    return os.path.getsize(path)
+
+
+def strip_suffix(name: str) -> str:
+    """Removes the compression suffix of a file name, if there is any."""
+    return name[:len(name) - len(SUFFIXES[get_path_format(name)])]
+
+
+def migrate(workdir: str, fmt: str) -> List[str]:
+    """
+    Converts the relation files of workdir to fmt and updates the format flag. The new files are
+    written first, the old ones are only removed after the flag is updated, so readers always find a
+    consistent state. Returns the names of the converted files.
+    """
+    if fmt == "zstd" and not is_zstd_available():
+        raise ValueError("zstd compression requires the zstandard module")
+    old_names = sorted(name for name in os.listdir(workdir) if RELATION_FILE.match(name))
+    new_names: List[str] = []
+    for old_name in old_names:
+        new_name = strip_suffix(old_name) + SUFFIXES[fmt]
+        if new_name == old_name:
+            continue
+        old_path = os.path.join(workdir, old_name)
+        new_path = os.path.join(workdir, new_name)
+        with open_file(old_path, "rb") as old_stream:
+            with open_file(new_path + ".tmp", "wb", fmt=fmt) as new_stream:
+                shutil.copyfileobj(old_stream, new_stream)
+        shutil.copystat(old_path, new_path + ".tmp")
+        os.replace(new_path + ".tmp", new_path)
+        new_names.append(new_name)
+
+    with open(os.path.join(workdir, FLAG_NAME + ".tmp"), "w") as stream:
+        stream.write(fmt + "\n")
+    os.replace(os.path.join(workdir, FLAG_NAME + ".tmp"), os.path.join(workdir, FLAG_NAME))
+
+    for old_name in old_names:
+        if old_name in new_names or get_path_format(old_name) == fmt:
+            continue
+        os.unlink(os.path.join(workdir, old_name))
+        if os.path.exists(os.path.join(workdir, old_name + ".idx")):
+            os.unlink(os.path.join(workdir, old_name + ".idx"))
+    return new_names
+
+
+def main() -> None:
+    """Commandline interface to this module."""
+    parser = argparse.ArgumentParser(description="Converts the relation files of the workdir.")
+    parser.add_argument("format", choices=sorted(SUFFIXES.keys()),
+                        help="the new format of the relation files")
+    args = parser.parse_args()
+    try:
+        names = migrate(config.Config.get_workdir(), args.format)
+    except ValueError as error:
+        print("compression: " + str(error))
+        sys.exit(1)
+    print("compression: converted %s files to '%s'" % (len(names), args.format))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -10,11 +10,69 @@ It intentionally doesn't import any other 'own' modules, so it can be used anywh
 """
 
 from typing import Any
+from typing import Dict
 from typing import List
 from typing import Optional
 import configparser
 import os
 
+# Defaults of the optional tuning keys, accessed via Config.get_bool() and friends.
+DEFAULTS: Dict[str, str] = {
+    # Should missing house numbers be calculated from the reference directly, without per-relation
+    # .lst files?
+    "reference_housenumbers_direct": "False",
+    # The byte budget of the in-memory cache of parsed workdir files in the web process, 0 disables it.
+    "dataset_cache_size": "67108864",
+    # The approximate number of bytes used to sort large CSV files in memory, larger files are sorted using
+    # temp files.
+    "sort_memory_limit": "67108864",
+    # Should the streets and house numbers of a relation be fetched with a single overpass query?
+    "overpass_combined_query": "False",
+    # The approximate result size in bytes, up to which small relations are fetched together with a single
+    # overpass query in combined mode, 0 disables this.
+    "overpass_batch_size": "262144",
+    # Should cron.py skip relations where the OSM data did not change since the last fetch?
+    "cron_skip_unchanged": "False",
+    # Should cron.py only fetch the changed objects of the OSM house number lists, when possible?
+    "cron_delta_updates": "False",
+    # The number of days after which cron.py fetches relations fully again, even when unchanged or delta
+    # updates or replication diffs are possible, as those can miss deleted or moved objects.
+    "cron_full_refresh_days": "7",
+    # The directory of OSM replication diffs, which cron.py applies instead of fetching relations from
+    # overpass, relative to the repo root. Empty if not set.
+    "cron_osc_dir": "",
+    # A local OSM extract (XML or PBF), which cron.py uses instead of fetching relations from overpass,
+    # relative to the repo root. Empty if not set.
+    "cron_osm_extract": "",
+    # Should cron.py write the OSM house number lists from the nationwide dump of the stats, instead of
+    # fetching them from overpass?
+    "cron_split_stats_dump": "False",
+    # Should cron.py derive the OSM house number lists of relations inside an other relation from the list of
+    # the outer one, instead of fetching them from overpass?
+    "cron_nested_areas": "False",
+    # The size of a previous OSM list in bytes, above which its overpass query is split into bounding box
+    # tiles, 0 disables this.
+    "overpass_tile_size": "8388608",
+    # The duration of a previous overpass query in seconds, above which it's split into bounding box tiles, 0
+    # disables this.
+    "overpass_tile_seconds": "240",
+    # The number of seconds for which an overpass response is reused for the same query, 0 disables this.
+    "overpass_cache_ttl": "0",
+    # The size limit of the cached overpass responses in bytes.
+    "overpass_cache_size": "67108864",
+    # The number of threads running the updates started from the web interface in the background, 0 runs them
+    # while handling the request.
+    "web_job_workers": "0",
+    # The number of updates which can wait for a background worker.
+    "web_job_queue_size": "16",
+    # The number of threads in which cron.py updates the reference lists and coverage of relations, while the
+    # OSM lists of other relations are still fetched. 0 runs the steps one after the other instead.
+    "cron_pipeline_workers": "0",
+    # Should cron.py record the inputs of the reference lists and coverage stats of relations, and only
+    # rebuild them when their inputs changed?
+    "cron_incremental": "False",
+}
+
 
 class Config:
     """Exposes config key values from wsgi.ini."""
@@ -30,6 +88,13 @@ class Config:
 
         return Config.__config
 
+    @staticmethod
+    def __get_with_default(key: str) -> str:
+        """Gets the value of key, falling back to its default from DEFAULTS."""
+        Config.__get()
+        assert Config.__config is not None
+        return Config.__config.get("wsgi", key, fallback=DEFAULTS[key]).strip()
+
     @staticmethod
     def get_value(key: str) -> str:
         """Gets the value of key."""
@@ -106,11 +171,29 @@ class Config:
         return int(Config.__config.get("wsgi", "tcp_port", fallback="8000").strip())
 
     @staticmethod
-    def get_overpass_uri() -> str:
-        """Gets the URI of the overpass instance to be used."""
+    def get_overpass_uris() -> List[str]:
+        """Gets the URIs of the overpass instances to be used, queries are spread across them."""
         Config.__get()
         assert Config.__config is not None
-        return Config.__config.get("wsgi", "overpass_uri", fallback="https://overpass-api.de").strip()
+        return Config.__config.get("wsgi", "overpass_uri", fallback="https://overpass-api.de").strip().split()
+
+    @staticmethod
+    def get_bool(key: str) -> bool:
+        """Gets the value of a boolean key which has a default in DEFAULTS."""
+        return Config.__get_with_default(key) == "True"
+
+    @staticmethod
+    def get_int(key: str) -> int:
+        """Gets the value of an integer key which has a default in DEFAULTS."""
+        return int(Config.__get_with_default(key))
+
+    @staticmethod
+    def get_path(key: str) -> str:
+        """Gets the value of a path key which has a default in DEFAULTS, made absolute if not empty."""
+        relpath = Config.__get_with_default(key)
+        if not relpath:
+            return ""
+        return get_abspath(relpath)
 
     @staticmethod
     def get_cron_update_inactive() -> bool:
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The coverage_pool module writes the house number and street coverage of relations, optionally in a
+pool of processes, so the computation of multiple relations can use multiple cores.
+"""
+
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+import concurrent.futures
+import contextlib
+import logging
+import time
+
+import areas
+import config
+import delta_update
+
+# The relations of a worker process, see init_worker().
+RELATIONS: Optional[areas.Relations] = None
+# The pool shared by the write_all_missing() calls of the parent process, see shared_pool().
+POOL: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+
+class LogCollector(logging.Handler):
+    """Collects the log messages of a worker process, so the parent can report them in order."""
+    def __init__(self) -> None:
+        logging.Handler.__init__(self)
+        self.__messages: List[Tuple[int, str]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.__messages.append((record.levelno, record.getMessage()))
+
+    def get_messages(self) -> List[Tuple[int, str]]:
+        """Gets the level and text of the collected messages."""
+        return self.__messages
+
+
+def write_missing(relation: areas.Relation, kind: str) -> None:
+    """Writes the coverage of relation, kind is 'housenumbers' or 'streets'."""
+    if kind == "streets":
+        relation.write_missing_streets()
+    elif config.Config.get_bool("cron_delta_updates"):
+        # Only recalculate the streets which changed since the last run.
+        delta_update.update_housenumbers_percent(relation)
+    else:
+        relation.write_missing_housenumbers()
+
+
+def init_worker(workdir: str) -> None:
+    """Sets up a worker process: the parent reports the log messages, not the inherited handlers."""
+    global RELATIONS  # pylint: disable=global-statement
+    RELATIONS = areas.Relations(workdir)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def write_missing_in_worker(relation_name: str, kind: str) -> Tuple[float, List[Tuple[int, str]]]:
+    """Same as write_missing(), but runs in a worker process. Returns the duration in seconds and the
+    log messages."""
+    assert RELATIONS is not None
+    collector = LogCollector()
+    logging.getLogger().addHandler(collector)
+    try:
+        start = time.time()
+        write_missing(RELATIONS.get_relation(relation_name), kind)
+        return time.time() - start, collector.get_messages()
+    finally:
+        logging.getLogger().removeHandler(collector)
+
+
+def create_pool(relations: areas.Relations, jobs: int) -> concurrent.futures.ProcessPoolExecutor:
+    """Creates a pool of jobs worker processes for the coverage of relations."""
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                                  initargs=(relations.get_workdir(),))
+
+
+@contextlib.contextmanager
+def shared_pool(relations: areas.Relations, jobs: int) -> Iterator[None]:
+    """
+    Lets the write_all_missing() calls in the context, e.g. from multiple threads, share one pool of
+    jobs processes. The worker processes are started when entering the context, so enter it before
+    starting threads: forking a process which already runs threads may deadlock.
+    """
+    global POOL  # pylint: disable=global-statement
+    if jobs <= 1:
+        yield
+        return
+    with create_pool(relations, jobs) as executor:
+        # The first task starts all worker processes.
+        executor.submit(time.time).result()
+        POOL = executor
+        try:
+            yield
+        finally:
+            POOL = None
+
+
+def report_all_missing(executor: concurrent.futures.ProcessPoolExecutor, relation_names: List[str],
+                       kind: str) -> None:
+    """Writes the coverage of relations in relation_names using the processes of executor."""
+    prefix = "update_missing_" + kind
+    futures = [executor.submit(write_missing_in_worker, relation_name, kind) for relation_name in relation_names]
+    for relation_name, future in zip(relation_names, futures):
+        seconds, messages = future.result()
+        for level, message in messages:
+            logging.log(level, message)
+        logging.info("%s: %s: %.3f seconds", prefix, relation_name, seconds)
+
+
+def write_all_missing(relations: areas.Relations, relation_names: List[str], kind: str, jobs: int) -> None:
+    """Writes the coverage of relations in relation_names, in jobs processes if jobs is larger than 1, or in
+    the processes of shared_pool(), if there is one. Log messages and per-relation timings are reported in
+    the order of relation_names."""
+    if POOL:
+        report_all_missing(POOL, relation_names, kind)
+        return
+
+    if jobs <= 1 or len(relation_names) <= 1:
+        prefix = "update_missing_" + kind
+        for relation_name in relation_names:
+            start = time.time()
+            write_missing(relations.get_relation(relation_name), kind)
+            logging.info("%s: %s: %.3f seconds", prefix, relation_name, time.time() - start)
+        return
+
+    with create_pool(relations, jobs) as executor:
+        report_all_missing(executor, relation_names, kind)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
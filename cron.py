@@ -7,85 +7,316 @@
 
 """The cron module allows doing nightly tasks."""
 
+from typing import Any
+from typing import Callable
+from typing import Collection
+from typing import ContextManager
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
 import argparse
+import concurrent.futures
+import contextlib
 import datetime
 import logging
 import os
 import subprocess
+import tempfile
+import threading
 import time
 import traceback
 import urllib.error
+import xml.etree.ElementTree
 
 import areas
+import artifacts
+import boundaries
+import change_probe
+import combined_query
 import config
+import coverage_pool
+import delta_update
+import dump_split
+import geometry
+import nested_areas
+import osc_diffs
+import osm_extract
 import overpass_query
+import tiled_query
 import util
 
-
-def overpass_sleep() -> None:
-    """Sleeps to respect overpass rate limit."""
-    while True:
-        sleep = overpass_query.overpass_query_need_sleep()
-        if not sleep:
-            break
-        logging.info("overpass_sleep: waiting for %s seconds", sleep)
-        time.sleep(sleep)
+# Upper limit of parallel overpass queries, in case the server has no rate limit.
+MAX_OVERPASS_WORKERS = 4
+# Number of times an overpass query is tried before giving up.
+OVERPASS_TRIES = 20
+# Upper limit of relations fetched with a single overpass query.
+MAX_BATCH_RELATIONS = 16
+
+T = TypeVar("T")
+# The overpass queries in flight are limited by the worker count of the outermost for_each_relation()
+# call, nested calls (e.g. for the tiles of a relation) share this.
+QUERY_SLOTS: List[threading.Semaphore] = []
+QUERY_SLOTS_LOCK = threading.Lock()
+
+
+def get_overpass_workers() -> int:
+    """Decides how many overpass queries we can run in parallel."""
+    slots = overpass_query.get_client().get_slots()
+    if slots <= 0 or slots > MAX_OVERPASS_WORKERS:
+        return MAX_OVERPASS_WORKERS
+    return slots
+
+
+def for_each_relation(relation_names: Sequence[T], worker: Callable[[T], None]) -> None:
+    """Runs worker for each relation (or batch of relations), as many of them in parallel as overpass
+    allows."""
+    if not relation_names:
+        return
+    workers = get_overpass_workers()
+    with QUERY_SLOTS_LOCK:
+        outermost = not QUERY_SLOTS
+        if outermost:
+            QUERY_SLOTS.append(threading.Semaphore(workers))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume the results, so exceptions from the workers are not lost.
+            list(executor.map(worker, relation_names))
+    finally:
+        if outermost:
+            with QUERY_SLOTS_LOCK:
+                QUERY_SLOTS.clear()
+
+
+def get_query_slot() -> ContextManager[Any]:
+    """Returns a context which holds a query slot while a query is in flight, see QUERY_SLOTS."""
+    with QUERY_SLOTS_LOCK:
+        if QUERY_SLOTS:
+            return QUERY_SLOTS[0]
+    return contextlib.nullcontext()
+
+
+def query_to_temp_file(query: str, directory: str) -> str:
+    """Streams the overpass result of query to a new temp file in directory, returns its path."""
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    try:
+        with get_query_slot():
+            overpass_query.overpass_query_to_file(query, path, OVERPASS_TRIES)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def fetch_osm_list(relation: areas.Relation, kind: str, query: str, directory: str) -> str:
+    """
+    Streams the result of the OSM list query of a relation of a kind to a new temp file in directory,
+    returns its path. The query is split into bounding box tiles when the previous result was large
+    or slow, and the duration is recorded for the next run.
+    """
+    count = tiled_query.get_tile_count(relation, kind)
+    boundary = None
+    if count > 1:
+        with get_query_slot():
+            boundary = boundaries.get_boundary(relation, OVERPASS_TRIES)
+    start = time.time()
+    if not boundary:
+        path = query_to_temp_file(query, directory)
+        tiled_query.set_duration(relation, kind, time.time() - start)
+        return path
+
+    tiles = tiled_query.get_tiles(boundary.get_bbox(), count)
+    paths: Dict[geometry.BoundingBox, str] = {}
+    durations: List[float] = []
+
+    def worker(tile: geometry.BoundingBox) -> None:
+        tile_start = time.time()
+        paths[tile] = query_to_temp_file(tiled_query.make_tile_query(query, tile), directory)
+        durations.append(time.time() - tile_start)
+    try:
+        for_each_relation(tiles, worker)
+    except BaseException:
+        for path in paths.values():
+            os.unlink(path)
+        raise
+    # The sum estimates the duration of a single query for the whole area.
+    tiled_query.set_duration(relation, kind, sum(durations))
+    return tiled_query.merge_results([paths[tile] for tile in tiles], directory)
+
+
+def fetch_osm_streets(relations: areas.Relations, relation_name: str) -> None:
+    """Fetches the OSM street list of a relation."""
+    relation = relations.get_relation(relation_name)
+    logging.info("update_osm_streets: start: %s", relation_name)
+    try:
+        query = relation.get_osm_streets_query()
+        relation.get_files().write_osm_streets_file(fetch_osm_list(relation, "streets", query, relations.get_workdir()))
+    except urllib.error.HTTPError as http_error:
+        logging.info("update_osm_streets: http error: %s", str(http_error))
+    logging.info("update_osm_streets: end: %s", relation_name)
 
 
-def should_retry(retry: int) -> bool:
-    """Decides if we should retry a query or not."""
-    return retry < 20
+def is_outdated(update: bool, paths: List[str]) -> bool:
+    """Decides if the files at paths should be updated: always, in case update is set, or when one of
+    them is missing."""
+    return update or not all(os.path.exists(path) for path in paths)
 
 
-def update_osm_streets(relations: areas.Relations, update: bool) -> None:
-    """Update the OSM street list of all relations."""
+def update_osm_streets(relations: areas.Relations, update: bool, skip: Collection[str] = ()) -> None:
+    """Update the OSM street list of all relations, except the ones in skip."""
+    relation_names: List[str] = []
     for relation_name in relations.get_active_names():
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_osm_streets_path()):
+        if not is_outdated(update, [relation.get_files().get_osm_streets_path()]) or relation_name in skip:
             continue
-        logging.info("update_osm_streets: start: %s", relation_name)
-        retry = 0
-        while should_retry(retry):
-            if retry > 0:
-                logging.info("update_osm_streets: try #%s", retry)
-            retry += 1
-            try:
-                overpass_sleep()
-                query = relation.get_osm_streets_query()
-                relation.get_files().write_osm_streets(overpass_query.overpass_query(query))
-                break
-            except urllib.error.HTTPError as http_error:
-                logging.info("update_osm_streets: http error: %s", str(http_error))
-        logging.info("update_osm_streets: end: %s", relation_name)
+        relation_names.append(relation_name)
 
+    for_each_relation(relation_names, lambda relation_name: fetch_osm_streets(relations, relation_name))
 
-def update_osm_housenumbers(relations: areas.Relations, update: bool) -> None:
-    """Update the OSM housenumber list of all relations."""
+
+def fetch_osm_housenumbers(relations: areas.Relations, relation_name: str,
+                           delta_bases: Optional[Dict[str, str]] = None) -> None:
+    """Fetches the OSM housenumber list of a relation, only the changed objects if it's in delta_bases."""
+    relation = relations.get_relation(relation_name)
+    logging.info("update_osm_housenumbers: start: %s", relation_name)
+    try:
+        query = relation.get_osm_housenumbers_query()
+        if delta_bases and relation_name in delta_bases:
+            try:
+                delta_query = delta_update.make_delta_query(query, delta_bases[relation_name])
+                delta_update.apply_delta(relation, query_to_temp_file(delta_query, relations.get_workdir()))
+                logging.info("update_osm_housenumbers: end: %s (delta)", relation_name)
+                return
+            except ValueError as value_error:
+                logging.info("update_osm_housenumbers: delta failed: %s", str(value_error))
+        relation.get_files().write_osm_housenumbers_file(fetch_osm_list(relation, "housenumbers", query,
+                                                                        relations.get_workdir()))
+    except urllib.error.HTTPError as http_error:
+        logging.info("update_osm_housenumbers: http error: %s", str(http_error))
+    logging.info("update_osm_housenumbers: end: %s", relation_name)
+
+
+def update_osm_housenumbers(relations: areas.Relations, update: bool,
+                            delta_bases: Optional[Dict[str, str]] = None, skip: Collection[str] = ()) -> None:
+    """
+    Update the OSM housenumber list of all relations, except the ones in skip. Relations in delta_bases
+    are only updated with the objects which changed after their OSM data timestamp.
+    """
+    relation_names: List[str] = []
     for relation_name in relations.get_active_names():
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_osm_housenumbers_path()):
+        if not is_outdated(update, [relation.get_files().get_osm_housenumbers_path()]) or relation_name in skip:
             continue
-        logging.info("update_osm_housenumbers: start: %s", relation_name)
-        retry = 0
-        while should_retry(retry):
-            if retry > 0:
-                logging.info("update_osm_housenumbers: try #%s", retry)
-            retry += 1
-            try:
-                overpass_sleep()
-                query = relation.get_osm_housenumbers_query()
-                relation.get_files().write_osm_housenumbers(overpass_query.overpass_query(query))
-                break
-            except urllib.error.HTTPError as http_error:
-                logging.info("update_osm_housenumbers: http error: %s", str(http_error))
-        logging.info("update_osm_housenumbers: end: %s", relation_name)
+        relation_names.append(relation_name)
+
+    for_each_relation(relation_names,
+                      lambda relation_name: fetch_osm_housenumbers(relations, relation_name, delta_bases))
+
+
+def get_result_size(relation: areas.Relation) -> Optional[int]:
+    """Returns the size of the last OSM street and housenumber lists of a relation, if there are any."""
+    files = relation.get_files()
+    paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def get_batches(relations: areas.Relations, relation_names: List[str], batch_size: int) -> List[List[str]]:
+    """
+    Packs relations into batches, each of them is fetched with one query. Relations with small
+    results in the past are batched, so the total result size of a batch is around batch_size.
+    Relations with a large or unknown result size are fetched alone.
+    """
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    size = 0
+    for relation_name in relation_names:
+        result_size = get_result_size(relations.get_relation(relation_name))
+        if result_size is None or result_size >= batch_size:
+            batches.append([relation_name])
+            continue
+        if batch and (size + result_size > batch_size or len(batch) >= MAX_BATCH_RELATIONS):
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(relation_name)
+        size += result_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def fetch_osm_combined(relations: areas.Relations, relation_names: List[str]) -> None:
+    """Fetches the OSM street and housenumber lists of a batch of relations with one query."""
+    batch = [relations.get_relation(relation_name) for relation_name in relation_names]
+    streets_query = batch[0].get_osm_streets_query()
+    housenumbers_query = batch[0].get_osm_housenumbers_query()
+    if len(batch) == 1:
+        query = combined_query.make_query(streets_query, housenumbers_query)
+        # No relation markers in the result.
+        labels = [""]
+    else:
+        queries = [(relation.get_name(), relation.get_osm_streets_query(), relation.get_osm_housenumbers_query())
+                   for relation in batch]
+        query = combined_query.make_batch_query(queries)
+        labels = relation_names
+    result_path = query_to_temp_file(query, relations.get_workdir())
+    try:
+        paths = combined_query.split_batch_result(result_path, streets_query, housenumbers_query, labels,
+                                                  relations.get_workdir())
+    finally:
+        os.unlink(result_path)
+    for relation, label in zip(batch, labels):
+        streets_path, housenumbers_path = paths[label]
+        relation.get_files().write_osm_streets_file(streets_path)
+        relation.get_files().write_osm_housenumbers_file(housenumbers_path)
+
+
+def fetch_osm_batch(relations: areas.Relations, batch: List[str]) -> None:
+    """Same as fetch_osm_combined(), but logs the errors of the query instead of raising them."""
+    logging.info("update_osm_combined: start: %s", ", ".join(batch))
+    try:
+        fetch_osm_combined(relations, batch)
+    except urllib.error.HTTPError as http_error:
+        logging.info("update_osm_combined: http error: %s", str(http_error))
+    except ValueError as value_error:
+        logging.info("update_osm_combined: invalid result: %s", str(value_error))
+    logging.info("update_osm_combined: end: %s", ", ".join(batch))
+
+
+def update_osm_combined(relations: areas.Relations, update: bool, skip: Collection[str] = ()) -> None:
+    """Update the OSM street and housenumber lists of all relations, except the ones in skip, with one
+    query per relation or batch of small relations."""
+    relation_names: List[str] = []
+    for relation_name in relations.get_active_names():
+        files = relations.get_relation(relation_name).get_files()
+        paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+        if not is_outdated(update, paths) or relation_name in skip:
+            continue
+        relation_names.append(relation_name)
 
+    batches = get_batches(relations, relation_names, config.Config.get_int("overpass_batch_size"))
+    for_each_relation(batches, lambda batch: fetch_osm_batch(relations, batch))
 
-def update_ref_housenumbers(relations: areas.Relations, update: bool) -> None:
-    """Update the reference housenumber list of all relations."""
-    for relation_name in relations.get_active_names():
+
+def get_relation_names(relations: areas.Relations, relation_names: Optional[List[str]]) -> List[str]:
+    """Returns relation_names, or the names of all active relations if it's None."""
+    if relation_names is None:
+        return relations.get_active_names()
+    return relation_names
+
+
+def update_ref_housenumbers(relations: areas.Relations, update: bool,
+                            relation_names: Optional[List[str]] = None) -> None:
+    """Update the reference housenumber list of all relations, or the ones in relation_names."""
+    for relation_name in get_relation_names(relations, relation_names):
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+        if not artifacts.is_outdated(relation, artifacts.REF_HOUSENUMBERS, update):
             continue
         references = config.Config.get_reference_housenumber_paths()
         streets = relation.get_config().should_check_missing_streets()
@@ -93,15 +324,17 @@ def update_ref_housenumbers(relations: areas.Relations, update: bool) -> None:
             continue
 
         logging.info("update_ref_housenumbers: start: %s", relation_name)
-        relation.write_ref_housenumbers(references)
+        relation.write_ref_housenumbers(references, shared=True)
+        artifacts.record(relation, artifacts.REF_HOUSENUMBERS)
         logging.info("update_ref_housenumbers: end: %s", relation_name)
 
 
-def update_ref_streets(relations: areas.Relations, update: bool) -> None:
-    """Update the reference street list of all relations."""
-    for relation_name in relations.get_active_names():
+def update_ref_streets(relations: areas.Relations, update: bool,
+                       relation_names: Optional[List[str]] = None) -> None:
+    """Update the reference street list of all relations, or the ones in relation_names."""
+    for relation_name in get_relation_names(relations, relation_names):
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_ref_streets_path()):
+        if not artifacts.is_outdated(relation, artifacts.REF_STREETS, update):
             continue
         reference = config.Config.get_reference_street_path()
         streets = relation.get_config().should_check_missing_streets()
@@ -110,37 +343,65 @@ def update_ref_streets(relations: areas.Relations, update: bool) -> None:
 
         logging.info("update_ref_streets: start: %s", relation_name)
         relation.write_ref_streets(reference)
+        artifacts.record(relation, artifacts.REF_STREETS)
         logging.info("update_ref_streets: end: %s", relation_name)
 
 
-def update_missing_housenumbers(relations: areas.Relations, update: bool) -> None:
-    """Update the relation's house number coverage stats."""
-    logging.info("update_missing_housenumbers: start")
-    for relation_name in relations.get_active_names():
+def log_normalize_cache(prefix: str) -> None:
+    """Logs the statistics of the normalize() cache, useful to tune its size."""
+    hits, misses, maxsize, currsize = areas.normalize_cache_info()
+    logging.info("%s: normalize cache: %s hits, %s misses, %s/%s entries", prefix, hits, misses, currsize, maxsize)
+
+
+def update_missing_housenumbers(relations: areas.Relations, update: bool,
+                                relation_names: Optional[List[str]] = None, jobs: int = 1) -> None:
+    """Update the house number coverage stats of all relations, or the ones in relation_names, in jobs
+    processes."""
+    if relation_names is None:
+        logging.info("update_missing_housenumbers: start")
+    outdated: List[str] = []
+    for relation_name in get_relation_names(relations, relation_names):
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_housenumbers_percent_path()):
+        if not artifacts.is_outdated(relation, artifacts.MISSING_HOUSENUMBERS, update):
             continue
         streets = relation.get_config().should_check_missing_streets()
         if streets == "only":
             continue
 
-        relation.write_missing_housenumbers()
-    logging.info("update_missing_housenumbers: end")
-
-
-def update_missing_streets(relations: areas.Relations, update: bool) -> None:
-    """Update the relation's street coverage stats."""
-    logging.info("update_missing_streets: start")
-    for relation_name in relations.get_active_names():
+        outdated.append(relation_name)
+    coverage_pool.write_all_missing(relations, outdated, "housenumbers", jobs)
+    for relation_name in outdated:
+        artifacts.record(relations.get_relation(relation_name), artifacts.MISSING_HOUSENUMBERS)
+    if relation_names is None:
+        log_normalize_cache("update_missing_housenumbers")
+        logging.info("update_missing_housenumbers: end")
+
+
+def update_missing_streets(relations: areas.Relations, update: bool,
+                           relation_names: Optional[List[str]] = None, jobs: int = 1) -> None:
+    """Update the street coverage stats of all relations, or the ones in relation_names, in jobs processes."""
+    if relation_names is None:
+        logging.info("update_missing_streets: start")
+    outdated: List[str] = []
+    for relation_name in get_relation_names(relations, relation_names):
         relation = relations.get_relation(relation_name)
-        if not update and os.path.exists(relation.get_files().get_streets_percent_path()):
+        if not artifacts.is_outdated(relation, artifacts.MISSING_STREETS, update):
             continue
         streets = relation.get_config().should_check_missing_streets()
         if streets == "no":
             continue
 
-        relation.write_missing_streets()
-    logging.info("update_missing_streets: end")
+        outdated.append(relation_name)
+    coverage_pool.write_all_missing(relations, outdated, "streets", jobs)
+    for relation_name in outdated:
+        artifacts.record(relations.get_relation(relation_name), artifacts.MISSING_STREETS)
+    if relation_names is None:
+        logging.info("update_missing_streets: end")
+
+
+def get_stats_csv_path() -> str:
+    """Builds the file name of today's whole-country house number csv."""
+    return os.path.join(config.get_abspath("workdir/stats"), "%s.csv" % time.strftime("%Y-%m-%d"))
 
 
 def update_stats() -> None:
@@ -149,24 +410,14 @@ def update_stats() -> None:
     # Fetch house numbers for the whole country.
     logging.info("update_stats: start, updating whole-country csv")
     query = util.get_content(config.get_abspath("data/street-housenumbers-hungary.txt"))
-    statedir = config.get_abspath("workdir/stats")
+    csv_path = get_stats_csv_path()
+    statedir = os.path.dirname(csv_path)
     os.makedirs(statedir, exist_ok=True)
-    today = time.strftime("%Y-%m-%d")
-    csv_path = os.path.join(statedir, "%s.csv" % today)
-
-    retry = 0
-    while should_retry(retry):
-        if retry > 0:
-            logging.info("update_stats: try #%s", retry)
-        retry += 1
-        try:
-            overpass_sleep()
-            response = overpass_query.overpass_query(query)
-            with open(csv_path, "w") as stream:
-                stream.write(response)
-            break
-        except urllib.error.HTTPError as http_error:
-            logging.info("update_stats: http error: %s", str(http_error))
+
+    try:
+        os.replace(query_to_temp_file(query, statedir), csv_path)
+    except urllib.error.HTTPError as http_error:
+        logging.info("update_stats: http error: %s", str(http_error))
 
     # Shell part.
     logging.info("update_stats: executing the shell part")
@@ -175,17 +426,260 @@ def update_stats() -> None:
     logging.info("update_stats: end")
 
 
-def our_main(relations: areas.Relations, mode: str, update: bool) -> None:
+def apply_osc_diffs(relations: areas.Relations) -> Set[str]:
+    """
+    Applies the OSM replication diffs to the OSM lists of all relations. Returns the relations which are
+    up to date now, so they are not fetched: the patched ones, except the ones with new objects.
+    """
+    logging.info("apply_osc_diffs: start")
+    patched, current = osc_diffs.update_from_diffs(relations, config.Config.get_path("cron_osc_dir"))
+    logging.info("apply_osc_diffs: patched %s relations: %s", len(patched), ", ".join(patched))
+    refetch: List[str] = []
+    try:
+        refetch = osc_diffs.resolve_queue(relations, OVERPASS_TRIES)
+    except urllib.error.HTTPError as http_error:
+        # The new objects stay queued for the next run.
+        logging.info("apply_osc_diffs: http error: %s", str(http_error))
+    logging.info("apply_osc_diffs: %s relations with new objects: %s", len(refetch), ", ".join(refetch))
+    logging.info("apply_osc_diffs: end")
+    return set(current) - set(refetch)
+
+
+def update_osm_from_extract(relations: areas.Relations, update: bool, skip: Collection[str] = ()) -> Set[str]:
+    """
+    Update the OSM street and housenumber lists of all relations from the local OSM extract, except the
+    ones in skip. Returns the relations which are up to date now, so they are not fetched.
+    """
+    relation_names: List[str] = []
+    for relation_name in relations.get_active_names():
+        relation = relations.get_relation(relation_name)
+        if not update and os.path.exists(relation.get_files().get_osm_housenumbers_path()) or relation_name in skip:
+            continue
+        relation_names.append(relation_name)
+    logging.info("update_osm_from_extract: start")
+    extracted: List[str] = []
+    try:
+        extracted = osm_extract.extract(relations, relation_names, config.Config.get_path("cron_osm_extract"))
+    except (OSError, ValueError, xml.etree.ElementTree.ParseError) as error:
+        logging.info("update_osm_from_extract: failed: %s", str(error))
+    logging.info("update_osm_from_extract: extracted %s relations: %s", len(extracted), ", ".join(extracted))
+    logging.info("update_osm_from_extract: end")
+    return set(extracted)
+
+
+def get_boundaries(relations: areas.Relations, relation_names: List[str]) -> Dict[str, geometry.Polygon]:
+    """Gets the boundaries of relations, fetching the ones which are not cached yet."""
+    ret: Dict[str, geometry.Polygon] = {}
+
+    def worker(relation_name: str) -> None:
+        try:
+            boundary = boundaries.get_boundary(relations.get_relation(relation_name), OVERPASS_TRIES)
+        except urllib.error.HTTPError as http_error:
+            logging.info("get_boundaries: http error: %s", str(http_error))
+            return
+        if boundary:
+            ret[relation_name] = boundary
+    for_each_relation(relation_names, worker)
+    return ret
+
+
+def split_stats_dump(relations: areas.Relations, skip: Collection[str] = ()) -> Set[str]:
+    """
+    Update the OSM housenumber list of all relations, except the ones in skip, from today's
+    whole-country csv. Returns the relations which are up to date now, so they are not fetched.
+    """
+    csv_path = get_stats_csv_path()
+    if not os.path.exists(csv_path):
+        logging.info("split_stats_dump: no csv for today")
+        return set()
+    logging.info("split_stats_dump: start")
+    polygons = get_boundaries(relations, [name for name in relations.get_active_names() if name not in skip])
+    split: List[str] = []
+    try:
+        split = dump_split.split_dump(relations, polygons, csv_path)
+    except ValueError as value_error:
+        logging.info("split_stats_dump: failed: %s", str(value_error))
+    logging.info("split_stats_dump: split %s relations: %s", len(split), ", ".join(split))
+    logging.info("split_stats_dump: end")
+    return set(split)
+
+
+def update_nested_areas(relations: areas.Relations, skip: Collection[str] = ()) -> Set[str]:
+    """
+    Update the OSM housenumber list of all relations, except the ones in skip, which are inside an
+    other relation: only the outermost relation is fetched, the lists of the relations inside it are
+    derived from its result. Returns the relations which are up to date now, so they are not fetched.
+    """
+    logging.info("update_nested_areas: start")
+    polygons = get_boundaries(relations, [name for name in relations.get_active_names() if name not in skip])
+    groups = nested_areas.get_groups(nested_areas.get_parents(relations, polygons))
+    updated: Set[str] = set()
+
+    def worker(root: str) -> None:
+        logging.info("update_nested_areas: start: %s", root)
+        children = {child: polygons[child] for child in groups[root]}
+        try:
+            updated.update(nested_areas.update_group(relations, root, children, OVERPASS_TRIES))
+        except urllib.error.HTTPError as http_error:
+            logging.info("update_nested_areas: http error: %s", str(http_error))
+        logging.info("update_nested_areas: end: %s", root)
+    for_each_relation(sorted(groups), worker)
+    logging.info("update_nested_areas: updated %s relations: %s", len(updated), ", ".join(sorted(updated)))
+    logging.info("update_nested_areas: end")
+    return updated
+
+
+def get_osm_base() -> str:
+    """Gets the timestamp of the OSM data, or an empty string on error."""
+    try:
+        return change_probe.query_osm_base()
+    except (urllib.error.HTTPError, ValueError, KeyError) as error:
+        logging.info("get_osm_base: failed to get the osm base: %s", str(error))
+        return ""
+
+
+def skip_unchanged(relations: areas.Relations) -> str:
+    """
+    Forgets about relations where the OSM data did not change since the last fetch, so they are neither
+    fetched nor recomputed. Returns the timestamp of the OSM data, or an empty string on error.
+    """
+    osm_base = get_osm_base()
+    if not osm_base:
+        return ""
+    unchanged: List[str] = []
+
+    def worker(relation_name: str) -> None:
+        if change_probe.is_unchanged(relations.get_relation(relation_name)):
+            unchanged.append(relation_name)
+    for_each_relation(relations.get_active_names(), worker)
+    logging.info("skip_unchanged: skipping %s relations: %s", len(unchanged), ", ".join(sorted(unchanged)))
+    relations.limit_to_names([name for name in relations.get_names() if name not in unchanged])
+    return osm_base
+
+
+def get_delta_bases(relations: areas.Relations, osm_base: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Gets the OSM data timestamp, unless osm_base already has it, and the bases of the relations which
+    can be updated with deltas. Combined queries always fetch the full lists, so their state records a
+    full refresh.
+    """
+    osm_base = osm_base or get_osm_base()
+    if not osm_base or config.Config.get_bool("overpass_combined_query"):
+        return osm_base, {}
+    return osm_base, delta_update.get_delta_bases(relations)
+
+
+def update_osm(relations: areas.Relations, update: bool, delta_bases: Dict[str, str], skip: Set[str],
+               split: Set[str]) -> None:
+    """
+    Update the OSM street and housenumber lists of all relations from overpass, except the ones in
+    skip. Relations in split already have an up to date housenumber list.
+    """
+    if config.Config.get_bool("overpass_combined_query"):
+        update_osm_combined(relations, update, skip | split)
+        if split:
+            update_osm_streets(relations, update, skip | (set(relations.get_active_names()) - split))
+    else:
+        update_osm_streets(relations, update, skip)
+        update_osm_housenumbers(relations, update, delta_bases, skip | split)
+
+
+def update_local(relations: areas.Relations, update: bool, relation_names: Optional[List[str]] = None,
+                 jobs: int = 1) -> None:
+    """Update the reference lists and the coverage stats of all relations, or the ones in relation_names.
+    The coverage stats are computed in jobs processes."""
+    update_ref_streets(relations, update, relation_names)
+    if not config.Config.get_bool("reference_housenumbers_direct"):
+        update_ref_housenumbers(relations, update, relation_names)
+    update_missing_streets(relations, update, relation_names, jobs)
+    update_missing_housenumbers(relations, update, relation_names, jobs)
+
+
+def fetch_osm(relations: areas.Relations, relation_names: List[str], update: bool, delta_bases: Dict[str, str],
+              split: Set[str]) -> None:
+    """Same as update_osm(), but only for the relations in relation_names."""
+    paths = {i: relations.get_relation(i).get_files() for i in relation_names}
+    streets = [i for i in relation_names if is_outdated(update, [paths[i].get_osm_streets_path()])]
+    housenumbers = [i for i in relation_names
+                    if i not in split and is_outdated(update, [paths[i].get_osm_housenumbers_path()])]
+    if config.Config.get_bool("overpass_combined_query"):
+        combined = [i for i in relation_names if i not in split and (i in streets or i in housenumbers)]
+        if combined:
+            fetch_osm_batch(relations, combined)
+        streets = [i for i in streets if i in split]
+        housenumbers = []
+    for relation_name in streets:
+        fetch_osm_streets(relations, relation_name)
+    for relation_name in housenumbers:
+        fetch_osm_housenumbers(relations, relation_name, delta_bases)
+
+
+def update_pipelined(relations: areas.Relations, update: bool, fetch: Callable[[List[str]], None],
+                     jobs: int = 1) -> None:
+    """
+    Same as update_osm() followed by update_local(), but once the OSM lists of a relation (or a batch
+    of relations) are fetched using fetch, its local steps run in a worker pool, while later relations
+    are still fetching. The coverage stats of all batches are computed in one pool of jobs processes.
+    """
+    logging.info("update_pipelined: start")
+    relation_names = relations.get_active_names()
+    if config.Config.get_bool("overpass_combined_query"):
+        batches = get_batches(relations, relation_names, config.Config.get_int("overpass_batch_size"))
+    else:
+        batches = [[relation_name] for relation_name in relation_names]
+    workers = config.Config.get_int("cron_pipeline_workers")
+    # The process pool is started before the threads, and the batches share it.
+    with coverage_pool.shared_pool(relations, jobs), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: List[concurrent.futures.Future[None]] = []
+
+        def worker(batch: List[str]) -> None:
+            fetch(batch)
+            futures.append(executor.submit(update_local, relations, update, batch, jobs))
+        for_each_relation(batches, worker)
+        # Consume the results, so exceptions from the workers are not lost.
+        for future in futures:
+            future.result()
+    log_normalize_cache("update_pipelined")
+    logging.info("update_pipelined: end")
+
+
+def our_main(relations: areas.Relations, mode: str, update: bool, jobs: int = 1) -> None:
     """Performs the actual nightly task."""
     if mode in ("all", "stats"):
         update_stats()
     if mode in ("all", "relations"):
-        update_osm_streets(relations, update)
-        update_osm_housenumbers(relations, update)
-        update_ref_streets(relations, update)
-        update_ref_housenumbers(relations, update)
-        update_missing_streets(relations, update)
-        update_missing_housenumbers(relations, update)
+        osm_base = ""
+        if update and config.Config.get_bool("cron_skip_unchanged"):
+            osm_base = skip_unchanged(relations)
+        delta_bases: Dict[str, str] = {}
+        if update and config.Config.get_bool("cron_delta_updates"):
+            osm_base, delta_bases = get_delta_bases(relations, osm_base)
+        skip: Set[str] = set()
+        if update and config.Config.get_path("cron_osc_dir"):
+            skip = apply_osc_diffs(relations)
+        if update and config.Config.get_path("cron_osm_extract"):
+            skip |= update_osm_from_extract(relations, update, skip)
+        split: Set[str] = set()
+        if update and config.Config.get_bool("cron_split_stats_dump"):
+            split = split_stats_dump(relations, skip)
+        if update and config.Config.get_bool("cron_nested_areas"):
+            split |= update_nested_areas(relations, skip | split)
+        # Whole seconds, in case the file system has a coarse mtime.
+        start = int(time.time())
+        if config.Config.get_int("cron_pipeline_workers") > 0:
+            def fetch(relation_names: List[str]) -> None:
+                fetch_osm(relations, [i for i in relation_names if i not in skip], update, delta_bases, split)
+            update_pipelined(relations, update, fetch, jobs)
+        else:
+            update_osm(relations, update, delta_bases, skip, split)
+            update_local(relations, update, jobs=jobs)
+        if osm_base:
+            # The house numbers of split relations were written before start, from a dump without an
+            # OSM data timestamp, so their state is not recorded.
+            for relation_name in change_probe.get_fetched_names(relations, start):
+                change_probe.write_state(relations.get_relation(relation_name), osm_base,
+                                         full=relation_name not in delta_bases)
 
 
 def main() -> None:
@@ -212,6 +706,8 @@ def main() -> None:
                         help="don't update existing state of relations")
     parser.add_argument("--mode", choices=["all", "stats", "relations"],
                         help="only perform the given sub-task or all of them")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="compute the coverage of relations in this many processes")
     parser.set_defaults(update=True, mode="relations")
     args = parser.parse_args()
 
@@ -220,7 +716,7 @@ def main() -> None:
     relations.limit_to_refcounty(args.refcounty)
     relations.limit_to_refsettlement(args.refsettlement)
     try:
-        our_main(relations, args.mode, args.update)
+        our_main(relations, args.mode, args.update, args.jobs)
     # pylint: disable=broad-except
     except Exception:
         logging.error("main: unhandled exception: %s", traceback.format_exc())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The dataset_cache module provides a process-wide cache of parsed workdir files."""
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+import collections
+import os
+import threading
+
+import compressed_files
+
+Value = TypeVar("Value")
+# Size and modification time of a file, None if it does not exist.
+Fingerprint = Optional[Tuple[int, int]]
+
+
+def get_fingerprint(path: str) -> Fingerprint:
+    """Gets the size and modification time of a file, so changes to it can be detected."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class DatasetCache:
+    """
+    An LRU cache of parsed file contents. An entry is identified by a kind (e.g. 'osm-streets') and
+    the paths it was parsed from, it's only used while the size and modification time of those files
+    are unchanged. The uncompressed size of the files is used as the cost of an entry, the sum of these
+    is kept under a byte budget.
+    """
+    def __init__(self, budget: int) -> None:
+        self.__budget = budget
+        self.__entries: 'collections.OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[List[Fingerprint], int, Any]]'
+        self.__entries = collections.OrderedDict()
+        self.__size = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__lock = threading.Lock()
+
+    def set_budget(self, budget: int) -> None:
+        """Sets the byte budget, 0 disables caching. Does nothing if the budget is unchanged."""
+        if budget == self.__budget:
+            return
+        with self.__lock:
+            self.__budget = budget
+            self.__evict()
+
+    def is_enabled(self) -> bool:
+        """Decides if values are cached at all."""
+        return self.__budget > 0
+
+    def get(self, kind: str, paths: List[str], loader: Callable[[], Value]) -> Value:
+        """
+        Returns the value parsed from paths, calls loader to parse it in case it's not cached or the
+        files changed since then. The value is shared, the caller must not modify it.
+        """
+        key = (kind, tuple(paths))
+        fingerprints = [get_fingerprint(path) for path in paths]
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry and entry[0] == fingerprints:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return entry[2]  # type: ignore
+            self.__misses += 1
+            if entry:
+                self.__remove(key)
+
+        value = loader()
+        # The on-disk size of a compressed file would underestimate the memory use of the value, this
+        # doesn't decompress the file again.
+        cost = sum(compressed_files.get_uncompressed_size(path) for path, fingerprint in zip(paths, fingerprints)
+                   if fingerprint)
+        with self.__lock:
+            if cost > self.__budget:
+                return value
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (fingerprints, cost, value)
+            self.__size += cost
+            self.__evict()
+        return value
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns statistics about the cache, useful to tune the budget."""
+        with self.__lock:
+            return {
+                "budget": self.__budget,
+                "size": self.__size,
+                "entries": len(self.__entries),
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+            }
+
+    def clear(self) -> None:
+        """Forgets all entries and statistics."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
+
+    def __remove(self, key: Tuple[str, Tuple[str, ...]]) -> None:
+        """Removes an entry, the lock is expected to be held."""
+        _fingerprints, cost, _value = self.__entries.pop(key)
+        self.__size -= cost
+
+    def __evict(self) -> None:
+        """Evicts least recently used entries till the budget is respected, the lock is expected to be
+        held."""
+        while self.__entries and self.__size > self.__budget:
+            key = next(iter(self.__entries))
+            self.__remove(key)
+            self.__evictions += 1
+
+
+# The cache of this process, disabled by default, the web interface enables it.
+CACHE = DatasetCache(0)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The delta_update module updates the OSM house number list of a relation with only the objects which
+changed since the last fetch, and then recalculates the house number stats of the touched streets only.
+"""
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import TextIO
+from typing import Tuple
+import hashlib
+import os
+import tempfile
+
+import areas
+import change_probe
+import combined_query
+import external_sort
+import util
+
+# Done and todo house number range counts of a street.
+StreetStats = Dict[str, Tuple[int, int]]
+
+
+def make_delta_query(housenumbers_query: str, osm_base: str) -> str:
+    """
+    Creates a query which returns all objects in the area of a house numbers query which changed after
+    osm_base, with the same columns. Objects without address tags are returned as well, so objects
+    which lost their address can be removed.
+    """
+    columns, rest, body = combined_query.get_settings(housenumbers_query)
+    lines = ["[out:csv(%s)]%s" % (", ".join(columns), rest)]
+    area_sets: List[str] = []
+    for line in body:
+        match = combined_query.AREA.match(line.strip())
+        if match:
+            lines.append(line.strip())
+            area_sets.append(match.group(1))
+    if not area_sets:
+        raise ValueError("query has no area")
+    lines += ['nwr(area.%s)(newer:"%s");' % (area_sets[0], osm_base), "out body;"]
+    return "\n".join(lines) + "\n"
+
+
+def get_file_hash(path: str) -> str:
+    """Gets a hash of the content of a file, an empty string if it does not exist."""
+    if not os.path.exists(path):
+        return ""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(65536), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_delta_bases(relations: areas.Relations) -> Dict[str, str]:
+    """
+    Decides which active relations can be updated with only the changed objects. Returns the OSM data
+    timestamp of their last fetch for each of them.
+    """
+    ret: Dict[str, str] = {}
+    for relation_name in relations.get_active_names():
+        relation = relations.get_relation(relation_name)
+        if not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
+            continue
+        state = change_probe.read_state(relation)
+        if not state or change_probe.is_full_refresh_due(state):
+            continue
+        ret[relation_name] = str(state["osm_base"])
+    return ret
+
+
+def get_row_key(headers: List[str], cells: List[str]) -> str:
+    """Gets the OSM object of a row: its type and id."""
+    object_type = util.get_array_nth(cells, headers.index("@type")) if "@type" in headers else ""
+    return object_type + "/" + util.get_array_nth(cells, headers.index("@id"))
+
+
+def is_address(headers: List[str], cells: List[str]) -> bool:
+    """Decides if a row has address tags, i.e. the house numbers query would return it."""
+    return any(cell for header, cell in zip(headers, cells) if header.startswith("addr:"))
+
+
+def patch_rows(old_rows: Iterator[str], delta: List[str], result: TextIO) -> Set[str]:
+    """
+    Writes the rows of old_rows to result, with the rows of the objects in delta replaced by their new
+    rows. Returns the streets of the removed and added rows.
+    """
+    headers = delta[0].split("\t")
+    street_index = headers.index("addr:street")
+    changed = {get_row_key(headers, line.split("\t")) for line in delta[1:]}
+    streets: Set[str] = set()
+    for line in old_rows:
+        cells = line.split("\t")
+        if line and get_row_key(headers, cells) in changed:
+            streets.add(util.get_array_nth(cells, street_index))
+        elif line:
+            result.write(line + "\n")
+    for line in delta[1:]:
+        cells = line.split("\t")
+        if is_address(headers, cells):
+            streets.add(util.get_array_nth(cells, street_index))
+            result.write(line + "\n")
+    streets.discard("")
+    return streets
+
+
+def apply_delta(relation: areas.Relation, delta_path: str) -> None:
+    """
+    Patches the OSM house number list of relation with the result of make_delta_query() at delta_path,
+    which is removed. Rows of changed objects are replaced by their new rows, the streets of the old
+    and new rows are marked dirty.
+    """
+    with open(delta_path, "r", newline="\n") as stream:
+        delta = [line for line in external_sort.read_lines(stream) if line]
+    os.unlink(delta_path)
+    apply_delta_rows(relation, delta)
+
+
+def apply_delta_rows(relation: areas.Relation, delta: List[str]) -> None:
+    """Same as apply_delta(), but the delta is a list of rows, starting with the header."""
+    files = relation.get_files()
+    path = files.get_osm_housenumbers_path()
+    with files.get_osm_housenumbers_stream("r") as stream:
+        header = next(external_sort.read_lines(stream), "")
+    if not delta or delta[0] != header:
+        raise ValueError("the columns of the delta and the house number list differ")
+    before = get_file_hash(path)
+    handle, result_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(handle, "w", newline="\n") as result:
+        with files.get_osm_housenumbers_stream("r") as stream:
+            lines = external_sort.read_lines(stream)
+            result.write(next(lines) + "\n")
+            streets = patch_rows(lines, delta, result)
+    files.write_osm_housenumbers_file(result_path)
+    mark_dirty(relation, before, get_file_hash(path), streets)
+
+
+def read_dirty(relation: areas.Relation) -> Optional[Tuple[str, str, Set[str]]]:
+    """Reads the hashes of the house number list before and after the changes and the dirty streets."""
+    path = relation.get_files().get_state_path("dirty-streets")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as stream:
+        lines = stream.read().splitlines()
+    before, after = lines[0].split("\t")
+    return before, after, set(lines[1:])
+
+
+def mark_dirty(relation: areas.Relation, before: str, after: str, streets: Set[str]) -> None:
+    """Marks streets dirty, after the house number list changed from the before to the after hash."""
+    dirty = read_dirty(relation)
+    if dirty:
+        before = dirty[0]
+        streets = streets | dirty[2]
+    with open(relation.get_files().get_state_path("dirty-streets"), "w") as stream:
+        stream.write(before + "\t" + after + "\n")
+        for street in sorted(streets):
+            stream.write(street + "\n")
+
+
+def get_stats_key(relation: areas.Relation) -> str:
+    """Gets a string which changes when the stats of all streets have to be recalculated."""
+    streets_hash = get_file_hash(relation.get_files().get_osm_streets_path())
+    return change_probe.get_inputs_fingerprint(relation) + " " + streets_hash
+
+
+def read_stats(relation: areas.Relation) -> Optional[Tuple[str, str, StreetStats]]:
+    """Reads the stats key, the hash of the house number list and the per-street stats."""
+    path = relation.get_files().get_state_path("street-stats")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as stream:
+        lines = stream.read().splitlines()
+    key, housenumbers_hash = lines[0].split("\t")
+    stats: StreetStats = {}
+    for line in lines[1:]:
+        street, done_count, todo_count = line.split("\t")
+        stats[street] = (int(done_count), int(todo_count))
+    return key, housenumbers_hash, stats
+
+
+def get_street_stats(relation: areas.Relation, street: str) -> Tuple[int, int]:
+    """Calculates the stats of a single street."""
+    only_in_reference, in_both = areas.get_missing_housenumbers_for_street(relation, street)
+    return len(util.get_housenumber_ranges(in_both)), len(util.get_housenumber_ranges(only_in_reference))
+
+
+def update_housenumbers_percent(relation: areas.Relation) -> str:
+    """
+    Same as Relation.write_missing_housenumbers(), but only recalculates the dirty streets in case the
+    per-street stats are up to date otherwise. Returns the percent.
+    """
+    files = relation.get_files()
+    key = get_stats_key(relation)
+    housenumbers_hash = get_file_hash(files.get_osm_housenumbers_path())
+    old_stats = read_stats(relation)
+    dirty = read_dirty(relation)
+    stats: Optional[StreetStats] = None
+    if old_stats and old_stats[0] == key:
+        if old_stats[1] == housenumbers_hash:
+            stats = old_stats[2]
+        elif dirty and dirty[0] == old_stats[1] and dirty[1] == housenumbers_hash:
+            stats = old_stats[2]
+            osm_streets = set(relation.get_osm_streets())
+            for street in dirty[2]:
+                if street in osm_streets:
+                    stats[street] = get_street_stats(relation, street)
+                else:
+                    stats.pop(street, None)
+    if stats is None:
+        stats = {}
+        for street, only_in_reference, in_both in relation.iter_missing_housenumbers():
+            stats[street] = (len(util.get_housenumber_ranges(in_both)),
+                             len(util.get_housenumber_ranges(only_in_reference)))
+
+    with open(files.get_state_path("street-stats"), "w") as stream:
+        stream.write(key + "\t" + housenumbers_hash + "\n")
+        for street in sorted(stats.keys()):
+            stream.write("%s\t%s\t%s\n" % (street, stats[street][0], stats[street][1]))
+    if dirty:
+        os.unlink(files.get_state_path("dirty-streets"))
+
+    percent = util.get_percent(sum(i[0] for i in stats.values()), sum(i[1] for i in stats.values()))
+    with files.get_housenumbers_percent_stream("w") as stream:
+        stream.write(percent)
+    return percent
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The dump_split module splits the nationwide house number dump of the stats into the OSM house number
+lists of relations, based on their boundaries, so the relations don't have to be queried one by one.
+"""
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+import contextlib
+
+import areas
+import combined_query
+import external_sort
+import geometry
+
+
+def get_headers(dump_path: str) -> List[str]:
+    """Gets the CSV header of the dump."""
+    with open(dump_path, "r") as stream:
+        return stream.readline().rstrip("\n").split("\t")
+
+
+def iter_dump(dump_path: str) -> Iterator[Tuple[Optional[geometry.Point], Dict[str, str]]]:
+    """Iterates over the objects of the dump: yields their center (if they have one) and their values by
+    header."""
+    headers = get_headers(dump_path)
+    lat, lon = headers.index("@lat"), headers.index("@lon")
+    with open(dump_path, "r") as stream:
+        lines = external_sort.read_lines(stream)
+        next(lines, "")
+        for line in lines:
+            cells = line.split("\t")
+            if len(cells) != len(headers):
+                continue
+            point: Optional[geometry.Point] = None
+            if cells[lat] and cells[lon]:
+                point = (float(cells[lat]), float(cells[lon]))
+            yield point, dict(zip(headers, cells))
+
+
+def get_temp_path(relation: areas.Relation) -> str:
+    """Builds the file name of the not yet sorted OSM house number list of a relation."""
+    return relation.get_files().get_osm_housenumbers_path() + ".tmp"
+
+
+def open_outputs(relations: areas.Relations, relation_names: List[str],
+                 stack: contextlib.ExitStack) -> Dict[str, Tuple[TextIO, List[str]]]:
+    """Opens the not yet sorted OSM house number lists of relations, writes their header. Returns the
+    streams and the headers."""
+    ret: Dict[str, Tuple[TextIO, List[str]]] = {}
+    for relation_name in relation_names:
+        relation = relations.get_relation(relation_name)
+        headers = combined_query.get_columns(relation.get_osm_housenumbers_query())
+        stream = stack.enter_context(open(get_temp_path(relation), "w"))
+        stream.write("\t".join(headers) + "\n")
+        ret[relation_name] = (stream, headers)
+    return ret
+
+
+def make_index(boundaries: Dict[str, geometry.Polygon]) -> geometry.GridIndex[str]:
+    """Builds a grid index of the boundaries of relations."""
+    index: geometry.GridIndex[str] = geometry.GridIndex()
+    for relation_name, boundary in boundaries.items():
+        index.add(relation_name, boundary)
+    return index
+
+
+def split_dump(relations: areas.Relations, boundaries: Dict[str, geometry.Polygon], dump_path: str,
+               complete: str = "") -> List[str]:
+    """
+    Writes the OSM house number list of the relations in boundaries from the dump at dump_path. An
+    object is in a relation if its center is inside the boundary. The complete relation gets all
+    objects, e.g. when the dump is the result of its own query. Returns the names of the written
+    relations. Raises ValueError if the dump has no coordinates.
+    """
+    relation_names = sorted(set(boundaries) | ({complete} if complete else set()))
+    if not relation_names:
+        return []
+    if not {"@lat", "@lon"}.issubset(get_headers(dump_path)):
+        raise ValueError("dump has no coordinates")
+    index = make_index(boundaries)
+    with contextlib.ExitStack() as stack:
+        outputs = open_outputs(relations, relation_names, stack)
+        for point, values in iter_dump(dump_path):
+            found = index.find(point) if point else []
+            if complete:
+                found.append(complete)
+            for relation_name in found:
+                stream, headers = outputs[relation_name]
+                stream.write("\t".join(values.get(header, "") for header in headers) + "\n")
+    for relation_name in relation_names:
+        relation = relations.get_relation(relation_name)
+        relation.get_files().write_osm_housenumbers_file(get_temp_path(relation))
+    return relation_names
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
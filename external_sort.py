@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The external_sort module sorts CSV files which don't necessarily fit into memory."""
+
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import TextIO
+from typing import Tuple
+import heapq
+import os
+import tempfile
+
+import compressed_files
+
+# A sort key of a CSV line.
+SortKey = Callable[[str], Any]
+
+
+def read_lines(stream: TextIO) -> Iterator[str]:
+    """
+    Reads lines of stream without their line ending. In case the last line ends with a newline, an
+    empty line is yielded at the end, like str.split('\\n') would do.
+    """
+    line = ""
+    for line in stream:
+        yield line.rstrip("\n")
+    if line.endswith("\n"):
+        yield ""
+
+
+def write_run(directory: str, lines: List[str], key: SortKey) -> str:
+    """Sorts lines and writes them to a new temp file in directory, returns its path."""
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".run")
+    with os.fdopen(handle, "w", newline="\n") as stream:
+        for line in sorted(lines, key=key):
+            stream.write(line + "\n")
+    return path
+
+
+def read_run(path: str) -> Iterator[str]:
+    """Reads back the lines of a file written by write_run()."""
+    with open(path, "r", newline="\n") as stream:
+        for line in stream:
+            yield line[:-1]
+
+
+def sort_lines(in_path: str, key: SortKey, memory_limit: int, runs: List[str]) -> Tuple[str, Iterator[str]]:
+    """
+    Reads the CSV at in_path, returns its header and its sorted body lines. The paths of temp files
+    are added to runs, they are needed while the result is consumed.
+    """
+    directory = os.path.dirname(os.path.abspath(in_path))
+    lines: List[str] = []
+    size = 0
+    with open(in_path, "r", newline="\n") as stream:
+        iterator = read_lines(stream)
+        header = next(iterator, "")
+        for line in iterator:
+            lines.append(line)
+            size += len(line)
+            if size > memory_limit:
+                runs.append(write_run(directory, lines, key))
+                lines = []
+                size = 0
+
+    if not runs:
+        return header, iter(sorted(lines, key=key))
+    if lines:
+        runs.append(write_run(directory, lines, key))
+    # The merge is stable: in case of equal keys, lines from earlier runs come first.
+    return header, heapq.merge(*[read_run(run) for run in runs], key=key)
+
+
+def sort_csv_file(in_path: str, out_path: str, key: SortKey, memory_limit: int) -> None:
+    """
+    Sorts the body of the CSV at in_path while keeping the header intact, the same way as
+    util.process_csv_body() would do. Sorted runs of about memory_limit bytes are written to temp files
+    and then merged in case the body is larger than that. The result is written to a temp file which
+    is then renamed to out_path, so readers never see a partial result. The result is compressed in
+    case out_path has a compression suffix.
+    """
+    runs: List[str] = []
+    try:
+        header, lines = sort_lines(in_path, key, memory_limit, runs)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), suffix=".tmp")
+        os.close(handle)
+        try:
+            fmt = compressed_files.get_path_format(out_path)
+            with compressed_files.open_file(tmp_path, "w", fmt=fmt, newline="\n") as stream:
+                stream.write(header)
+                for line in lines:
+                    stream.write("\n" + line)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        for run in runs:
+            os.unlink(run)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The geometry module contains the planar geometry needed to assign OSM objects to relations locally:
+boundary polygons, point-in-polygon tests and a grid index of polygons.
+"""
+
+from typing import Dict
+from typing import Generic
+from typing import Hashable
+from typing import List
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
+import bisect
+import itertools
+import json
+import math
+
+# A (lat, lon) pair.
+Point = Tuple[float, float]
+# A closed list of points, the first and the last point are the same.
+Ring = List[Point]
+# A (min lat, min lon, max lat, max lon) tuple.
+BoundingBox = Tuple[float, float, float, float]
+
+T = TypeVar("T", bound=Hashable)
+
+
+def assemble_rings(ways: List[List[T]]) -> List[List[T]]:
+    """
+    Joins the node lists of boundary ways into closed rings, by matching their end nodes. Raises
+    ValueError in case a ring can't be closed.
+    """
+    rings: List[List[T]] = []
+    pending = [list(way) for way in ways if len(way) >= 2]
+    while pending:
+        ring = pending.pop()
+        while ring[0] != ring[-1]:
+            for index, way in enumerate(pending):
+                if way[0] == ring[-1]:
+                    ring = ring + way[1:]
+                elif way[-1] == ring[-1]:
+                    ring = ring + way[-2::-1]
+                elif way[-1] == ring[0]:
+                    ring = way[:-1] + ring
+                elif way[0] == ring[0]:
+                    ring = way[:0:-1] + ring
+                else:
+                    continue
+                del pending[index]
+                break
+            else:
+                raise ValueError("ring is not closed")
+        rings.append(ring)
+    return rings
+
+
+def get_bbox(points: List[Point]) -> BoundingBox:
+    """Gets the bounding box of points."""
+    lats = [point[0] for point in points]
+    lons = [point[1] for point in points]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def get_crossings(edges: List[Tuple[Point, Point]], lat: float) -> List[float]:
+    """Gets the sorted longitudes where edges cross the horizontal line at lat."""
+    ret: List[float] = []
+    for start, end in edges:
+        if (start[0] > lat) != (end[0] > lat):
+            ret.append(start[1] + (lat - start[0]) * (end[1] - start[1]) / (end[0] - start[0]))
+    return sorted(ret)
+
+
+def get_orientation(start: Point, end: Point, point: Point) -> float:
+    """Positive if point is left of the start -> end line, negative if right, 0 if on it."""
+    return (end[0] - start[0]) * (point[1] - start[1]) - (end[1] - start[1]) * (point[0] - start[0])
+
+
+def is_crossing(first: Tuple[Point, Point], second: Tuple[Point, Point]) -> bool:
+    """Decides if two segments cross each other."""
+    def separates(line: Tuple[Point, Point], segment: Tuple[Point, Point]) -> bool:
+        """Decides if the endpoints of segment are on different sides of line."""
+        start, end = line
+        return (get_orientation(start, end, segment[0]) > 0) != (get_orientation(start, end, segment[1]) > 0)
+    return separates(first, second) and separates(second, first)
+
+
+def get_distance(point: Point, edge: Tuple[Point, Point]) -> float:
+    """Gets the distance of point from the edge segment, in degrees."""
+    start, end = edge
+    length = (end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2
+    ratio = 0.0
+    if length:
+        ratio = ((point[0] - start[0]) * (end[0] - start[0]) + (point[1] - start[1]) * (end[1] - start[1])) / length
+        ratio = min(max(ratio, 0.0), 1.0)
+    closest = (start[0] + ratio * (end[0] - start[0]), start[1] + ratio * (end[1] - start[1]))
+    return math.hypot(point[0] - closest[0], point[1] - closest[1])
+
+
+class Polygon:
+    """
+    A polygon is a set of rings with the even-odd rule, so inner rings are holes. Point-in-polygon tests
+    use a grid over the bounding box: each cell knows if its center is inside and which edges cross the
+    cell, so a test only looks at the edges of a single cell.
+    """
+    def __init__(self, rings: List[Ring], cells: int = 64) -> None:
+        self.__rings = rings
+        self.__bbox = get_bbox([point for ring in rings for point in ring])
+        self.__cells = cells
+        self.__cell_lat = (self.__bbox[2] - self.__bbox[0]) / cells or 1.0
+        self.__cell_lon = (self.__bbox[3] - self.__bbox[1]) / cells or 1.0
+        edges = [(ring[index], ring[index + 1]) for ring in rings for index in range(len(ring) - 1)]
+        self.__cell_edges: Dict[Tuple[int, int], List[Tuple[Point, Point]]] = {}
+        for edge in edges:
+            min_row, min_column = self.__get_cell((min(edge[0][0], edge[1][0]), min(edge[0][1], edge[1][1])))
+            max_row, max_column = self.__get_cell((max(edge[0][0], edge[1][0]), max(edge[0][1], edge[1][1])))
+            for row in range(min_row, max_row + 1):
+                for column in range(min_column, max_column + 1):
+                    self.__cell_edges.setdefault((row, column), []).append(edge)
+        # A row of cells is inside where the number of crossings left of the center is odd.
+        self.__center_inside: List[List[bool]] = []
+        for row in range(cells):
+            crossings = get_crossings(edges, self.__get_center((row, 0))[0])
+            self.__center_inside.append([bisect.bisect(crossings, self.__get_center((row, column))[1]) % 2 == 1
+                                         for column in range(cells)])
+
+    def __get_cell(self, point: Point) -> Tuple[int, int]:
+        """Gets the cell of a point inside the bounding box."""
+        row = min(int((point[0] - self.__bbox[0]) / self.__cell_lat), self.__cells - 1)
+        column = min(int((point[1] - self.__bbox[1]) / self.__cell_lon), self.__cells - 1)
+        return row, column
+
+    def __get_center(self, cell: Tuple[int, int]) -> Point:
+        """Gets the center point of a cell."""
+        return (self.__bbox[0] + (cell[0] + 0.5) * self.__cell_lat, self.__bbox[1] + (cell[1] + 0.5) * self.__cell_lon)
+
+    def get_rings(self) -> List[Ring]:
+        """Gets the rings of the polygon."""
+        return self.__rings
+
+    def get_bbox(self) -> BoundingBox:
+        """Gets the bounding box of the polygon."""
+        return self.__bbox
+
+    def contains(self, point: Point) -> bool:
+        """Decides if point is inside the polygon."""
+        if not self.__bbox[0] <= point[0] <= self.__bbox[2] or not self.__bbox[1] <= point[1] <= self.__bbox[3]:
+            return False
+        cell = self.__get_cell(point)
+        inside = self.__center_inside[cell[0]][cell[1]]
+        segment = (point, self.__get_center(cell))
+        for edge in self.__cell_edges.get(cell, []):
+            if is_crossing(segment, edge):
+                inside = not inside
+        return inside
+
+    def covers(self, point: Point, tolerance: float) -> bool:
+        """Decides if point is inside the polygon or closer to its boundary than tolerance, which is
+        expected to be smaller than a cell."""
+        if self.contains(point):
+            return True
+        bbox = self.__bbox
+        if not bbox[0] - tolerance <= point[0] <= bbox[2] + tolerance \
+                or not bbox[1] - tolerance <= point[1] <= bbox[3] + tolerance:
+            return False
+        row, column = self.__get_cell((min(max(point[0], bbox[0]), bbox[2]), min(max(point[1], bbox[1]), bbox[3])))
+        for cell in itertools.product(range(row - 1, row + 2), range(column - 1, column + 2)):
+            if any(get_distance(point, edge) <= tolerance for edge in self.__cell_edges.get(cell, [])):
+                return True
+        return False
+
+    def to_json(self) -> str:
+        """Serializes the polygon, see from_json()."""
+        return json.dumps([[list(point) for point in ring] for ring in self.__rings])
+
+    @staticmethod
+    def from_json(buf: str) -> 'Polygon':
+        """Deserializes a polygon, see to_json()."""
+        return Polygon([[(point[0], point[1]) for point in ring] for ring in json.loads(buf)])
+
+
+class GridIndex(Generic[T]):
+    """A grid index finds the polygons which may contain a point, based on their bounding boxes."""
+    def __init__(self, cell_size: float = 0.05) -> None:
+        self.__cell_size = cell_size
+        self.__cells: Dict[Tuple[int, int], List[Tuple[T, Polygon]]] = {}
+
+    def __get_cell(self, point: Point) -> Tuple[int, int]:
+        """Gets the cell of a point."""
+        return math.floor(point[0] / self.__cell_size), math.floor(point[1] / self.__cell_size)
+
+    def add(self, key: T, polygon: Polygon) -> None:
+        """Adds a polygon to the index."""
+        bbox = polygon.get_bbox()
+        min_row, min_column = self.__get_cell((bbox[0], bbox[1]))
+        max_row, max_column = self.__get_cell((bbox[2], bbox[3]))
+        for row in range(min_row, max_row + 1):
+            for column in range(min_column, max_column + 1):
+                self.__cells.setdefault((row, column), []).append((key, polygon))
+
+    def find(self, point: Point) -> List[T]:
+        """Finds the keys of the polygons which contain point."""
+        return [key for key, polygon in self.__cells.get(self.__get_cell(point), []) if polygon.contains(point)]
+
+    def find_any(self, points: List[Point]) -> Set[T]:
+        """Finds the keys of the polygons which contain any of points."""
+        ret: Set[T] = set()
+        for point in points:
+            ret.update(self.find(point))
+        return ret
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The nested_areas module finds relations which are inside other relations, based on their boundaries,
+so the OSM house number list of a parent can be fetched once and the lists of its children can be
+derived from it locally.
+"""
+
+from typing import Dict
+from typing import List
+import os
+import re
+import tempfile
+
+import areas
+import combined_query
+import dump_split
+import geometry
+import overpass_query
+
+# Points of a child boundary closer to the parent boundary than this (in degrees, ~10 cm) are
+# considered to be on it: sub-areas share parts of their boundary with their parent.
+TOLERANCE = 1e-6
+
+OUT = re.compile(r"^out( body)?;$")
+
+
+def get_bbox_area(polygon: geometry.Polygon) -> float:
+    """Gets the area of the bounding box of a polygon."""
+    bbox = polygon.get_bbox()
+    return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+
+def is_nested(child: geometry.Polygon, parent: geometry.Polygon) -> bool:
+    """Decides if the child polygon is inside the parent one, their boundaries may touch."""
+    if get_bbox_area(child) >= get_bbox_area(parent):
+        return False
+    return all(parent.covers(point, TOLERANCE) for ring in child.get_rings() for point in ring)
+
+
+def get_parents(relations: areas.Relations, boundaries: Dict[str, geometry.Polygon]) -> Dict[str, str]:
+    """Maps the relations of boundaries which are inside an other one to their smallest parent."""
+    ret: Dict[str, str] = {}
+    for child, child_boundary in boundaries.items():
+        osmrelation = relations.get_relation(child).get_config().get_osmrelation()
+        candidates = [parent for parent, parent_boundary in boundaries.items()
+                      if relations.get_relation(parent).get_config().get_osmrelation() != osmrelation
+                      and is_nested(child_boundary, parent_boundary)]
+        if candidates:
+            ret[child] = min(candidates, key=lambda parent: (get_bbox_area(boundaries[parent]), parent))
+    return ret
+
+
+def get_groups(parents: Dict[str, str]) -> Dict[str, List[str]]:
+    """Maps the outermost parents to all relations inside them."""
+    ret: Dict[str, List[str]] = {}
+    for child in sorted(parents):
+        root = parents[child]
+        while root in parents:
+            root = parents[root]
+        ret.setdefault(root, []).append(child)
+    return ret
+
+
+def make_located_query(housenumbers_query: str) -> str:
+    """Creates a house numbers query which also returns the center of the objects."""
+    columns, rest, body = combined_query.get_settings(housenumbers_query)
+    lines = ["[out:csv(%s)]%s" % (", ".join(columns + ["::lat", "::lon"]), rest)]
+    lines += ["out center;" if OUT.match(line.strip()) else line for line in body]
+    return "\n".join(lines) + "\n"
+
+
+def update_group(relations: areas.Relations, root: str, children: Dict[str, geometry.Polygon], tries: int) -> List[str]:
+    """
+    Fetches the OSM house number list of the root relation with the center of the objects, then writes
+    the lists of root and the children relations inside it. Returns the names of the written relations.
+    """
+    relation = relations.get_relation(root)
+    query = make_located_query(relation.get_osm_housenumbers_query())
+    handle, path = tempfile.mkstemp(dir=relations.get_workdir(), suffix=".tmp")
+    os.close(handle)
+    try:
+        overpass_query.overpass_query_to_file(query, path, tries)
+        return dump_split.split_dump(relations, children, path, complete=root)
+    finally:
+        os.unlink(path)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The osc_diffs module applies OSM replication diffs (osmChange files) from a local directory to the OSM
+street and house number lists of relations, so they don't have to be fetched from overpass again.
+Objects which are not yet in any list are queued, the relations containing them are fetched again.
+The last diff applied to the lists of a relation is recorded in its 'osc' state file.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+import os
+import tempfile
+import time
+import xml.etree.ElementTree
+
+import areas
+import combined_query
+import compressed_files
+import config
+import delta_update
+import external_sort
+import overpass_query
+import util
+
+# Name of the file in the workdir, which contains the new objects, not yet mapped to relations.
+QUEUE_NAME = "osc.queue"
+
+# OSM object key ("type/id") -> its tags, None for deleted objects.
+Changes = Dict[str, Optional[Dict[str, str]]]
+
+
+def get_pending_paths(osc_dir: str, last: str) -> List[str]:
+    """Lists the osmChange files of osc_dir after last, relative to osc_dir, in replication order."""
+    ret: List[str] = []
+    for root, _dirs, names in os.walk(osc_dir):
+        for name in names:
+            if not compressed_files.strip_suffix(name).endswith(".osc"):
+                continue
+            path = os.path.relpath(os.path.join(root, name), osc_dir)
+            if path > last:
+                ret.append(path)
+    return sorted(ret)
+
+
+def read_changes(path: str, changes: Changes, known: Set[str], address_keys: Set[str]) -> None:
+    """
+    Reads an osmChange file into changes, later changes of an object replace earlier ones. Most objects
+    of a diff are untagged nodes, so only the changes of known objects and of objects which would be in
+    a street or house number list are kept.
+    """
+    action = ""
+    with compressed_files.open_file(path, "rb") as stream:
+        for event, element in xml.etree.ElementTree.iterparse(stream, events=("start", "end")):
+            if event == "start" and element.tag in ("create", "modify", "delete"):
+                action = element.tag
+            elif event == "end" and element.tag in ("node", "way", "relation"):
+                key = element.tag + "/" + element.attrib["id"]
+                tags: Optional[Dict[str, str]] = None
+                if action != "delete":
+                    tags = {tag.attrib["k"]: tag.attrib["v"] for tag in element.iter("tag")}
+                if key in changes or key in known or is_relevant(key, tags, address_keys):
+                    changes[key] = tags
+                element.clear()
+
+
+def is_street(key: str, tags: Dict[str, str]) -> bool:
+    """
+    Decides if an object with tags would be in the OSM street list, see streets-template.txt: streets are
+    ways, parks are ways or relations.
+    """
+    object_type = key.split("/")[0]
+    highway = tags.get("highway", "")
+    if object_type == "way" and highway and "bridge" not in tags and (highway != "service" or "name" in tags):
+        return True
+    return object_type in ("way", "relation") and tags.get("leisure") == "park" and "name" in tags
+
+
+def get_address_keys(relation: areas.Relation) -> Set[str]:
+    """Gets the address columns of the house number query of relation, objects with any of these tags
+    are in the OSM house number list."""
+    columns = combined_query.get_columns(relation.get_osm_housenumbers_query())
+    return {column for column in columns if column.startswith("addr:")}
+
+
+def is_address(tags: Dict[str, str], address_keys: Set[str]) -> bool:
+    """Decides if an object with tags would be in the OSM house number list."""
+    return any(key in address_keys for key in tags)
+
+
+def is_relevant(key: str, tags: Optional[Dict[str, str]], address_keys: Set[str]) -> bool:
+    """Decides if an object with tags (None if it was deleted) would be in a street or house number list."""
+    if tags is None:
+        return False
+    return is_street(key, tags) or is_address(tags, address_keys)
+
+
+def make_row(headers: List[str], key: str, tags: Dict[str, str]) -> str:
+    """Creates a CSV row of an object, the way overpass would write it."""
+    object_type, object_id = key.split("/")
+    values = {"@id": object_id, "@type": object_type}
+    return "\t".join(values.get(header, tags.get(header, "")) for header in headers)
+
+
+def write_temp_file(directory: str, lines: List[str]) -> str:
+    """Writes lines to a temp file in directory, returns its path."""
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(handle, "w", newline="\n") as stream:
+        for line in lines:
+            stream.write(line + "\n")
+    return path
+
+
+def get_list_keys(relation: areas.Relation) -> Set[str]:
+    """Gets the objects in the OSM street and house number lists of relation."""
+    files = relation.get_files()
+    keys: Set[str] = set()
+    for get_stream in (files.get_osm_streets_stream, files.get_osm_housenumbers_stream):
+        with get_stream("r") as stream:
+            lines = external_sort.read_lines(stream)
+            headers = next(lines, "").split("\t")
+            for line in lines:
+                if line and "@id" in headers:
+                    keys.add(delta_update.get_row_key(headers, line.split("\t")))
+    return keys
+
+
+def patch_streets(relation: areas.Relation, changes: Changes) -> bool:
+    """Applies changes to the OSM street list of relation. Returns if the list changed."""
+    files = relation.get_files()
+    rows: List[str] = []
+    changed = False
+    with files.get_osm_streets_stream("r") as stream:
+        lines = external_sort.read_lines(stream)
+        header = next(lines, "")
+        headers = header.split("\t")
+        for line in lines:
+            if not line or "@id" not in headers:
+                continue
+            key = delta_update.get_row_key(headers, line.split("\t"))
+            if key not in changes:
+                rows.append(line)
+                continue
+            changed = True
+            tags = changes[key]
+            if tags and is_street(key, tags):
+                rows.append(make_row(headers, key, tags))
+    if changed:
+        files.write_osm_streets_file(write_temp_file(os.path.dirname(files.get_osm_streets_path()), [header] + rows))
+    return changed
+
+
+def patch_housenumbers(relation: areas.Relation, changes: Changes) -> bool:
+    """Applies changes to the OSM house number list of relation. Returns if the list changed."""
+    keys: Set[str] = set()
+    with relation.get_files().get_osm_housenumbers_stream("r") as stream:
+        lines = external_sort.read_lines(stream)
+        header = next(lines, "")
+        headers = header.split("\t")
+        for line in lines:
+            if line and "@id" in headers:
+                keys.add(delta_update.get_row_key(headers, line.split("\t")))
+    delta = [make_row(headers, key, changes[key] or {}) for key in sorted(keys) if key in changes]
+    if delta:
+        delta_update.apply_delta_rows(relation, [header] + delta)
+    return bool(delta)
+
+
+def read_lines(path: str) -> List[str]:
+    """Reads the non-empty lines of a file, if it exists."""
+    if not os.path.exists(path):
+        return []
+    return [line for line in util.get_content(path).splitlines() if line]
+
+
+def read_state(relation: areas.Relation, now: float) -> Optional[Tuple[str, int]]:
+    """
+    Reads the last diff applied to the OSM lists of relation and the time when this state was reset.
+    Returns None if the lists have to be fetched again: they are missing, they were not written since
+    the reset or the reset was more than cron_full_refresh_days ago.
+    """
+    files = relation.get_files()
+    lines = read_lines(files.get_state_path("osc"))
+    paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+    if not lines or not all(os.path.exists(path) for path in paths):
+        return None
+    last, base = lines[0].split("\t")
+    if now - int(base) > config.Config.get_int("cron_full_refresh_days") * 24 * 3600:
+        return None
+    if any(os.path.getmtime(path) < int(base) for path in paths):
+        return None
+    return last, int(base)
+
+
+def write_state(relation: areas.Relation, last: str, base: int) -> None:
+    """Writes the last diff applied to the OSM lists of relation and the time of the last reset."""
+    with open(relation.get_files().get_state_path("osc"), "w") as stream:
+        stream.write("%s\t%s\n" % (last, base))
+
+
+def read_diffs(osc_dir: str, paths: List[str], known: Set[str], address_keys: Set[str]) -> Changes:
+    """Reads the relevant changes of the diffs at paths, relative to osc_dir, see read_changes()."""
+    changes: Changes = {}
+    for path in paths:
+        read_changes(os.path.join(osc_dir, path), changes, known, address_keys)
+    return changes
+
+
+def queue_new_objects(workdir: str, keys: Set[str]) -> None:
+    """Queues new objects, which would be in the street or house number list of some relation."""
+    queue = set(read_lines(os.path.join(workdir, QUEUE_NAME))) | keys
+    with open(os.path.join(workdir, QUEUE_NAME), "w") as stream:
+        for key in sorted(queue):
+            stream.write(key + "\n")
+
+
+def group_relations(relations: areas.Relations, newest: str) -> Dict[str, List[Tuple[areas.Relation, int]]]:
+    """
+    Groups the active relations with a usable state by their last applied diff, with the time of their
+    last reset. The state of the other relations is reset to newest, so the diffs after it apply to the
+    lists fetched in this run.
+    """
+    now = int(time.time())
+    groups: Dict[str, List[Tuple[areas.Relation, int]]] = {}
+    for relation_name in relations.get_active_names():
+        relation = relations.get_relation(relation_name)
+        state = read_state(relation, now)
+        if state:
+            groups.setdefault(state[0], []).append((relation, state[1]))
+        else:
+            write_state(relation, newest, now)
+    return groups
+
+
+def patch_relations(relations: List[areas.Relation], changes: Changes) -> List[str]:
+    """Applies changes to the OSM lists of relations. Returns the names of the changed relations."""
+    patched: List[str] = []
+    for relation in relations:
+        streets_changed = patch_streets(relation, changes)
+        if patch_housenumbers(relation, changes) or streets_changed:
+            patched.append(relation.get_name())
+    return patched
+
+
+def update_from_diffs(relations: areas.Relations, osc_dir: str) -> Tuple[List[str], List[str]]:
+    """
+    Applies the diffs of osc_dir which are not yet applied to the OSM lists of the active relations,
+    relations without a usable state are fetched again instead. Objects which are not in any list but
+    would be are queued. Returns the names of the changed relations and of the ones which are up to date
+    now.
+    """
+    paths = get_pending_paths(osc_dir, "")
+    groups = group_relations(relations, paths[-1] if paths else "")
+    known: Set[str] = set()
+    candidates: Set[str] = set()
+    patched: List[str] = []
+    current: List[str] = []
+    for last in sorted(groups):
+        members = [relation for relation, _base in groups[last]]
+        for relation in members:
+            known |= get_list_keys(relation)
+        address_keys = get_address_keys(members[0])
+        # known also has the objects of earlier groups, a list is only patched with the changes of its objects.
+        changes = read_diffs(osc_dir, [path for path in paths if path > last], known, address_keys)
+        patched += patch_relations(members, changes)
+        current += [relation.get_name() for relation in members]
+        candidates |= {key for key, tags in changes.items() if is_relevant(key, tags, address_keys)}
+    queue_new_objects(relations.get_workdir(), candidates - known)
+    # Only mark the diffs as applied once the new objects are queued.
+    for last, group in groups.items():
+        for relation, base in group:
+            write_state(relation, paths[-1] if paths else last, base)
+    return patched, current
+
+
+def get_queue_query(keys: List[str]) -> str:
+    """Produces a query which finds the areas containing the objects of keys."""
+    ids: Dict[str, List[str]] = {}
+    for key in keys:
+        object_type, object_id = key.split("/")
+        ids.setdefault(object_type, []).append(object_id)
+    statements = "".join("%s(id:%s);" % (object_type, ",".join(ids[object_type])) for object_type in sorted(ids))
+    return "[out:csv(::id)][timeout:425];\n(%s);\n(._;>;);\nis_in;\nout ids;\n" % statements
+
+
+def resolve_queue(relations: areas.Relations, tries: int) -> List[str]:
+    """
+    Finds the active relations which contain queued objects, so they can be fetched again. The queue is
+    emptied once the query succeeded.
+    """
+    queue_path = os.path.join(relations.get_workdir(), QUEUE_NAME)
+    keys = read_lines(queue_path)
+    if not keys:
+        return []
+    result = overpass_query.overpass_query(get_queue_query(keys), tries)
+    area_ids = set(result.splitlines()[1:])
+    ret: List[str] = []
+    for relation_name in relations.get_active_names():
+        osmrelation = relations.get_relation(relation_name).get_config().get_osmrelation()
+        if str(3600000000 + osmrelation) in area_ids:
+            ret.append(relation_name)
+    os.unlink(queue_path)
+    return ret
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The osm_extract module writes the OSM street and house number lists of relations from a local OSM
+extract (XML, optionally compressed, or PBF), instead of querying overpass for each relation.
+"""
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+import importlib.util
+import os
+import xml.etree.ElementTree
+
+import areas
+import combined_query
+import compressed_files
+import geometry
+import osc_diffs
+
+# OSM object type -> osmium entity filter name.
+PBF_ENTITIES = {
+    "node": "NODE",
+    "way": "WAY",
+    "relation": "RELATION",
+}
+
+# Roles of relation members which are part of the boundary.
+BOUNDARY_ROLES = ("outer", "inner", "")
+
+
+class Element:
+    """An element is an OSM object of an extract: a node, a way or a relation."""
+    def __init__(self, object_type: str, object_id: int, tags: Dict[str, str]) -> None:
+        self.__type = object_type
+        self.__id = object_id
+        self.__tags = tags
+        self.__location: Optional[geometry.Point] = None
+        self.__refs: List[int] = []
+        self.__members: List[Tuple[str, int, str]] = []
+
+    def get_type(self) -> str:
+        """Gets the type of the object: node, way or relation."""
+        return self.__type
+
+    def get_id(self) -> int:
+        """Gets the OSM id of the object."""
+        return self.__id
+
+    def get_key(self) -> str:
+        """Gets the type and the id of the object, e.g. 'way/42'."""
+        return "%s/%s" % (self.__type, self.__id)
+
+    def get_tags(self) -> Dict[str, str]:
+        """Gets the tags of the object."""
+        return self.__tags
+
+    def get_location(self) -> Optional[geometry.Point]:
+        """Gets the location of a node."""
+        return self.__location
+
+    def set_location(self, location: geometry.Point) -> None:
+        """Sets the location of a node."""
+        self.__location = location
+
+    def get_refs(self) -> List[int]:
+        """Gets the node ids of a way."""
+        return self.__refs
+
+    def set_refs(self, refs: List[int]) -> None:
+        """Sets the node ids of a way."""
+        self.__refs = refs
+
+    def get_members(self) -> List[Tuple[str, int, str]]:
+        """Gets the (type, id, role) members of a relation."""
+        return self.__members
+
+    def set_members(self, members: List[Tuple[str, int, str]]) -> None:
+        """Sets the (type, id, role) members of a relation."""
+        self.__members = members
+
+
+# OSM relation id -> objects inside the relation.
+Assignment = Dict[int, List[Element]]
+
+
+def is_osmium_available() -> bool:
+    """Decides if the optional osmium module is installed, which is needed for PBF extracts."""
+    return importlib.util.find_spec("osmium") is not None
+
+
+def iter_xml(path: str, object_type: str) -> Iterator[Element]:
+    """Iterates over the objects of an OSM XML extract with a given type."""
+    with compressed_files.open_file(path, "rb") as stream:
+        root: Optional[xml.etree.ElementTree.Element] = None
+        for event, node in xml.etree.ElementTree.iterparse(stream, events=("start", "end")):
+            if root is None:
+                root = node
+            if event != "end" or node.tag not in PBF_ENTITIES:
+                continue
+            if node.tag == object_type:
+                tags = {tag.attrib["k"]: tag.attrib["v"] for tag in node.iter("tag")}
+                element = Element(object_type, int(node.attrib["id"]), tags)
+                if object_type == "node":
+                    element.set_location((float(node.attrib["lat"]), float(node.attrib["lon"])))
+                element.set_refs([int(nd.attrib["ref"]) for nd in node.iter("nd")])
+                element.set_members([(member.attrib["type"], int(member.attrib["ref"]), member.attrib.get("role", ""))
+                                     for member in node.iter("member")])
+                yield element
+            # Objects are children of the root, forget about the ones already seen.
+            root.clear()
+
+
+def iter_pbf(path: str, object_type: str) -> Iterator[Element]:
+    """Iterates over the objects of a PBF extract with a given type."""
+    import osmium  # type: ignore  # pylint: disable=import-outside-toplevel,import-error
+    member_types = {"n": "node", "w": "way", "r": "relation"}
+    for obj in osmium.FileProcessor(path, getattr(osmium.osm, PBF_ENTITIES[object_type])):
+        element = Element(object_type, obj.id, {tag.k: tag.v for tag in obj.tags})
+        if object_type == "node":
+            element.set_location((obj.location.lat, obj.location.lon))
+        elif object_type == "way":
+            element.set_refs([node.ref for node in obj.nodes])
+        else:
+            element.set_members([(member_types[member.type], member.ref, member.role) for member in obj.members])
+        yield element
+
+
+def iter_elements(path: str, object_type: str) -> Iterator[Element]:
+    """Iterates over the objects of an extract with a given type."""
+    if path.endswith(".pbf"):
+        if not is_osmium_available():
+            raise ValueError("PBF extracts require the osmium module")
+        return iter_pbf(path, object_type)
+    return iter_xml(path, object_type)
+
+
+class Extract:
+    """
+    The objects of an extract which are relevant for a set of relations. The extract is read in three
+    passes, one per object type, so only the locations of the needed nodes are kept in memory. Street
+    and address relations (e.g. parks) are located by their member nodes and the nodes of their member
+    ways, like overpass does.
+    """
+    def __init__(self, path: str, osmrelations: Set[int], address_keys: Set[str]) -> None:
+        self.__address_keys = address_keys
+        # OSM relation -> ids of its member ways, which are part of the boundary.
+        self.__boundary_ways: Dict[int, List[int]] = {}
+        # OSM relation -> ids of its other member ways, e.g. streets.
+        self.__member_ways: Dict[int, List[int]] = {}
+        # Streets and addresses.
+        self.__objects: List[Element] = []
+        for element in iter_elements(path, "relation"):
+            if self.is_street(element) or self.is_address(element):
+                self.__objects.append(element)
+            if element.get_id() not in osmrelations:
+                continue
+            ways = [(ref, role) for member_type, ref, role in element.get_members() if member_type == "way"]
+            self.__boundary_ways[element.get_id()] = [ref for ref, role in ways if role in BOUNDARY_ROLES]
+            self.__member_ways[element.get_id()] = [ref for ref, role in ways if role not in BOUNDARY_ROLES]
+        member_ways = {way for ways in self.__boundary_ways.values() for way in ways}
+        member_ways.update(ref for element in self.__objects for member_type, ref, _role in element.get_members()
+                           if member_type == "way")
+        self.__way_refs: Dict[int, List[int]] = {}
+        for element in iter_elements(path, "way"):
+            if element.get_id() in member_ways:
+                self.__way_refs[element.get_id()] = element.get_refs()
+            if self.is_street(element) or self.is_address(element):
+                self.__objects.append(element)
+        needed = {ref for refs in self.__way_refs.values() for ref in refs}
+        needed.update(ref for element in self.__objects for ref in self.get_node_refs(element))
+        self.__locations: Dict[int, geometry.Point] = {}
+        for element in iter_elements(path, "node"):
+            location = element.get_location()
+            assert location
+            if element.get_id() in needed:
+                self.__locations[element.get_id()] = location
+            if self.is_address(element):
+                self.__objects.append(element)
+
+    def is_address(self, element: Element) -> bool:
+        """Decides if an object would be in the OSM house number list."""
+        return osc_diffs.is_address(element.get_tags(), self.__address_keys)
+
+    @staticmethod
+    def is_street(element: Element) -> bool:
+        """Decides if an object would be in the OSM street list."""
+        return osc_diffs.is_street(element.get_key(), element.get_tags())
+
+    def get_boundary(self, osmrelation: int) -> Optional[geometry.Polygon]:
+        """Builds the boundary polygon of a relation, if the extract contains all of it."""
+        try:
+            ways = [self.__way_refs[way] for way in self.__boundary_ways[osmrelation]]
+            rings = geometry.assemble_rings(ways)
+            return geometry.Polygon([[self.__locations[ref] for ref in ring] for ring in rings])
+        except (KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def get_node_refs(element: Element) -> List[int]:
+        """Gets the ids of the nodes of a way or the member nodes of a relation."""
+        return element.get_refs() + [ref for member_type, ref, _role in element.get_members() if member_type == "node"]
+
+    def get_points(self, element: Element) -> List[geometry.Point]:
+        """
+        Gets the points of an object: the location of a node, the nodes of a way or the member nodes
+        and the nodes of the member ways of a relation.
+        """
+        location = element.get_location()
+        if location:
+            return [location]
+        refs = self.get_node_refs(element)
+        for member_type, ref, _role in element.get_members():
+            if member_type == "way":
+                refs += self.__way_refs.get(ref, [])
+        return [self.__locations[ref] for ref in refs if ref in self.__locations]
+
+    def assign(self, boundaries: Dict[int, geometry.Polygon]) -> Tuple[Assignment, Assignment]:
+        """
+        Assigns the objects to relations, like overpass area queries do: a way is in a relation if any
+        of its nodes is inside. Member streets of the relation itself are streets of the relation as well.
+        Returns the streets and the addresses for each relation.
+        """
+        index: geometry.GridIndex[int] = geometry.GridIndex()
+        for osmrelation, boundary in boundaries.items():
+            index.add(osmrelation, boundary)
+        streets: Dict[int, Dict[str, Element]] = {}
+        addresses: Assignment = {}
+        street_ways: Dict[int, Element] = {}
+        for element in self.__objects:
+            is_street = self.is_street(element)
+            if is_street:
+                street_ways[element.get_id()] = element
+            for osmrelation in index.find_any(self.get_points(element)):
+                if is_street:
+                    streets.setdefault(osmrelation, {})[element.get_key()] = element
+                if self.is_address(element):
+                    addresses.setdefault(osmrelation, []).append(element)
+        for osmrelation, ways in self.__member_ways.items():
+            for way in ways:
+                if way in street_ways:
+                    streets.setdefault(osmrelation, {})[street_ways[way].get_key()] = street_ways[way]
+        return {key: list(value.values()) for key, value in streets.items()}, addresses
+
+
+def write_rows(directory: str, headers: List[str], elements: List[Element]) -> str:
+    """Writes elements to a temp file in directory, the way overpass would write them."""
+    path = osc_diffs.write_temp_file(directory, ["\t".join(headers)])
+    with open(path, "a") as stream:
+        for element in elements:
+            stream.write(osc_diffs.make_row(headers, element.get_key(), element.get_tags()) + "\n")
+    return path
+
+
+def write_lists(relation: areas.Relation, headers: Tuple[List[str], List[str]],
+                lists: Tuple[List[Element], List[Element]], boundary: geometry.Polygon) -> None:
+    """Writes the OSM street and house number lists and the boundary of a relation."""
+    files = relation.get_files()
+    directory = os.path.dirname(files.get_osm_streets_path())
+    files.write_osm_streets_file(write_rows(directory, headers[0], lists[0]))
+    files.write_osm_housenumbers_file(write_rows(directory, headers[1], lists[1]))
+    with open(files.get_state_path("boundary"), "w") as stream:
+        stream.write(boundary.to_json())
+
+
+def get_osmrelations(relations: areas.Relations, relation_names: List[str]) -> Dict[int, List[str]]:
+    """Maps OSM relation ids to the names of relations, several relations may have the same boundary."""
+    ret: Dict[int, List[str]] = {}
+    for relation_name in relation_names:
+        osmrelation = relations.get_relation(relation_name).get_config().get_osmrelation()
+        ret.setdefault(osmrelation, []).append(relation_name)
+    return ret
+
+
+def extract(relations: areas.Relations, relation_names: List[str], path: str) -> List[str]:
+    """
+    Writes the OSM street and house number lists and the boundary of relations from the extract at path.
+    Returns the names of the relations where the extract contains the whole boundary.
+    """
+    if not relation_names:
+        return []
+    first = relations.get_relation(relation_names[0])
+    headers = (combined_query.get_columns(first.get_osm_streets_query()),
+               combined_query.get_columns(first.get_osm_housenumbers_query()))
+    osmrelations = get_osmrelations(relations, relation_names)
+    osm_extract = Extract(path, set(osmrelations.keys()), osc_diffs.get_address_keys(first))
+
+    boundaries: Dict[int, geometry.Polygon] = {}
+    for osmrelation in osmrelations:
+        boundary = osm_extract.get_boundary(osmrelation)
+        if boundary:
+            boundaries[osmrelation] = boundary
+    streets, addresses = osm_extract.assign(boundaries)
+
+    ret: List[str] = []
+    for osmrelation, boundary in boundaries.items():
+        for relation_name in osmrelations[osmrelation]:
+            lists = (streets.get(osmrelation, []), addresses.get(osmrelation, []))
+            write_lists(relations.get_relation(relation_name), headers, lists, boundary)
+            ret.append(relation_name)
+    return sorted(ret)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -7,48 +7,436 @@
 
 """The overpass_query module allows getting data out of the OSM DB without a full download."""
 
-from typing import cast
-import urllib.request
-import urllib.error
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
+import email.message
+import http.client
+import math
+import os
+import random
 import re
+import shutil
 import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
 
 import config
+import response_cache
 
 
-def overpass_query(query: str) -> str:
-    """Posts the query string to the overpass API and returns the result string."""
-    url = config.Config.get_overpass_uri() + "/api/interpreter"
+# Responses are written to files in chunks of this size.
+CHUNK_SIZE = 65536
+# Delay of the first retry in seconds, doubled for each further retry...
+BACKOFF_BASE = 1.0
+# ...up to this limit.
+BACKOFF_MAX = 120.0
+# Queries have [timeout:425], a server not answering for longer than this is considered to be down.
+CONNECTION_TIMEOUT = 600.0
+# Weight of the last query in the rolling latency and error rate of an endpoint.
+HEALTH_ALPHA = 0.2
+# Seconds added to the score of an endpoint with only failed queries...
+ERROR_PENALTY = 600.0
+# ...and of an endpoint with all of its slots in use.
+BUSY_PENALTY = 60.0
 
-    sock = urllib.request.urlopen(url, bytes(query, "utf-8"))
-    buf = sock.read()
-    sock.close()
+T = TypeVar("T")
+
+
+def parse_status(status: str) -> Tuple[int, List[int]]:
+    """
+    Parses the output of /api/status. Returns the rate limit (0 means no limit) and the number of
+    seconds till each slot is available.
+    """
+    rate_limit = 1
+    seconds: List[int] = []
+    for line in status.splitlines():
+        if line.startswith("Rate limit:"):
+            rate_limit = int(line[len("Rate limit:"):].strip())
+        elif line.startswith("Slot available after:"):
+            # Wait one more second just to be safe.
+            seconds.append(max(int(re.sub(r".*in (-?\d+) seconds.*", r"\1", line.strip())) + 1, 1))
+        else:
+            match = re.match(r"(\d+) slots? available now", line)
+            if match:
+                seconds += [0] * int(match.group(1))
+    if rate_limit:
+        # Slots used by running queries are not listed: assume they are available, a 429 response
+        # will correct this.
+        seconds = sorted(seconds + [0] * max(rate_limit - len(seconds), 0))[:rate_limit]
+    return rate_limit, seconds
+
+
+def get_backoff(attempt: int, headers: Optional[email.message.Message]) -> float:
+    """Decides how many seconds to wait after a failed attempt, before the next try."""
+    if headers:
+        retry_after = headers.get("Retry-After")
+        if retry_after and retry_after.strip().isdigit():
+            return float(retry_after)
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2.0 ** (attempt - 1))
+    # Jitter, so parallel clients don't retry at the same time.
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class OverpassClient:
+    """
+    A client of an overpass instance. Idle connections are kept alive and reused. The rate limit is
+    parsed from the status once and then slots are tracked locally, the status is only parsed again
+    when the server still rejects a query with 429. Failed queries are retried with exponential
+    backoff.
+    """
+    def __init__(self, uri: str) -> None:
+        self.__uri = urllib.parse.urlsplit(uri.rstrip("/"))
+        self.__pool_lock = threading.Lock()
+        self.__idle_connections: List[http.client.HTTPConnection] = []
+        self.__lock = threading.Condition()
+        # None means the status is not parsed yet, 0 means no limit.
+        self.__rate_limit: Optional[int] = None
+        # Monotonic times when the currently not used slots can be used.
+        self.__free_slots: List[float] = []
+        self.__busy_slots = 0
+
+    def __get_idle_connection(self) -> Optional[http.client.HTTPConnection]:
+        """Returns an idle connection, if there is one."""
+        with self.__pool_lock:
+            if self.__idle_connections:
+                return self.__idle_connections.pop()
+        return None
+
+    def __get_new_connection(self) -> http.client.HTTPConnection:
+        """Creates a new connection."""
+        if self.__uri.scheme == "https":
+            return http.client.HTTPSConnection(self.__uri.netloc, timeout=CONNECTION_TIMEOUT)
+        return http.client.HTTPConnection(self.__uri.netloc, timeout=CONNECTION_TIMEOUT)
+
+    def __send(
+            self,
+            connection: http.client.HTTPConnection,
+            path: str,
+            data: Optional[bytes],
+            output: Optional[BinaryIO]
+    ) -> bytes:
+        """Sends a request on a connection, puts the connection back to the pool if possible."""
+        try:
+            if data is not None:
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+                connection.request("POST", self.__uri.path + path, body=data, headers=headers)
+            else:
+                connection.request("GET", self.__uri.path + path)
+            response = connection.getresponse()
+            if output and response.status == 200:
+                shutil.copyfileobj(response, output, CHUNK_SIZE)
+                buf = b""
+            else:
+                buf = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            with self.__pool_lock:
+                self.__idle_connections.append(connection)
+        if response.status != 200:
+            url = self.__uri.geturl() + path
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return buf
+
+    def request(self, path: str, data: Optional[bytes] = None, output: Optional[BinaryIO] = None) -> bytes:
+        """
+        Sends a single request to the server: a GET or a POST with data. The response is written to
+        output in chunks if it's provided, otherwise it's returned.
+        """
+        connection = self.__get_idle_connection()
+        if not connection:
+            # A failure on a new connection is left to the backoff of the caller, the query may have
+            # reached the server.
+            return self.__send(self.__get_new_connection(), path, data, output)
+        try:
+            return self.__send(connection, path, data, output)
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have closed the idle connection, try again with a new one.
+            if output:
+                output.seek(0)
+                output.truncate()
+            return self.__send(self.__get_new_connection(), path, data, output)
+
+    def __parse_status(self) -> None:
+        """Parses the status of the server, the lock is expected to be held."""
+        try:
+            status = self.request("/api/status").decode("utf-8")
+        except urllib.error.HTTPError:
+            status = ""
+        self.__rate_limit, seconds = parse_status(status)
+        now = time.monotonic()
+        self.__free_slots = [now + i for i in seconds[:max(self.__rate_limit - self.__busy_slots, 0)]]
+
+    def close(self) -> None:
+        """Closes the idle connections."""
+        with self.__pool_lock:
+            for connection in self.__idle_connections:
+                connection.close()
+            self.__idle_connections = []
+
+    def get_slots(self) -> int:
+        """Returns how many queries can be executed in parallel, 0 means there is no limit."""
+        with self.__lock:
+            if self.__rate_limit is None:
+                self.__parse_status()
+            assert self.__rate_limit is not None
+            return self.__rate_limit
+
+    def get_slot_delay(self) -> float:
+        """Estimates how many seconds a new query would wait for a slot, without parsing the status."""
+        with self.__lock:
+            if not self.__rate_limit:
+                return 0
+            if not self.__free_slots:
+                return BUSY_PENALTY
+            return max(min(self.__free_slots) - time.monotonic(), 0)
+
+    def get_need_sleep(self) -> int:
+        """Parses the status again and returns how many seconds a new query would wait for a slot."""
+        with self.__lock:
+            self.__parse_status()
+            self.__lock.notify_all()
+        return int(math.ceil(self.get_slot_delay()))
+
+    def __acquire_slot(self) -> None:
+        """Waits till a slot is available and takes it."""
+        while True:
+            with self.__lock:
+                if self.__rate_limit is None:
+                    self.__parse_status()
+                if not self.__rate_limit:
+                    self.__busy_slots += 1
+                    return
+                if not self.__free_slots:
+                    self.__lock.wait()
+                    continue
+                self.__free_slots.sort()
+                delay = self.__free_slots[0] - time.monotonic()
+                if delay <= 0:
+                    self.__free_slots.pop(0)
+                    self.__busy_slots += 1
+                    return
+            time.sleep(delay)
+
+    def __release_slot(self, rejected: bool) -> None:
+        """Gives back a slot, rejected means the server said there was no free slot."""
+        with self.__lock:
+            self.__busy_slots -= 1
+            if rejected:
+                # Our view of the slots is outdated.
+                self.__rate_limit = None
+            elif self.__rate_limit and len(self.__free_slots) + self.__busy_slots < self.__rate_limit:
+                self.__free_slots.append(time.monotonic())
+            self.__lock.notify()
+
+    def query(self, query: str, tries: int = 1) -> str:
+        """Posts the query string to the server and returns the result string."""
+        return self.__query(query, tries, None).decode("utf-8")
+
+    def query_to_file(self, query: str, path: str, tries: int = 1) -> None:
+        """Posts the query string to the server and writes the result to path, without keeping it in
+        memory."""
+        with open(path, "wb") as stream:
+            self.__query(query, tries, stream)
+
+    def __query(self, query: str, tries: int, output: Optional[BinaryIO]) -> bytes:
+        """Posts the query string to the server, retrying on failure."""
+        attempt = 0
+        while True:
+            self.__acquire_slot()
+            rejected = False
+            try:
+                if output:
+                    output.seek(0)
+                    output.truncate()
+                return self.request("/api/interpreter", bytes(query, "utf-8"), output)
+            except urllib.error.HTTPError as http_error:
+                # The status is parsed again, even if the caller retries with an other endpoint.
+                rejected = http_error.code == 429
+                attempt += 1
+                if attempt >= tries:
+                    raise
+                delay = get_backoff(attempt, http_error.headers)
+            except (http.client.HTTPException, OSError):
+                attempt += 1
+                if attempt >= tries:
+                    raise
+                delay = get_backoff(attempt, None)
+            finally:
+                self.__release_slot(rejected)
+            time.sleep(delay)
+
+
+class EndpointHealth:
+    """The rolling latency and error rate of an overpass endpoint."""
+    def __init__(self) -> None:
+        self.__latency = 0.0
+        self.__error_rate = 0.0
+        self.__lock = threading.Lock()
+
+    def record_success(self, latency: float) -> None:
+        """Records a successful query, which took latency seconds."""
+        with self.__lock:
+            self.__latency += HEALTH_ALPHA * (latency - self.__latency)
+            self.__error_rate -= HEALTH_ALPHA * self.__error_rate
 
-    return cast(str, buf.decode('utf-8'))
+    def record_failure(self) -> None:
+        """Records a failed query."""
+        with self.__lock:
+            self.__error_rate += HEALTH_ALPHA * (1 - self.__error_rate)
+
+    def get_latency(self) -> float:
+        """Gets the rolling latency in seconds."""
+        return self.__latency
+
+    def get_error_rate(self) -> float:
+        """Gets the rolling error rate, between 0 and 1."""
+        return self.__error_rate
+
+    def get_score(self, slot_delay: float) -> float:
+        """Estimates the cost of a query in seconds, lower is better."""
+        return self.__latency + slot_delay + self.__error_rate * ERROR_PENALTY
+
+
+class OverpassPool:
+    """
+    A pool of overpass endpoints. Each query goes to the endpoint with the best health score and
+    fails over to the next best one on errors, only backing off when all endpoints failed.
+    """
+    def __init__(self, uris: List[str]) -> None:
+        self.__clients = [OverpassClient(uri) for uri in uris]
+        self.__healths = [EndpointHealth() for _uri in uris]
+
+    def get_health(self, index: int) -> EndpointHealth:
+        """Gets the health of the endpoint at index."""
+        return self.__healths[index]
+
+    def close(self) -> None:
+        """Closes the idle connections of all endpoints."""
+        for client in self.__clients:
+            client.close()
+
+    def get_slots(self) -> int:
+        """Returns how many queries can be executed in parallel on all endpoints, 0 means there is no
+        limit."""
+        slots = [client.get_slots() for client in self.__clients]
+        if 0 in slots:
+            return 0
+        return sum(slots)
+
+    def get_need_sleep(self) -> int:
+        """Returns how many seconds a new query would wait for a slot on the least busy endpoint."""
+        return min(client.get_need_sleep() for client in self.__clients)
+
+    def __get_order(self, failed: Set[int]) -> List[int]:
+        """Orders the endpoints by their score, the ones in failed are tried last."""
+        scores = [health.get_score(client.get_slot_delay())
+                  for client, health in zip(self.__clients, self.__healths)]
+        return sorted(range(len(self.__clients)), key=lambda index: (index in failed, scores[index], index))
+
+    def query(self, query: str, tries: int = 1) -> str:
+        """Posts the query string to the best endpoint and returns the result string."""
+        return self.__query(tries, lambda client: client.query(query))
+
+    def query_to_file(self, query: str, path: str, tries: int = 1) -> None:
+        """Posts the query string to the best endpoint and writes the result to path, without keeping
+        it in memory."""
+        self.__query(tries, lambda client: client.query_to_file(query, path))
+
+    def __query(self, tries: int, send: Callable[[OverpassClient], T]) -> T:
+        """Sends a query using send, failing over to other endpoints and retrying on failure."""
+        attempt = 0
+        failed: Set[int] = set()
+        while True:
+            index = self.__get_order(failed)[0]
+            start = time.monotonic()
+            try:
+                ret = send(self.__clients[index])
+                self.__healths[index].record_success(time.monotonic() - start)
+                return ret
+            except (urllib.error.HTTPError, http.client.HTTPException, OSError) as error:
+                self.__healths[index].record_failure()
+                attempt += 1
+                if attempt >= tries:
+                    raise
+                failed.add(index)
+                if len(failed) < len(self.__clients):
+                    continue
+                failed = set()
+                headers = error.headers if isinstance(error, urllib.error.HTTPError) else None
+            time.sleep(get_backoff(attempt, headers))
+
+
+# Shared pools of this process, one for each list of overpass URIs.
+CLIENTS: Dict[Tuple[str, ...], OverpassPool] = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+def get_client() -> OverpassPool:
+    """Returns the shared client of the configured overpass instances."""
+    uris = tuple(config.Config.get_overpass_uris())
+    with CLIENTS_LOCK:
+        if uris not in CLIENTS:
+            CLIENTS[uris] = OverpassPool(list(uris))
+        return CLIENTS[uris]
+
+
+# Shared response caches of this process, one for each configuration.
+CACHES: Dict[Tuple[str, int, int], response_cache.ResponseCache] = {}
+
+
+def get_cache() -> Optional[response_cache.ResponseCache]:
+    """Returns the shared response cache, None if it's disabled."""
+    ttl = config.Config.get_int("overpass_cache_ttl")
+    budget = config.Config.get_int("overpass_cache_size")
+    if ttl <= 0 or budget <= 0:
+        return None
+    key = (os.path.join(config.Config.get_workdir(), "overpass-cache"), ttl, budget)
+    with CLIENTS_LOCK:
+        if key not in CACHES:
+            CACHES[key] = response_cache.ResponseCache(*key)
+        return CACHES[key]
+
+
+def overpass_query(query: str, tries: int = 1, cache: bool = True) -> str:
+    """Posts the query string to the overpass API and returns the result string, trying at most
+    'tries' times. A fresh cached result is used when cache is True, if the cache is enabled."""
+    responses = get_cache() if cache else None
+    if responses:
+        buf = responses.get(query)
+        if buf:
+            return buf.decode("utf-8")
+    ret = get_client().query(query, tries)
+    if responses:
+        responses.put(query, ret.encode("utf-8"))
+    return ret
 
 
 def overpass_query_need_sleep() -> int:
     """Checks if we need to sleep before executing an overpass query."""
-    try:
-        with urllib.request.urlopen(config.Config.get_overpass_uri() + "/api/status") as sock:
-            buf = sock.read()
-    except urllib.error.HTTPError:
-        return 0
-    status = buf.decode('utf-8')
-    sleep = 0
-    available = False
-    for line in status.splitlines():
-        if line.startswith("Slot available after:"):
-            # Wait one more second just to be safe.
-            sleep = int(re.sub(r".*in (-?\d+) seconds.*", r"\1", line.strip())) + 1
-            if sleep <= 0:
-                sleep = 1
-            break
-        if "available now" in line:
-            available = True
-    if available:
-        return 0
-    return sleep
+    return get_client().get_need_sleep()
+
+
+def overpass_query_to_file(query: str, path: str, tries: int = 1) -> None:
+    """Posts the query string to the overpass API and streams the result to path. A fresh cached
+    result is used, if the cache is enabled."""
+    responses = get_cache()
+    if responses and responses.get_to_file(query, path):
+        return
+    get_client().query_to_file(query, path, tries)
+    if responses:
+        responses.put_file(query, path)
 
 
 def main() -> None:
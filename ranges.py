@@ -52,6 +52,9 @@ class Range:
             return False
         return True
 
+    def __hash__(self) -> int:
+        return hash((self.__start, self.__end, self.__is_odd))
+
 
 class Ranges:
     """A Ranges object contains an item if any of its Range objects contains it."""
@@ -75,5 +78,8 @@ class Ranges:
         other_ranges = cast(Ranges, other)
         return self.__items == other_ranges.get_items()
 
+    def __hash__(self) -> int:
+        return hash(tuple(self.__items))
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab:
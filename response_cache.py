@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The response_cache module stores overpass responses in the workdir, so repeated queries are cheap."""
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Suffix of the cached responses in the cache directory.
+SUFFIX = ".response"
+
+
+def get_key(query: str) -> str:
+    """Gets the key of a query: the hash of its text."""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A cache of overpass responses in a directory, one file per query. An entry is only used for ttl
+    seconds after it was written. The total size of the entries is kept under a byte budget by
+    removing the least recently used ones. The directory may be shared by multiple processes.
+    """
+    def __init__(self, directory: str, ttl: int, budget: int) -> None:
+        self.__directory = directory
+        self.__ttl = ttl
+        self.__budget = budget
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        """Decides if responses are cached at all."""
+        return self.__ttl > 0 and self.__budget > 0
+
+    def __get_path(self, query: str) -> str:
+        """Gets the path of the cached response of a query."""
+        return os.path.join(self.__directory, get_key(query) + SUFFIX)
+
+    def __lookup(self, query: str) -> str:
+        """Finds the fresh cached response of a query and marks it as used. Returns its path or an empty
+        string."""
+        path = self.__get_path(query)
+        try:
+            stat = os.stat(path)
+            fresh = time.time() - stat.st_mtime < self.__ttl
+            if fresh:
+                # The access time orders the entries for eviction, the modification time decides freshness.
+                os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            fresh = False
+        with self.__lock:
+            if fresh:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+        return path if fresh else ""
+
+    def get(self, query: str) -> bytes:
+        """Gets the cached response of a query, empty if there is no fresh one."""
+        path = self.__lookup(query)
+        if not path:
+            return b""
+        try:
+            with open(path, "rb") as stream:
+                return stream.read()
+        except FileNotFoundError:
+            # Evicted by an other process in the meantime.
+            return b""
+
+    def get_to_file(self, query: str, output_path: str) -> bool:
+        """Copies the cached response of a query to output_path. Returns False if there is no fresh one."""
+        path = self.__lookup(query)
+        if not path:
+            return False
+        try:
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, query: str, data: bytes) -> None:
+        """Stores the response of a query."""
+        if len(data) > self.__budget:
+            return
+        os.makedirs(self.__directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.__directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as stream:
+            stream.write(data)
+        os.replace(temp_path, self.__get_path(query))
+        self.__evict()
+
+    def put_file(self, query: str, path: str) -> None:
+        """Stores the response of a query from a file."""
+        if os.path.getsize(path) > self.__budget:
+            return
+        os.makedirs(self.__directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.__directory, suffix=".tmp")
+        os.close(handle)
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, self.__get_path(query))
+        self.__evict()
+
+    def __get_entries(self) -> List[Tuple[float, float, int, str]]:
+        """Lists the access time, modification time, size and path of the entries."""
+        ret: List[Tuple[float, float, int, str]] = []
+        for name in os.listdir(self.__directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.__directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            ret.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        return ret
+
+    def __evict(self) -> None:
+        """Removes the expired entries, then the least recently used ones till the budget is respected."""
+        entries = sorted(self.__get_entries())
+        now = time.time()
+        size = sum(entry[2] for entry in entries)
+        for _atime, mtime, entry_size, path in entries:
+            if now - mtime < self.__ttl and size <= self.__budget:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns statistics about the cache, useful to tune the TTL and the budget."""
+        entries = self.__get_entries() if os.path.isdir(self.__directory) else []
+        with self.__lock:
+            return {
+                "ttl": self.__ttl,
+                "budget": self.__budget,
+                "size": sum(entry[2] for entry in entries),
+                "entries": len(entries),
+                "hits": self.__hits,
+                "misses": self.__misses,
+            }
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
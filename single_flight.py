@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The single_flight module coalesces concurrent calls doing the same work, e.g. when multiple users
+request the update of the same OSM list at the same time.
+"""
+
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+import os
+import tempfile
+import threading
+
+import areas
+import overpass_query
+
+Key = TypeVar("Key", bound=Hashable)
+Value = TypeVar("Value")
+
+
+class Flight(Generic[Value]):
+    """A call in progress: its callers wait for its result or exception."""
+    def __init__(self) -> None:
+        self.__done = threading.Event()
+        self.__value: Optional[Value] = None
+        self.__error: Optional[BaseException] = None
+
+    def finish(self, value: Optional[Value], error: Optional[BaseException]) -> None:
+        """Records the outcome of the call and wakes up the waiting callers."""
+        self.__value = value
+        self.__error = error
+        self.__done.set()
+
+    def get(self) -> Value:
+        """Waits for the call to finish, returns its result or raises its exception."""
+        self.__done.wait()
+        if self.__error:
+            raise self.__error
+        return self.__value  # type: ignore
+
+
+class SingleFlight(Generic[Key, Value]):
+    """
+    Runs a function only once at a time for a key: callers arriving while it runs wait for it and
+    share its result, or get the same exception.
+    """
+    def __init__(self) -> None:
+        self.__flights: Dict[Key, Flight[Value]] = {}
+        self.__lock = threading.Lock()
+
+    def is_running(self, key: Key) -> bool:
+        """Decides if a call is in progress for key."""
+        with self.__lock:
+            return key in self.__flights
+
+    def run(self, key: Key, function: Callable[[], Value]) -> Value:
+        """Calls function, unless a call with the same key is in progress: then waits for its result."""
+        with self.__lock:
+            flight = self.__flights.get(key)
+            if flight:
+                leader = False
+            else:
+                leader = True
+                flight = Flight()
+                self.__flights[key] = flight
+        if leader:
+            value: Optional[Value] = None
+            error: Optional[BaseException] = None
+            try:
+                value = function()
+            except BaseException as exception:  # pylint: disable=broad-except
+                error = exception
+            with self.__lock:
+                del self.__flights[key]
+            flight.finish(value, error)
+        return flight.get()
+
+
+# Updates of OSM lists, started from the web interface, by relation name and kind.
+UPDATES: SingleFlight[Tuple[str, str], None] = SingleFlight()
+
+
+def query_to_temp_file(query: str, directory: str) -> str:
+    """Streams the overpass result of query to a new temp file in directory, returns its path."""
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    try:
+        overpass_query.overpass_query_to_file(query, path)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def update_osm_streets(relation: areas.Relation) -> None:
+    """Fetches the OSM street list of relation, concurrent calls for the same relation share one query."""
+    def fetch() -> None:
+        files = relation.get_files()
+        directory = os.path.dirname(files.get_osm_streets_path())
+        files.write_osm_streets_file(query_to_temp_file(relation.get_osm_streets_query(), directory))
+    UPDATES.run((relation.get_name(), "streets"), fetch)
+
+
+def update_osm_housenumbers(relation: areas.Relation) -> None:
+    """Fetches the OSM house number list of relation, concurrent calls for the same relation share one
+    query."""
+    def fetch() -> None:
+        files = relation.get_files()
+        directory = os.path.dirname(files.get_osm_housenumbers_path())
+        files.write_osm_housenumbers_file(query_to_temp_file(relation.get_osm_housenumbers_query(), directory))
+    UPDATES.run((relation.get_name(), "housenumbers"), fetch)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
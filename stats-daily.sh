@@ -17,9 +17,13 @@ mkdir -p "${statedir}"
 mkdir -p "${htmldir}"
 
 date="$(date +%Y-%m-%d)"
+# Only count objects with a house number, the rest is there for cron.py, which splits the csv into
+# relations.
+awk -F $'\t' 'NR > 1 && $4 != ""' "${statedir}/${date}.csv" > "${statedir}/${date}.housenumbers"
 # Ignore 5th field, which is the user who touched the object last.
-sed '1d' "${statedir}/${date}.csv" |cut -d $'\t' -f 1-4 |sort -u|wc -l > "${statedir}/${date}.count"
-cut -d $'\t' -f 5 "${statedir}/${date}.csv" |sort |uniq -c |sort -k1,1rn |head -n 20 > "${statedir}/${date}.topusers"
+cut -d $'\t' -f 1-4 "${statedir}/${date}.housenumbers" |sort -u|wc -l > "${statedir}/${date}.count"
+cut -d $'\t' -f 5 "${statedir}/${date}.housenumbers" |sort |uniq -c |sort -k1,1rn |head -n 20 > "${statedir}/${date}.topusers"
+rm -f "${statedir}/${date}.housenumbers"
 
 # Clean up older (than 7 days), large .csv files.
 find "${statedir}" -type f -name "*.csv" -mtime +7 -exec rm -f {} \;
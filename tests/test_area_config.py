@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_area_config module covers the area_config module."""
+
+import os
+import unittest
+import unittest.mock
+
+import areas
+import util
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+class TestRelationConfigGetFingerprint(unittest.TestCase):
+    """Tests RelationConfig.get_fingerprint()."""
+    def test_happy(self) -> None:
+        """Tests that only relevant changes change the fingerprint."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation_config = relations.get_relation("gazdagret").get_config()
+            fingerprint = relation_config.get_fingerprint()
+            self.assertNotEqual(relations.get_relation("budafok").get_config().get_fingerprint(), fingerprint)
+            relation_config.set_active(False)
+            self.assertEqual(relation_config.get_fingerprint(), fingerprint)
+            relation_config.set_letter_suffix_style(util.LetterSuffixStyle.LOWER)
+            self.assertNotEqual(relation_config.get_fingerprint(), fingerprint)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_area_files module covers the area_files module."""
+
+import os
+import unittest
+import unittest.mock
+
+import area_files
+import areas
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+class TestBuildStreetIndex(unittest.TestCase):
+    """Tests build_street_index()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: adjacent rows are merged, others are not."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            path = relation.get_files().get_osm_housenumbers_path()
+            index = area_files.build_street_index(path, column=1, has_header=True)
+            self.assertEqual(len(index["OSM Name 1"]), 1)
+            with open(path, "rb") as stream:
+                offset, length = index["OSM Name 1"][0]
+                stream.seek(offset)
+                self.assertEqual(stream.read(length), "1\tOSM Name 1\t1\n1\tOSM Name 1\t2\n".encode("utf-8"))
+            self.assertNotIn("addr:street", index.keys())
+
+
+class TestWriteStreetIndex(unittest.TestCase):
+    """Tests write_street_index()."""
+    def test_failed(self) -> None:
+        """Tests that a failed write leaves no partial index behind."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            files = get_relations().get_relation("gazdagret").get_files()
+            path = files.get_osm_housenumbers_path()
+            index_path = get_abspath("workdir/failed.idx")
+            before = os.listdir(get_abspath("workdir"))
+            with unittest.mock.patch("os.replace", side_effect=OSError()):
+                with self.assertRaises(OSError):
+                    area_files.write_street_index(path, index_path, column=1, has_header=True)
+            self.assertEqual(os.listdir(get_abspath("workdir")), before)
+
+
+class TestReadStreetIndex(unittest.TestCase):
+    """Tests read_street_index()."""
+    def test_outdated(self) -> None:
+        """Tests that an index of a previous version of the file is not used."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            files = relations.get_relation("gazdagret").get_files()
+            path = files.get_osm_housenumbers_path()
+            index_path = area_files.get_index_path(files.get_osm_housenumbers_path())
+            with open(index_path, "w") as stream:
+                stream.write("0\t0\nOSM Name 1\t0\t1\n")
+            index = area_files.read_street_index(path, index_path, column=1, has_header=True)
+            self.assertNotEqual(index["OSM Name 1"], [(0, 1)])
+            # The rebuilt index is now up to date on disk.
+            self.assertEqual(area_files.read_street_index(path, index_path, column=1, has_header=True), index)
+
+
+class TestRelationFilesGetOsmHousenumbersStreetLines(unittest.TestCase):
+    """Tests RelationFiles.get_osm_housenumbers_street_lines()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            files = relations.get_relation("gazdagret").get_files()
+            if os.path.exists(area_files.get_index_path(files.get_osm_housenumbers_path())):
+                os.unlink(area_files.get_index_path(files.get_osm_housenumbers_path()))
+            lines = files.get_osm_housenumbers_street_lines("Tűzkő utca")
+            self.assertEqual(lines, ["1\tTűzkő utca\t9", "1\tTűzkő utca\t10"])
+            self.assertEqual(files.get_osm_housenumbers_street_lines("No Such utca"), [])
+
+
+class TestRelationFilesWriteRefHousenumbers(unittest.TestCase):
+    """Tests RelationFiles.write_ref_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests that the street index is written next to the list."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            files = relations.get_relation("gazdagret").get_files()
+            with files.get_ref_housenumbers_stream("r") as stream:
+                lines = [line.rstrip("\n") for line in stream]
+            files.write_ref_housenumbers(lines)
+            self.assertTrue(os.path.exists(area_files.get_index_path(files.get_ref_housenumbers_path())))
+            actual = files.get_ref_housenumbers_street_lines("Ref Name 1")
+            self.assertEqual(actual, ["Ref Name 1\t1\t", "Ref Name 1\t2\t"])
+
+
+if __name__ == '__main__':
+    unittest.main()
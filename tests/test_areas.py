@@ -7,6 +7,7 @@
 """The test_areas module covers the areas module."""
 
 import os
+from typing import Any
 from typing import List
 import unittest
 import unittest.mock
@@ -14,6 +15,7 @@ import unittest.mock
 import yattag
 
 import areas
+import config
 import ranges
 import util
 
@@ -365,6 +367,38 @@ class TestNormalize(unittest.TestCase):
             self.assertEqual([i.get_number() for i in house_number], ["2"])
 
 
+class TestNormalizeCache(unittest.TestCase):
+    """Tests the memoization of normalize()."""
+    def test_happy(self) -> None:
+        """Tests that the same raw value is only normalized once, even across streets."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            normalizers = relation.get_street_ranges()
+            areas.normalize_cached.cache_clear()
+            first = areas.normalize(relation, "2-6", "Budaörs út", normalizers)
+            second = areas.normalize(relation, "2-6", "Törökugrató utca", normalizers)
+            self.assertEqual(first, second)
+            hits, misses, maxsize, currsize = areas.normalize_cache_info()
+            self.assertEqual(hits, 1)
+            self.assertEqual(misses, 1)
+            self.assertEqual(maxsize, areas.NORMALIZE_CACHE_SIZE)
+            self.assertEqual(currsize, 1)
+
+    def test_settings_are_part_of_key(self) -> None:
+        """Tests that the letter suffix style is not ignored when looking up cached results."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            relation.get_config().set_housenumber_letters(True)
+            normalizers = relation.get_street_ranges()
+            upper = [i.get_number() for i in areas.normalize(relation, "42a", "Budaörs út", normalizers)]
+            relation.get_config().set_letter_suffix_style(util.LetterSuffixStyle.LOWER)
+            lower = [i.get_number() for i in areas.normalize(relation, "42a", "Budaörs út", normalizers)]
+            self.assertEqual(upper, ["42/A"])
+            self.assertEqual(lower, ["42a"])
+
+
 class TestRelationGetRefStreets(unittest.TestCase):
     """Tests Relation.GetRefStreets()."""
     def test_happy(self) -> None:
@@ -504,6 +538,57 @@ class TestRelationGetMissingHousenumbers(unittest.TestCase):
             self.assertEqual(housenumber_range_names, expected)
 
 
+class TestRelationIterMissingHousenumbers(unittest.TestCase):
+    """Tests Relation.iter_missing_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: streets are visited in reference order."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            results = list(relation.iter_missing_housenumbers())
+            street_names = [result[0] for result in results]
+            # 'OSM Name 1' is mapped to 'Ref Name 1', so it comes after 'Only In OSM utca'.
+            self.assertEqual(street_names, ['Hamzsabégi út',
+                                            'Only In OSM utca',
+                                            'OSM Name 1',
+                                            'Törökugrató utca',
+                                            'Tűzkő utca'])
+            _street_name, only_in_reference, in_both = results[2]
+            self.assertEqual(only_in_reference, [])
+            self.assertEqual([i.get_number() for i in in_both], ['1', '2'])
+            _street_name, only_in_reference, in_both = results[1]
+            self.assertEqual(only_in_reference, [])
+            self.assertEqual(in_both, [])
+
+
+class TestRelationReferenceDirect(unittest.TestCase):
+    """Tests the direct reference mode, which doesn't use the .lst file."""
+    def test_happy(self) -> None:
+        """Tests that the result is the same as the result with the .lst file."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            expected = relation.get_missing_housenumbers()
+            expected_street = areas.get_missing_housenumbers_for_street(relation, "Törökugrató utca")
+            expected_text = areas.get_ref_housenumbers_text(relation)
+            hide_path = relation.get_files().get_ref_housenumbers_path()
+            real_open = open
+
+            def mock_open(path: str, *args: Any, **kwargs: Any) -> Any:
+                assert path != hide_path
+                return real_open(path, *args, **kwargs)
+            with config.ConfigContext("reference_housenumbers_direct", "True"):
+                with unittest.mock.patch('builtins.open', mock_open):
+                    has_ref_housenumbers = areas.has_ref_housenumbers(relation)
+                    actual = relation.get_missing_housenumbers()
+                    actual_street = areas.get_missing_housenumbers_for_street(relation, "Törökugrató utca")
+                    actual_text = areas.get_ref_housenumbers_text(relation)
+        self.assertTrue(has_ref_housenumbers)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual_street, expected_street)
+        self.assertEqual(actual_text, expected_text)
+
+
 class TestRelationGetMissingStreets(unittest.TestCase):
     """Tests Relation.get_missing_streets()."""
     def test_happy(self) -> None:
@@ -773,6 +858,8 @@ class TestRelations(unittest.TestCase):
             relations.limit_to_refsettlement("99")
             self.assertTrue("gazdagret" not in relations.get_active_names())
             self.assertTrue("nosuchrefsettlement" in relations.get_active_names())
+            relations.limit_to_names(["nosuchrefsettlement", "gellerthegy"])
+            self.assertEqual(relations.get_active_names(), ["nosuchrefsettlement"])
 
 
 class TestRelationConfigMissingStreets(unittest.TestCase):
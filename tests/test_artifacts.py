@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_artifacts module covers the artifacts module."""
+
+from typing import List
+import contextlib
+import os
+import unittest
+import unittest.mock
+
+import areas
+import artifacts
+import config
+import cron
+import util
+
+KINDS = [artifacts.REF_STREETS, artifacts.REF_HOUSENUMBERS, artifacts.MISSING_STREETS, artifacts.MISSING_HOUSENUMBERS]
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+class TestIsOutdated(unittest.TestCase):
+    """Tests is_outdated()."""
+    def setUp(self) -> None:
+        self.stack = contextlib.ExitStack()
+        self.stack.enter_context(unittest.mock.patch('config.get_abspath', get_abspath))
+        self.stack.enter_context(unittest.mock.patch.dict("config.DEFAULTS", {"cron_incremental": "True"}))
+        self.relations = areas.Relations(get_abspath("workdir"))
+
+    def tearDown(self) -> None:
+        for relation_name in ("gazdagret", "budafok"):
+            path = self.relations.get_relation(relation_name).get_files().get_state_path("artifacts")
+            if os.path.exists(path):
+                os.unlink(path)
+        self.stack.close()
+
+    def get_outdated(self, relation_name: str) -> List[str]:
+        """Gets the outdated artifact kinds of a relation."""
+        relation = self.relations.get_relation(relation_name)
+        return [kind for kind in KINDS if artifacts.is_outdated(relation, kind, update=True)]
+
+    def test_happy(self) -> None:
+        """Tests that changing the filters of a relation only makes the artifacts of that relation outdated."""
+        for relation_name in ("gazdagret", "budafok"):
+            self.assertEqual(self.get_outdated(relation_name), KINDS)
+            for kind in KINDS:
+                artifacts.record(self.relations.get_relation(relation_name), kind)
+        self.assertEqual(self.get_outdated("gazdagret"), [])
+        # The street lists of budafok are missing.
+        self.assertEqual(self.get_outdated("budafok"), [artifacts.REF_STREETS, artifacts.MISSING_STREETS])
+        relation_config = self.relations.get_relation("gazdagret").get_config()
+        filters = relation_config.get_filters()
+        filters["Renamed utca"] = filters.pop("Törökugrató utca")
+        relation_config.set_filters(filters)
+        self.assertEqual(self.get_outdated("gazdagret"), KINDS)
+        self.assertEqual(self.get_outdated("budafok"), [artifacts.REF_STREETS, artifacts.MISSING_STREETS])
+
+    def test_input_changed(self) -> None:
+        """Tests that a changed OSM list only makes the coverage outdated."""
+        relation = self.relations.get_relation("gazdagret")
+        for kind in KINDS:
+            artifacts.record(relation, kind)
+        with unittest.mock.patch("delta_update.get_file_hash", lambda _path: "changed"):
+            outdated = self.get_outdated("gazdagret")
+        expected = [artifacts.REF_HOUSENUMBERS, artifacts.MISSING_STREETS, artifacts.MISSING_HOUSENUMBERS]
+        self.assertEqual(outdated, expected)
+
+    def test_street_added(self) -> None:
+        """Tests that a new OSM street rebuilds the reference house number list."""
+        relation = self.relations.get_relation("gazdagret")
+        for kind in KINDS:
+            artifacts.record(relation, kind)
+        path = relation.get_files().get_osm_streets_path()
+        original = util.get_content(path)
+        with open(path, "a") as stream:
+            stream.write("5\tNew utca\n")
+        mock_write = unittest.mock.Mock()
+        with unittest.mock.patch("areas.Relation.write_ref_housenumbers", mock_write):
+            cron.update_ref_housenumbers(self.relations, update=True, relation_names=["gazdagret"])
+        with open(path, "w") as stream:
+            stream.write(original)
+        mock_write.assert_called_once()
+
+    def test_direct(self) -> None:
+        """Tests that the coverage depends on the reference instead of the reference list in direct mode."""
+        relation = self.relations.get_relation("gazdagret")
+        with config.ConfigContext("reference_housenumbers_direct", "True"):
+            inputs = artifacts.get_inputs(relation, artifacts.MISSING_HOUSENUMBERS)
+        self.assertNotIn("street-housenumbers-reference-gazdagret.lst", inputs)
+        self.assertIn("streets-gazdagret.csv", inputs)
+        for path in config.Config.get_reference_housenumber_paths():
+            self.assertIn(path, inputs)
+
+    def test_not_incremental(self) -> None:
+        """Tests that existing artifacts are rebuilt with update and kept without it, if not incremental."""
+        relation = self.relations.get_relation("gazdagret")
+        with unittest.mock.patch.dict("config.DEFAULTS", {"cron_incremental": "False"}):
+            artifacts.record(relation, artifacts.REF_STREETS)
+            self.assertFalse(os.path.exists(relation.get_files().get_state_path("artifacts")))
+            self.assertTrue(artifacts.is_outdated(relation, artifacts.REF_STREETS, update=True))
+        self.assertFalse(artifacts.is_outdated(relation, artifacts.REF_STREETS, update=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
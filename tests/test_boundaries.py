@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_boundaries module covers the boundaries module."""
+
+from typing import List
+import os
+import time
+import unittest
+import unittest.mock
+
+import areas
+import boundaries
+
+# The boundary of a relation, as returned by overpass.
+BOUNDARY = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+  <node id="1" lat="47.0" lon="19.0"/>
+  <node id="2" lat="47.0" lon="19.1"/>
+  <node id="3" lat="47.1" lon="19.1"/>
+  <way id="100">
+    <nd ref="1"/>
+    <nd ref="2"/>
+    <nd ref="3"/>
+    <nd ref="1"/>
+  </way>
+  <relation id="2713748">
+    <member type="way" ref="100" role="outer"/>
+  </relation>
+</osm>
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+class TestGetBoundary(unittest.TestCase):
+    """Tests get_boundary()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the boundary is only fetched when the cache is missing or old."""
+        queries: List[str] = []
+
+        def mock_overpass_query_to_file(query: str, path: str, tries: int) -> None:
+            queries.append(query)
+            self.assertEqual(tries, 3)
+            with open(path, "w") as stream:
+                stream.write(BOUNDARY)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("overpass_query.overpass_query_to_file", mock_overpass_query_to_file):
+            relation = get_relations().get_relation("gazdagret")
+            path = relation.get_files().get_state_path("boundary")
+            try:
+                boundary = boundaries.get_boundary(relation, tries=3)
+                assert boundary
+                self.assertTrue(boundary.contains((47.01, 19.05)))
+                self.assertFalse(boundary.contains((47.09, 19.01)))
+                self.assertTrue(os.path.exists(path))
+                self.assertIsNotNone(boundaries.get_boundary(relation, tries=3))
+                self.assertEqual(len(queries), 1)
+                old = time.time() - (boundaries.MAX_AGE_DAYS + 1) * 24 * 3600
+                os.utime(path, (old, old))
+                self.assertIsNotNone(boundaries.get_boundary(relation, tries=3))
+                self.assertEqual(len(queries), 2)
+            finally:
+                os.unlink(path)
+        self.assertEqual(queries[0], "[timeout:425];\nrel(2713748);\n(._;>;);\nout skel;\n")
+
+    def test_not_closed(self) -> None:
+        """Tests the case when the boundary is not a closed polygon."""
+        def mock_overpass_query_to_file(_query: str, path: str, _tries: int) -> None:
+            with open(path, "w") as stream:
+                stream.write(BOUNDARY.replace('<nd ref="3"/>\n    <nd ref="1"/>', '<nd ref="3"/>'))
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("overpass_query.overpass_query_to_file", mock_overpass_query_to_file):
+            relation = get_relations().get_relation("gazdagret")
+            self.assertIsNone(boundaries.get_boundary(relation, tries=3))
+            self.assertFalse(os.path.exists(relation.get_files().get_state_path("boundary")))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_change_probe module covers the change_probe module."""
+
+from typing import List
+import json
+import os
+import time
+import unittest
+import unittest.mock
+import urllib.error
+
+import areas
+import change_probe
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+def get_count_result(total: int) -> str:
+    """Produces the JSON result of an 'out count' query."""
+    result = {
+        "osm3s": {"timestamp_osm_base": "2020-05-10T22:02:25Z"},
+        "elements": [{"type": "count", "id": 0, "tags": {"total": str(total)}}],
+    }
+    return json.dumps(result)
+
+
+def get_timestamp(seconds_ago: float) -> str:
+    """Produces an overpass timestamp of some time ago."""
+    return time.strftime(change_probe.TIMESTAMP_FORMAT, time.gmtime(time.time() - seconds_ago))
+
+
+class TestParseOsmBase(unittest.TestCase):
+    """Tests parse_osm_base()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertEqual(change_probe.parse_osm_base(get_count_result(0)), "2020-05-10T22:02:25Z")
+
+
+class TestParseCount(unittest.TestCase):
+    """Tests parse_count()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertEqual(change_probe.parse_count(get_count_result(42)), 42)
+
+
+class TestQueryOsmBase(unittest.TestCase):
+    """Tests query_osm_base()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        queries: List[str] = []
+
+        def mock_overpass_query(query: str, tries: int, cache: bool) -> str:
+            queries.append(query)
+            self.assertGreater(tries, 1)
+            # The OSM data timestamp must be fresh.
+            self.assertFalse(cache)
+            return '{"osm3s": {"timestamp_osm_base": "2020-05-10T22:02:25Z"}, "elements": []}'
+        with unittest.mock.patch('overpass_query.overpass_query', mock_overpass_query):
+            self.assertEqual(change_probe.query_osm_base(), "2020-05-10T22:02:25Z")
+        self.assertEqual(queries, ["[out:json];out;"])
+
+
+class TestGetChangesQuery(unittest.TestCase):
+    """Tests get_changes_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            expected = "changes aaa 2713748 bbb 3602713748 ccc 2020-05-10T22:02:25Z\n"
+            self.assertEqual(change_probe.get_changes_query(relation, "2020-05-10T22:02:25Z"), expected)
+
+
+class TestState(unittest.TestCase):
+    """Tests read_state() and write_state()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            self.assertIsNone(change_probe.read_state(relation))
+            change_probe.write_state(relation, "2020-05-10T22:02:25Z")
+            state = change_probe.read_state(relation)
+            os.unlink(relation.get_files().get_state_path("osm-base"))
+            assert state
+            self.assertEqual(state["osm_base"], "2020-05-10T22:02:25Z")
+            self.assertEqual(state["inputs"], change_probe.get_inputs_fingerprint(relation))
+
+    def test_not_full(self) -> None:
+        """Tests that a delta update keeps the timestamp of the last full fetch."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            change_probe.write_state(relation, "2020-05-10T22:02:25Z")
+            change_probe.write_state(relation, "2020-05-11T22:02:25Z", full=False)
+            change_probe.write_state(relation, "2020-05-12T22:02:25Z", full=False)
+            state = change_probe.read_state(relation)
+            os.unlink(relation.get_files().get_state_path("osm-base"))
+        assert state
+        self.assertEqual(state["osm_base"], "2020-05-12T22:02:25Z")
+        self.assertEqual(state["full_osm_base"], "2020-05-10T22:02:25Z")
+
+
+class TestIsUnchanged(unittest.TestCase):
+    """Tests is_unchanged()."""
+    def is_unchanged(self, relation_name: str, seconds_ago: float, result: str) -> bool:
+        """Writes a state of some time ago and probes the relation with result."""
+        def mock_overpass_query(_query: str, tries: int, cache: bool) -> str:
+            self.assertGreater(tries, 1)
+            self.assertFalse(cache)
+            if not result:
+                raise urllib.error.HTTPError("", 503, "", None, None)  # type: ignore
+            return result
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation(relation_name)
+            change_probe.write_state(relation, get_timestamp(seconds_ago))
+            try:
+                with unittest.mock.patch('overpass_query.overpass_query', mock_overpass_query):
+                    return change_probe.is_unchanged(relation)
+            finally:
+                os.unlink(relation.get_files().get_state_path("osm-base"))
+
+    def test_unchanged(self) -> None:
+        """Tests the case when nothing changed since the last fetch."""
+        self.assertTrue(self.is_unchanged("gazdagret", 3600, get_count_result(0)))
+
+    def test_changed(self) -> None:
+        """Tests the case when some objects changed since the last fetch."""
+        self.assertFalse(self.is_unchanged("gazdagret", 3600, get_count_result(3)))
+
+    def test_probe_error(self) -> None:
+        """Tests the case when the probe fails."""
+        self.assertFalse(self.is_unchanged("gazdagret", 3600, ""))
+
+    def test_too_old(self) -> None:
+        """Tests the case when the last fetch is too old: deletions are not visible in the probe."""
+        self.assertFalse(self.is_unchanged("gazdagret", 8 * 24 * 3600, get_count_result(0)))
+
+    def test_no_osm_files(self) -> None:
+        """Tests the case when the OSM files are missing."""
+        self.assertFalse(self.is_unchanged("gellerthegy", 3600, get_count_result(0)))
+
+    def test_no_state(self) -> None:
+        """Tests the case when the relation was not fetched yet."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            self.assertFalse(change_probe.is_unchanged(relation))
+
+    def test_inputs_changed(self) -> None:
+        """Tests the case when the reference data changed since the last fetch."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            change_probe.write_state(relation, get_timestamp(3600))
+            relation.get_config().set_housenumber_letters(True)
+            ret = change_probe.is_unchanged(relation)
+            os.unlink(relation.get_files().get_state_path("osm-base"))
+        self.assertFalse(ret)
+
+
+class TestGetFetchedNames(unittest.TestCase):
+    """Tests get_fetched_names()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            since = time.time() + 3600
+            files = relations.get_relation("gazdagret").get_files()
+            paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+            mtimes = [os.path.getmtime(path) for path in paths]
+            for path in paths:
+                os.utime(path, (since, since))
+            try:
+                self.assertEqual(change_probe.get_fetched_names(relations, since), ["gazdagret"])
+            finally:
+                for path, mtime in zip(paths, mtimes):
+                    os.utime(path, (mtime, mtime))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_combined_query module covers the combined_query module."""
+
+import os
+import unittest
+
+import combined_query
+import util
+
+STREETS_QUERY = """[out:csv(::id, name, ::type)]  [timeout:425];
+area(3600002713)->.searchArea;
+way(area.searchArea)[highway];
+out;
+"""
+
+HOUSENUMBERS_QUERY = """// A comment.
+[out:csv(::id, "addr:street", "addr:housenumber", name, ::type)]  [timeout:425];
+area(3600002713)->.searchArea;
+node["addr:street"](area.searchArea);
+out body;
+"""
+
+
+def get_workdir() -> str:
+    """Returns the directory of temporary test files."""
+    return os.path.join(os.path.dirname(__file__), "workdir")
+
+
+class TestMakeQuery(unittest.TestCase):
+    """Tests make_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        expected = """[out:csv(::id, name, ::type, "addr:street", "addr:housenumber")]  [timeout:425];
+area(3600002713)->.searchArea;
+way(area.searchArea)[highway];
+out;
+make osm_gimmisn_marker;
+out;
+node["addr:street"](area.searchArea);
+out body;
+"""
+        self.assertEqual(combined_query.make_query(STREETS_QUERY, HOUSENUMBERS_QUERY), expected)
+
+    def test_no_settings(self) -> None:
+        """Tests the case when a query has no CSV output."""
+        with self.assertRaises(ValueError):
+            combined_query.make_query("[out:json];", HOUSENUMBERS_QUERY)
+
+
+class TestMakeBatchQuery(unittest.TestCase):
+    """Tests make_batch_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        streets_query = "[out:csv(::id, ::type)];\nway[highway];\nout;\n"
+        housenumbers_query = '[out:csv(::id, "addr:street")];\nnode["addr:street"];\nout;\n'
+        expected = """[out:csv(::id, ::type, "addr:street", name)];
+make osm_gimmisn_relation name="a";
+out;
+way[highway];
+out;
+make osm_gimmisn_marker;
+out;
+node["addr:street"];
+out;
+make osm_gimmisn_relation name="b";
+out;
+way[highway];
+out;
+make osm_gimmisn_marker;
+out;
+node["addr:street"];
+out;
+"""
+        queries = [("a", streets_query, housenumbers_query), ("b", streets_query, housenumbers_query)]
+        self.assertEqual(combined_query.make_batch_query(queries), expected)
+
+
+class TestGetColumns(unittest.TestCase):
+    """Tests get_columns()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        expected = ["@id", "addr:street", "addr:housenumber", "name", "@type"]
+        self.assertEqual(combined_query.get_columns(HOUSENUMBERS_QUERY), expected)
+
+
+class TestSplitResult(unittest.TestCase):
+    """Tests split_result()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        result_path = os.path.join(get_workdir(), "combined-query-happy.csv")
+        with open(result_path, "w") as stream:
+            stream.write("@id\tname\t@type\taddr:street\taddr:housenumber\n")
+            stream.write("1\tTűzkő utca\tway\t\t\n")
+            stream.write("2\tTörökugrató utca\tway\t\t\n")
+            stream.write("3\t\tosm_gimmisn_marker\t\t\n")
+            stream.write("4\t\tnode\tTűzkő utca\t1\n")
+            stream.write("5\tA house\tway\tTűzkő utca\t2\n")
+        streets_path, housenumbers_path = combined_query.split_result(
+            result_path, STREETS_QUERY, HOUSENUMBERS_QUERY, get_workdir())
+        os.unlink(result_path)
+        streets = util.get_content(streets_path)
+        os.unlink(streets_path)
+        housenumbers = util.get_content(housenumbers_path)
+        os.unlink(housenumbers_path)
+        self.assertEqual(streets, "@id\tname\t@type\n1\tTűzkő utca\tway\n2\tTörökugrató utca\tway\n")
+        expected = "@id\taddr:street\taddr:housenumber\tname\t@type\n"
+        expected += "4\tTűzkő utca\t1\t\tnode\n"
+        expected += "5\tTűzkő utca\t2\tA house\tway\n"
+        self.assertEqual(housenumbers, expected)
+
+    def test_no_marker(self) -> None:
+        """Tests the case when the result is cut before the marker."""
+        result_path = os.path.join(get_workdir(), "combined-query-no-marker.csv")
+        with open(result_path, "w") as stream:
+            stream.write("@id\tname\t@type\taddr:street\taddr:housenumber\n")
+            stream.write("1\tTűzkő utca\tway\t\t\n")
+        before = sorted(os.listdir(get_workdir()))
+        with self.assertRaises(ValueError):
+            combined_query.split_result(result_path, STREETS_QUERY, HOUSENUMBERS_QUERY, get_workdir())
+        # No temp files are left behind.
+        self.assertEqual(sorted(os.listdir(get_workdir())), before)
+        os.unlink(result_path)
+
+
+class TestSplitBatchResult(unittest.TestCase):
+    """Tests split_batch_result()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        result_path = os.path.join(get_workdir(), "combined-query-batch.csv")
+        with open(result_path, "w") as stream:
+            stream.write("@id\tname\t@type\taddr:street\taddr:housenumber\n")
+            # Empty lines before the first relation are ignored.
+            stream.write("\n")
+            stream.write("1\ta\tosm_gimmisn_relation\t\t\n")
+            stream.write("1\tTűzkő utca\tway\t\t\n")
+            stream.write("2\t\tosm_gimmisn_marker\t\t\n")
+            stream.write("4\t\tnode\tTűzkő utca\t1\n")
+            stream.write("3\tb\tosm_gimmisn_relation\t\t\n")
+            stream.write("4\t\tosm_gimmisn_marker\t\t\n")
+            stream.write("5\t\tnode\tMártonhegyi út\t2\n")
+        paths = combined_query.split_batch_result(result_path, STREETS_QUERY, HOUSENUMBERS_QUERY, ["a", "b"],
+                                                  get_workdir())
+        os.unlink(result_path)
+        actual = {}
+        for name, (streets_path, housenumbers_path) in paths.items():
+            actual[name] = (util.get_content(streets_path), util.get_content(housenumbers_path))
+            os.unlink(streets_path)
+            os.unlink(housenumbers_path)
+        housenumbers_header = "@id\taddr:street\taddr:housenumber\tname\t@type"
+        expected = {
+            "a": ("@id\tname\t@type\n1\tTűzkő utca\tway\n", housenumbers_header + "\n4\tTűzkő utca\t1\t\tnode\n"),
+            "b": ("@id\tname\t@type\n", housenumbers_header + "\n5\tMártonhegyi út\t2\t\tnode\n"),
+        }
+        self.assertEqual(actual, expected)
+
+    def test_unexpected_marker(self) -> None:
+        """Tests the case when the result of a relation is missing."""
+        result_path = os.path.join(get_workdir(), "combined-query-batch-unexpected.csv")
+        with open(result_path, "w") as stream:
+            stream.write("@id\tname\t@type\n")
+            stream.write("1\tb\tosm_gimmisn_relation\n")
+        before = sorted(os.listdir(get_workdir()))
+        with self.assertRaises(ValueError):
+            combined_query.split_batch_result(result_path, STREETS_QUERY, HOUSENUMBERS_QUERY, ["a", "b"],
+                                              get_workdir())
+        self.assertEqual(sorted(os.listdir(get_workdir())), before)
+        os.unlink(result_path)
+
+    def test_no_relation_marker(self) -> None:
+        """Tests the case when the result has rows before the first relation marker."""
+        result_path = os.path.join(get_workdir(), "combined-query-batch-no-marker.csv")
+        with open(result_path, "w") as stream:
+            stream.write("@id\tname\n")
+            stream.write("1\tTűzkő utca\n")
+        with self.assertRaises(ValueError):
+            combined_query.split_batch_result(result_path, STREETS_QUERY, HOUSENUMBERS_QUERY, ["a"], get_workdir())
+        os.unlink(result_path)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_compressed_files module covers the compressed_files module."""
+
+from typing import Any
+from typing import IO
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import cast
+import gzip
+import importlib.machinery
+import io
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+import unittest.mock
+
+import areas
+import compressed_files
+import external_sort
+import util
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def copy_workdir(workdir: str) -> None:
+    """Copies the gazdagret files of the test workdir to workdir."""
+    for name in ("streets-gazdagret.csv", "street-housenumbers-gazdagret.csv",
+                 "street-housenumbers-reference-gazdagret.lst", "streets-reference-gazdagret.lst",
+                 "gazdagret.percent"):
+        shutil.copy(get_abspath(os.path.join("workdir", name)), workdir)
+
+
+def get_zstandard_stub(calls: List[Tuple[str, str]]) -> types.ModuleType:
+    """Creates a stand-in for the optional zstandard module, which records its calls and uses gzip."""
+    def mock_open(path: str, mode: str, newline: Optional[str] = None) -> IO[Any]:
+        calls.append((os.path.basename(path), mode))
+        if "b" not in mode:
+            mode += "t"
+        return cast(IO[Any], gzip.open(path, mode, newline=newline))
+    zstandard = types.ModuleType("zstandard")
+    zstandard.__spec__ = importlib.machinery.ModuleSpec("zstandard", None)
+    setattr(zstandard, "open", mock_open)
+    return zstandard
+
+
+class TestGetUncompressedSize(unittest.TestCase):
+    """Tests get_uncompressed_size()."""
+    def test_gzip(self) -> None:
+        """Tests that the size is read from the gzip trailer."""
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "streets-test.csv.gz")
+            with gzip.open(path, "wt") as stream:
+                stream.write("abc" * 100)
+            self.assertEqual(compressed_files.get_uncompressed_size(path), 300)
+
+    def test_zstd(self) -> None:
+        """Tests that the size is read from the zstd frame header, if it's there."""
+        zstandard = get_zstandard_stub([])
+        sizes = [300, -1]
+        setattr(zstandard, "frame_content_size", lambda _header: sizes.pop(0))
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "streets-test.csv.zst")
+            with open(path, "wb") as stream:
+                stream.write(b"abc")
+            with unittest.mock.patch.dict(sys.modules, {"zstandard": zstandard}):
+                self.assertEqual(compressed_files.get_uncompressed_size(path), 300)
+                # Unknown content size: fall back to the compressed size.
+                self.assertEqual(compressed_files.get_uncompressed_size(path), 3)
+
+
+class TestGetFormat(unittest.TestCase):
+    """Tests get_format()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            self.assertEqual(compressed_files.get_format(workdir), "none")
+            with open(os.path.join(workdir, "compression"), "w") as stream:
+                stream.write("gzip\n")
+            self.assertEqual(compressed_files.get_format(workdir), "gzip")
+
+    def test_unknown(self) -> None:
+        """Tests the case when the flag has an unknown format."""
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(os.path.join(workdir, "compression"), "w") as stream:
+                stream.write("xz\n")
+            with self.assertRaises(ValueError):
+                compressed_files.get_format(workdir)
+
+
+class TestOpenFile(unittest.TestCase):
+    """Tests open_file()."""
+    def test_gzip(self) -> None:
+        """Tests that the file is compressed based on its name."""
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "streets-test.csv.gz")
+            with compressed_files.open_file(path, "w") as stream:
+                stream.write("@id\tname\n")
+            with open(path, "rb") as raw_stream:
+                self.assertEqual(raw_stream.read(2), b"\x1f\x8b")
+            with compressed_files.open_file(path, "r") as stream:
+                self.assertEqual(stream.read(), "@id\tname\n")
+
+    def test_zstd(self) -> None:
+        """Tests that zstd files are opened using the zstandard module."""
+        calls: List[Tuple[str, str]] = []
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "streets-test.csv.zst")
+            with unittest.mock.patch.dict(sys.modules, {"zstandard": get_zstandard_stub(calls)}):
+                with compressed_files.open_file(path, "w") as stream:
+                    stream.write("@id\tname\n")
+                with compressed_files.open_file(path, "r") as stream:
+                    content = stream.read()
+        self.assertEqual(content, "@id\tname\n")
+        self.assertEqual(calls, [("streets-test.csv.zst", "w"), ("streets-test.csv.zst", "r")])
+
+
+class TestMigrate(unittest.TestCase):
+    """Tests migrate()."""
+    def test_happy(self) -> None:
+        """Tests that relation files can be read before and after migrations."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with tempfile.TemporaryDirectory() as workdir:
+                copy_workdir(workdir)
+                relation = areas.Relations(workdir).get_relation("gazdagret")
+                expected_streets = relation.get_osm_streets()
+                expected_housenumbers = relation.get_missing_housenumbers()
+
+                names = compressed_files.migrate(workdir, "gzip")
+                self.assertEqual(len(names), 4)
+                self.assertIn("streets-gazdagret.csv.gz", os.listdir(workdir))
+                self.assertNotIn("streets-gazdagret.csv", os.listdir(workdir))
+                # Percent files are small, they are not compressed.
+                self.assertIn("gazdagret.percent", os.listdir(workdir))
+                relation = areas.Relations(workdir).get_relation("gazdagret")
+                self.assertEqual(relation.get_osm_streets(), expected_streets)
+                self.assertEqual(relation.get_missing_housenumbers(), expected_housenumbers)
+                self.assertEqual(relation.get_files().get_osm_housenumbers_street_lines("Tűzkő utca"),
+                                 ["1\tTűzkő utca\t9", "1\tTűzkő utca\t10"])
+
+                # Already converted files are kept as-is.
+                self.assertEqual(compressed_files.migrate(workdir, "gzip"), [])
+
+                compressed_files.migrate(workdir, "none")
+                self.assertIn("streets-gazdagret.csv", os.listdir(workdir))
+                self.assertEqual(util.get_content(workdir, "streets-gazdagret.csv"),
+                                 util.get_content(get_abspath("workdir"), "streets-gazdagret.csv"))
+
+    def test_zstd(self) -> None:
+        """Tests that the zstandard module is used when it's available."""
+        calls: List[Tuple[str, str]] = []
+        with unittest.mock.patch.dict(sys.modules, {"zstandard": get_zstandard_stub(calls)}):
+            with tempfile.TemporaryDirectory() as workdir:
+                copy_workdir(workdir)
+                names = compressed_files.migrate(workdir, "zstd")
+                format_flag = compressed_files.get_format(workdir)
+        self.assertEqual(format_flag, "zstd")
+        self.assertIn("streets-gazdagret.csv.zst", names)
+        self.assertEqual(len(calls), 4)
+
+    def test_zstd_unavailable(self) -> None:
+        """Tests the case when zstd is requested, but it's not installed."""
+        with unittest.mock.patch('compressed_files.is_zstd_available', lambda: False):
+            with tempfile.TemporaryDirectory() as workdir:
+                with self.assertRaises(ValueError):
+                    compressed_files.migrate(workdir, "zstd")
+
+
+class TestSortCsvFile(unittest.TestCase):
+    """Tests that external_sort.sort_csv_file() compresses its output."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            in_path = os.path.join(workdir, "in.csv")
+            with open(in_path, "w") as stream:
+                stream.write("@id\tname\n2\tB utca\n1\tA utca\n")
+            out_path = os.path.join(workdir, "out.csv.gz")
+            external_sort.sort_csv_file(in_path, out_path, util.split_street_line, memory_limit=1024)
+            with compressed_files.open_file(out_path, "r") as stream:
+                self.assertEqual(stream.read(), "@id\tname\n1\tA utca\n2\tB utca\n")
+
+
+class TestMain(unittest.TestCase):
+    """Tests main()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            copy_workdir(workdir)
+            buf = io.StringIO()
+            with unittest.mock.patch('config.Config.get_workdir', lambda: workdir):
+                with unittest.mock.patch('sys.argv', ["", "gzip"]):
+                    with unittest.mock.patch('sys.stdout', buf):
+                        compressed_files.main()
+            self.assertEqual(compressed_files.get_format(workdir), "gzip")
+        self.assertEqual(buf.getvalue(), "compression: converted 4 files to 'gzip'\n")
+
+    def test_error(self) -> None:
+        """Tests the error path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            buf = io.StringIO()
+            with unittest.mock.patch('config.Config.get_workdir', lambda: workdir):
+                with unittest.mock.patch('sys.argv', ["", "zstd"]):
+                    with unittest.mock.patch('sys.stdout', buf):
+                        with unittest.mock.patch('compressed_files.is_zstd_available', lambda: False):
+                            with self.assertRaises(SystemExit):
+                                compressed_files.main()
+        self.assertTrue(buf.getvalue().startswith("compression: zstd compression requires"))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_coverage_pool module covers the coverage_pool module."""
+
+import logging
+import os
+import unittest
+import unittest.mock
+
+import areas
+import coverage_pool
+import util
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+class TestWriteAllMissing(unittest.TestCase):
+    """Tests write_all_missing()."""
+    def test_happy(self) -> None:
+        """Tests that relations are computed in multiple processes, timings are logged in order."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = areas.Relations(get_abspath("workdir"))
+            path = relations.get_relation("gazdagret").get_files().get_housenumbers_percent_path()
+            expected = util.get_content(path)
+            os.unlink(path)
+            with self.assertLogs(level="INFO") as logs:
+                coverage_pool.write_all_missing(relations, ["gazdagret", "budafok"], "housenumbers", jobs=2)
+        self.assertEqual(util.get_content(path), expected)
+        self.assertEqual([message.split(": ")[1] for message in logs.output], ["gazdagret", "budafok"])
+        self.assertTrue(logs.output[0].startswith("INFO:root:update_missing_housenumbers: gazdagret: "))
+
+    def test_worker_messages(self) -> None:
+        """Tests that the log messages of the workers are emitted by the parent."""
+        def mock_write_missing(relation: areas.Relation, kind: str) -> None:
+            logging.warning("%s: %s", relation.get_name(), kind)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("coverage_pool.write_missing", mock_write_missing):
+            relations = areas.Relations(get_abspath("workdir"))
+            with self.assertLogs(level="INFO") as logs:
+                coverage_pool.write_all_missing(relations, ["gazdagret", "budafok"], "streets", jobs=2)
+        self.assertEqual(logs.output[0], "WARNING:root:gazdagret: streets")
+        self.assertEqual(logs.output[2], "WARNING:root:budafok: streets")
+
+    def test_single_process(self) -> None:
+        """Tests that no processes are started for a single job."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('concurrent.futures.ProcessPoolExecutor', None):
+            relations = areas.Relations(get_abspath("workdir"))
+            with self.assertLogs(level="INFO") as logs:
+                coverage_pool.write_all_missing(relations, ["gazdagret"], "streets", jobs=2)
+        self.assertTrue(logs.output[0].startswith("INFO:root:update_missing_streets: gazdagret: "))
+
+
+class TestSharedPool(unittest.TestCase):
+    """Tests shared_pool()."""
+    def test_happy(self) -> None:
+        """Tests that even a single relation is computed in the shared pool."""
+        def mock_write_missing(relation: areas.Relation, kind: str) -> None:
+            logging.warning("%s: %s: %s", relation.get_name(), kind, os.getpid())
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("coverage_pool.write_missing", mock_write_missing):
+            relations = areas.Relations(get_abspath("workdir"))
+            with coverage_pool.shared_pool(relations, jobs=2), self.assertLogs(level="INFO") as logs:
+                coverage_pool.write_all_missing(relations, ["gazdagret"], "streets", jobs=1)
+        self.assertIsNone(coverage_pool.POOL)
+        self.assertTrue(logs.output[0].startswith("WARNING:root:gazdagret: streets: "))
+        self.assertNotEqual(logs.output[0], "WARNING:root:gazdagret: streets: %s" % os.getpid())
+
+    def test_single_job(self) -> None:
+        """Tests that no processes are started for a single job."""
+        with unittest.mock.patch('concurrent.futures.ProcessPoolExecutor', None):
+            with coverage_pool.shared_pool(areas.Relations(get_abspath("workdir")), jobs=1):
+                self.assertIsNone(coverage_pool.POOL)
+
+
+class TestWriteMissingInWorker(unittest.TestCase):
+    """Tests init_worker() and write_missing_in_worker()."""
+    def test_happy(self) -> None:
+        """Tests that the log messages of the worker are returned, not emitted."""
+        def mock_write_missing(relation: areas.Relation, kind: str) -> None:
+            logging.warning("%s: %s", relation.get_name(), kind)
+
+        logger = logging.getLogger()
+        level = logger.level
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch.object(logger, "handlers", [logging.NullHandler()]), \
+                unittest.mock.patch("coverage_pool.RELATIONS", None), \
+                unittest.mock.patch("coverage_pool.write_missing", mock_write_missing):
+            coverage_pool.init_worker(get_abspath("workdir"))
+            self.assertEqual(logger.handlers, [])
+            seconds, messages = coverage_pool.write_missing_in_worker("gazdagret", "streets")
+            self.assertEqual(logger.handlers, [])
+        logger.setLevel(level)
+        self.assertGreaterEqual(seconds, 0)
+        self.assertEqual(messages, [(logging.WARNING, "gazdagret: streets")])
+
+
+if __name__ == '__main__':
+    unittest.main()
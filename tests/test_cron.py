@@ -7,26 +7,39 @@
 """The test_cron module covers the cron module."""
 
 from typing import Any
-from typing import BinaryIO
+from typing import Callable
+from typing import ContextManager
+from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import Optional
-import io
+from typing import Set
+from typing import Tuple
+import contextlib
 import os
+import tempfile
+import threading
 import time
 import unittest
 import unittest.mock
 import urllib.error
 
+import area_files
 import areas
 import config
 import cron
+import geometry
 import util
 
 
-def get_relations() -> areas.Relations:
-    """Returns a Relations object that uses the test data and workdir."""
+def get_relations(*names: str) -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir, only names are active if given."""
     workdir = os.path.join(os.path.dirname(__file__), "workdir")
-    return areas.Relations(workdir)
+    relations = areas.Relations(workdir)
+    for relation_name in relations.get_active_names():
+        if names and relation_name not in names:
+            relations.get_relation(relation_name).get_config().set_active(False)
+    return relations
 
 
 def get_abspath(path: str) -> str:
@@ -36,46 +49,38 @@ def get_abspath(path: str) -> str:
     return os.path.join(os.path.dirname(__file__), path)
 
 
-def mock_urlopen_raise_error(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-    """Mock urlopen(), always throwing an error."""
+def mock_overpass_query_raise_error(_query: str, _path: str, _tries: int) -> None:
+    """Mock overpass_query_to_file(), always throwing an error."""
     raise urllib.error.HTTPError(url=None, code=None, msg=None, hdrs=None, fp=None)
 
 
-class TestOverpassSleep(unittest.TestCase):
-    """Tests overpass_sleep()."""
-    def test_no_sleep(self) -> None:
-        """Tests the case when no sleep is needed."""
-        def mock_overpass_query_need_sleep() -> int:
-            return 0
-        mock_sleep_called = False
-
-        def mock_sleep(_seconds: float) -> None:
-            nonlocal mock_sleep_called
-            mock_sleep_called = True
-        with unittest.mock.patch('overpass_query.overpass_query_need_sleep', mock_overpass_query_need_sleep):
-            with unittest.mock.patch('time.sleep', mock_sleep):
-                cron.overpass_sleep()
-                self.assertFalse(mock_sleep_called)
-
-    def test_need_sleep(self) -> None:
-        """Tests the case when sleep is needed."""
-        sleep_for = 42
-
-        def mock_overpass_query_need_sleep() -> int:
-            nonlocal sleep_for
-            if sleep_for > 0:
-                sleep_for = 0
-                return 42
-            return sleep_for
-        captured_seconds = 0.0
-
-        def mock_sleep(seconds: float) -> None:
-            nonlocal captured_seconds
-            captured_seconds = seconds
-        with unittest.mock.patch('overpass_query.overpass_query_need_sleep', mock_overpass_query_need_sleep):
-            with unittest.mock.patch('time.sleep', mock_sleep):
-                cron.overpass_sleep()
-                self.assertEqual(captured_seconds, 42.0)
+def mock_query_results(queries: List[str], result: str) -> ContextManager[Any]:
+    """Mocks overpass_query_to_file(), which records the queries and always writes result."""
+    def mock_overpass_query_to_file(query: str, path: str, _tries: int) -> None:
+        queries.append(query)
+        with open(path, "w") as stream:
+            stream.write(result)
+    return unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file)
+
+
+def no_op(_relations: areas.Relations, _update: bool, *_args: Any) -> None:
+    """Mock update step, which does nothing."""
+
+
+def fail_step(_relations: areas.Relations, _update: bool, *_args: Any) -> None:
+    """Mock update step, which should not be called."""
+    raise AssertionError()
+
+
+@contextlib.contextmanager
+def mock_update_steps(**mocks: Callable[..., None]) -> Iterator[None]:
+    """Mocks the update steps of our_main() with no_op(), except the ones in mocks."""
+    steps = ["update_osm_combined", "update_osm_streets", "update_osm_housenumbers", "update_ref_streets",
+             "update_ref_housenumbers", "update_missing_streets", "update_missing_housenumbers"]
+    with contextlib.ExitStack() as stack:
+        for step in steps:
+            stack.enter_context(unittest.mock.patch("cron." + step, mocks.get(step, no_op)))
+        yield
 
 
 class TestUpdateRefHousenumbers(unittest.TestCase):
@@ -83,14 +88,14 @@ class TestUpdateRefHousenumbers(unittest.TestCase):
     def test_happy(self) -> None:
         """Tests the happy path."""
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            relations = get_relations()
-            for relation_name in relations.get_active_names():
-                if relation_name not in ("gazdagret", "ujbuda"):
-                    relations.get_relation(relation_name).get_config().set_active(False)
+            relations = get_relations("gazdagret", "ujbuda")
             path = os.path.join(relations.get_workdir(), "street-housenumbers-reference-gazdagret.lst")
             expected = util.get_content(path)
             os.unlink(path)
+            util.REFERENCE_CACHES.clear()
             cron.update_ref_housenumbers(relations, update=True)
+            # The relations of a cron run share the reference.
+            self.assertTrue(util.REFERENCE_CACHES)
             mtime = os.path.getmtime(path)
             cron.update_ref_housenumbers(relations, update=False)
             self.assertEqual(os.path.getmtime(path), mtime)
@@ -106,17 +111,14 @@ class TestUpdateRefStreets(unittest.TestCase):
     def test_happy(self) -> None:
         """Tests the happy path."""
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            relations = get_relations()
-            for relation_name in relations.get_active_names():
-                # gellerthegy is streets=no
-                if relation_name not in ("gazdagret", "gellerthegy"):
-                    relations.get_relation(relation_name).get_config().set_active(False)
+            # gellerthegy is streets=no
+            relations = get_relations("gazdagret", "gellerthegy")
             path = os.path.join(relations.get_workdir(), "streets-reference-gazdagret.lst")
             expected = util.get_content(path)
             os.unlink(path)
             cron.update_ref_streets(relations, update=True)
             mtime = os.path.getmtime(path)
-            cron.update_ref_streets(relations, update=False)
+            cron.update_ref_streets(relations, update=False, relation_names=["gazdagret"])
             self.assertEqual(os.path.getmtime(path), mtime)
             actual = util.get_content(path)
             self.assertEqual(actual, expected)
@@ -130,40 +132,63 @@ class TestUpdateMissingHousenumbers(unittest.TestCase):
     def test_happy(self) -> None:
         """Tests the happy path."""
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            relations = get_relations()
-            for relation_name in relations.get_active_names():
-                # ujbuda is streets=only
-                if relation_name not in ("gazdagret", "ujbuda"):
-                    relations.get_relation(relation_name).get_config().set_active(False)
+            # ujbuda is streets=only
+            relations = get_relations("gazdagret", "ujbuda")
             path = os.path.join(relations.get_workdir(), "gazdagret.percent")
             expected = util.get_content(path)
             os.unlink(path)
             cron.update_missing_housenumbers(relations, update=True)
             mtime = os.path.getmtime(path)
-            cron.update_missing_housenumbers(relations, update=False)
+            with self.assertNoLogs(level="INFO"):
+                cron.update_missing_housenumbers(relations, update=False, relation_names=["gazdagret"])
             self.assertEqual(os.path.getmtime(path), mtime)
             actual = util.get_content(path)
             self.assertEqual(actual, expected)
             # Make sure housenumber stat is not created for the streets=only case.
             self.assertFalse(os.path.exists(os.path.join(relations.get_workdir(), "ujbuda.percent")))
 
+    def test_delta_updates(self) -> None:
+        """Tests that the per-street stats are maintained in delta mode."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations("gazdagret")
+            files = relations.get_relation("gazdagret").get_files()
+            expected = util.get_content(files.get_housenumbers_percent_path())
+            with config.ConfigContext("cron_delta_updates", "True"):
+                cron.update_missing_housenumbers(relations, update=True)
+            self.assertTrue(os.path.exists(files.get_state_path("street-stats")))
+            os.unlink(files.get_state_path("street-stats"))
+            self.assertEqual(util.get_content(files.get_housenumbers_percent_path()), expected)
+
+    def test_incremental(self) -> None:
+        """Tests that only the relation with renamed filters is recomputed in incremental mode."""
+        computed: List[str] = []
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch.dict("config.DEFAULTS", {"cron_incremental": "True"}):
+            relations = get_relations("gazdagret", "budafok")
+            cron.update_missing_housenumbers(relations, update=True)
+            relation_config = relations.get_relation("gazdagret").get_config()
+            relation_config.set_filters({"Renamed utca": relation_config.get_filters()["Törökugrató utca"]})
+            with unittest.mock.patch("coverage_pool.write_all_missing",
+                                     lambda _relations, names, _kind, _jobs: computed.extend(names)):
+                cron.update_missing_housenumbers(relations, update=True)
+            for relation_name in ("gazdagret", "budafok"):
+                os.unlink(relations.get_relation(relation_name).get_files().get_state_path("artifacts"))
+        self.assertEqual(computed, ["gazdagret"])
+
 
 class TestUpdateMissingStreets(unittest.TestCase):
     """Tests update_missing_streets()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            relations = get_relations()
-            for relation_name in relations.get_active_names():
-                # gellerthegy is streets=no
-                if relation_name not in ("gazdagret", "gellerthegy"):
-                    relations.get_relation(relation_name).get_config().set_active(False)
+            # gellerthegy is streets=no
+            relations = get_relations("gazdagret", "gellerthegy")
             path = os.path.join(relations.get_workdir(), "gazdagret-streets.percent")
             expected = util.get_content(path)
             os.unlink(path)
             cron.update_missing_streets(relations, update=True)
             mtime = os.path.getmtime(path)
-            cron.update_missing_streets(relations, update=False)
+            cron.update_missing_streets(relations, update=False, relation_names=["gazdagret"])
             self.assertEqual(os.path.getmtime(path), mtime)
             actual = util.get_content(path)
             self.assertEqual(actual, expected)
@@ -171,16 +196,76 @@ class TestUpdateMissingStreets(unittest.TestCase):
             self.assertFalse(os.path.exists(os.path.join(relations.get_workdir(), "gellerthegy-streets.percent")))
 
 
-class TestUpdateOsmHousenumbers(unittest.TestCase):
-    """Tests update_osm_housenumbers()."""
+class TestGetOverpassWorkers(unittest.TestCase):
+    """Tests get_overpass_workers()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        mock_overpass_sleep_called = False
+        with unittest.mock.patch('overpass_query.OverpassClient.get_slots', lambda _self: 2):
+            self.assertEqual(cron.get_overpass_workers(), 2)
+
+    def test_unlimited(self) -> None:
+        """Tests the case when the server has no rate limit."""
+        with unittest.mock.patch('overpass_query.OverpassClient.get_slots', lambda _self: 0):
+            self.assertEqual(cron.get_overpass_workers(), cron.MAX_OVERPASS_WORKERS)
 
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
 
+class TestForEachRelation(unittest.TestCase):
+    """Tests for_each_relation()."""
+    def test_happy(self) -> None:
+        """Tests that all relations are processed, in parallel."""
+        started: List[str] = []
+        barrier = threading.Barrier(2, timeout=5)
+
+        def worker(relation_name: str) -> None:
+            started.append(relation_name)
+            # This would time out if the workers would run one after the other.
+            barrier.wait()
+        with unittest.mock.patch('cron.get_overpass_workers', lambda: 2):
+            cron.for_each_relation(["a", "b"], worker)
+        self.assertEqual(sorted(started), ["a", "b"])
+
+    def test_exception(self) -> None:
+        """Tests that exceptions in workers are not lost."""
+        def worker(_relation_name: str) -> None:
+            raise ValueError()
+        with unittest.mock.patch('cron.get_overpass_workers', lambda: 2):
+            with self.assertRaises(ValueError):
+                cron.for_each_relation(["a"], worker)
+
+    def test_nested(self) -> None:
+        """Tests that nested calls, e.g. for tiles, share the limit of the queries in flight."""
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def mock_overpass_query_to_file(_query: str, _path: str, _tries: int) -> None:
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+
+        def worker(_relation_name: str) -> None:
+            cron.for_each_relation(["tile1", "tile2"], lambda _tile: os.unlink(cron.query_to_temp_file("", directory)))
+        with tempfile.TemporaryDirectory() as directory, \
+                unittest.mock.patch('cron.get_overpass_workers', lambda: 2), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            cron.for_each_relation(["a", "b"], worker)
+        self.assertEqual(in_flight[1], 2)
+        self.assertEqual(cron.QUERY_SLOTS, [])
+
+    def test_empty(self) -> None:
+        """Tests that the overpass status is not queried when there is nothing to do."""
+        def fail() -> int:
+            raise AssertionError()
+        with unittest.mock.patch('cron.get_overpass_workers', fail):
+            cron.for_each_relation([], lambda _relation_name: None)
+
+
+class TestUpdateOsmHousenumbers(unittest.TestCase):
+    """Tests update_osm_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
         result_from_overpass = "@id\taddr:street\taddr:housenumber\n"
         result_from_overpass += "1\tTörökugrató utca\t1\n"
         result_from_overpass += "1\tTörökugrató utca\t2\n"
@@ -190,19 +275,18 @@ class TestUpdateOsmHousenumbers(unittest.TestCase):
         result_from_overpass += "1\tOSM Name 1\t2\n"
         result_from_overpass += "1\tOnly In OSM utca\t1\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
+        actual_tries = 0
+
+        def mock_overpass_query_to_file(_query: str, path: str, tries: int) -> None:
+            nonlocal actual_tries
+            actual_tries = tries
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
 
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
-                    relations = get_relations()
-                    for relation_name in relations.get_active_names():
-                        if relation_name != "gazdagret":
-                            relations.get_relation(relation_name).get_config().set_active(False)
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1):
+                with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+                    relations = get_relations("gazdagret")
                     path = os.path.join(relations.get_workdir(), "street-housenumbers-gazdagret.csv")
                     expected = util.get_content(path)
                     os.unlink(path)
@@ -210,59 +294,84 @@ class TestUpdateOsmHousenumbers(unittest.TestCase):
                     mtime = os.path.getmtime(path)
                     cron.update_osm_housenumbers(relations, update=False)
                     self.assertEqual(os.path.getmtime(path), mtime)
-                    self.assertTrue(mock_overpass_sleep_called)
+                    self.assertEqual(actual_tries, cron.OVERPASS_TRIES)
                     actual = util.get_content(path)
                     self.assertEqual(actual, expected)
 
     def test_http_error(self) -> None:
         """Tests the case when we keep getting HTTP errors."""
-        mock_overpass_sleep_called = False
-
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
-
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen_raise_error):
-                    relations = get_relations()
-                    for relation_name in relations.get_active_names():
-                        if relation_name != "gazdagret":
-                            relations.get_relation(relation_name).get_config().set_active(False)
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1):
+                with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_raise_error):
+                    relations = get_relations("gazdagret")
                     expected = util.get_content(relations.get_workdir(), "street-housenumbers-gazdagret.csv")
                     cron.update_osm_housenumbers(relations, update=True)
-                    self.assertTrue(mock_overpass_sleep_called)
                     # Make sure that in case we keep getting errors we give up at some stage and
                     # leave the last state unchanged.
                     actual = util.get_content(relations.get_workdir(), "street-housenumbers-gazdagret.csv")
                     self.assertEqual(actual, expected)
 
+    def test_delta(self) -> None:
+        """Tests that only the changed objects are fetched for relations with a delta base."""
+        queries: List[str] = []
+        deltas: List[str] = []
+
+        def mock_apply_delta(relation: areas.Relation, delta_path: str) -> None:
+            deltas.append(relation.get_name())
+            os.unlink(delta_path)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.get_overpass_workers", lambda: 1), \
+                mock_query_results(queries, "@id\taddr:street\taddr:housenumber\n"), \
+                unittest.mock.patch("delta_update.make_delta_query", lambda _query, osm_base: "delta " + osm_base), \
+                unittest.mock.patch("delta_update.apply_delta", mock_apply_delta):
+            relations = get_relations("gazdagret")
+            path = relations.get_relation("gazdagret").get_files().get_osm_housenumbers_path()
+            mtime = os.path.getmtime(path)
+            cron.update_osm_housenumbers(relations, update=True, delta_bases={"gazdagret": "2020-05-10T22:02:25Z"})
+            self.assertEqual(os.path.getmtime(path), mtime)
+        self.assertEqual(queries, ["delta 2020-05-10T22:02:25Z"])
+        self.assertEqual(deltas, ["gazdagret"])
+
+    def test_delta_fallback(self) -> None:
+        """Tests that the full list is fetched in case the delta can't be used."""
+        queries: List[str] = []
+
+        def mock_overpass_query_to_file(query: str, path: str, _tries: int) -> None:
+            queries.append(query)
+            with open(path, "w") as stream:
+                stream.write(result)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.get_overpass_workers", lambda: 1), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            relations = get_relations("gazdagret")
+            relation = relations.get_relation("gazdagret")
+            result = util.get_content(relation.get_files().get_osm_housenumbers_path())
+            # The test query template has no CSV settings, so no delta query can be created.
+            cron.update_osm_housenumbers(relations, update=True, delta_bases={"gazdagret": "2020-05-10T22:02:25Z"})
+            self.assertEqual(util.get_content(relation.get_files().get_osm_housenumbers_path()), result)
+            self.assertEqual(queries, [relation.get_osm_housenumbers_query()])
+
 
 class TestUpdateOsmStreets(unittest.TestCase):
     """Tests update_osm_streets()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        mock_overpass_sleep_called = False
-
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
-
         result_from_overpass = "@id\tname\n1\tTűzkő utca\n2\tTörökugrató utca\n3\tOSM Name 1\n4\tHamzsabégi út\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
+        actual_tries = 0
+
+        def mock_overpass_query_to_file(_query: str, path: str, tries: int) -> None:
+            nonlocal actual_tries
+            actual_tries = tries
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
 
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
-                    relations = get_relations()
-                    for relation_name in relations.get_active_names():
-                        if relation_name != "gazdagret":
-                            relations.get_relation(relation_name).get_config().set_active(False)
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1):
+                with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+                    relations = get_relations("gazdagret")
                     expected = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
                     path = os.path.join(relations.get_workdir(), "streets-gazdagret.csv")
                     os.unlink(path)
@@ -270,34 +379,163 @@ class TestUpdateOsmStreets(unittest.TestCase):
                     mtime = os.path.getmtime(path)
                     cron.update_osm_streets(relations, update=False)
                     self.assertEqual(os.path.getmtime(path), mtime)
-                    self.assertTrue(mock_overpass_sleep_called)
+                    self.assertEqual(actual_tries, cron.OVERPASS_TRIES)
                     actual = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
                     self.assertEqual(actual, expected)
 
     def test_http_error(self) -> None:
         """Tests the case when we keep getting HTTP errors."""
-        mock_overpass_sleep_called = False
-
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
-
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen_raise_error):
-                    relations = get_relations()
-                    for relation_name in relations.get_active_names():
-                        if relation_name != "gazdagret":
-                            relations.get_relation(relation_name).get_config().set_active(False)
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1):
+                with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_raise_error):
+                    relations = get_relations("gazdagret")
                     expected = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
                     cron.update_osm_streets(relations, update=True)
-                    self.assertTrue(mock_overpass_sleep_called)
                     # Make sure that in case we keep getting errors we give up at some stage and
                     # leave the last state unchanged.
                     actual = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
                     self.assertEqual(actual, expected)
 
 
+def mock_combined_queries() -> ContextManager[Any]:
+    """Mocks the streets and house numbers queries of relations, so they can be combined."""
+    stack = contextlib.ExitStack()
+    streets_query = "[out:csv(::id, name)];\nway(area.searchArea)[highway];\nout;\n"
+    housenumbers_query = '[out:csv(::id, "addr:street", "addr:housenumber")];\nnode(area.searchArea);\nout;\n'
+    stack.enter_context(unittest.mock.patch('areas.Relation.get_osm_streets_query', lambda _self: streets_query))
+    stack.enter_context(unittest.mock.patch('areas.Relation.get_osm_housenumbers_query',
+                                            lambda _self: housenumbers_query))
+    return stack
+
+
+class TestUpdateOsmCombined(unittest.TestCase):
+    """Tests update_osm_combined()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        result_from_overpass = "@id\tname\taddr:street\taddr:housenumber\t@type\n"
+        result_from_overpass += "1\tTűzkő utca\t\t\tway\n"
+        result_from_overpass += "2\tTörökugrató utca\t\t\tway\n"
+        result_from_overpass += "3\tOSM Name 1\t\t\tway\n"
+        result_from_overpass += "4\tHamzsabégi út\t\t\tway\n"
+        result_from_overpass += "5\t\t\t\tosm_gimmisn_marker\n"
+        result_from_overpass += "1\t\tTörökugrató utca\t1\tnode\n"
+        result_from_overpass += "1\t\tTörökugrató utca\t2\tnode\n"
+        result_from_overpass += "1\t\tTűzkő utca\t9\tnode\n"
+        result_from_overpass += "1\t\tTűzkő utca\t10\tnode\n"
+        result_from_overpass += "1\t\tOSM Name 1\t1\tnode\n"
+        result_from_overpass += "1\t\tOSM Name 1\t2\tnode\n"
+        result_from_overpass += "1\t\tOnly In OSM utca\t1\tnode\n"
+
+        queries: List[str] = []
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1), mock_combined_queries():
+                with mock_query_results(queries, result_from_overpass):
+                    relations = get_relations("gazdagret")
+                    files = relations.get_relation("gazdagret").get_files()
+                    streets_path = files.get_osm_streets_path()
+                    housenumbers_path = files.get_osm_housenumbers_path()
+                    streets_expected = util.get_content(streets_path)
+                    housenumbers_expected = util.get_content(housenumbers_path)
+                    os.unlink(streets_path)
+                    cron.update_osm_combined(relations, update=False)
+                    cron.update_osm_combined(relations, update=False)
+                    streets_actual = util.get_content(streets_path)
+                    housenumbers_actual = util.get_content(housenumbers_path)
+        # One query for both lists, and no query when both lists are up to date.
+        self.assertEqual(len(queries), 1)
+        self.assertIn("make osm_gimmisn_marker;", queries[0])
+        self.assertEqual(streets_actual, streets_expected)
+        self.assertEqual(housenumbers_actual, housenumbers_expected)
+
+    def test_batch(self) -> None:
+        """Tests that small relations are fetched with a single query."""
+        result_from_overpass = "@id\tname\taddr:street\taddr:housenumber\t@type\n"
+        result_from_overpass += "1\tgazdagret\t\t\tosm_gimmisn_relation\n"
+        result_from_overpass += "1\tTűzkő utca\t\t\tway\n"
+        result_from_overpass += "2\t\t\t\tosm_gimmisn_marker\n"
+        result_from_overpass += "1\t\tTűzkő utca\t9\tnode\n"
+        result_from_overpass += "3\tgh195\t\t\tosm_gimmisn_relation\n"
+        result_from_overpass += "24746223\tKalotaszeg utca\t\t\tway\n"
+        result_from_overpass += "4\t\t\t\tosm_gimmisn_marker\n"
+        result_from_overpass += "2\t\tKalotaszeg utca\t1\tnode\n"
+
+        queries: List[str] = []
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1), mock_combined_queries():
+                with mock_query_results(queries, result_from_overpass):
+                    relations = get_relations("gazdagret", "gh195")
+                    paths: List[str] = []
+                    for relation_name in ("gazdagret", "gh195"):
+                        files = relations.get_relation(relation_name).get_files()
+                        paths += [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+                    originals = [util.get_content(path) for path in paths]
+                    index_path = area_files.get_index_path(paths[3])
+                    had_index = os.path.exists(index_path)
+                    try:
+                        cron.update_osm_combined(relations, update=True)
+                        actual = [util.get_content(path) for path in paths]
+                    finally:
+                        for path, original in zip(paths, originals):
+                            with open(path, "w") as stream:
+                                stream.write(original)
+                        if not had_index:
+                            os.unlink(index_path)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('make osm_gimmisn_relation name="gh195";', queries[0])
+        self.assertEqual(actual, [
+            "@id\tname\n1\tTűzkő utca\n",
+            "@id\taddr:street\taddr:housenumber\n\n1\tTűzkő utca\t9",
+            "@id\tname\n24746223\tKalotaszeg utca\n",
+            "@id\taddr:street\taddr:housenumber\n\n2\tKalotaszeg utca\t1",
+        ])
+
+    def test_http_error(self) -> None:
+        """Tests the case when we keep getting HTTP errors."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1), mock_combined_queries():
+                with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_raise_error):
+                    relations = get_relations("gazdagret")
+                    expected = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
+                    cron.update_osm_combined(relations, update=True)
+                    actual = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
+                    self.assertEqual(actual, expected)
+
+    def test_no_marker(self) -> None:
+        """Tests the case when the result has no marker, e.g. it was cut."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1), mock_combined_queries():
+                with mock_query_results([], "@id\tname\taddr:street\taddr:housenumber\t@type\n"):
+                    relations = get_relations("gazdagret")
+                    expected = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
+                    before = sorted(os.listdir(relations.get_workdir()))
+                    cron.update_osm_combined(relations, update=True)
+                    # The last state is kept and no temp files are left behind.
+                    self.assertEqual(sorted(os.listdir(relations.get_workdir())), before)
+                    actual = util.get_content(relations.get_workdir(), "streets-gazdagret.csv")
+                    self.assertEqual(actual, expected)
+
+
+class TestGetBatches(unittest.TestCase):
+    """Tests get_batches()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            # gazdagret and gh195 have small results, ujbuda has no house numbers and gellerthegy has
+            # nothing: these are unknown.
+            names = ["gazdagret", "ujbuda", "gh195", "gellerthegy"]
+            self.assertEqual(cron.get_batches(relations, names, 65536),
+                             [["ujbuda"], ["gellerthegy"], ["gazdagret", "gh195"]])
+            # A small budget means no batching.
+            self.assertEqual(cron.get_batches(relations, ["gazdagret", "gh195"], 0), [["gazdagret"], ["gh195"]])
+            # The number of relations in a batch is limited.
+            with unittest.mock.patch('cron.MAX_BATCH_RELATIONS', 1):
+                self.assertEqual(cron.get_batches(relations, ["gazdagret", "gh195"], 65536),
+                                 [["gazdagret"], ["gh195"]])
+
+
 class TestUpdateStats(unittest.TestCase):
     """Tests update_stats()."""
     def test_happy(self) -> None:
@@ -311,32 +549,27 @@ class TestUpdateStats(unittest.TestCase):
             actual_args = args
             actual_check = check
 
-        mock_overpass_sleep_called = False
-
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
-
         result_from_overpass = "@id\taddr:postcode\naddr:city\taddr:street\taddr:housenumber\t@user\n"
         result_from_overpass += "7677\tOrfű\tDollár utca\t1\tvasony\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
+        actual_tries = 0
+
+        def mock_overpass_query_to_file(_query: str, path: str, tries: int) -> None:
+            nonlocal actual_tries
+            actual_tries = tries
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
 
         with unittest.mock.patch('config.get_abspath', get_abspath):
             today = time.strftime("%Y-%m-%d")
             path = config.get_abspath("workdir/stats/%s.csv" % today)
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
-                    with unittest.mock.patch('subprocess.run', mock_subprocess_run):
-                        cron.update_stats()
+            with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+                with unittest.mock.patch('subprocess.run', mock_subprocess_run):
+                    cron.update_stats()
             actual = util.get_content(path)
             self.assertEqual(actual, result_from_overpass)
 
-        self.assertTrue(mock_overpass_sleep_called)
+        self.assertEqual(actual_tries, cron.OVERPASS_TRIES)
         self.assertTrue(actual_args[0].endswith("stats-daily.sh"))
         self.assertTrue(actual_check)
 
@@ -351,65 +584,363 @@ class TestUpdateStats(unittest.TestCase):
             actual_args = args
             actual_check = check
 
-        mock_overpass_sleep_called = False
-
-        def mock_overpass_sleep() -> None:
-            nonlocal mock_overpass_sleep_called
-            mock_overpass_sleep_called = True
-
         with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.overpass_sleep", mock_overpass_sleep):
-                with unittest.mock.patch('urllib.request.urlopen', mock_urlopen_raise_error):
-                    with unittest.mock.patch('subprocess.run', mock_subprocess_run):
-                        cron.update_stats()
-        self.assertTrue(mock_overpass_sleep_called)
+            with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_raise_error):
+                with unittest.mock.patch('subprocess.run', mock_subprocess_run):
+                    cron.update_stats()
         self.assertTrue(actual_args[0].endswith("stats-daily.sh"))
         self.assertTrue(actual_check)
 
 
+class TestSplitStatsDump(unittest.TestCase):
+    """Tests split_stats_dump()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: relations without a boundary are not split."""
+        def mock_get_boundary(relation: areas.Relation, _tries: int) -> Optional[geometry.Polygon]:
+            if relation.get_name() == "ujbuda":
+                mock_overpass_query_raise_error("", "", 0)
+            if relation.get_name() == "gazdagret":
+                return geometry.Polygon([[(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (0.0, 0.0)]])
+            return None
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.get_stats_csv_path", lambda: __file__), \
+                unittest.mock.patch('cron.get_overpass_workers', lambda: 2), \
+                unittest.mock.patch("boundaries.get_boundary", mock_get_boundary), \
+                unittest.mock.patch("dump_split.split_dump", lambda _relations, polygons, _path: sorted(polygons)):
+            self.assertEqual(cron.split_stats_dump(get_relations(), skip={"budafok"}), {"gazdagret"})
+
+    def test_error(self) -> None:
+        """Tests the cases when there is no csv for today or it has no coordinates."""
+        def mock_split_dump(_relations: areas.Relations, _polygons: Dict[str, Any], _path: str) -> List[str]:
+            raise ValueError("dump has no coordinates")
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('cron.get_overpass_workers', lambda: 2), \
+                unittest.mock.patch("boundaries.get_boundary", lambda _relation, _tries: None), \
+                unittest.mock.patch("dump_split.split_dump", mock_split_dump):
+            with unittest.mock.patch("cron.get_stats_csv_path", lambda: "/nosuchdir/today.csv"):
+                self.assertEqual(cron.split_stats_dump(get_relations()), set())
+            with unittest.mock.patch("cron.get_stats_csv_path", lambda: __file__):
+                self.assertEqual(cron.split_stats_dump(get_relations()), set())
+
+
+class TestUpdateNestedAreas(unittest.TestCase):
+    """Tests update_nested_areas()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: only the outermost relations are fetched."""
+        def mock_update_group(_relations: areas.Relations, root: str, children: Any, _tries: int) -> List[str]:
+            if root == "gellerthegy":
+                mock_overpass_query_raise_error("", "", 0)
+            return [root] + sorted(children)
+
+        polygons = {"gazdagret": geometry.Polygon([[(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (0.0, 0.0)]])}
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('cron.get_boundaries', lambda _relations, _names: polygons), \
+                unittest.mock.patch('cron.get_overpass_workers', lambda: 2), \
+                unittest.mock.patch("nested_areas.get_groups",
+                                    lambda _parents: {"gellerthegy": ["gazdagret"], "ujbuda": ["gazdagret"]}), \
+                unittest.mock.patch("nested_areas.update_group", mock_update_group):
+            self.assertEqual(cron.update_nested_areas(get_relations()), {"gazdagret", "ujbuda"})
+
+
+class TestSkipUnchanged(unittest.TestCase):
+    """Tests skip_unchanged()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        def mock_is_unchanged(relation: areas.Relation) -> bool:
+            return relation.get_name() == "gazdagret"
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("cron.get_overpass_workers", lambda: 1):
+                with unittest.mock.patch("change_probe.query_osm_base", lambda: "2020-05-10T22:02:25Z"):
+                    with unittest.mock.patch("change_probe.is_unchanged", mock_is_unchanged):
+                        relations = get_relations()
+                        self.assertIn("gazdagret", relations.get_active_names())
+                        self.assertEqual(cron.skip_unchanged(relations), "2020-05-10T22:02:25Z")
+                        self.assertNotIn("gazdagret", relations.get_active_names())
+                        self.assertIn("budafok", relations.get_active_names())
+
+    def test_error(self) -> None:
+        """Tests the case when the timestamp of the OSM data is not available."""
+        def mock_query_osm_base() -> str:
+            raise ValueError()
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            with unittest.mock.patch("change_probe.query_osm_base", mock_query_osm_base):
+                relations = get_relations()
+                names = relations.get_active_names()
+                self.assertEqual(cron.skip_unchanged(relations), "")
+                self.assertEqual(relations.get_active_names(), names)
+
+
+class TestApplyOscDiffs(unittest.TestCase):
+    """Tests apply_osc_diffs()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: relations with new objects or without a usable state are fetched."""
+        def mock_update_from_diffs(_relations: areas.Relations, osc_dir: str) -> Tuple[List[str], List[str]]:
+            self.assertEqual(osc_dir, get_abspath("osc"))
+            return ["budafok"], ["budafok", "gazdagret"]
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("osc_diffs.update_from_diffs", mock_update_from_diffs), \
+                unittest.mock.patch("osc_diffs.resolve_queue", lambda _relations, _tries: ["gazdagret"]):
+            relations = get_relations()
+            with config.ConfigContext("cron_osc_dir", "osc"):
+                skip = cron.apply_osc_diffs(relations)
+        self.assertEqual(skip, {"budafok"})
+
+    def test_http_error(self) -> None:
+        """Tests the case when the new objects can't be mapped to relations."""
+        def mock_resolve_queue(_relations: areas.Relations, _tries: int) -> List[str]:
+            raise urllib.error.HTTPError("http://localhost", 503, "", None, None)  # type: ignore
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("osc_diffs.update_from_diffs", lambda _relations, _osc_dir: ([], ["gazdagret"])), \
+                unittest.mock.patch("osc_diffs.resolve_queue", mock_resolve_queue):
+            relations = get_relations()
+            with config.ConfigContext("cron_osc_dir", "osc"):
+                skip = cron.apply_osc_diffs(relations)
+        self.assertIn("gazdagret", skip)
+
+
+class TestUpdateOsmFromExtract(unittest.TestCase):
+    """Tests update_osm_from_extract()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        relation_names: List[str] = []
+
+        def mock_extract(_relations: areas.Relations, names: List[str], path: str) -> List[str]:
+            self.assertEqual(path, get_abspath("extract.osm"))
+            relation_names.extend(names)
+            return ["gazdagret"]
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("osm_extract.extract", mock_extract):
+            relations = get_relations()
+            with config.ConfigContext("cron_osm_extract", "extract.osm"):
+                extracted = cron.update_osm_from_extract(relations, update=True, skip={"budafok"})
+        self.assertEqual(extracted, {"gazdagret"})
+        self.assertIn("gazdagret", relation_names)
+        self.assertNotIn("budafok", relation_names)
+
+    def test_error(self) -> None:
+        """Tests the case when the extract can't be read."""
+        def mock_extract(_relations: areas.Relations, _names: List[str], _path: str) -> List[str]:
+            raise ValueError("PBF extracts require the osmium module")
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("osm_extract.extract", mock_extract):
+            relations = get_relations()
+            with config.ConfigContext("cron_osm_extract", "extract.osm.pbf"):
+                self.assertEqual(cron.update_osm_from_extract(relations, update=False), set())
+
+
+class TestUpdatePipelined(unittest.TestCase):
+    """Tests update_pipelined()."""
+    def test_happy(self) -> None:
+        """Tests that the local steps of a relation run while the next relation is fetched."""
+        calls: List[str] = []
+        fetching = threading.Event()
+
+        def mock_fetch(_relations: areas.Relations, relation_name: str, *_args: Any) -> None:
+            calls.append("fetch " + relation_name)
+            if relation_name == "ujbuda":
+                fetching.set()
+
+        def mock_update_ref_streets(_relations: areas.Relations, _update: bool, relation_names: List[str]) -> None:
+            # This would time out if the local steps would wait for all fetches.
+            if relation_names == ["gazdagret"] and fetching.wait(timeout=5):
+                calls.append("overlap")
+            calls.append("ref " + relation_names[0])
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.get_overpass_workers", lambda: 1), \
+                unittest.mock.patch.dict("config.DEFAULTS", {"cron_pipeline_workers": "2"}), \
+                unittest.mock.patch("cron.fetch_osm_streets", mock_fetch), \
+                unittest.mock.patch("cron.fetch_osm_housenumbers", mock_fetch), \
+                mock_update_steps(update_ref_streets=mock_update_ref_streets, update_osm_streets=fail_step):
+            cron.our_main(get_relations("gazdagret", "ujbuda"), mode="relations", update=True)
+        self.assertEqual(calls[:2], ["fetch gazdagret", "fetch gazdagret"])
+        self.assertEqual(sorted(calls[2:]), ["fetch ujbuda", "fetch ujbuda", "overlap", "ref gazdagret", "ref ujbuda"])
+
+    def test_combined(self) -> None:
+        """Tests that batches are fetched with a combined query, except the streets of split relations."""
+        calls: List[str] = []
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.get_overpass_workers", lambda: 1), \
+                unittest.mock.patch.dict("config.DEFAULTS", {"cron_pipeline_workers": "1"}), \
+                unittest.mock.patch("cron.fetch_osm_batch", lambda _relations, batch: calls.append(str(batch))), \
+                unittest.mock.patch("cron.fetch_osm_streets", lambda _relations, name: calls.append(name)), \
+                unittest.mock.patch("cron.update_local", lambda *args: calls.append("local %s" % args[3])), \
+                config.ConfigContext("overpass_combined_query", "True"), self.assertLogs(level="INFO") as logs:
+            relations = get_relations("gazdagret", "ujbuda")
+            fetch: Callable[[List[str]], None] = lambda names: cron.fetch_osm(relations, names, True, {}, {"ujbuda"})
+            cron.update_pipelined(relations, True, fetch, jobs=2)
+        # ujbuda has no house numbers, so its size is unknown and it's fetched first.
+        self.assertEqual(sorted(calls), ["['gazdagret']", "local 2", "local 2", "ujbuda"])
+        self.assertEqual(len([i for i in logs.output if "normalize cache" in i]), 1)
+
+
 class TestOurMain(unittest.TestCase):
     """Tests our_main()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        calls = 0
+        calls: List[str] = []
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            steps = ["update_osm_streets", "update_osm_housenumbers", "update_ref_streets", "update_ref_housenumbers",
+                     "update_missing_streets", "update_missing_housenumbers"]
+            with mock_update_steps(**{step: lambda *_args, step=step: calls.append(step) for step in steps}):
+                cron.our_main(relations, mode="relations", update=True)
 
-        def count_calls(_relations: areas.Relation, _update: bool) -> None:
-            nonlocal calls
-            calls += 1
+        # The 2 sources and the diff between them, for both streets and house numbers.
+        self.assertEqual(calls, steps)
 
+    def test_reference_direct(self) -> None:
+        """Tests that the reference house number lists are not written in direct mode."""
         with unittest.mock.patch('config.get_abspath', get_abspath):
             relations = get_relations()
-            with unittest.mock.patch("cron.update_osm_streets", count_calls):
-                with unittest.mock.patch("cron.update_osm_housenumbers", count_calls):
-                    with unittest.mock.patch("cron.update_ref_streets", count_calls):
-                        with unittest.mock.patch("cron.update_ref_housenumbers", count_calls):
-                            with unittest.mock.patch("cron.update_missing_streets", count_calls):
-                                with unittest.mock.patch("cron.update_missing_housenumbers", count_calls):
-                                    cron.our_main(relations, mode="relations", update=True)
-
-        expected = 0
-        # Consider what to update automatically: the 2 sources and the diff between them.
-        for _ in ("osm", "ref", "missing"):
-            # What object types we have.
-            for _ in ("streets", "housenumbers"):
-                expected += 1
-
-        self.assertEqual(calls, expected)
+            with mock_update_steps(update_ref_housenumbers=fail_step):
+                with config.ConfigContext("reference_housenumbers_direct", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
 
-    def test_stats(self) -> None:
-        """Tests the stats path."""
-        calls = 0
+    def test_combined(self) -> None:
+        """Tests that streets and house numbers are fetched together in combined mode."""
+        calls: List[str] = []
+
+        def mock_update_osm_combined(_relations: areas.Relation, _update: bool, *_args: Any) -> None:
+            calls.append("combined")
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with mock_update_steps(update_osm_combined=mock_update_osm_combined, update_osm_streets=fail_step,
+                                   update_osm_housenumbers=fail_step):
+                with config.ConfigContext("overpass_combined_query", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(calls, ["combined"])
+
+    def test_skip_unchanged(self) -> None:
+        """Tests that the OSM data timestamp is recorded for fetched relations."""
+        states: List[str] = []
+
+        def mock_write_state(relation: areas.Relation, osm_base: str, full: bool) -> None:
+            self.assertTrue(full)
+            states.append(relation.get_name() + " " + osm_base)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with unittest.mock.patch("cron.skip_unchanged", lambda _relations: "2020-05-10T22:02:25Z"), \
+                    unittest.mock.patch("change_probe.get_fetched_names", lambda _relations, _since: ["gazdagret"]), \
+                    unittest.mock.patch("change_probe.write_state", mock_write_state), \
+                    mock_update_steps():
+                with config.ConfigContext("cron_skip_unchanged", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(states, ["gazdagret 2020-05-10T22:02:25Z"])
+
+    def test_delta_updates(self) -> None:
+        """Tests that relations with a delta base are only updated with the changed objects."""
+        states: List[str] = []
+        actual_bases: Dict[str, str] = {}
 
-        def count_calls() -> None:
-            nonlocal calls
-            calls += 1
+        def mock_write_state(relation: areas.Relation, osm_base: str, full: bool) -> None:
+            states.append("%s %s %s" % (relation.get_name(), osm_base, full))
+
+        def mock_update_osm_housenumbers(_relations: areas.Relation, _update: bool,
+                                         delta_bases: Dict[str, str], *_args: Any) -> None:
+            actual_bases.update(delta_bases)
 
         with unittest.mock.patch('config.get_abspath', get_abspath):
             relations = get_relations()
-            with unittest.mock.patch("cron.update_stats", count_calls):
+            with unittest.mock.patch("cron.get_osm_base", lambda: "2020-05-11T22:02:25Z"), \
+                    unittest.mock.patch("delta_update.get_delta_bases",
+                                        lambda _relations: {"gazdagret": "2020-05-10T22:02:25Z"}), \
+                    unittest.mock.patch("change_probe.get_fetched_names",
+                                        lambda _relations, _since: ["budafok", "gazdagret"]), \
+                    unittest.mock.patch("change_probe.write_state", mock_write_state), \
+                    mock_update_steps(update_osm_housenumbers=mock_update_osm_housenumbers):
+                with config.ConfigContext("cron_delta_updates", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
+                    with config.ConfigContext("overpass_combined_query", "True"):
+                        cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(actual_bases, {"gazdagret": "2020-05-10T22:02:25Z"})
+        expected = ["budafok 2020-05-11T22:02:25Z True", "gazdagret 2020-05-11T22:02:25Z False"]
+        # Combined queries are not delta updates.
+        expected += ["budafok 2020-05-11T22:02:25Z True", "gazdagret 2020-05-11T22:02:25Z True"]
+        self.assertEqual(states, expected)
+
+    def test_osc_diffs(self) -> None:
+        """Tests that relations which are up to date from replication diffs are not fetched."""
+        skips: List[Any] = []
+
+        def mock_update_osm_streets(_relations: areas.Relation, _update: bool, skip: Any) -> None:
+            skips.append(skip)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with unittest.mock.patch("cron.apply_osc_diffs", lambda _relations: {"gazdagret"}), \
+                    mock_update_steps(update_osm_streets=mock_update_osm_streets):
+                with config.ConfigContext("cron_osc_dir", "osc"):
+                    cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(skips, [{"gazdagret"}])
+
+    def test_osm_extract(self) -> None:
+        """Tests that relations which are up to date from the OSM extract are not fetched."""
+        skips: List[Any] = []
+
+        def mock_update_osm_combined(_relations: areas.Relation, _update: bool, skip: Any) -> None:
+            skips.append(skip)
+
+        def mock_update_osm_from_extract(_relations: areas.Relations, _update: bool, skip: Any) -> Set[str]:
+            self.assertEqual(skip, {"gazdagret"})
+            return {"budafok"}
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with unittest.mock.patch("cron.apply_osc_diffs", lambda _relations: {"gazdagret"}), \
+                    unittest.mock.patch("cron.update_osm_from_extract", mock_update_osm_from_extract), \
+                    mock_update_steps(update_osm_combined=mock_update_osm_combined):
+                with config.ConfigContext("cron_osc_dir", "osc"), \
+                        config.ConfigContext("cron_osm_extract", "extract.osm"), \
+                        config.ConfigContext("overpass_combined_query", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(skips, [{"budafok", "gazdagret"}])
+
+    def test_split_stats_dump(self) -> None:
+        """Tests that only the streets of relations split from the stats dump or a parent are fetched."""
+        skips: List[Any] = []
+
+        def mock_update(_relations: areas.Relation, _update: bool, skip: Any) -> None:
+            skips.append(skip)
+
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with unittest.mock.patch("cron.split_stats_dump", lambda _relations, _skip: {"gazdagret"}), \
+                    unittest.mock.patch("cron.update_nested_areas", lambda _relations, _skip: {"ujbuda"}), \
+                    mock_update_steps(update_osm_combined=mock_update, update_osm_streets=mock_update):
+                with config.ConfigContext("cron_split_stats_dump", "True"), \
+                        config.ConfigContext("cron_nested_areas", "True"), \
+                        config.ConfigContext("overpass_combined_query", "True"):
+                    cron.our_main(relations, mode="relations", update=True)
+
+        self.assertEqual(skips[0], {"gazdagret", "ujbuda"})
+        self.assertEqual(len(skips), 2)
+        self.assertTrue("gazdagret" not in skips[1] and "budafok" in skips[1])
+
+    def test_stats(self) -> None:
+        """Tests the stats path."""
+        calls: List[str] = []
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with unittest.mock.patch("cron.update_stats", lambda: calls.append("update_stats")):
                 cron.our_main(relations, mode="stats", update=False)
 
-        self.assertEqual(calls, 1)
+        self.assertEqual(calls, ["update_stats"])
 
 
 class TestMain(unittest.TestCase):
@@ -418,9 +949,9 @@ class TestMain(unittest.TestCase):
         """Tests the happy path."""
         mock_main_called = False
 
-        def mock_main(_relations: areas.Relation, _mode: str, _update: bool) -> None:
+        def mock_main(_relations: areas.Relation, _mode: str, _update: bool, jobs: int) -> None:
             nonlocal mock_main_called
-            mock_main_called = True
+            mock_main_called = jobs == 2
 
         mock_info_called = False
 
@@ -428,12 +959,9 @@ class TestMain(unittest.TestCase):
             nonlocal mock_info_called
             mock_info_called = True
 
-        with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.our_main", mock_main):
-                with unittest.mock.patch("logging.info", mock_info):
-                    argv = [""]
-                    with unittest.mock.patch('sys.argv', argv):
-                        cron.main()
+        with unittest.mock.patch('config.get_abspath', get_abspath), unittest.mock.patch("cron.our_main", mock_main), \
+                unittest.mock.patch("logging.info", mock_info), unittest.mock.patch('sys.argv', ["", "--jobs", "2"]):
+            cron.main()
 
         self.assertTrue(mock_main_called)
         self.assertTrue(mock_info_called)
@@ -443,22 +971,18 @@ class TestMain(unittest.TestCase):
         def mock_our_main(_relations: areas.Relation) -> None:
             raise Exception()
 
-        def mock_info(_msg: str, *_args: Any, **_kwargs: Any) -> None:
-            pass
-
         mock_error_called = False
 
         def mock_error(_msg: str, *_args: Any, **_kwargs: Any) -> None:
             nonlocal mock_error_called
             mock_error_called = True
 
-        with unittest.mock.patch('config.get_abspath', get_abspath):
-            with unittest.mock.patch("cron.our_main", mock_our_main):
-                with unittest.mock.patch("logging.info", mock_info):
-                    with unittest.mock.patch("logging.error", mock_error):
-                        argv = [""]
-                        with unittest.mock.patch('sys.argv', argv):
-                            cron.main()
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("cron.our_main", mock_our_main), \
+                unittest.mock.patch("logging.info", lambda _msg, *_args: None), \
+                unittest.mock.patch("logging.error", mock_error), \
+                unittest.mock.patch('sys.argv', [""]):
+            cron.main()
 
         self.assertTrue(mock_error_called)
 
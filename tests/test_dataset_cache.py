@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_dataset_cache module covers the dataset_cache module."""
+
+from typing import List
+import gzip
+import os
+import unittest
+import unittest.mock
+
+import areas
+import dataset_cache
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_path(name: str) -> str:
+    """Returns the path of a temporary test file in the workdir."""
+    return os.path.join(os.path.dirname(__file__), "workdir", name)
+
+
+def write_file(path: str, content: str) -> None:
+    """Writes content to path."""
+    with open(path, "w") as stream:
+        stream.write(content)
+
+
+class TestGetFingerprint(unittest.TestCase):
+    """Tests get_fingerprint()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        path = get_path("dataset-cache-fingerprint.txt")
+        write_file(path, "abc")
+        fingerprint = dataset_cache.get_fingerprint(path)
+        os.unlink(path)
+        assert fingerprint
+        self.assertEqual(fingerprint[0], 3)
+
+    def test_missing(self) -> None:
+        """Tests the case when the file does not exist."""
+        self.assertIsNone(dataset_cache.get_fingerprint(get_path("no-such-file.txt")))
+
+
+class TestDatasetCacheGet(unittest.TestCase):
+    """Tests DatasetCache.get()."""
+    def test_happy(self) -> None:
+        """Tests that the loader is only called once while the file is unchanged."""
+        path = get_path("dataset-cache-happy.txt")
+        write_file(path, "abc")
+        cache = dataset_cache.DatasetCache(1024)
+        calls: List[str] = []
+
+        def loader() -> str:
+            calls.append(path)
+            with open(path) as stream:
+                return stream.read()
+        self.assertEqual(cache.get("kind", [path], loader), "abc")
+        self.assertEqual(cache.get("kind", [path], loader), "abc")
+        self.assertEqual(len(calls), 1)
+        # A different size invalidates the entry.
+        write_file(path, "abcd")
+        self.assertEqual(cache.get("kind", [path], loader), "abcd")
+        os.unlink(path)
+        self.assertEqual(len(calls), 2)
+        stats = cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["size"], 4)
+
+    def test_compressed(self) -> None:
+        """Tests that the cost of a compressed file is its uncompressed size."""
+        path = get_path("dataset-cache-compressed.txt.gz")
+        with gzip.open(path, "wt") as stream:
+            stream.write("abc" * 100)
+        cache = dataset_cache.DatasetCache(1024)
+        cache.get("kind", [path], lambda: 0)
+        os.unlink(path)
+        self.assertEqual(cache.get_stats()["size"], 300)
+
+    def test_evict(self) -> None:
+        """Tests that the least recently used entry is evicted when the budget is exceeded."""
+        paths = [get_path("dataset-cache-evict-" + str(i) + ".txt") for i in range(3)]
+        for path in paths:
+            write_file(path, "abc")
+        cache = dataset_cache.DatasetCache(6)
+        cache.get("kind", [paths[0]], lambda: 0)
+        cache.get("kind", [paths[1]], lambda: 1)
+        # Make the first entry more recently used than the second one.
+        cache.get("kind", [paths[0]], lambda: 0)
+        cache.get("kind", [paths[2]], lambda: 2)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.get("kind", [paths[0]], lambda: -1), 0)
+        self.assertEqual(cache.get("kind", [paths[1]], lambda: -1), -1)
+        for path in paths:
+            os.unlink(path)
+
+    def test_disabled(self) -> None:
+        """Tests that nothing is cached with a zero budget."""
+        path = get_path("dataset-cache-disabled.txt")
+        write_file(path, "abc")
+        cache = dataset_cache.DatasetCache(0)
+        self.assertFalse(cache.is_enabled())
+        cache.get("kind", [path], lambda: 0)
+        self.assertEqual(cache.get("kind", [path], lambda: 1), 1)
+        os.unlink(path)
+        self.assertEqual(cache.get_stats()["entries"], 0)
+
+    def test_concurrent(self) -> None:
+        """Tests that an entry added by an other thread while loading is replaced, not counted twice."""
+        path = get_path("dataset-cache-concurrent.txt")
+        write_file(path, "abc")
+        cache = dataset_cache.DatasetCache(1024)
+
+        def loader() -> int:
+            # An other thread loads the same file meanwhile.
+            cache.get("kind", [path], lambda: 1)
+            return 2
+        self.assertEqual(cache.get("kind", [path], loader), 2)
+        self.assertEqual(cache.get("kind", [path], lambda: -1), 2)
+        os.unlink(path)
+        stats = cache.get_stats()
+        self.assertEqual((stats["entries"], stats["size"]), (1, 3))
+
+
+class TestDatasetCacheSetBudget(unittest.TestCase):
+    """Tests DatasetCache.set_budget()."""
+    def test_happy(self) -> None:
+        """Tests that lowering the budget evicts entries."""
+        path = get_path("dataset-cache-budget.txt")
+        write_file(path, "abc")
+        cache = dataset_cache.DatasetCache(1024)
+        cache.get("kind", [path], lambda: 0)
+        cache.set_budget(0)
+        os.unlink(path)
+        self.assertEqual(cache.get_stats()["entries"], 0)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        cache.clear()
+        self.assertEqual(cache.get_stats()["evictions"], 0)
+
+
+class TestRelation(unittest.TestCase):
+    """Tests the usage of the cache in areas.Relation."""
+    def test_happy(self) -> None:
+        """Tests that repeated reads of a relation are served from the cache."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = areas.Relations(get_path(""))
+            relation = relations.get_relation("gazdagret")
+            with unittest.mock.patch('dataset_cache.CACHE', dataset_cache.DatasetCache(1024 * 1024)):
+                expected = relation.get_missing_housenumbers()
+                self.assertEqual(relation.get_missing_housenumbers(), expected)
+                self.assertEqual(relation.get_osm_streets(), relation.get_osm_streets())
+                stats = dataset_cache.CACHE.get_stats()
+        # Streets, OSM and ref house numbers are each parsed once.
+        self.assertEqual(stats["misses"], 3)
+        self.assertGreater(stats["hits"], 0)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_delta_update module covers the delta_update module."""
+
+from typing import Iterator
+import contextlib
+import os
+import time
+import unittest
+import unittest.mock
+
+import areas
+import change_probe
+import delta_update
+import util
+
+HOUSENUMBERS_QUERY = """[out:csv(::id, "addr:street", "addr:housenumber")]  [timeout:425];
+area(3600002713)->.searchArea;
+node["addr:street"](area.searchArea);
+out body;
+"""
+
+HOUSENUMBERS = """@id\taddr:street\taddr:housenumber
+1\tTörökugrató utca\t1
+2\tTörökugrató utca\t2
+3\tTűzkő utca\t9
+4\tTűzkő utca\t10
+5\tOSM Name 1\t1
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+@contextlib.contextmanager
+def housenumbers_file(relation: areas.Relation) -> Iterator[None]:
+    """Replaces the OSM house number list of relation with HOUSENUMBERS, then restores it and the percent."""
+    files = relation.get_files()
+    paths = [files.get_osm_housenumbers_path(), files.get_housenumbers_percent_path()]
+    originals = [util.get_content(path) for path in paths]
+    with open(paths[0], "w") as stream:
+        stream.write(HOUSENUMBERS)
+    try:
+        yield
+    finally:
+        for path, original in zip(paths, originals):
+            with open(path, "w") as stream:
+                stream.write(original)
+        for state_path in (files.get_state_path("dirty-streets"), files.get_state_path("street-stats")):
+            if os.path.exists(state_path):
+                os.unlink(state_path)
+
+
+def write_delta(relation: areas.Relation, content: str) -> str:
+    """Writes a delta result to a temp file."""
+    path = os.path.join(os.path.dirname(relation.get_files().get_osm_housenumbers_path()), "delta.csv")
+    with open(path, "w") as stream:
+        stream.write(content)
+    return path
+
+
+class TestMakeDeltaQuery(unittest.TestCase):
+    """Tests make_delta_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        expected = """[out:csv(::id, "addr:street", "addr:housenumber")]  [timeout:425];
+area(3600002713)->.searchArea;
+nwr(area.searchArea)(newer:"2020-05-10T22:02:25Z");
+out body;
+"""
+        self.assertEqual(delta_update.make_delta_query(HOUSENUMBERS_QUERY, "2020-05-10T22:02:25Z"), expected)
+
+    def test_no_area(self) -> None:
+        """Tests the case when the query has no search area."""
+        with self.assertRaises(ValueError):
+            delta_update.make_delta_query("[out:csv(::id)];\nnode;\nout;\n", "2020-05-10T22:02:25Z")
+
+
+class TestGetFileHash(unittest.TestCase):
+    """Tests get_file_hash()."""
+    def test_missing(self) -> None:
+        """Tests that a missing file has an empty hash."""
+        self.assertEqual(delta_update.get_file_hash(get_abspath("workdir/nosuchfile")), "")
+
+
+class TestGetDeltaBases(unittest.TestCase):
+    """Tests get_delta_bases()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            recent = time.strftime(change_probe.TIMESTAMP_FORMAT, time.gmtime(time.time() - 3600))
+            old = time.strftime(change_probe.TIMESTAMP_FORMAT, time.gmtime(time.time() - 8 * 24 * 3600))
+            gazdagret = relations.get_relation("gazdagret")
+            change_probe.write_state(gazdagret, recent)
+            # No OSM house number list.
+            gellerthegy = relations.get_relation("gellerthegy")
+            change_probe.write_state(gellerthegy, recent)
+            ujbuda = relations.get_relation("ujbuda")
+            change_probe.write_state(ujbuda, old)
+            try:
+                bases = delta_update.get_delta_bases(relations)
+            finally:
+                for relation in (gazdagret, gellerthegy, ujbuda):
+                    os.unlink(relation.get_files().get_state_path("osm-base"))
+        self.assertEqual(bases, {"gazdagret": recent})
+
+
+class TestApplyDelta(unittest.TestCase):
+    """Tests apply_delta()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            with housenumbers_file(relation):
+                before = delta_update.get_file_hash(relation.get_files().get_osm_housenumbers_path())
+                # 2 moved to an other street, 4 lost its address and 6 is new.
+                delta = "@id\taddr:street\taddr:housenumber\n"
+                delta += "2\tTűzkő utca\t2\n"
+                delta += "4\t\t\n"
+                delta += "6\tHamzsabégi út\t1\n"
+                delta += "7\t\t\n"
+                delta_path = write_delta(relation, delta)
+                delta_update.apply_delta(relation, delta_path)
+                self.assertFalse(os.path.exists(delta_path))
+                # The sort puts the empty line of the trailing newline after the header.
+                expected = "@id\taddr:street\taddr:housenumber\n\n"
+                expected += "6\tHamzsabégi út\t1\n"
+                expected += "5\tOSM Name 1\t1\n"
+                expected += "1\tTörökugrató utca\t1\n"
+                expected += "2\tTűzkő utca\t2\n"
+                expected += "3\tTűzkő utca\t9"
+                self.assertEqual(util.get_content(relation.get_files().get_osm_housenumbers_path()), expected)
+                self.assertEqual(relation.get_files().get_osm_housenumbers_street_lines("Tűzkő utca"),
+                                 ["2\tTűzkő utca\t2", "3\tTűzkő utca\t9"])
+                dirty = delta_update.read_dirty(relation)
+                assert dirty
+                self.assertEqual(dirty[0], before)
+                self.assertEqual(dirty[2], {"Hamzsabégi út", "Törökugrató utca", "Tűzkő utca"})
+
+                # A second delta keeps the original before hash and adds to the dirty streets.
+                delta = "@id\taddr:street\taddr:housenumber\n5\tOSM Name 1\t3\n"
+                delta_update.apply_delta(relation, write_delta(relation, delta))
+                dirty = delta_update.read_dirty(relation)
+                assert dirty
+                self.assertEqual(dirty[0], before)
+                after = delta_update.get_file_hash(relation.get_files().get_osm_housenumbers_path())
+                self.assertEqual(dirty[1], after)
+                self.assertIn("OSM Name 1", dirty[2])
+                self.assertIn("Tűzkő utca", dirty[2])
+
+    def test_columns_differ(self) -> None:
+        """Tests the case when the delta has different columns than the house number list."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            with housenumbers_file(relation):
+                delta_path = write_delta(relation, "@id\taddr:street\n1\tTűzkő utca\n")
+                with self.assertRaises(ValueError):
+                    delta_update.apply_delta(relation, delta_path)
+                self.assertEqual(util.get_content(relation.get_files().get_osm_housenumbers_path()), HOUSENUMBERS)
+                self.assertIsNone(delta_update.read_dirty(relation))
+
+
+class TestUpdateHousenumbersPercent(unittest.TestCase):
+    """Tests update_housenumbers_percent()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the result is the same as the one of a full recalculation."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            with housenumbers_file(relation):
+                files = relation.get_files()
+                expected = relation.write_missing_housenumbers()[3]
+                # No stats yet: calculate all streets.
+                self.assertEqual(delta_update.update_housenumbers_percent(relation), expected)
+                stats = delta_update.read_stats(relation)
+                assert stats
+                self.assertEqual(stats[2]["Tűzkő utca"], (2, 2))
+
+                # Nothing changed: no street is recalculated.
+                with unittest.mock.patch("delta_update.get_street_stats", self.fail), \
+                        unittest.mock.patch("areas.Relation.iter_missing_housenumbers", self.fail):
+                    self.assertEqual(delta_update.update_housenumbers_percent(relation), expected)
+
+                # Only the changed streets are recalculated.
+                delta = "@id\taddr:street\taddr:housenumber\n"
+                delta += "9\tTörökugrató utca\t7\n"
+                delta += "5\t\t\n"
+                delta += "8\tOnly In OSM utca\t1\n"
+                delta_update.apply_delta(relation, write_delta(relation, delta))
+                with unittest.mock.patch("areas.Relation.iter_missing_housenumbers", self.fail):
+                    actual = delta_update.update_housenumbers_percent(relation)
+                self.assertFalse(os.path.exists(files.get_state_path("dirty-streets")))
+                self.assertEqual(util.get_content(files.get_housenumbers_percent_path()), actual)
+                self.assertEqual(actual, relation.write_missing_housenumbers()[3])
+                stats = delta_update.read_stats(relation)
+                assert stats
+                self.assertEqual(stats[2]["Törökugrató utca"], (3, 1))
+                self.assertIn("OSM Name 1", stats[2])
+                self.assertIn("Only In OSM utca", stats[2])
+
+                # A street without house numbers and without a street object is removed.
+                delta = "@id\taddr:street\taddr:housenumber\n8\t\t\n"
+                delta_update.apply_delta(relation, write_delta(relation, delta))
+                actual = delta_update.update_housenumbers_percent(relation)
+                self.assertEqual(actual, relation.write_missing_housenumbers()[3])
+                stats = delta_update.read_stats(relation)
+                assert stats
+                self.assertNotIn("Only In OSM utca", stats[2])
+
+    def test_full_fetch(self) -> None:
+        """Tests the case when the house number list was fetched fully since the last stats."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            with housenumbers_file(relation):
+                delta_update.update_housenumbers_percent(relation)
+                with open(relation.get_files().get_osm_housenumbers_path(), "a") as stream:
+                    stream.write("6\tTűzkő utca\t1\n")
+                with unittest.mock.patch("delta_update.get_street_stats", self.fail):
+                    actual = delta_update.update_housenumbers_percent(relation)
+                self.assertEqual(actual, relation.write_missing_housenumbers()[3])
+
+    def test_inputs_changed(self) -> None:
+        """Tests the case when the stats are outdated because the configuration changed."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            with housenumbers_file(relation):
+                delta_update.update_housenumbers_percent(relation)
+                relation.get_config().set_housenumber_letters(True)
+                delta = "@id\taddr:street\taddr:housenumber\n1\tTörökugrató utca\t7\n"
+                delta_update.apply_delta(relation, write_delta(relation, delta))
+                with unittest.mock.patch("delta_update.get_street_stats", self.fail):
+                    actual = delta_update.update_housenumbers_percent(relation)
+                self.assertEqual(actual, relation.write_missing_housenumbers()[3])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_dump_split module covers the dump_split module."""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import areas
+import dump_split
+import geometry
+import util
+
+HOUSENUMBERS_QUERY = """[out:csv(::id, "addr:street", "addr:housenumber", ::type)] [timeout:425];
+area(3602713748)->.searchArea;
+nwr["addr:street"](area.searchArea);
+out;
+"""
+
+DUMP = """addr:postcode\taddr:city\taddr:street\taddr:housenumber\t@user\t@id\t@type\t@lat\t@lon
+1117\tBudapest\tTűzkő utca\t1\tuser\t1\tnode\t47.05\t19.05
+1117\tBudapest\tTűzkő utca\t2\tuser\t2\tway\t47.06\t19.05
+1117\tBudapest\tKinti utca\t1\tuser\t3\tnode\t48.0\t19.05
+1117\tBudapest\tTűzkő utca\t3\tuser\t4\trelation\t\t
+truncated
+"""
+
+SQUARE = [(47.0, 19.0), (47.0, 19.1), (47.1, 19.1), (47.1, 19.0), (47.0, 19.0)]
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+class TestSplitDump(unittest.TestCase):
+    """Tests split_dump()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY):
+            relations = get_relations()
+            path = relations.get_relation("gazdagret").get_files().get_osm_housenumbers_path()
+            original = util.get_content(path)
+            with tempfile.NamedTemporaryFile("w", suffix=".csv") as dump:
+                dump.write(DUMP)
+                dump.flush()
+                try:
+                    boundaries = {"gazdagret": geometry.Polygon([SQUARE])}
+                    self.assertEqual(dump_split.split_dump(relations, boundaries, dump.name), ["gazdagret"])
+                    actual = util.get_content(path)
+                finally:
+                    with open(path, "w") as stream:
+                        stream.write(original)
+                self.assertEqual(dump_split.split_dump(relations, {}, dump.name), [])
+        # The sort puts the empty line of the trailing newline after the header.
+        expected = "@id\taddr:street\taddr:housenumber\t@type\n\n"
+        expected += "1\tTűzkő utca\t1\tnode\n"
+        expected += "2\tTűzkő utca\t2\tway"
+        self.assertEqual(actual, expected)
+
+    def test_complete(self) -> None:
+        """Tests the case when a relation gets all objects, even the ones outside its boundary."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY):
+            relations = get_relations()
+            path = relations.get_relation("gazdagret").get_files().get_osm_housenumbers_path()
+            original = util.get_content(path)
+            with tempfile.NamedTemporaryFile("w", suffix=".csv") as dump:
+                dump.write(DUMP)
+                dump.flush()
+                try:
+                    self.assertEqual(dump_split.split_dump(relations, {}, dump.name, complete="gazdagret"),
+                                     ["gazdagret"])
+                    actual = util.get_content(path)
+                finally:
+                    with open(path, "w") as stream:
+                        stream.write(original)
+        self.assertIn("3\tKinti utca\t1\tnode", actual)
+        self.assertIn("4\tTűzkő utca\t3\trelation", actual)
+
+    def test_no_coordinates(self) -> None:
+        """Tests the case when the dump has no coordinates."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            with tempfile.NamedTemporaryFile("w", suffix=".csv") as dump:
+                dump.write("addr:postcode\taddr:city\taddr:street\taddr:housenumber\t@user\n")
+                dump.flush()
+                with self.assertRaises(ValueError):
+                    dump_split.split_dump(relations, {"gazdagret": geometry.Polygon([SQUARE])}, dump.name)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_external_sort module covers the external_sort module."""
+
+import os
+import unittest
+import unittest.mock
+
+import external_sort
+import util
+
+
+def get_path(name: str) -> str:
+    """Returns the path of a temporary test file in the workdir."""
+    return os.path.join(os.path.dirname(__file__), "workdir", name)
+
+
+class TestSortCsvFile(unittest.TestCase):
+    """Tests sort_csv_file()."""
+    def sort(self, data: str, memory_limit: int) -> str:
+        """Sorts data as house numbers using a file, returns the result."""
+        in_path = get_path("external-sort-in.tmp")
+        out_path = get_path("external-sort-out.tmp")
+        with open(in_path, "w", newline="\n") as stream:
+            stream.write(data)
+        before = sorted(os.listdir(get_path("")))
+        external_sort.sort_csv_file(in_path, out_path, util.split_housenumber_line, memory_limit)
+        with open(out_path, "r", newline="\n") as stream:
+            ret = stream.read()
+        # No leftover temp files.
+        self.assertEqual(sorted(os.listdir(get_path(""))), sorted(before + ["external-sort-out.tmp"]))
+        os.unlink(in_path)
+        os.unlink(out_path)
+        return ret
+
+    def test_in_memory(self) -> None:
+        """Tests the case when the body fits into memory."""
+        data = "@id\taddr:street\taddr:housenumber\n2\tB utca\t1\n1\tA utca\t2\n1\tA utca\t1\n"
+        self.assertEqual(self.sort(data, memory_limit=1024), util.sort_housenumbers_csv(data))
+
+    def test_runs(self) -> None:
+        """Tests the case when the body is sorted using temp files."""
+        lines = ["%s\t%s utca\t%s" % (i, chr(ord('A') + i % 7), i % 5) for i in range(100)]
+        data = "@id\taddr:street\taddr:housenumber\n" + "\n".join(lines) + "\n"
+        self.assertEqual(self.sort(data, memory_limit=100), util.sort_housenumbers_csv(data))
+
+    def test_no_trailing_newline(self) -> None:
+        """Tests the case when the last line has no newline."""
+        data = "@id\tname\n2\tB utca\n1\tA utca"
+        self.assertEqual(self.sort(data, memory_limit=1), util.sort_housenumbers_csv(data))
+
+    def test_empty(self) -> None:
+        """Tests the case when there is no body or no header."""
+        self.assertEqual(self.sort("@id\tname\n", memory_limit=1024), "@id\tname\n")
+        self.assertEqual(self.sort("", memory_limit=1024), "")
+
+    def test_failure(self) -> None:
+        """Tests that no temp files are left behind when writing the result fails."""
+        in_path = get_path("external-sort-in.tmp")
+        with open(in_path, "w", newline="\n") as stream:
+            stream.write("@id\tname\n2\tB utca\n1\tA utca\n")
+        before = sorted(os.listdir(get_path("")))
+
+        def mock_replace(_src: str, _dst: str) -> None:
+            raise OSError("disk full")
+        with unittest.mock.patch("os.replace", mock_replace):
+            with self.assertRaises(OSError):
+                external_sort.sort_csv_file(in_path, get_path("external-sort-out.tmp"), util.split_housenumber_line, 1)
+        self.assertEqual(sorted(os.listdir(get_path(""))), before)
+        os.unlink(in_path)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
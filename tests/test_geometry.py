@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_geometry module covers the geometry module."""
+
+import unittest
+
+import geometry
+
+# A 1x1 square with a 0.5x0.5 hole in the middle.
+OUTER = [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0), (0.0, 0.0)]
+INNER = [(0.25, 0.25), (0.25, 0.75), (0.75, 0.75), (0.75, 0.25), (0.25, 0.25)]
+
+
+class TestAssembleRings(unittest.TestCase):
+    """Tests assemble_rings()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: ways in any order and direction."""
+        ways = [[1, 2], [3, 2], [4, 1], [3, 4], [5, 6, 7, 5], [8]]
+        rings = geometry.assemble_rings(ways)
+        self.assertEqual(len(rings), 2)
+        self.assertEqual(rings[0], [5, 6, 7, 5])
+        self.assertEqual(set(rings[1]), {1, 2, 3, 4})
+        self.assertEqual(rings[1][0], rings[1][-1])
+        self.assertEqual(len(rings[1]), 5)
+
+    def test_prepend(self) -> None:
+        """Tests the case when ways have to be added before the start of the ring."""
+        self.assertEqual(geometry.assemble_rings([[3, 1], [2, 3], [1, 2]]), [[3, 1, 2, 3]])
+        self.assertEqual(geometry.assemble_rings([[1, 3], [2, 3], [1, 2]]), [[3, 1, 2, 3]])
+
+    def test_reversed(self) -> None:
+        """Tests the case when a way has to be added in reverse after the end of the ring."""
+        self.assertEqual(geometry.assemble_rings([[3, 2], [3, 1], [1, 2]]), [[1, 2, 3, 1]])
+
+    def test_not_closed(self) -> None:
+        """Tests the case when a ring can't be closed."""
+        with self.assertRaises(ValueError):
+            geometry.assemble_rings([[1, 2], [2, 3]])
+
+
+class TestIsCrossing(unittest.TestCase):
+    """Tests is_crossing()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertTrue(geometry.is_crossing(((0.0, 0.0), (1.0, 1.0)), ((0.0, 1.0), (1.0, 0.0))))
+        self.assertFalse(geometry.is_crossing(((0.0, 0.0), (1.0, 1.0)), ((0.0, 1.0), (0.4, 0.6))))
+        self.assertFalse(geometry.is_crossing(((0.0, 0.0), (1.0, 1.0)), ((3.0, 0.0), (0.0, 3.0))))
+
+
+class TestGetDistance(unittest.TestCase):
+    """Tests get_distance()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the closest point may be inside the edge or at one of its ends."""
+        edge = ((0.0, 0.0), (0.0, 2.0))
+        self.assertEqual(geometry.get_distance((1.0, 1.0), edge), 1.0)
+        self.assertEqual(geometry.get_distance((0.0, 5.0), edge), 3.0)
+        self.assertEqual(geometry.get_distance((3.0, 4.0), ((0.0, 0.0), (0.0, 0.0))), 5.0)
+
+
+class TestPolygon(unittest.TestCase):
+    """Tests Polygon."""
+    def test_contains(self) -> None:
+        """Tests contains(), including points in the hole and outside the bounding box."""
+        polygon = geometry.Polygon([OUTER, INNER], cells=4)
+        self.assertTrue(polygon.contains((0.1, 0.1)))
+        self.assertTrue(polygon.contains((0.9, 0.5)))
+        self.assertFalse(polygon.contains((0.5, 0.5)))
+        self.assertFalse(polygon.contains((0.3, 0.7)))
+        self.assertFalse(polygon.contains((1.5, 0.5)))
+        self.assertFalse(polygon.contains((0.5, -0.5)))
+        self.assertEqual(polygon.get_bbox(), (0.0, 0.0, 1.0, 1.0))
+
+    def test_contains_brute_force(self) -> None:
+        """Tests that contains() agrees with ray casting over all edges, for a concave polygon."""
+        ring = [(0.0, 0.0), (0.0, 3.0), (3.0, 3.0), (3.0, 2.0), (1.0, 2.0), (1.0, 1.0), (3.0, 1.0), (3.0, 0.0),
+                (0.0, 0.0)]
+        polygon = geometry.Polygon([ring], cells=5)
+        edges = list(zip(ring, ring[1:]))
+        for row in range(31):
+            for column in range(31):
+                point = (row * 0.1 + 0.013, column * 0.1 + 0.017)
+                crossings = geometry.get_crossings(edges, point[0])
+                expected = len([lon for lon in crossings if lon < point[1]]) % 2 == 1
+                self.assertEqual(polygon.contains(point), expected, point)
+
+    def test_covers(self) -> None:
+        """Tests covers(): points on the boundary are covered, even if they are not contained."""
+        polygon = geometry.Polygon([OUTER, INNER], cells=4)
+        self.assertTrue(polygon.covers((0.1, 0.1), 1e-6))
+        self.assertTrue(polygon.covers((0.0, 0.3), 1e-6))
+        self.assertTrue(polygon.covers((1.0000001, 0.6), 1e-6))
+        self.assertTrue(polygon.covers((0.5, 0.25), 1e-6))
+        self.assertFalse(polygon.covers((0.5, 0.5), 1e-6))
+        self.assertFalse(polygon.covers((1.1, 0.5), 1e-6))
+
+    def test_json(self) -> None:
+        """Tests to_json() and from_json()."""
+        polygon = geometry.Polygon.from_json(geometry.Polygon([OUTER]).to_json())
+        self.assertEqual(polygon.get_rings(), [OUTER])
+
+
+class TestGridIndex(unittest.TestCase):
+    """Tests GridIndex."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        index: geometry.GridIndex[str] = geometry.GridIndex(cell_size=0.5)
+        index.add("square", geometry.Polygon([OUTER, INNER]))
+        index.add("small", geometry.Polygon([[(0.0, 0.0), (0.0, 0.2), (0.2, 0.2), (0.2, 0.0), (0.0, 0.0)]]))
+        self.assertEqual(sorted(index.find((0.1, 0.1))), ["small", "square"])
+        self.assertEqual(index.find((0.5, 0.5)), [])
+        self.assertEqual(index.find((5.0, 5.0)), [])
+        self.assertEqual(index.find_any([(0.5, 0.5), (0.9, 0.9)]), {"square"})
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_nested_areas module covers the nested_areas module."""
+
+from typing import Dict
+from typing import List
+import os
+import unittest
+import unittest.mock
+
+import areas
+import geometry
+import nested_areas
+import util
+
+HOUSENUMBERS_QUERY = """[out:csv(::id, "addr:street", "addr:housenumber", ::type)] [timeout:425];
+area(3602713748)->.searchArea;
+nwr["addr:street"](area.searchArea);
+out body;
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+def get_square(min_lat: float, min_lon: float, size: float) -> geometry.Polygon:
+    """Creates a square polygon."""
+    max_lat, max_lon = min_lat + size, min_lon + size
+    return geometry.Polygon([[(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon),
+                              (min_lat, min_lon)]])
+
+
+def get_boundaries() -> Dict[str, geometry.Polygon]:
+    """Returns nested boundaries: gellerthegy is in gazdagret, which is in ujbuda."""
+    return {
+        "ujbuda": get_square(0.0, 0.0, 1.0),
+        # Shares a corner and parts of two edges with ujbuda.
+        "gazdagret": get_square(0.0, 0.0, 0.5),
+        "gellerthegy": get_square(0.1, 0.1, 0.1),
+        # Overlaps with ujbuda.
+        "budafok": get_square(0.5, 0.5, 1.0),
+        # Inside budafok, but it has the same OSM relation.
+        "nosuchrelation": get_square(1.2, 1.2, 0.1),
+    }
+
+
+class TestIsNested(unittest.TestCase):
+    """Tests is_nested()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        boundaries = get_boundaries()
+        self.assertTrue(nested_areas.is_nested(boundaries["gazdagret"], boundaries["ujbuda"]))
+        self.assertFalse(nested_areas.is_nested(boundaries["ujbuda"], boundaries["gazdagret"]))
+        self.assertFalse(nested_areas.is_nested(boundaries["budafok"], boundaries["ujbuda"]))
+        self.assertFalse(nested_areas.is_nested(get_square(0.9, 0.9, 0.2), boundaries["ujbuda"]))
+
+
+class TestGetParents(unittest.TestCase):
+    """Tests get_parents() and get_groups()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the smallest parent is used."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            parents = nested_areas.get_parents(get_relations(), get_boundaries())
+        self.assertEqual(parents, {"gazdagret": "ujbuda", "gellerthegy": "gazdagret"})
+        self.assertEqual(nested_areas.get_groups(parents), {"ujbuda": ["gazdagret", "gellerthegy"]})
+
+
+class TestMakeLocatedQuery(unittest.TestCase):
+    """Tests make_located_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        expected = """[out:csv(::id, "addr:street", "addr:housenumber", ::type, ::lat, ::lon)] [timeout:425];
+area(3602713748)->.searchArea;
+nwr["addr:street"](area.searchArea);
+out center;
+"""
+        self.assertEqual(nested_areas.make_located_query(HOUSENUMBERS_QUERY), expected)
+
+
+class TestUpdateGroup(unittest.TestCase):
+    """Tests update_group()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        queries: List[str] = []
+
+        def mock_overpass_query_to_file(query: str, path: str, tries: int) -> None:
+            queries.append(query)
+            self.assertEqual(tries, 3)
+            with open(path, "w") as stream:
+                stream.write("@id\taddr:street\taddr:housenumber\t@type\t@lat\t@lon\n")
+                stream.write("1\tTűzkő utca\t1\tnode\t0.15\t0.15\n")
+                stream.write("2\tTűzkő utca\t2\tnode\t0.3\t0.3\n")
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY), \
+                unittest.mock.patch("overpass_query.overpass_query_to_file", mock_overpass_query_to_file):
+            relations = get_relations()
+            paths = [relations.get_relation(name).get_files().get_osm_housenumbers_path()
+                     for name in ("gazdagret", "budafok")]
+            originals = [util.get_content(path) for path in paths]
+            try:
+                children = {"budafok": get_boundaries()["gellerthegy"]}
+                self.assertEqual(nested_areas.update_group(relations, "gazdagret", children, tries=3),
+                                 ["budafok", "gazdagret"])
+                actual = [util.get_content(path) for path in paths]
+            finally:
+                for path, original in zip(paths, originals):
+                    with open(path, "w") as stream:
+                        stream.write(original)
+                os.unlink(paths[1] + ".idx")
+        self.assertIn("::lat, ::lon", queries[0])
+        self.assertIn("2\tTűzkő utca\t2\tnode", actual[0])
+        self.assertIn("1\tTűzkő utca\t1\tnode", actual[1])
+        self.assertNotIn("2\tTűzkő utca\t2\tnode", actual[1])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
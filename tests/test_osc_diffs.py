@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_osc_diffs module covers the osc_diffs module."""
+
+from typing import Iterator
+from typing import List
+import contextlib
+import gzip
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import areas
+import osc_diffs
+import util
+
+STREETS = """@id\tname\t@type
+1\tTűzkő utca\tway
+2\tTörökugrató utca\tway
+"""
+
+HOUSENUMBERS = """@id\taddr:street\taddr:housenumber\t@type
+3\tTűzkő utca\t9\tnode
+4\tTűzkő utca\t10\tnode
+5\tTörökugrató utca\t1\tnode
+"""
+
+HOUSENUMBERS_QUERY = """[out:csv(::id, "addr:street", "addr:housenumber", "addr:conscriptionnumber", ::type)];
+"""
+
+OSC = """<?xml version='1.0' encoding='UTF-8'?>
+<osmChange version="0.6" generator="test">
+  <modify>
+    <way id="1" version="2">
+      <nd ref="100"/>
+      <tag k="highway" v="residential"/>
+      <tag k="name" v="Tűzkő út"/>
+    </way>
+    <node id="3" version="2" lat="47.4" lon="19.0">
+      <tag k="addr:street" v="Tűzkő utca"/>
+      <tag k="addr:housenumber" v="11"/>
+    </node>
+  </modify>
+  <delete>
+    <way id="2" version="3"/>
+    <node id="4" version="3" lat="47.4" lon="19.0"/>
+  </delete>
+  <create>
+    <node id="10" version="1" lat="47.4" lon="19.0">
+      <tag k="addr:street" v="Tűzkő utca"/>
+      <tag k="addr:housenumber" v="12"/>
+    </node>
+    <node id="11" version="1" lat="47.4" lon="19.0">
+      <tag k="amenity" v="bench"/>
+    </node>
+    <way id="12" version="1">
+      <nd ref="101"/>
+      <tag k="highway" v="residential"/>
+      <tag k="name" v="Új utca"/>
+    </way>
+  </create>
+</osmChange>
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+@contextlib.contextmanager
+def osm_files(relation: areas.Relation) -> Iterator[None]:
+    """Replaces the OSM lists of relation with STREETS and HOUSENUMBERS, then restores them."""
+    files = relation.get_files()
+    paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+    originals = [util.get_content(path) for path in paths]
+    for path, content in zip(paths, [STREETS, HOUSENUMBERS]):
+        with open(path, "w") as stream:
+            stream.write(content)
+    workdir = os.path.dirname(paths[0])
+    # The lists were fetched after the last reset of the state.
+    osc_diffs.write_state(relation, "", int(time.time()) - 60)
+    try:
+        yield
+    finally:
+        for path, original in zip(paths, originals):
+            with open(path, "w") as stream:
+                stream.write(original)
+        state_paths = [files.get_state_path("dirty-streets"), files.get_state_path("osc"),
+                       os.path.join(workdir, osc_diffs.QUEUE_NAME)]
+        for path in state_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class TestGetPendingPaths(unittest.TestCase):
+    """Tests get_pending_paths()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as osc_dir:
+            os.makedirs(os.path.join(osc_dir, "000", "001"))
+            os.makedirs(os.path.join(osc_dir, "000", "002"))
+            for path in ["000/001/998.osc.gz", "000/001/999.osc", "000/001/999.state.txt", "000/002/000.osc.gz",
+                         "state.txt"]:
+                with open(os.path.join(osc_dir, path), "w"):
+                    pass
+            expected = ["000/001/999.osc", "000/002/000.osc.gz"]
+            self.assertEqual(osc_diffs.get_pending_paths(osc_dir, "000/001/998.osc.gz"), expected)
+            self.assertEqual(len(osc_diffs.get_pending_paths(osc_dir, "")), 3)
+
+
+class TestReadChanges(unittest.TestCase):
+    """Tests read_changes()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: later changes replace earlier ones, irrelevant ones are skipped."""
+        with tempfile.TemporaryDirectory() as osc_dir:
+            path = os.path.join(osc_dir, "001.osc.gz")
+            with gzip.open(path, "wt") as stream:
+                stream.write(OSC)
+            changes: osc_diffs.Changes = {"node/5": {}, "node/11": {"addr:housenumber": "1"}}
+            osc_diffs.read_changes(path, changes, {"node/4"}, {"addr:housenumber"})
+        self.assertEqual(changes["way/1"], {"highway": "residential", "name": "Tűzkő út"})
+        self.assertIsNone(changes["node/4"])
+        self.assertEqual(changes["node/5"], {})
+        self.assertEqual(changes["node/10"], {"addr:street": "Tűzkő utca", "addr:housenumber": "12"})
+        # Not relevant anymore, but an earlier change of it was kept.
+        self.assertEqual(changes["node/11"], {"amenity": "bench"})
+        # Deleted, but not in any list.
+        self.assertNotIn("way/2", changes)
+
+    def test_untagged(self) -> None:
+        """Tests that untagged and otherwise irrelevant objects are skipped."""
+        with tempfile.TemporaryDirectory() as osc_dir:
+            path = os.path.join(osc_dir, "001.osc")
+            with open(path, "w") as stream:
+                stream.write(OSC)
+            changes: osc_diffs.Changes = {}
+            osc_diffs.read_changes(path, changes, set(), set())
+        self.assertEqual(sorted(changes.keys()), ["way/1", "way/12"])
+
+
+class TestIsStreet(unittest.TestCase):
+    """Tests is_street()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertTrue(osc_diffs.is_street("way/1", {"highway": "residential"}))
+        self.assertFalse(osc_diffs.is_street("way/1", {"highway": "residential", "bridge": "yes"}))
+        self.assertFalse(osc_diffs.is_street("way/1", {"highway": "service"}))
+        self.assertTrue(osc_diffs.is_street("way/1", {"highway": "service", "name": "A"}))
+        self.assertTrue(osc_diffs.is_street("relation/1", {"leisure": "park", "name": "A"}))
+        self.assertFalse(osc_diffs.is_street("way/1", {"leisure": "park"}))
+        # E.g. a crossing.
+        self.assertFalse(osc_diffs.is_street("node/1", {"highway": "crossing", "name": "A"}))
+
+
+class TestIsAddress(unittest.TestCase):
+    """Tests is_address()."""
+    def test_happy(self) -> None:
+        """Tests that only the address columns of the house number query count."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY):
+            address_keys = osc_diffs.get_address_keys(get_relations().get_relation("gazdagret"))
+        self.assertTrue(osc_diffs.is_address({"addr:conscriptionnumber": "1"}, address_keys))
+        self.assertFalse(osc_diffs.is_address({"addr:city": "Budapest"}, address_keys))
+
+
+class TestUpdateFromDiffs(unittest.TestCase):
+    """Tests update_from_diffs()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            files = relation.get_files()
+            workdir = relations.get_workdir()
+            with osm_files(relation), tempfile.TemporaryDirectory() as osc_dir:
+                with open(os.path.join(osc_dir, "001.osc"), "w") as stream:
+                    stream.write(OSC)
+                patched, current = osc_diffs.update_from_diffs(relations, osc_dir)
+                streets = util.get_content(files.get_osm_streets_path())
+                housenumbers = util.get_content(files.get_osm_housenumbers_path())
+                queue = util.get_content(workdir, osc_diffs.QUEUE_NAME)
+                state = util.get_content(files.get_state_path("osc"))
+
+                # Nothing new: the queue is kept.
+                self.assertEqual(osc_diffs.update_from_diffs(relations, osc_dir), ([], ["gazdagret"]))
+                self.assertEqual(util.get_content(workdir, osc_diffs.QUEUE_NAME), queue)
+                self.assertTrue(os.path.exists(files.get_state_path("dirty-streets")))
+        self.assertEqual((patched, current), (["gazdagret"], ["gazdagret"]))
+        self.assertEqual(streets, "@id\tname\t@type\n1\tTűzkő út\tway\n")
+        # The sort puts the empty line of the trailing newline after the header.
+        expected = "@id\taddr:street\taddr:housenumber\t@type\n\n"
+        expected += "5\tTörökugrató utca\t1\tnode\n"
+        expected += "3\tTűzkő utca\t11\tnode"
+        self.assertEqual(housenumbers, expected)
+        self.assertEqual(queue, "node/10\nway/12\n")
+        self.assertTrue(state.startswith("001.osc\t"))
+
+    def test_reset(self) -> None:
+        """Tests that relations without a usable state are not patched, but fetched again."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            files = relation.get_files()
+            with osm_files(relation), tempfile.TemporaryDirectory() as osc_dir:
+                with open(os.path.join(osc_dir, "001.osc"), "w") as stream:
+                    stream.write(OSC)
+                # Not written since the last reset.
+                osc_diffs.write_state(relation, "", int(time.time()) + 60)
+                self.assertEqual(osc_diffs.update_from_diffs(relations, osc_dir), ([], []))
+                # Full refresh.
+                osc_diffs.write_state(relation, "", 0)
+                self.assertEqual(osc_diffs.update_from_diffs(relations, osc_dir), ([], []))
+                # No state.
+                os.unlink(files.get_state_path("osc"))
+                self.assertEqual(osc_diffs.update_from_diffs(relations, osc_dir), ([], []))
+                state = util.get_content(files.get_state_path("osc"))
+                streets = util.get_content(files.get_osm_streets_path())
+        self.assertTrue(state.startswith("001.osc\t"))
+        self.assertEqual(streets, STREETS)
+
+
+class TestResolveQueue(unittest.TestCase):
+    """Tests resolve_queue()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        queries: List[str] = []
+
+        def mock_overpass_query(query: str, tries: int) -> str:
+            queries.append(query)
+            self.assertEqual(tries, 3)
+            return "@id\n3600000042\n3602713748\n"
+
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("overpass_query.overpass_query", mock_overpass_query):
+            relations = get_relations()
+            queue_path = os.path.join(relations.get_workdir(), osc_diffs.QUEUE_NAME)
+            with open(queue_path, "w") as stream:
+                stream.write("node/10\nway/12\nnode/13\n")
+            # These test relations have the same OSM relation.
+            expected_names = ["budafok", "gazdagret", "nosuchrelation"]
+            self.assertEqual(osc_diffs.resolve_queue(relations, tries=3), expected_names)
+            self.assertFalse(os.path.exists(queue_path))
+            # Empty queue: no query.
+            self.assertEqual(osc_diffs.resolve_queue(relations, tries=3), [])
+        expected = "[out:csv(::id)][timeout:425];\n(node(id:10,13);way(id:12););\n(._;>;);\nis_in;\nout ids;\n"
+        self.assertEqual(queries, [expected])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
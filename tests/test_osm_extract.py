@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_osm_extract module covers the osm_extract module."""
+
+from typing import Iterator
+from typing import List
+import contextlib
+import gzip
+import importlib.machinery
+import os
+import sys
+import tempfile
+import types
+import unittest
+import unittest.mock
+
+import areas
+import geometry
+import osm_extract
+import util
+
+STREETS_QUERY = """[out:csv(::id, name, ::type)] [timeout:425];
+area(3602713748)->.searchArea;
+way["highway"](area.searchArea);
+out;
+"""
+
+HOUSENUMBERS_QUERY = """[out:csv(::id, "addr:street", "addr:housenumber", ::type)] [timeout:425];
+area(3602713748)->.searchArea;
+nwr["addr:street"](area.searchArea);
+out;
+"""
+
+# A square boundary with a street inside, one outside and one which is a member of the relation.
+EXTRACT = """<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6" generator="test">
+  <node id="1" lat="47.0" lon="19.0"/>
+  <node id="2" lat="47.0" lon="19.1"/>
+  <node id="3" lat="47.1" lon="19.1"/>
+  <node id="4" lat="47.1" lon="19.0"/>
+  <node id="5" lat="48.0" lon="19.0"/>
+  <node id="6" lat="48.0" lon="19.1"/>
+  <node id="7" lat="47.05" lon="19.05"/>
+  <node id="8" lat="47.06" lon="19.05"/>
+  <node id="9" lat="47.05" lon="19.06">
+    <tag k="addr:street" v="Tűzkő utca"/>
+    <tag k="addr:housenumber" v="1"/>
+  </node>
+  <node id="10" lat="48.0" lon="19.05">
+    <tag k="addr:street" v="Kinti utca"/>
+    <tag k="addr:housenumber" v="1"/>
+  </node>
+  <way id="100">
+    <nd ref="1"/>
+    <nd ref="2"/>
+    <nd ref="3"/>
+  </way>
+  <way id="101">
+    <nd ref="3"/>
+    <nd ref="4"/>
+    <nd ref="1"/>
+  </way>
+  <way id="102">
+    <nd ref="5"/>
+    <nd ref="6"/>
+    <tag k="highway" v="residential"/>
+    <tag k="name" v="Határ utca"/>
+  </way>
+  <way id="103">
+    <nd ref="7"/>
+    <nd ref="8"/>
+    <tag k="highway" v="residential"/>
+    <tag k="name" v="Tűzkő utca"/>
+  </way>
+  <way id="104">
+    <nd ref="5"/>
+    <nd ref="6"/>
+    <tag k="highway" v="residential"/>
+    <tag k="name" v="Kinti utca"/>
+  </way>
+  <way id="105">
+    <nd ref="7"/>
+    <nd ref="8"/>
+    <nd ref="9"/>
+    <nd ref="7"/>
+    <tag k="building" v="yes"/>
+    <tag k="addr:street" v="Tűzkő utca"/>
+    <tag k="addr:housenumber" v="2"/>
+  </way>
+  <way id="106">
+    <nd ref="7"/>
+    <nd ref="8"/>
+    <tag k="highway" v="residential"/>
+    <tag k="bridge" v="yes"/>
+  </way>
+  <relation id="2713748">
+    <member type="way" ref="100" role="outer"/>
+    <member type="way" ref="101" role="outer"/>
+    <member type="way" ref="102" role="street"/>
+    <member type="node" ref="9" role="admin_centre"/>
+    <member type="way" ref="105" role="house"/>
+    <tag k="boundary" v="administrative"/>
+  </relation>
+  <relation id="42">
+    <member type="way" ref="100" role="outer"/>
+  </relation>
+  <relation id="43">
+    <member type="way" ref="106" role="outer"/>
+    <tag k="leisure" v="park"/>
+    <tag k="name" v="Kis park"/>
+  </relation>
+  <relation id="44">
+    <member type="way" ref="104" role="outer"/>
+    <tag k="leisure" v="park"/>
+    <tag k="name" v="Kinti park"/>
+  </relation>
+  <relation id="45">
+    <member type="node" ref="8" role=""/>
+    <tag k="addr:street" v="Tűzkő utca"/>
+    <tag k="addr:housenumber" v="3"/>
+  </relation>
+</osm>
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+@contextlib.contextmanager
+def osm_files(relation: areas.Relation) -> Iterator[None]:
+    """Backs up the OSM lists of relation, then restores them and removes the boundary."""
+    files = relation.get_files()
+    paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+    originals = [util.get_content(path) for path in paths]
+    try:
+        yield
+    finally:
+        for path, original in zip(paths, originals):
+            with open(path, "w") as stream:
+                stream.write(original)
+        if os.path.exists(files.get_state_path("boundary")):
+            os.unlink(files.get_state_path("boundary"))
+
+
+class TestIterXml(unittest.TestCase):
+    """Tests iter_xml()."""
+    def test_happy(self) -> None:
+        """Tests the happy path, with a compressed extract."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "extract.osm.gz")
+            with gzip.open(path, "wt") as stream:
+                stream.write(EXTRACT)
+            nodes = list(osm_extract.iter_xml(path, "node"))
+            relations = list(osm_extract.iter_xml(path, "relation"))
+        self.assertEqual(len(nodes), 10)
+        self.assertEqual(nodes[8].get_key(), "node/9")
+        self.assertEqual(nodes[8].get_location(), (47.05, 19.06))
+        self.assertEqual(nodes[8].get_tags()["addr:housenumber"], "1")
+        self.assertEqual(relations[0].get_members()[2], ("way", 102, "street"))
+        self.assertEqual(relations[1].get_type(), "relation")
+
+
+class TestIterElements(unittest.TestCase):
+    """Tests iter_elements()."""
+    def test_no_osmium(self) -> None:
+        """Tests the case when a PBF extract is used without the osmium module."""
+        with unittest.mock.patch("osm_extract.is_osmium_available", lambda: False):
+            with self.assertRaises(ValueError):
+                osm_extract.iter_elements("extract.osm.pbf", "node")
+
+    def test_pbf(self) -> None:
+        """Tests that PBF extracts are read using the osmium module."""
+        objects = {
+            "NODE": [types.SimpleNamespace(id=1, tags=[types.SimpleNamespace(k="name", v="A")],
+                                           location=types.SimpleNamespace(lat=47.1, lon=19.1))],
+            "WAY": [types.SimpleNamespace(id=2, tags=[], nodes=[types.SimpleNamespace(ref=1)])],
+            "RELATION": [types.SimpleNamespace(id=3, tags=[],
+                                               members=[types.SimpleNamespace(type="w", ref=2, role="outer")])],
+        }
+
+        def mock_file_processor(path: str, entity: str) -> List[types.SimpleNamespace]:
+            self.assertEqual(path, "extract.osm.pbf")
+            return objects[entity]
+        osmium = types.ModuleType("osmium")
+        osmium.__spec__ = importlib.machinery.ModuleSpec("osmium", None)
+        setattr(osmium, "FileProcessor", mock_file_processor)
+        setattr(osmium, "osm", types.SimpleNamespace(NODE="NODE", WAY="WAY", RELATION="RELATION"))
+        with unittest.mock.patch.dict(sys.modules, {"osmium": osmium}):
+            nodes = list(osm_extract.iter_elements("extract.osm.pbf", "node"))
+            ways = list(osm_extract.iter_elements("extract.osm.pbf", "way"))
+            relations = list(osm_extract.iter_elements("extract.osm.pbf", "relation"))
+        self.assertEqual(nodes[0].get_key(), "node/1")
+        self.assertEqual(nodes[0].get_tags(), {"name": "A"})
+        self.assertEqual(nodes[0].get_location(), (47.1, 19.1))
+        self.assertEqual(ways[0].get_refs(), [1])
+        self.assertEqual(relations[0].get_members(), [("way", 2, "outer")])
+
+
+class TestExtract(unittest.TestCase):
+    """Tests extract()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch("areas.Relation.get_osm_streets_query", lambda _self: STREETS_QUERY), \
+                unittest.mock.patch("areas.Relation.get_osm_housenumbers_query", lambda _self: HOUSENUMBERS_QUERY):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            files = relation.get_files()
+            with osm_files(relation), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "extract.osm")
+                with open(path, "w") as stream:
+                    stream.write(EXTRACT)
+                # ujbuda's boundary is not in the extract.
+                self.assertEqual(osm_extract.extract(relations, ["ujbuda", "gazdagret"], path), ["gazdagret"])
+                streets = util.get_content(files.get_osm_streets_path())
+                housenumbers = util.get_content(files.get_osm_housenumbers_path())
+                boundary = geometry.Polygon.from_json(util.get_content(files.get_state_path("boundary")))
+                self.assertEqual(osm_extract.extract(relations, [], path), [])
+        # The park relation outside the boundary is not there.
+        expected = "@id\tname\t@type\n102\tHatár utca\tway\n43\tKis park\trelation\n103\tTűzkő utca\tway\n"
+        self.assertEqual(streets, expected)
+        # The sort puts the empty line of the trailing newline after the header.
+        expected = "@id\taddr:street\taddr:housenumber\t@type\n\n"
+        expected += "9\tTűzkő utca\t1\tnode\n"
+        expected += "45\tTűzkő utca\t3\trelation\n"
+        expected += "105\tTűzkő utca\t2\tway"
+        self.assertEqual(housenumbers, expected)
+        self.assertTrue(boundary.contains((47.05, 19.05)))
+        self.assertFalse(boundary.contains((48.0, 19.05)))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -6,93 +6,603 @@
 
 """The test_overpass_query module covers the overpass_query module."""
 
+from typing import Any
 from typing import BinaryIO
-from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
+from typing import cast
+import email.message
+import http.server
 import io
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 import unittest.mock
 import urllib.error
+
 import overpass_query
 
 
-def gen_urlopen(name: str) -> Callable[[str, Optional[bytes]], BinaryIO]:
-    """Generates a mock for urllib.request.urlopen()."""
-    def mock_urlopen(url: str, data: Optional[bytes] = None) -> BinaryIO:
-        """Mocks urllib.request.urlopen()."""
-        base_path = os.path.join("tests/mock", name)
-        with open(base_path + ".url", "r") as stream:
-            assert url == stream.read()
-        if data:
-            with open(base_path + ".request-data", "rb") as request_stream:
-                assert data == request_stream.read()
-
-        with open(base_path + ".response-data", "rb") as response_stream:
-            buf = io.BytesIO()
-            buf.write(response_stream.read())
-            buf.seek(0)
-            return buf
+class TestParseStatus(unittest.TestCase):
+    """Tests parse_status()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with open("tests/mock/overpass-status-happy.response-data") as stream:
+            self.assertEqual(overpass_query.parse_status(stream.read()), (2, [0, 0]))
+
+    def test_wait(self) -> None:
+        """Tests the case when all slots are used."""
+        with open("tests/mock/overpass-status-wait.response-data") as stream:
+            self.assertEqual(overpass_query.parse_status(stream.read()), (2, [12, 23]))
 
-    def fail(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-        raise urllib.error.HTTPError(url=None, code=None, msg=None, hdrs=None, fp=None)
+    def test_not_listed(self) -> None:
+        """Tests the case when a slot is used by a running query."""
+        with open("tests/mock/overpass-status-wait-negative.response-data") as stream:
+            self.assertEqual(overpass_query.parse_status(stream.read()), (2, [0, 1]))
 
-    if name:
-        return mock_urlopen
+    def test_unlimited(self) -> None:
+        """Tests the case when the server has no rate limit."""
+        with open("tests/mock/overpass-status-unlimited.response-data") as stream:
+            self.assertEqual(overpass_query.parse_status(stream.read()), (0, []))
 
-    return fail
+    def test_empty(self) -> None:
+        """Tests the case when the status is not known."""
+        self.assertEqual(overpass_query.parse_status(""), (1, [0]))
 
 
-class TestOverpassQueryNeedSleeep(unittest.TestCase):
-    """Tests overpass_query_need_sleep()."""
+class TestGetBackoff(unittest.TestCase):
+    """Tests get_backoff()."""
     def test_happy(self) -> None:
-        """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-happy")):
-            self.assertEqual(overpass_query.overpass_query_need_sleep(), 0)
+        """Tests that the delay grows exponentially, with jitter."""
+        self.assertTrue(0.5 <= overpass_query.get_backoff(1, None) <= 1)
+        self.assertTrue(2 <= overpass_query.get_backoff(3, None) <= 4)
+        self.assertLessEqual(overpass_query.get_backoff(100, None), overpass_query.BACKOFF_MAX)
 
-    def test_wait(self) -> None:
-        """Tests the wait path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-wait")):
-            self.assertEqual(overpass_query.overpass_query_need_sleep(), 12)
+    def test_retry_after(self) -> None:
+        """Tests that the Retry-After header is respected."""
+        headers = email.message.Message()
+        headers["Retry-After"] = "42"
+        self.assertEqual(overpass_query.get_backoff(1, headers), 42)
+
+
+# Status code, headers and body of a response.
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+class StandInServer:
+    """A local overpass stand-in, serving canned responses."""
+    def __init__(self) -> None:
+        # Path -> responses, the last one is repeated.
+        self.responses: Dict[str, List[Response]] = {}
+        self.requests: List[Tuple[str, bytes]] = []
+        self.content_types: List[str] = []
+        self.connections = 0
+        # Close connections after each response, without telling the client.
+        self.drop_connections = False
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Handles requests of a single connection."""
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                server.connections += 1
+
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                """Handles a GET request."""
+                self.respond(b"")
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                """Handles a POST request."""
+                server.content_types.append(self.headers["Content-Type"])
+                self.respond(self.rfile.read(int(self.headers["Content-Length"])))
+
+            def respond(self, data: bytes) -> None:
+                """Sends the next response for the path."""
+                server.requests.append((self.path, data))
+                responses = server.responses.get(self.path, [(404, {}, b"")])
+                code, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+                self.send_response(code)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if server.drop_connections:
+                    self.close_connection = True
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={"poll_interval": 0.01})
+
+    def __enter__(self) -> 'StandInServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, _exc_type: Any, _exc_value: Any, _exc_traceback: Any) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def get_uri(self) -> str:
+        """Returns the URI of the server."""
+        return "http://127.0.0.1:" + str(self.httpd.server_address[1])
+
+    def get_paths(self) -> List[str]:
+        """Returns the path of each request so far."""
+        return [path for path, _data in self.requests]
+
+
+def get_status(name: str) -> Response:
+    """Returns a status response from tests/mock."""
+    with open(os.path.join("tests/mock", name + ".response-data"), "rb") as stream:
+        return (200, {}, stream.read())
+
+
+class TestOverpassClient(unittest.TestCase):
+    """Tests OverpassClient."""
+    def test_happy(self) -> None:
+        """Tests that the status is parsed once and the connection is reused."""
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {}, "@id\tname\n".encode("utf-8"))]
+            client = overpass_query.OverpassClient(server.get_uri())
+            self.assertEqual(client.query("q1"), "@id\tname\n")
+            self.assertEqual(client.query("q2"), "@id\tname\n")
+            client.close()
+        self.assertEqual(server.get_paths(), ["/api/status", "/api/interpreter", "/api/interpreter"])
+        self.assertEqual(server.requests[2][1], b"q2")
+        self.assertEqual(server.content_types, ["application/x-www-form-urlencoded"] * 2)
+        self.assertEqual(server.connections, 1)
+
+    def test_too_many_requests(self) -> None:
+        """Tests that Retry-After is respected and the status is parsed again on 429."""
+        sleeps: List[float] = []
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(429, {"Retry-After": "3"}, b""), (200, {}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            with unittest.mock.patch('time.sleep', sleeps.append):
+                self.assertEqual(client.query("q", tries=2), "@id\n")
+            client.close()
+        self.assertEqual(sleeps, [3])
+        self.assertEqual(server.get_paths(), ["/api/status", "/api/interpreter", "/api/status", "/api/interpreter"])
+
+    def test_backoff(self) -> None:
+        """Tests the case when the query keeps failing."""
+        sleeps: List[float] = []
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(500, {}, b"")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            with unittest.mock.patch('time.sleep', sleeps.append):
+                with self.assertRaises(urllib.error.HTTPError) as context_manager:
+                    client.query("q", tries=3)
+            client.close()
+        self.assertEqual(context_manager.exception.code, 500)
+        self.assertEqual(len(sleeps), 2)
+        self.assertLess(sleeps[0], sleeps[1])
+
+    def test_wait_for_slot(self) -> None:
+        """Tests that the slot release time from the status is respected."""
+        now = 1000.0
+        sleeps: List[float] = []
+
+        def mock_sleep(seconds: float) -> None:
+            nonlocal now
+            sleeps.append(seconds)
+            now += seconds
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-wait")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            with unittest.mock.patch('time.sleep', mock_sleep):
+                with unittest.mock.patch('time.monotonic', lambda: now):
+                    client.query("q")
+            client.close()
+        self.assertEqual(sleeps, [12])
+
+    def test_dropped_connection(self) -> None:
+        """Tests the case when the server closes an idle connection."""
+        with StandInServer() as server:
+            server.drop_connections = True
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            self.assertEqual(client.query("q"), "@id\n")
+            client.close()
+        self.assertEqual(server.connections, 2)
+
+    def test_connection_close(self) -> None:
+        """Tests the case when the server closes the connection after a response."""
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {"Connection": "close"}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            self.assertEqual(client.query("q1"), "@id\n")
+            self.assertEqual(client.query("q2"), "@id\n")
+            client.close()
+        self.assertEqual(server.connections, 2)
+
+    def test_connection_error(self) -> None:
+        """Tests that a query is retried after a connection error, when the server has no rate limit."""
+        status = get_status("overpass-status-unlimited")[2]
+        responses: List[Any] = [OSError("connection reset"), b"@id\n", OSError("connection reset")]
+
+        def mock_request(path: str, _data: Optional[bytes] = None, _output: Optional[BinaryIO] = None) -> bytes:
+            if path == "/api/status":
+                return status
+            response = responses.pop(0)
+            if isinstance(response, OSError):
+                raise response
+            return cast(bytes, response)
+        sleeps: List[float] = []
+        client = overpass_query.OverpassClient("http://overpass.example.com")
+        with unittest.mock.patch.object(client, "request", mock_request), \
+                unittest.mock.patch('time.sleep', sleeps.append):
+            self.assertEqual(client.query("q", tries=2), "@id\n")
+            with self.assertRaises(OSError):
+                client.query("q")
+        self.assertEqual(len(sleeps), 1)
+
+    def test_wait_for_busy_slot(self) -> None:
+        """Tests that a query waits while the only slot is used by an other query."""
+        waiting = threading.Event()
+
+        class Condition(threading.Condition):
+            """Condition that signals when a thread starts waiting."""
+            def wait(self, timeout: Optional[float] = None) -> bool:
+                waiting.set()
+                return super().wait(timeout)
+        results: List[str] = []
+        with StandInServer() as server:
+            server.responses["/api/status"] = [(200, {}, b"Rate limit: 1\n1 slots available now.\n")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            with unittest.mock.patch("threading.Condition", Condition):
+                client = overpass_query.OverpassClient(server.get_uri())
+            thread = threading.Thread(target=lambda: results.append(client.query("q2")))
+            real_request = client.request
+
+            def mock_request(path: str, data: Optional[bytes] = None, output: Optional[BinaryIO] = None) -> bytes:
+                if data == b"q1":
+                    # Keep the only slot busy till the second query waits for it.
+                    thread.start()
+                    waiting.wait(timeout=5)
+                return real_request(path, data, output)
+            with unittest.mock.patch.object(client, "request", mock_request):
+                results.append(client.query("q1"))
+                thread.join()
+            client.close()
+        self.assertTrue(waiting.is_set())
+        self.assertEqual(results, ["@id\n", "@id\n"])
+
+    def test_https(self) -> None:
+        """Tests that a https URI is connected with TLS."""
+        hosts: List[str] = []
+
+        class MockConnection:
+            """Connection that fails to send requests."""
+            def __init__(self, host: str, **_kwargs: Any) -> None:
+                hosts.append(host)
+
+            def request(self, *_args: Any, **_kwargs: Any) -> None:
+                """Fails to send a request."""
+                raise OSError("no network")
+
+            def close(self) -> None:
+                """Closes the connection."""
+        client = overpass_query.OverpassClient("https://overpass.example.com/")
+        with unittest.mock.patch("http.client.HTTPSConnection", MockConnection):
+            with self.assertRaises(OSError):
+                client.request("/api/status")
+        self.assertEqual(hosts, ["overpass.example.com"])
+
+    def test_new_connection_error(self) -> None:
+        """Tests that a failure on a new connection is not retried right away."""
+        hosts: List[str] = []
+
+        class MockConnection:
+            """Connection that gets reset while sending requests."""
+            def __init__(self, host: str, **_kwargs: Any) -> None:
+                hosts.append(host)
+
+            def request(self, *_args: Any, **_kwargs: Any) -> None:
+                """Fails to send a request."""
+                raise ConnectionResetError("connection reset")
+
+            def close(self) -> None:
+                """Closes the connection."""
+        client = overpass_query.OverpassClient("http://overpass.example.com/")
+        with unittest.mock.patch("http.client.HTTPConnection", MockConnection):
+            with self.assertRaises(ConnectionResetError):
+                client.request("/api/interpreter", b"q")
+        self.assertEqual(hosts, ["overpass.example.com"])
+
+    def test_query_to_file(self) -> None:
+        """Tests that a failed attempt doesn't leave partial output in the file."""
+        path = os.path.join("tests/workdir", "overpass-query-to-file.tmp")
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(500, {}, b"error"), (200, {}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            with unittest.mock.patch('time.sleep', lambda _seconds: None):
+                client.query_to_file("q", path, tries=2)
+            client.close()
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), b"@id\n")
+        os.unlink(path)
+
+    def test_query_to_file_dropped_connection(self) -> None:
+        """Tests the case when the server closes an idle connection, while writing to a file."""
+        path = os.path.join("tests/workdir", "overpass-query-to-file.tmp")
+        with StandInServer() as server:
+            server.drop_connections = True
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            client.query_to_file("q", path)
+            client.close()
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), b"@id\n")
+        os.unlink(path)
+        self.assertEqual(server.connections, 2)
+
+    def test_get_slots(self) -> None:
+        """Tests get_slots()."""
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-unlimited")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            self.assertEqual(client.get_slots(), 0)
+            # The status is only parsed once.
+            self.assertEqual(client.get_slots(), 0)
+            client.close()
+        self.assertEqual(server.get_paths(), ["/api/status"])
+
+    def test_get_slot_delay(self) -> None:
+        """Tests get_slot_delay()."""
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-wait")]
+            client = overpass_query.OverpassClient(server.get_uri())
+            with unittest.mock.patch('time.monotonic', lambda: 1000.0):
+                # The status is not parsed yet.
+                self.assertEqual(client.get_slot_delay(), 0)
+                client.get_slots()
+                self.assertEqual(client.get_slot_delay(), 12)
+            client.close()
+
+    def test_get_slot_delay_busy(self) -> None:
+        """Tests get_slot_delay(), when all slots are used by running queries."""
+        status = get_status("overpass-status-happy")[2]
+        delays: List[float] = []
+
+        def mock_request(path: str, data: Optional[bytes] = None, _output: Optional[BinaryIO] = None) -> bytes:
+            if path == "/api/status":
+                return status
+            if data == b"q1":
+                client.query("q2")
+            else:
+                delays.append(client.get_slot_delay())
+            return b"@id\n"
+        client = overpass_query.OverpassClient("http://overpass.example.com")
+        with unittest.mock.patch.object(client, "request", mock_request):
+            client.query("q1")
+        self.assertEqual(delays, [overpass_query.BUSY_PENALTY])
+
+    def test_get_slots_no_status(self) -> None:
+        """Tests get_slots(), when the status can't be queried."""
+        with StandInServer() as server:
+            client = overpass_query.OverpassClient(server.get_uri())
+            self.assertEqual(client.get_slots(), 1)
+            client.close()
+
+
+class TestEndpointHealth(unittest.TestCase):
+    """Tests EndpointHealth."""
+    def test_happy(self) -> None:
+        """Tests that latency, errors and busy slots make the score worse."""
+        health = overpass_query.EndpointHealth()
+        self.assertEqual(health.get_score(0), 0)
+        health.record_success(10)
+        self.assertEqual(health.get_latency(), 2)
+        self.assertEqual(health.get_score(3), 5)
+        health.record_failure()
+        self.assertAlmostEqual(health.get_error_rate(), 0.2)
+        self.assertAlmostEqual(health.get_score(0), 2 + 0.2 * overpass_query.ERROR_PENALTY)
+        health.record_success(2)
+        self.assertAlmostEqual(health.get_error_rate(), 0.16)
+
+
+class TestOverpassPool(unittest.TestCase):
+    """Tests OverpassPool."""
+    def test_failover(self) -> None:
+        """Tests that a failed query goes to the other endpoint, without waiting."""
+        sleeps: List[float] = []
+        with StandInServer() as bad, StandInServer() as good:
+            for server in (bad, good):
+                server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            bad.responses["/api/interpreter"] = [(500, {}, b"")]
+            good.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            pool = overpass_query.OverpassPool([bad.get_uri(), good.get_uri()])
+            with unittest.mock.patch('time.sleep', sleeps.append):
+                self.assertEqual(pool.query("q1", tries=2), "@id\n")
+                # The failed endpoint has a worse score now, so it's not tried again.
+                self.assertEqual(pool.query("q2"), "@id\n")
+            pool.close()
+        self.assertEqual(sleeps, [])
+        self.assertEqual(bad.get_paths(), ["/api/status", "/api/interpreter"])
+        self.assertEqual(good.get_paths(), ["/api/status", "/api/interpreter", "/api/interpreter"])
+        self.assertGreater(pool.get_health(0).get_error_rate(), 0)
+        self.assertEqual(pool.get_health(1).get_error_rate(), 0)
+
+    def test_all_failed(self) -> None:
+        """Tests that the pool backs off when all endpoints failed."""
+        sleeps: List[float] = []
+        with StandInServer() as first, StandInServer() as second:
+            for server in (first, second):
+                server.responses["/api/status"] = [get_status("overpass-status-happy")]
+                server.responses["/api/interpreter"] = [(500, {}, b"")]
+            pool = overpass_query.OverpassPool([first.get_uri(), second.get_uri()])
+            with unittest.mock.patch('time.sleep', sleeps.append):
+                with self.assertRaises(urllib.error.HTTPError):
+                    pool.query("q", tries=3)
+            pool.close()
+        self.assertEqual(len(sleeps), 1)
+        self.assertEqual(len(first.get_paths() + second.get_paths()), 5)
+
+    def test_too_many_requests(self) -> None:
+        """Tests that the status of an endpoint is parsed again after a 429 during failover."""
+        with StandInServer() as busy, StandInServer() as good:
+            for server in (busy, good):
+                server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            busy.responses["/api/interpreter"] = [(429, {}, b"")]
+            good.responses["/api/interpreter"] = [(200, {}, b"@id\n")]
+            pool = overpass_query.OverpassPool([busy.get_uri(), good.get_uri()])
+            self.assertEqual(pool.query("q", tries=2), "@id\n")
+            self.assertEqual(pool.get_slots(), 4)
+            pool.close()
+        self.assertEqual(busy.get_paths(), ["/api/status", "/api/interpreter", "/api/status"])
+
+    def test_get_slots(self) -> None:
+        """Tests that the slots of the endpoints are added."""
+        with StandInServer() as first, StandInServer() as second:
+            first.responses["/api/status"] = [get_status("overpass-status-happy")]
+            second.responses["/api/status"] = [get_status("overpass-status-wait")]
+            pool = overpass_query.OverpassPool([first.get_uri(), second.get_uri()])
+            self.assertEqual(pool.get_slots(), 4)
+            pool.close()
+            second.responses["/api/status"] = [get_status("overpass-status-unlimited")]
+            pool = overpass_query.OverpassPool([first.get_uri(), second.get_uri()])
+            self.assertEqual(pool.get_slots(), 0)
+            pool.close()
+
+
+class TestOverpassQueryNeedSleep(unittest.TestCase):
+    """Tests overpass_query_need_sleep()."""
+    def test_happy(self) -> None:
+        """Tests that the status is parsed again, the least busy endpoint is used."""
+        with StandInServer() as first, StandInServer() as second:
+            first.responses["/api/status"] = [get_status("overpass-status-wait")]
+            second.responses["/api/status"] = [get_status("overpass-status-happy"), get_status("overpass-status-wait")]
+            uris = [first.get_uri(), second.get_uri()]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: uris):
+                self.assertEqual(overpass_query.overpass_query_need_sleep(), 0)
+                self.assertEqual(overpass_query.overpass_query_need_sleep(), 12)
+                overpass_query.get_client().close()
+        self.assertEqual(second.get_paths(), ["/api/status", "/api/status"])
 
     def test_wait_negative(self) -> None:
-        """Tests the wait for negative amount path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-wait-negative")):
-            self.assertEqual(overpass_query.overpass_query_need_sleep(), 1)
+        """Tests the wait for negative amount path: the slot not listed is assumed to be free."""
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-wait-negative")]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]):
+                self.assertEqual(overpass_query.overpass_query_need_sleep(), 0)
+                overpass_query.get_client().close()
 
 
 class TestOverpassQuery(unittest.TestCase):
     """Tests overpass_query()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-interpreter-happy")):
-            with open("tests/mock/overpass-interpreter-happy.request-data") as stream:
-                query = stream.read()
-                ret = overpass_query.overpass_query(query)
-                self.assertEqual(ret[:3], "@id")
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            with open("tests/mock/overpass-interpreter-happy.response-data", "rb") as stream:
+                server.responses["/api/interpreter"] = [(200, {}, stream.read())]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]):
+                with open("tests/mock/overpass-interpreter-happy.request-data") as stream:
+                    query = stream.read()
+                    ret = overpass_query.overpass_query(query)
+                    self.assertEqual(ret[:3], "@id")
+                self.assertIs(overpass_query.get_client(), overpass_query.get_client())
+                overpass_query.get_client().close()
+
+
+class TestOverpassQueryCache(unittest.TestCase):
+    """Tests the response cache of overpass_query() and overpass_query_to_file()."""
+    def test_happy(self) -> None:
+        """Tests that a fresh cached result is served without a request."""
+        workdir = tempfile.mkdtemp()
+        path = os.path.join(workdir, "result.csv")
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n1\n"), (200, {}, b"@id\n2\n"),
+                                                    (200, {}, b"@id\n3\n")]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]), \
+                    unittest.mock.patch('config.Config.get_workdir', lambda: workdir), \
+                    unittest.mock.patch.dict('config.DEFAULTS', {'overpass_cache_ttl': '60'}):
+                self.assertEqual(overpass_query.overpass_query("q"), "@id\n1\n")
+                self.assertEqual(overpass_query.overpass_query("q"), "@id\n1\n")
+                overpass_query.overpass_query_to_file("q", path)
+                self.assertEqual(overpass_query.overpass_query("q", cache=False), "@id\n2\n")
+                # A result streamed to a file is cached as well.
+                overpass_query.overpass_query_to_file("q2", path + ".2")
+                self.assertEqual(overpass_query.overpass_query("q2"), "@id\n3\n")
+                cache = overpass_query.get_cache()
+                assert cache
+                stats = cache.get_stats()
+                overpass_query.get_client().close()
+        self.assertEqual(server.get_paths(), ["/api/status"] + ["/api/interpreter"] * 3)
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), b"@id\n1\n")
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 2))
+        shutil.rmtree(workdir)
+
+    def test_disabled(self) -> None:
+        """Tests that the cache is disabled by default."""
+        self.assertIsNone(overpass_query.get_cache())
+
+
+class TestOverpassQueryToFile(unittest.TestCase):
+    """Tests overpass_query_to_file()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        path = os.path.join("tests/workdir", "overpass-query-to-file.tmp")
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(200, {}, b"@id\n" * 100000)]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]):
+                overpass_query.overpass_query_to_file("q", path)
+                overpass_query.get_client().close()
+        self.assertEqual(os.path.getsize(path), len(b"@id\n") * 100000)
+        os.unlink(path)
 
 
 class TestMain(unittest.TestCase):
     """Tests main()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-interpreter-happy")):
-            buf = io.StringIO()
-            with unittest.mock.patch('sys.stdout', buf):
-                argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
-                with unittest.mock.patch('sys.argv', argv):
-                    overpass_query.main()
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            with open("tests/mock/overpass-interpreter-happy.response-data", "rb") as stream:
+                server.responses["/api/interpreter"] = [(200, {}, stream.read())]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]):
+                buf = io.StringIO()
+                with unittest.mock.patch('sys.stdout', buf):
+                    argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
+                    with unittest.mock.patch('sys.argv', argv):
+                        overpass_query.main()
+                overpass_query.get_client().close()
             buf.seek(0)
             self.assertTrue(buf.read().startswith("@id"))
 
     def test_failure(self) -> None:
         """Tests the failure path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("")):
-            buf = io.StringIO()
-            with unittest.mock.patch('sys.stdout', buf):
-                argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
-                with unittest.mock.patch('sys.argv', argv):
-                    overpass_query.main()
+        with StandInServer() as server:
+            server.responses["/api/status"] = [get_status("overpass-status-happy")]
+            server.responses["/api/interpreter"] = [(500, {}, b"")]
+            with unittest.mock.patch('config.Config.get_overpass_uris', lambda: [server.get_uri()]):
+                buf = io.StringIO()
+                with unittest.mock.patch('sys.stdout', buf):
+                    argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
+                    with unittest.mock.patch('sys.argv', argv):
+                        overpass_query.main()
+                overpass_query.get_client().close()
             buf.seek(0)
             self.assertTrue(buf.read().startswith("overpass query failed"))
 
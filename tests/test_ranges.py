@@ -66,6 +66,13 @@ class TestRanges(unittest.TestCase):
         test = ranges.Ranges([ranges.Range(0, 0), ranges.Range(1, 1)])
         self.assertFalse(2 in test)
 
+    def test_hash(self) -> None:
+        """Tests that equal ranges can be used as the same dict key."""
+        first = ranges.Ranges([ranges.Range(1, 999), ranges.Range(2, 998)])
+        second = ranges.Ranges([ranges.Range(1, 999), ranges.Range(2, 998)])
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first: 1, second: 2}), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
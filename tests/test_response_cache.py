@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_response_cache module covers the response_cache module."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import response_cache
+
+
+class TestResponseCache(unittest.TestCase):
+    """Tests ResponseCache."""
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_happy(self) -> None:
+        """Tests the happy path: hits and misses are counted."""
+        cache = response_cache.ResponseCache(os.path.join(self.directory, "cache"), ttl=60, budget=1024)
+        self.assertTrue(cache.is_enabled())
+        self.assertEqual(cache.get("q1"), b"")
+        cache.put("q1", b"@id\n1\n")
+        self.assertEqual(cache.get("q1"), b"@id\n1\n")
+        self.assertEqual(cache.get("q2"), b"")
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"], stats["size"]), (1, 2, 1, 6))
+
+    def test_files(self) -> None:
+        """Tests put_file() and get_to_file()."""
+        cache = response_cache.ResponseCache(self.directory, ttl=60, budget=1024)
+        path = os.path.join(self.directory, "result.csv")
+        self.assertFalse(cache.get_to_file("q", path))
+        with open(path, "wb") as stream:
+            stream.write(b"@id\n1\n")
+        cache.put_file("q", path)
+        os.unlink(path)
+        self.assertTrue(cache.get_to_file("q", path))
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), b"@id\n1\n")
+
+    def test_expired(self) -> None:
+        """Tests that an entry is not used after the TTL."""
+        cache = response_cache.ResponseCache(self.directory, ttl=60, budget=1024)
+        cache.put("q", b"@id\n")
+        path = os.path.join(self.directory, response_cache.get_key("q") + response_cache.SUFFIX)
+        written = time.time() - 61
+        os.utime(path, (written, written))
+        self.assertEqual(cache.get("q"), b"")
+        # Expired entries are removed when the next one is stored.
+        cache.put("q2", b"@id\n")
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(cache.get("q2"), b"@id\n")
+
+    def test_budget(self) -> None:
+        """Tests that the least recently used entries are removed to respect the budget."""
+        cache = response_cache.ResponseCache(self.directory, ttl=600, budget=10)
+        now = time.time()
+        with unittest.mock.patch('time.time', lambda: now):
+            cache.put("q1", b"1234")
+        with unittest.mock.patch('time.time', lambda: now + 1):
+            cache.put("q2", b"1234")
+        with unittest.mock.patch('time.time', lambda: now + 2):
+            # q1 is used, so q2 is the least recently used one.
+            self.assertEqual(cache.get("q1"), b"1234")
+            cache.put("q3", b"1234")
+        self.assertEqual(cache.get("q2"), b"")
+        self.assertEqual(cache.get("q1"), b"1234")
+        self.assertEqual(cache.get("q3"), b"1234")
+        # Too large to be cached at all.
+        cache.put("q4", b"12345678901")
+        self.assertEqual(cache.get("q4"), b"")
+
+    def test_removed(self) -> None:
+        """Tests that entries removed by an other process in the meantime are handled."""
+        cache = response_cache.ResponseCache(self.directory, ttl=60, budget=1024)
+        path = os.path.join(self.directory, "result.csv")
+        # Removed between the lookup and the read.
+        for lookup in (cache.get, lambda query: cache.get_to_file(query, path)):
+            cache.put("q", b"@id\n")
+            with unittest.mock.patch("os.utime", lambda entry, _times: os.unlink(entry)):
+                self.assertFalse(lookup("q"))
+        # Removed between the listing and the stat or the removal.
+        cache.put("q", b"@id\n")
+        written = time.time() - 61
+        os.utime(os.path.join(self.directory, response_cache.get_key("q") + response_cache.SUFFIX), (written, written))
+        listdir = os.listdir
+        unlink = os.unlink
+        with unittest.mock.patch("os.listdir", lambda directory: listdir(directory) + ["gone.response"]), \
+                unittest.mock.patch("os.unlink", lambda entry: unlink(entry) or unlink(entry)):
+            cache.put("q2", b"@id\n")
+        self.assertEqual(cache.get_stats()["entries"], 1)
+        # Too large to be cached at all.
+        with open(path, "wb") as stream:
+            stream.write(b"@id\n" * 257)
+        cache.put_file("q3", path)
+        self.assertFalse(cache.get_to_file("q3", path))
+
+    def test_disabled(self) -> None:
+        """Tests is_enabled()."""
+        self.assertFalse(response_cache.ResponseCache(self.directory, ttl=0, budget=1024).is_enabled())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_single_flight module covers the single_flight module."""
+
+from typing import Any
+from typing import Iterator
+from typing import List
+import contextlib
+import os
+import threading
+import unittest
+import unittest.mock
+import urllib.error
+
+import areas
+import single_flight
+import util
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+@contextlib.contextmanager
+def mock_waiting() -> Iterator[threading.Event]:
+    """Mocks Flight.get(), so the returned event is set when a caller starts to wait for a flight."""
+    waiting = threading.Event()
+    get = single_flight.Flight.get
+
+    def mock_get(self: single_flight.Flight[Any]) -> Any:
+        waiting.set()
+        return get(self)
+    with unittest.mock.patch('single_flight.Flight.get', mock_get):
+        yield waiting
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests SingleFlight."""
+    def test_happy(self) -> None:
+        """Tests that a concurrent call waits for the running one and shares its result."""
+        flights: single_flight.SingleFlight[str, int] = single_flight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls: List[str] = []
+        results: List[int] = []
+
+        def function() -> int:
+            calls.append("function")
+            started.set()
+            release.wait()
+            return 42
+
+        leader = threading.Thread(target=lambda: results.append(flights.run("key", function)))
+        leader.start()
+        started.wait()
+        self.assertTrue(flights.is_running("key"))
+        with mock_waiting() as waiting:
+            follower = threading.Thread(target=lambda: results.append(flights.run("key", function)))
+            follower.start()
+            waiting.wait()
+        # An other key is not blocked.
+        self.assertEqual(flights.run("other", lambda: 1), 1)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(calls, ["function"])
+        self.assertEqual(results, [42, 42])
+        self.assertFalse(flights.is_running("key"))
+        # Calls after the finished one run again.
+        self.assertEqual(flights.run("key", lambda: 43), 43)
+
+    def test_error(self) -> None:
+        """Tests that the exception of the running call is raised in the waiting ones, too."""
+        flights: single_flight.SingleFlight[str, None] = single_flight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors: List[str] = []
+
+        def function() -> None:
+            started.set()
+            release.wait()
+            raise ValueError("failed")
+
+        def call() -> None:
+            try:
+                flights.run("key", function)
+            except ValueError as error:
+                errors.append(str(error))
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        with mock_waiting() as waiting:
+            follower = threading.Thread(target=call)
+            follower.start()
+            waiting.wait()
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(errors, ["failed", "failed"])
+
+
+class TestUpdateOsmStreets(unittest.TestCase):
+    """Tests update_osm_streets() and update_osm_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        queries: List[str] = []
+
+        def mock_overpass_query_to_file(query: str, path: str) -> None:
+            queries.append(query)
+            with open(path, "w") as stream:
+                stream.write("@id\tname\n1\tTűzkő utca\n")
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            relation = areas.Relations(get_abspath("workdir")).get_relation("gazdagret")
+            path = relation.get_files().get_osm_streets_path()
+            original = util.get_content(path)
+            try:
+                single_flight.update_osm_streets(relation)
+                self.assertEqual(util.get_content(path), "@id\tname\n1\tTűzkő utca\n")
+            finally:
+                with open(path, "w") as stream:
+                    stream.write(original)
+            self.assertEqual(queries, [relation.get_osm_streets_query()])
+
+    def test_http_error(self) -> None:
+        """Tests that the error of the query is raised."""
+        def mock_overpass_query_to_file(_query: str, _path: str) -> None:
+            raise urllib.error.HTTPError("", 503, "", None, None)  # type: ignore
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            relation = areas.Relations(get_abspath("workdir")).get_relation("gazdagret")
+            before = sorted(os.listdir(get_abspath("workdir")))
+            with self.assertRaises(urllib.error.HTTPError):
+                single_flight.update_osm_housenumbers(relation)
+            # The temp file of the failed query is removed.
+            self.assertEqual(sorted(os.listdir(get_abspath("workdir"))), before)
+            self.assertFalse(single_flight.UPDATES.is_running(("gazdagret", "housenumbers")))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
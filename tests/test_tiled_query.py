@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_tiled_query module covers the tiled_query module."""
+
+from typing import List
+import gzip
+import os
+import tempfile
+import unittest
+import unittest.mock
+import urllib.error
+
+import areas
+import cron
+import geometry
+import tiled_query
+import util
+
+STREETS_QUERY = """[out:csv(::id, name, highway, ::type)]  [timeout:425];
+area(3602713748)->.searchArea;
+way(area.searchArea)[highway];
+out body;
+"""
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relations() -> areas.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return areas.Relations(workdir)
+
+
+class TestDurations(unittest.TestCase):
+    """Tests get_durations() and set_duration()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("budafok")
+            path = relation.get_files().get_state_path("query-durations")
+            self.assertFalse(os.path.exists(path))
+            try:
+                self.assertEqual(tiled_query.get_durations(relation), {})
+                # Lines without a duration are ignored.
+                with open(path, "w") as stream:
+                    stream.write("streets\n")
+                self.assertEqual(tiled_query.get_durations(relation), {})
+                tiled_query.set_duration(relation, "streets", 1.5)
+                tiled_query.set_duration(relation, "housenumbers", 300.0)
+                tiled_query.set_duration(relation, "streets", 2.5)
+                self.assertEqual(tiled_query.get_durations(relation), {"housenumbers": 300.0, "streets": 2.5})
+                self.assertEqual(util.get_content(path), "housenumbers\t300.0\nstreets\t2.5\n")
+            finally:
+                os.unlink(path)
+
+
+class TestGetTileCount(unittest.TestCase):
+    """Tests get_tile_count()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the larger of the size and duration ratios decides."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("gazdagret")
+            size = os.path.getsize(relation.get_files().get_osm_housenumbers_path())
+            with unittest.mock.patch.dict("config.DEFAULTS", {"overpass_tile_size": str(size),
+                                                              "overpass_tile_seconds": "100"}), \
+                    unittest.mock.patch("tiled_query.get_durations", lambda _relation: {}):
+                # Size is at the threshold, no duration yet.
+                self.assertEqual(tiled_query.get_tile_count(relation, "housenumbers"), 1)
+                with unittest.mock.patch("tiled_query.get_durations", lambda _relation: {"housenumbers": 500.0}):
+                    self.assertEqual(tiled_query.get_tile_count(relation, "housenumbers"), 3)
+                with unittest.mock.patch("tiled_query.get_durations", lambda _relation: {"housenumbers": 5000.0}):
+                    self.assertEqual(tiled_query.get_tile_count(relation, "housenumbers"), 4)
+            with unittest.mock.patch.dict("config.DEFAULTS", {"overpass_tile_size": str(size // 2),
+                                                              "overpass_tile_seconds": "0"}):
+                self.assertEqual(tiled_query.get_tile_count(relation, "housenumbers"), 2)
+
+    def test_compressed(self) -> None:
+        """Tests that the size of a compressed list is its uncompressed size."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "street-housenumbers-test.csv.gz")
+            with gzip.open(path, "wt") as stream:
+                stream.write("@id\n" + "1\n" * 500)
+            with unittest.mock.patch("tiled_query.get_result_path", lambda _relation, _kind: path), \
+                    unittest.mock.patch("tiled_query.get_durations", lambda _relation: {}), \
+                    unittest.mock.patch.dict("config.DEFAULTS", {"overpass_tile_size": "500"}):
+                self.assertEqual(tiled_query.get_tile_count(unittest.mock.Mock(), "housenumbers"), 2)
+
+    def test_disabled(self) -> None:
+        """Tests when both thresholds are disabled."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relation = get_relations().get_relation("budafok")
+            with unittest.mock.patch.dict("config.DEFAULTS", {"overpass_tile_size": "0", "overpass_tile_seconds": "0"}):
+                self.assertEqual(tiled_query.get_tile_count(relation, "streets"), 1)
+
+
+class TestGetTiles(unittest.TestCase):
+    """Tests get_tiles()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertEqual(tiled_query.get_tiles((0.0, 0.0, 2.0, 4.0), 2), [
+            (0.0, 0.0, 1.0, 2.0),
+            (0.0, 2.0, 1.0, 4.0),
+            (1.0, 0.0, 2.0, 2.0),
+            (1.0, 2.0, 2.0, 4.0),
+        ])
+
+
+class TestMakeTileQuery(unittest.TestCase):
+    """Tests make_tile_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        expected = """[out:csv(::id, name, highway, ::type)][bbox:47.0,19.0,47.5,19.5]  [timeout:425];
+area(3602713748)->.searchArea;
+way(area.searchArea)[highway];
+out body;
+"""
+        self.assertEqual(tiled_query.make_tile_query(STREETS_QUERY, (47.0, 19.0, 47.5, 19.5)), expected)
+
+
+class TestMergeResults(unittest.TestCase):
+    """Tests merge_results()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: objects in multiple tiles are only kept once."""
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, "tile%s.tmp" % index) for index in range(2)]
+        with open(paths[0], "w") as stream:
+            stream.write("@id\tname\t@type\n1\tTűzkő utca\tway\n2\tTörökugrató utca\tway\n")
+        with open(paths[1], "w") as stream:
+            stream.write("@id\tname\t@type\n2\tTörökugrató utca\tway\n2\tOtthon utca\tnode\n")
+        # Sort the rows in multiple runs.
+        with unittest.mock.patch.dict("config.DEFAULTS", {"sort_memory_limit": "1"}):
+            merged = tiled_query.merge_results(paths, directory)
+        self.assertEqual(util.get_content(merged),
+                         "@id\tname\t@type\n2\tOtthon utca\tnode\n1\tTűzkő utca\tway\n2\tTörökugrató utca\tway\n")
+        self.assertEqual(os.listdir(directory), [os.path.basename(merged)])
+        os.unlink(merged)
+        os.rmdir(directory)
+
+    def test_no_ids(self) -> None:
+        """Tests when the result has no object ids: only duplicated rows are dropped."""
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, "tile%s.tmp" % index) for index in range(2)]
+        for path in paths:
+            with open(path, "w") as stream:
+                stream.write("name\nTűzkő utca\n")
+        merged = tiled_query.merge_results(paths, directory)
+        self.assertEqual(util.get_content(merged), "name\nTűzkő utca\n")
+        os.unlink(merged)
+        os.rmdir(directory)
+
+
+class TestFetchOsmList(unittest.TestCase):
+    """Tests fetch_osm_list()."""
+    def test_tiles(self) -> None:
+        """Tests when the query is split into tiles: objects in multiple tiles are only kept once."""
+        queries: List[str] = []
+
+        def mock_overpass_query_to_file(query: str, path: str, _tries: int) -> None:
+            if len(queries) == 6:
+                raise urllib.error.HTTPError(url=None, code=None, msg=None, hdrs=None, fp=None)  # type: ignore
+            queries.append(query)
+            with open(path, "w") as stream:
+                stream.write("@id\tname\t@type\n1\tTűzkő utca\tway\n%s\tTűzkő utca\tnode\n" % len(queries))
+
+        boundary = geometry.Polygon([[(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (0.0, 0.0)]])
+        streets_query = "[out:csv(::id, name)];\nway(area.searchArea)[highway];\nout;\n"
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch('areas.Relation.get_osm_streets_query', lambda _self: streets_query), \
+                unittest.mock.patch("cron.get_overpass_workers", lambda: 1), \
+                unittest.mock.patch("tiled_query.get_tile_count", lambda _relation, _kind: 2), \
+                unittest.mock.patch("tiled_query.set_duration", lambda _relation, _kind, _seconds: None), \
+                unittest.mock.patch("boundaries.get_boundary", lambda _relation, _tries: boundary), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            path = cron.fetch_osm_list(relation, "streets", relation.get_osm_streets_query(), relations.get_workdir())
+            # When a tile fails, the results of the other tiles are removed.
+            before = sorted(os.listdir(relations.get_workdir()))
+            with self.assertRaises(urllib.error.HTTPError):
+                cron.fetch_osm_list(relation, "streets", relation.get_osm_streets_query(), relations.get_workdir())
+            self.assertEqual(sorted(os.listdir(relations.get_workdir())), before)
+        self.assertEqual([query.splitlines()[0][-23:] for query in queries[1:3]],
+                         ["[bbox:0.0,0.5,0.5,1.0];", "[bbox:0.5,0.0,1.0,0.5];"])
+        rows = "".join("%s\tTűzkő utca\tnode\n" % index for index in range(1, 5))
+        self.assertEqual(util.get_content(path), "@id\tname\t@type\n" + rows + "1\tTűzkő utca\tway\n")
+        os.unlink(path)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_update_jobs module covers the update_jobs module."""
+
+from typing import List
+import os
+import threading
+import time
+import unittest
+import unittest.mock
+
+import areas
+import update_jobs
+import util
+
+
+def get_abspath(path: str) -> str:
+    """Mock get_abspath() that uses the test directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def get_relation() -> areas.Relation:
+    """Returns a relation that uses the test data and workdir."""
+    with unittest.mock.patch('config.get_abspath', get_abspath):
+        return areas.Relations(get_abspath("workdir")).get_relation("gazdagret")
+
+
+def wait_for(job: update_jobs.Job) -> None:
+    """Waits till a job is finished."""
+    deadline = time.time() + 10
+    while job.get_state() not in (update_jobs.DONE, update_jobs.FAILED) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestJobQueue(unittest.TestCase):
+    """Tests JobQueue."""
+    def test_happy(self) -> None:
+        """Tests that jobs are executed in the background and the same update is not queued twice."""
+        queue = update_jobs.JobQueue(workers=1, max_queued=2)
+        release = threading.Event()
+        calls: List[str] = []
+
+        def function(name: str) -> None:
+            release.wait()
+            calls.append(name)
+        first = queue.submit(("gazdagret", "streets"), lambda: function("first"))
+        assert first
+        # Wait till the only worker picks up the first job.
+        while first.get_state() == update_jobs.QUEUED:
+            time.sleep(0.01)
+        second = queue.submit(("gazdagret", "housenumbers"), lambda: function("second"))
+        assert second
+        self.assertIs(queue.submit(("gazdagret", "housenumbers"), lambda: function("third")), second)
+        self.assertEqual(first.get_state(), update_jobs.RUNNING)
+        self.assertGreaterEqual(first.get_seconds(), 0)
+        self.assertEqual(second.get_state(), update_jobs.QUEUED)
+        self.assertEqual(queue.get_position(second), 1)
+        self.assertEqual(queue.get_position(first), 0)
+        self.assertIs(queue.get_job(second.get_id()), second)
+        self.assertIsNone(queue.get_job("nosuchjob"))
+        release.set()
+        wait_for(first)
+        wait_for(second)
+        self.assertEqual(calls, ["first", "second"])
+        self.assertEqual(second.get_state(), update_jobs.DONE)
+        self.assertIsNone(second.get_error())
+        self.assertGreaterEqual(second.get_seconds(), 0)
+        # Finished jobs don't block a new update.
+        self.assertIsNot(queue.submit(("gazdagret", "housenumbers"), lambda: None), second)
+
+    def test_queue_full(self) -> None:
+        """Tests that the number of queued jobs is bounded."""
+        queue = update_jobs.JobQueue(workers=1, max_queued=1)
+        release = threading.Event()
+
+        def function() -> None:
+            release.wait()
+        first = queue.submit(("gazdagret", "streets"), function)
+        assert first
+        while first.get_state() == update_jobs.QUEUED:
+            time.sleep(0.01)
+        self.assertTrue(queue.submit(("ujbuda", "streets"), lambda: None))
+        self.assertIsNone(queue.submit(("budafok", "streets"), lambda: None))
+        release.set()
+        wait_for(first)
+
+    def test_failed(self) -> None:
+        """Tests that the error of a failed job is recorded and old finished jobs are forgotten."""
+        def function() -> None:
+            raise ValueError("failed")
+        queue = update_jobs.JobQueue(workers=1, max_queued=1)
+        with unittest.mock.patch("update_jobs.MAX_FINISHED", 0):
+            job = queue.submit(("gazdagret", "streets"), function)
+            assert job
+            wait_for(job)
+            deadline = time.time() + 10
+            while queue.get_job(job.get_id()) and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertIsNone(queue.get_job(job.get_id()))
+        self.assertEqual(job.get_state(), update_jobs.FAILED)
+        self.assertEqual(str(job.get_error()), "failed")
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            doc = update_jobs.get_job_doc(get_relation(), queue, job)
+        self.assertIn('<div id="update-error">Update failed: failed</div>', doc.getvalue())
+
+    def test_resubmit(self) -> None:
+        """Tests a job submitted again right after the same update finished."""
+        queue = update_jobs.JobQueue(workers=1, max_queued=1)
+        jobs: List[update_jobs.Job] = []
+        run = update_jobs.Job.run
+
+        def mock_run(job: update_jobs.Job) -> None:
+            run(job)
+            if not jobs:
+                resubmitted = queue.submit(job.get_key(), lambda: None)
+                assert resubmitted
+                jobs.append(resubmitted)
+        with unittest.mock.patch("update_jobs.Job.run", mock_run):
+            first = queue.submit(("gazdagret", "streets"), lambda: None)
+            assert first
+            wait_for(first)
+            while not jobs:
+                time.sleep(0.01)
+            wait_for(jobs[0])
+        self.assertIsNot(jobs[0], first)
+        self.assertEqual(jobs[0].get_state(), update_jobs.DONE)
+
+
+class TestGetJobDoc(unittest.TestCase):
+    """Tests get_job_doc()."""
+    def test_running(self) -> None:
+        """Tests the status of a running job."""
+        queue = update_jobs.JobQueue(workers=1, max_queued=1)
+        release = threading.Event()
+
+        def function() -> None:
+            release.wait()
+        job = queue.submit(("gazdagret", "streets"), function)
+        assert job
+        while job.get_state() == update_jobs.QUEUED:
+            time.sleep(0.01)
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            doc = update_jobs.get_job_doc(get_relation(), queue, job)
+        release.set()
+        wait_for(job)
+        self.assertIn('<div id="job-running">', doc.getvalue())
+
+
+class TestRunUpdate(unittest.TestCase):
+    """Tests run_update()."""
+    def test_ref_housenumbers(self) -> None:
+        """Tests that the web process doesn't keep the reference in memory after the update."""
+        relation = get_relation()
+        path = relation.get_files().get_ref_housenumbers_path()
+        expected = util.get_content(path)
+        util.REFERENCE_CACHES.clear()
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            update_jobs.run_update(relation, "ref-housenumbers")
+        self.assertEqual(util.REFERENCE_CACHES, {})
+        self.assertEqual(util.get_content(path), expected)
+
+
+class TestHandleUpdate(unittest.TestCase):
+    """Tests handle_update()."""
+    def test_queue_full(self) -> None:
+        """Tests the case when the update can't be queued."""
+        queue = update_jobs.JobQueue(workers=1, max_queued=0)
+        with unittest.mock.patch("update_jobs.get_queue", lambda: queue):
+            doc = update_jobs.handle_update(get_relation(), "streets")
+        self.assertIn('<div id="queue-full">', doc.getvalue())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -6,6 +6,7 @@
 
 """The test_util module covers the util module."""
 
+from typing import Dict
 from typing import List
 import io
 import os
@@ -468,6 +469,28 @@ class TestGetWorkdir(unittest.TestCase):
             self.assertEqual(actual, expected)
 
 
+class TestGetReferenceCaches(unittest.TestCase):
+    """Tests get_reference_caches()."""
+    def test_happy(self) -> None:
+        """Tests that the reference is only loaded once."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        util.REFERENCE_CACHES.clear()
+        calls = 0
+        real_build_reference_cache = util.build_reference_cache
+
+        def mock_build_reference_cache(local: str) -> Dict[str, Dict[str, Dict[str, List[util.HouseNumberRange]]]]:
+            nonlocal calls
+            calls += 1
+            return real_build_reference_cache(local)
+        with unittest.mock.patch('util.build_reference_cache', mock_build_reference_cache):
+            first = util.get_reference_caches([refpath])
+            second = util.get_reference_caches([refpath])
+        self.assertEqual(calls, 1)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(first, util.build_reference_caches([refpath]))
+
+
 class TestGetContent(unittest.TestCase):
     """Tests get_content()."""
     def test_happy(self) -> None:
@@ -19,6 +19,7 @@ import time
 # pylint: disable=unused-import
 import yattag
 
+import areas
 import config
 import webframe
 
@@ -66,6 +67,17 @@ class TestHandleStatic(unittest.TestCase):
         self.assertFalse(len(content_type))
 
 
+class TestGetRequestUri(unittest.TestCase):
+    """Tests get_request_uri()."""
+    def test_alias_street(self) -> None:
+        """Tests that only the relation name is rewritten, not a street name containing the alias."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = areas.Relations(get_abspath("workdir"))
+            environ = {"PATH_INFO": "/osm/missing-housenumbers/budapest_22/street/budapest_22 utca"}
+            request_uri = webframe.get_request_uri(environ, relations)
+        self.assertEqual(request_uri, "/osm/missing-housenumbers/budafok/street/budapest_22 utca")
+
+
 class TestHandleException(unittest.TestCase):
     """Tests handle_exception()."""
     def test_happy(self) -> None:
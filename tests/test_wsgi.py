@@ -15,10 +15,12 @@ from typing import Optional
 from typing import TYPE_CHECKING
 from typing import Tuple
 from typing import cast
+import email.message
 import io
 import json
 import locale
 import os
+import time
 import unittest
 import unittest.mock
 import urllib.error
@@ -28,6 +30,8 @@ import yattag
 
 import areas
 import config
+import dataset_cache
+import update_jobs
 import util
 import webframe
 import wsgi
@@ -137,12 +141,10 @@ class TestStreets(TestWsgi):
         """Tests if the update-result output is well-formed."""
         result_from_overpass = "@id\tname\n1\tTűzkő utca\n2\tTörökugrató utca\n3\tOSM Name 1\n4\tHamzsabégi út\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
-        with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
+        def mock_overpass_query_to_file(_query: str, path: str) -> None:
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
+        with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
             root = self.get_dom_for_path("/streets/gazdagret/update-result")
             results = root.findall("body")
             self.assertEqual(len(results), 1)
@@ -150,10 +152,15 @@ class TestStreets(TestWsgi):
     def test_update_result_error_well_formed(self) -> None:
         """Tests if the update-result output on error is well-formed."""
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            raise urllib.error.HTTPError(url=None, code=None, msg=None, hdrs=None, fp=None)
-        with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
-            root = self.get_dom_for_path("/streets/gazdagret/update-result")
+        def mock_overpass_query_to_file(_query: str, _path: str) -> None:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+
+        def mock_request(*_args: Any, **_kwargs: Any) -> bytes:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+        with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            # The status can't be queried either.
+            with unittest.mock.patch('overpass_query.OverpassClient.request', mock_request):
+                root = self.get_dom_for_path("/streets/gazdagret/update-result")
             results = root.findall("body/div[@id='overpass-error']")
             self.assertTrue(results)
 
@@ -164,12 +171,10 @@ class TestStreets(TestWsgi):
         """
         result_from_overpass = "@id\tname\n3\tOSM Name 1\n2\tTörökugrató utca\n1\tTűzkő utca\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
-        with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
+        def mock_overpass_query_to_file(_query: str, path: str) -> None:
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
+        with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
             root = self.get_dom_for_path("/streets/ujbuda/update-result")
             results = root.findall("body")
             self.assertEqual(len(results), 1)
@@ -409,6 +414,90 @@ Tűzkő utca	[1], [2]"""
         self.assertEqual(len(results), 1)
 
 
+class TestMissingHousenumbersViewQuery(TestWsgi):
+    """Tests the missing house numbers view-query page."""
+    def test_direct(self) -> None:
+        """Tests that the date comes from the reference in direct mode, which has no list."""
+        with unittest.mock.patch.dict("config.DEFAULTS", {"reference_housenumbers_direct": "True"}):
+            root = self.get_dom_for_path("/missing-housenumbers/gazdagret/view-query")
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            references = config.Config.get_reference_housenumber_paths()
+        date = webframe.format_timestamp(max(os.path.getmtime(path) for path in references))
+        self.assertIn("Last update: " + date, ET.tostring(root, encoding="unicode"))
+
+
+class TestMissingHousenumbersUpdate(TestWsgi):
+    """Tests updating the reference list from the missing house numbers page."""
+    def test_direct(self) -> None:
+        """Tests that the update doesn't write the reference list in direct mode."""
+        calls: List[str] = []
+        with config.ConfigContext("reference_housenumbers_direct", "True"), \
+                unittest.mock.patch("areas.Relation.write_ref_housenumbers",
+                                    lambda relation, _references: calls.append(relation.get_name())):
+            root = self.get_dom_for_path("/missing-housenumbers/gazdagret/update-result")
+        self.assertEqual(calls, [])
+        self.assertEqual(len(root.findall("body/a")), 1)
+
+
+class TestMissingHousenumbersStreet(TestWsgi):
+    """Tests the per-street missing house numbers page."""
+    def test_street(self) -> None:
+        """Tests the per-street view."""
+        root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/Törökugrató utca")
+        results = root.findall("body/table/tr")
+        self.assertEqual(len(results), 2)
+        cells = results[1].findall("td")
+        self.assertEqual(cells[0].text, "Törökugrató utca")
+        # 11 and 12 are filtered out as invalid.
+        self.assertEqual(cells[1].text, "2")
+
+    def test_street_utf8(self) -> None:
+        """Tests the per-street view when the street name is latin-1 encoded UTF-8, as WSGI provides it."""
+        street = "Törökugrató utca".encode("utf-8").decode("latin-1")
+        root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/" + street)
+        self.assertEqual(len(root.findall("body/table")), 1)
+
+    def test_street_refstreets(self) -> None:
+        """Tests the per-street view for a complete street, which has a different ref name."""
+        root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/OSM Name 1")
+        self.assertEqual(len(root.findall("body/table")), 0)
+        results = root.findall("body/p")
+        self.assertTrue(cast(str, results[0].text).endswith("(existing: 2, ready: 100.00%)."))
+
+    def test_street_no_such_street(self) -> None:
+        """Tests the per-street view for a street which is in neither lists."""
+        root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/No Such utca")
+        results = root.findall("body/p")
+        self.assertTrue(cast(str, results[0].text).endswith("(existing: 0, ready: 100.00%)."))
+
+    def test_street_no_osm_housenumbers(self) -> None:
+        """Tests the per-street view, no osm housenumbers case."""
+        with unittest.mock.patch('config.get_abspath', get_abspath):
+            relations = get_relations()
+            relation = relations.get_relation("gazdagret")
+            hide_path = relation.get_files().get_osm_housenumbers_path()
+            real_exists = os.path.exists
+
+            def mock_exists(path: str) -> bool:
+                if path == hide_path:
+                    return False
+                return real_exists(path)
+            with unittest.mock.patch('os.path.exists', mock_exists):
+                root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/Tűzkő utca")
+                results = root.findall("body/div[@id='no-osm-housenumbers']")
+                self.assertEqual(len(results), 1)
+
+    def test_street_no_housenumber(self) -> None:
+        """Tests the per-street view when an OSM row has no house number."""
+        lines = ["1\tTörökugrató utca\n", "1\tTörökugrató utca\t1\n"]
+        with unittest.mock.patch("area_files.RelationFiles.get_osm_housenumbers_street_lines",
+                                 lambda _self, _street: lines):
+            root = self.get_dom_for_path("/missing-housenumbers/gazdagret/street/Törökugrató utca")
+        cells = root.findall("body/table/tr")[1].findall("td")
+        # 2 is now missing as well.
+        self.assertEqual(cells[1].text, "3")
+
+
 class TestStreetHousenumbers(TestWsgi):
     """Tests handle_street_housenumbers()."""
     def test_view_result_update_result_link(self) -> None:
@@ -435,12 +524,10 @@ class TestStreetHousenumbers(TestWsgi):
         result_from_overpass += "1\tOSM Name 1\t2\n"
         result_from_overpass += "1\tOnly In OSM utca\t1\n"
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            buf = io.BytesIO()
-            buf.write(result_from_overpass.encode('utf-8'))
-            buf.seek(0)
-            return buf
-        with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
+        def mock_overpass_query_to_file(_query: str, path: str) -> None:
+            with open(path, "w") as stream:
+                stream.write(result_from_overpass)
+        with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
             root = self.get_dom_for_path("/street-housenumbers/gazdagret/update-result")
             results = root.findall("body")
             self.assertEqual(len(results), 1)
@@ -448,10 +535,15 @@ class TestStreetHousenumbers(TestWsgi):
     def test_update_result_error_well_formed(self) -> None:
         """Tests if the update-result output on error is well-formed."""
 
-        def mock_urlopen(_url: str, _data: Optional[bytes] = None) -> BinaryIO:
-            raise urllib.error.HTTPError(url=None, code=None, msg=None, hdrs=None, fp=None)
-        with unittest.mock.patch('urllib.request.urlopen', mock_urlopen):
-            root = self.get_dom_for_path("/street-housenumbers/gazdagret/update-result")
+        def mock_overpass_query_to_file(_query: str, _path: str) -> None:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+
+        def mock_request(*_args: Any, **_kwargs: Any) -> bytes:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+        with unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file):
+            # The status can't be queried either.
+            with unittest.mock.patch('overpass_query.OverpassClient.request', mock_request):
+                root = self.get_dom_for_path("/street-housenumbers/gazdagret/update-result")
             results = root.findall("body/div[@id='overpass-error']")
             self.assertTrue(results)
 
@@ -571,6 +663,56 @@ class TestMissingStreets(TestWsgi):
         self.assertEqual(len(results), 1)
 
 
+class TestJobs(TestWsgi):
+    """Tests updates running in the background."""
+    def wait_for_job(self, root: ET.Element) -> str:
+        """Waits till the job of an update-result or job page finishes, returns its identifier."""
+        meta = root.find("body/meta")
+        assert meta is not None
+        job_id = meta.attrib["content"].split("/")[-1]
+        queue = update_jobs.get_queue()
+        assert queue
+        job = queue.get_job(job_id)
+        assert job
+        while job.get_state() not in (update_jobs.DONE, update_jobs.FAILED):
+            time.sleep(0.01)
+        return job_id
+
+    def test_happy(self) -> None:
+        """Tests that the job page redirects to the result once the update is done."""
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch.dict('config.DEFAULTS', {'web_job_workers': '1'}):
+            root = self.get_dom_for_path("/missing-streets/gazdagret/update-result")
+            states = root.findall("body/div[@id='job-queued']") + root.findall("body/div[@id='job-running']")
+            self.assertEqual(len(states), 1)
+            root = self.get_dom_for_path("/jobs/" + self.wait_for_job(root))
+            prefix = config.Config.get_uri_prefix()
+            meta = root.find("body/meta")
+            assert meta is not None
+            self.assertEqual(meta.attrib["content"], "0; url=" + prefix + "/missing-streets/gazdagret/view-result")
+
+    def test_error(self) -> None:
+        """Tests the job page of a failed update."""
+        def mock_overpass_query_to_file(_query: str, _path: str) -> None:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+
+        def mock_request(*_args: Any, **_kwargs: Any) -> bytes:
+            raise urllib.error.HTTPError(url="", code=0, msg="", hdrs=email.message.Message(), fp=None)
+        with unittest.mock.patch('config.get_abspath', get_abspath), \
+                unittest.mock.patch.dict('config.DEFAULTS', {'web_job_workers': '1'}), \
+                unittest.mock.patch('overpass_query.overpass_query_to_file', mock_overpass_query_to_file), \
+                unittest.mock.patch('overpass_query.OverpassClient.request', mock_request):
+            root = self.get_dom_for_path("/streets/gazdagret/update-result")
+            root = self.get_dom_for_path("/jobs/" + self.wait_for_job(root))
+        self.assertTrue(root.findall("body/div[@id='overpass-error']"))
+
+    def test_no_such_job(self) -> None:
+        """Tests the job page of an unknown job."""
+        with unittest.mock.patch.dict('config.DEFAULTS', {'web_job_workers': '1'}):
+            root = self.get_dom_for_path("/jobs/nosuchjob")
+        self.assertTrue(root.findall("body/div[@id='no-such-job']"))
+
+
 class TestMain(TestWsgi):
     """Tests handle_main()."""
     def test_well_formed(self) -> None:
@@ -744,6 +886,19 @@ class TestWebhooks(TestWsgi):
         self.assertTrue(mock_called)
 
 
+class TestCacheStats(TestWsgi):
+    """Tests handle_cache_stats()."""
+    def test_happy(self) -> None:
+        """Tests that the statistics of the dataset cache are shown."""
+        cache = dataset_cache.DatasetCache(1024)
+        with unittest.mock.patch('dataset_cache.CACHE', cache):
+            root = self.get_dom_for_path("/cache-stats/")
+        rows = root.findall("body/table/tr")
+        self.assertEqual([row.findall("td")[0].text for row in rows[1:]], list(cache.get_stats().keys()))
+        # The configured budget replaced the initial one.
+        self.assertEqual(cache.get_stats()["budget"], config.Config.get_int("dataset_cache_size"))
+
+
 class TestStatic(TestWsgi):
     """Tests /osm/static/."""
     def test_js(self) -> None:
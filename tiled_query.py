@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The tiled_query module splits the overpass query of a large relation into bounding box tiles, so
+each of them finishes well before the timeout, and merges their results.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import math
+import os
+import tempfile
+
+import areas
+import combined_query
+import compressed_files
+import config
+import external_sort
+import geometry
+import util
+
+# At most this many tiles are used along each side of the bounding box.
+MAX_TILES_PER_SIDE = 4
+
+
+def get_durations(relation: areas.Relation) -> Dict[str, float]:
+    """Gets the duration of the last OSM queries of a relation in seconds, by kind."""
+    path = relation.get_files().get_state_path("query-durations")
+    if not os.path.exists(path):
+        return {}
+    ret: Dict[str, float] = {}
+    for line in util.get_content(path).splitlines():
+        cells = line.split("\t")
+        if len(cells) == 2:
+            ret[cells[0]] = float(cells[1])
+    return ret
+
+
+def set_duration(relation: areas.Relation, kind: str, seconds: float) -> None:
+    """Records the duration of the last OSM query of a relation of a kind ('streets' or 'housenumbers')."""
+    durations = get_durations(relation)
+    durations[kind] = seconds
+    with open(relation.get_files().get_state_path("query-durations"), "w") as stream:
+        for key in sorted(durations):
+            stream.write("%s\t%s\n" % (key, durations[key]))
+
+
+def get_result_path(relation: areas.Relation, kind: str) -> str:
+    """Gets the path of the OSM list of a relation of a kind."""
+    if kind == "streets":
+        return relation.get_files().get_osm_streets_path()
+    return relation.get_files().get_osm_housenumbers_path()
+
+
+def get_ratio(value: float, threshold: float) -> float:
+    """Gets how many times value is larger than threshold, 0 if the threshold is disabled."""
+    if threshold <= 0:
+        return 0
+    return value / threshold
+
+
+def get_tile_count(relation: areas.Relation, kind: str) -> int:
+    """
+    Decides how many tiles to use along each side of the bounding box of a relation for a query of a
+    kind, based on the size and duration of the previous result. The area of a tile is expected to
+    stay below both thresholds.
+    """
+    path = get_result_path(relation, kind)
+    # The list may be compressed, the threshold is about the size of the result.
+    size = compressed_files.get_uncompressed_size(path) if os.path.exists(path) else 0
+    duration = get_durations(relation).get(kind, 0.0)
+    ratio = max(get_ratio(size, config.Config.get_int("overpass_tile_size")),
+                get_ratio(duration, config.Config.get_int("overpass_tile_seconds")))
+    if ratio <= 1:
+        return 1
+    return min(math.ceil(math.sqrt(ratio)), MAX_TILES_PER_SIDE)
+
+
+def get_tiles(bbox: geometry.BoundingBox, count: int) -> List[geometry.BoundingBox]:
+    """Splits a bounding box into count * count tiles."""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lat_step = (max_lat - min_lat) / count
+    lon_step = (max_lon - min_lon) / count
+    ret: List[geometry.BoundingBox] = []
+    for row in range(count):
+        for column in range(count):
+            ret.append((min_lat + row * lat_step, min_lon + column * lon_step,
+                        max_lat if row == count - 1 else min_lat + (row + 1) * lat_step,
+                        max_lon if column == count - 1 else min_lon + (column + 1) * lon_step))
+    return ret
+
+
+def make_tile_query(query: str, tile: geometry.BoundingBox) -> str:
+    """Limits a query to a tile, using a global bounding box setting."""
+    columns, rest, body = combined_query.get_settings(query)
+    lines = ["[out:csv(%s)][bbox:%s,%s,%s,%s]%s" % ((", ".join(columns),) + tile + (rest,))]
+    return "\n".join(lines + body) + "\n"
+
+
+def get_key(headers: List[str], cells: List[str]) -> Tuple[str, ...]:
+    """Gets the key of a row to detect objects which are in multiple tiles."""
+    if "@id" in headers and "@type" in headers:
+        return (cells[headers.index("@type")], cells[headers.index("@id")])
+    return tuple(cells)
+
+
+def concat_results(paths: List[str], directory: str) -> Tuple[str, List[str]]:
+    """Concatenates the results of tile queries into a new temp file in directory, with a single
+    header, and removes them. Returns the path of the new file and its header."""
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    headers: List[str] = []
+    with os.fdopen(handle, "w", newline="\n") as output:
+        for index, tile_path in enumerate(paths):
+            with open(tile_path, "r") as stream:
+                lines = external_sort.read_lines(stream)
+                header = next(lines, "")
+                if index == 0:
+                    output.write(header)
+                    headers = header.split("\t")
+                for line in lines:
+                    if line:
+                        output.write("\n" + line)
+            os.unlink(tile_path)
+    return path, headers
+
+
+def merge_results(paths: List[str], directory: str) -> str:
+    """
+    Merges the results of tile queries into a new temp file in directory and removes them. Objects
+    crossing tile borders are only kept once: the rows are sorted by their key, so duplicates are
+    adjacent. The sort is external, so large relations don't have to fit into memory. Returns the path
+    of the merged file.
+    """
+    concat_path, headers = concat_results(paths, directory)
+    runs: List[str] = []
+    try:
+        header, lines = external_sort.sort_lines(concat_path, lambda line: get_key(headers, line.split("\t")),
+                                                 config.Config.get_int("sort_memory_limit"), runs)
+        handle, merged_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "w", newline="\n") as output:
+            output.write(header + "\n")
+            previous: Optional[Tuple[str, ...]] = None
+            for line in lines:
+                key = get_key(headers, line.split("\t"))
+                if key != previous:
+                    output.write(line + "\n")
+                previous = key
+    finally:
+        for run in runs:
+            os.unlink(run)
+        os.unlink(concat_path)
+    return merged_path
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The update_jobs module runs the updates started from the web interface (overpass queries, reference
+rebuilds) in background workers, so they don't block the threads of the web server.
+"""
+
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import collections
+import threading
+import time
+import urllib.error
+import uuid
+
+import yattag
+
+from i18n import translate as _
+import areas
+import config
+import single_flight
+import util
+import webframe
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# This many finished jobs are remembered, so their status can be still seen.
+MAX_FINISHED = 256
+# The status page of an unfinished job is reloaded after this many seconds.
+REFRESH_SECONDS = 2
+
+# Update kinds -> the function part of the URI of their page.
+PAGES = {
+    "streets": "streets",
+    "housenumbers": "street-housenumbers",
+    "ref-housenumbers": "missing-housenumbers",
+    "ref-streets": "missing-streets",
+}
+
+
+class Job:
+    """An update running in the background."""
+    def __init__(self, key: Tuple[str, str], function: Callable[[], None]) -> None:
+        self.__id = uuid.uuid4().hex
+        self.__key = key
+        self.__function = function
+        self.__state = QUEUED
+        # The time when the job was queued, then when it was started.
+        self.__started = time.time()
+        self.__finished = 0.0
+        self.__error: Optional[Exception] = None
+
+    def get_id(self) -> str:
+        """Gets the identifier of the job."""
+        return self.__id
+
+    def get_key(self) -> Tuple[str, str]:
+        """Gets the relation name and the update kind of the job."""
+        return self.__key
+
+    def get_state(self) -> str:
+        """Gets the state of the job: QUEUED, RUNNING, DONE or FAILED."""
+        return self.__state
+
+    def get_error(self) -> Optional[Exception]:
+        """Gets the error of a failed job."""
+        return self.__error
+
+    def get_seconds(self) -> int:
+        """Gets how many seconds the job is queued, running or was running."""
+        if self.__state in (QUEUED, RUNNING):
+            return int(time.time() - self.__started)
+        return int(self.__finished - self.__started)
+
+    def run(self) -> None:
+        """Runs the job, recording its outcome."""
+        self.__state = RUNNING
+        self.__started = time.time()
+        try:
+            self.__function()
+            self.__state = DONE
+        except Exception as error:  # pylint: disable=broad-except
+            self.__error = error
+            self.__state = FAILED
+        self.__finished = time.time()
+
+
+class JobQueue:
+    """
+    A queue of jobs, executed by a bounded number of worker threads. The number of queued jobs is
+    bounded as well. A job is not added again while the same update is queued or running.
+    """
+    def __init__(self, workers: int, max_queued: int) -> None:
+        self.__workers = workers
+        self.__max_queued = max_queued
+        self.__threads: List[threading.Thread] = []
+        self.__queued: 'collections.deque[Job]' = collections.deque()
+        self.__jobs: 'collections.OrderedDict[str, Job]' = collections.OrderedDict()
+        self.__active: Dict[Tuple[str, str], Job] = {}
+        self.__condition = threading.Condition()
+
+    def submit(self, key: Tuple[str, str], function: Callable[[], None]) -> Optional[Job]:
+        """Adds a job, returns the already queued or running one with the same key, or None if the
+        queue is full."""
+        with self.__condition:
+            job = self.__active.get(key)
+            if job and job.get_state() in (QUEUED, RUNNING):
+                return job
+            if len(self.__queued) >= self.__max_queued:
+                return None
+            job = Job(key, function)
+            self.__jobs[job.get_id()] = job
+            self.__active[key] = job
+            self.__queued.append(job)
+            if len(self.__threads) < min(self.__workers, len(self.__active)):
+                thread = threading.Thread(target=self.__work, daemon=True)
+                thread.start()
+                self.__threads.append(thread)
+            self.__condition.notify()
+            return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """Finds a job by its identifier."""
+        with self.__condition:
+            return self.__jobs.get(job_id)
+
+    def get_position(self, job: Job) -> int:
+        """Gets the 1-based position of a queued job in the queue, 0 if it's not queued."""
+        with self.__condition:
+            if job not in self.__queued:
+                return 0
+            return self.__queued.index(job) + 1
+
+    def __work(self) -> None:
+        """Executes queued jobs, forever."""
+        while True:
+            with self.__condition:
+                while not self.__queued:
+                    self.__condition.wait()
+                job = self.__queued.popleft()
+            job.run()
+            with self.__condition:
+                if self.__active.get(job.get_key()) is job:
+                    del self.__active[job.get_key()]
+                finished = [i for i in self.__jobs.values() if i.get_state() in (DONE, FAILED)]
+                for old_job in finished[:max(len(finished) - MAX_FINISHED, 0)]:
+                    del self.__jobs[old_job.get_id()]
+
+
+# Shared queues of this process, one for each configuration.
+QUEUES: Dict[Tuple[int, int], JobQueue] = {}
+QUEUES_LOCK = threading.Lock()
+
+
+def get_queue() -> Optional[JobQueue]:
+    """Returns the shared job queue, None if updates are not running in the background."""
+    key = (config.Config.get_int("web_job_workers"), config.Config.get_int("web_job_queue_size"))
+    if key[0] <= 0:
+        return None
+    with QUEUES_LOCK:
+        if key not in QUEUES:
+            QUEUES[key] = JobQueue(*key)
+        return QUEUES[key]
+
+
+def run_update(relation: areas.Relation, kind: str) -> None:
+    """Runs an update of a relation: 'streets' and 'housenumbers' fetch OSM lists, 'ref-housenumbers'
+    and 'ref-streets' rebuild the reference lists."""
+    if kind == "streets":
+        single_flight.update_osm_streets(relation)
+    elif kind == "housenumbers":
+        single_flight.update_osm_housenumbers(relation)
+    elif kind == "ref-housenumbers":
+        if not config.Config.get_bool("reference_housenumbers_direct"):
+            relation.write_ref_housenumbers(config.Config.get_reference_housenumber_paths())
+    else:
+        relation.write_ref_streets(config.Config.get_reference_street_path())
+
+
+def get_result_uri(relation: areas.Relation, kind: str) -> str:
+    """Gets the URI of the page showing the result of an update."""
+    function = "missing-housenumbers"
+    if kind == "ref-streets" or kind == "streets" and relation.get_config().should_check_missing_streets() == "only":
+        function = "missing-streets"
+    return config.Config.get_uri_prefix() + "/" + function + "/" + relation.get_name() + "/view-result"
+
+
+def get_success_doc(relation: areas.Relation, kind: str) -> yattag.doc.Doc:
+    """Produces the output of a successful update, which was executed while handling the request."""
+    doc = yattag.doc.Doc()
+    if kind == "ref-streets":
+        with doc.tag("div", id="update-success"):
+            doc.text(_("Update successful."))
+    elif kind == "streets" and relation.get_config().should_check_missing_streets() == "only":
+        doc.text(_("Update successful."))
+    else:
+        doc.text(_("Update successful: "))
+        doc.asis(util.gen_link(get_result_uri(relation, kind), _("View missing house numbers")).getvalue())
+    return doc
+
+
+def get_error_doc(error: Exception) -> yattag.doc.Doc:
+    """Produces the output of a failed update."""
+    if isinstance(error, urllib.error.HTTPError):
+        return util.handle_overpass_error(error)
+    doc = yattag.doc.Doc()
+    with doc.tag("div", id="update-error"):
+        doc.text(_("Update failed: {0}").format(str(error)))
+    return doc
+
+
+def get_job_doc(relation: areas.Relation, queue: JobQueue, job: Job) -> yattag.doc.Doc:
+    """Produces the status of a job of relation, redirects to the result once it's done."""
+    doc = yattag.doc.Doc()
+    state = job.get_state()
+    if state == DONE:
+        result_uri = get_result_uri(relation, job.get_key()[1])
+        doc.stag("meta", ("http-equiv", "refresh"), content="0; url=" + result_uri)
+        doc.text(_("Update successful: "))
+        doc.asis(util.gen_link(result_uri, _("View result")).getvalue())
+        return doc
+    error = job.get_error()
+    if error:
+        return get_error_doc(error)
+    uri = config.Config.get_uri_prefix() + "/jobs/" + job.get_id()
+    doc.stag("meta", ("http-equiv", "refresh"), content=str(REFRESH_SECONDS) + "; url=" + uri)
+    with doc.tag("div", id="job-" + state):
+        if state == QUEUED:
+            doc.text(_("Update is waiting, position in the queue: {0}").format(queue.get_position(job)))
+        else:
+            doc.text(_("Update is in progress since {0} seconds.").format(job.get_seconds()))
+    return doc
+
+
+def handle_update(relation: areas.Relation, kind: str) -> yattag.doc.Doc:
+    """Handles the update-result action of a relation: runs the update in the background if possible,
+    otherwise while handling the request."""
+    queue = get_queue()
+    if not queue:
+        try:
+            run_update(relation, kind)
+        except urllib.error.HTTPError as http_error:
+            return util.handle_overpass_error(http_error)
+        return get_success_doc(relation, kind)
+
+    job = queue.submit((relation.get_name(), kind), lambda: run_update(relation, kind))
+    if not job:
+        doc = yattag.doc.Doc()
+        with doc.tag("div", id="queue-full"):
+            doc.text(_("Too many updates are in progress, please try again later."))
+        return doc
+    return get_job_doc(relation, queue, job)
+
+
+def handle_job(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
+    """Expected request_uri: e.g. /osm/jobs/<job id>."""
+    job_id = request_uri.split("/")[-1]
+    doc = yattag.doc.Doc()
+    queue = get_queue()
+    found = queue.get_job(job_id) if queue else None
+    if queue and found:
+        relation_name, kind = found.get_key()
+        relation = relations.get_relation(relation_name)
+        osmrelation = relation.get_config().get_osmrelation()
+        doc.asis(webframe.get_toolbar(relations, PAGES[kind], relation_name, osmrelation).getvalue())
+        doc.asis(get_job_doc(relation, queue, found).getvalue())
+    else:
+        doc.asis(webframe.get_toolbar(relations).getvalue())
+        with doc.tag("div", id="no-such-job"):
+            doc.text(_("No such job: {0}").format(job_id))
+    doc.asis(webframe.get_footer().getvalue())
+    return doc
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -21,6 +21,7 @@ import locale
 import os
 import pickle
 import re
+import threading
 import urllib.error
 
 import yattag
@@ -297,6 +298,25 @@ def build_reference_caches(references: List[str]) -> List[Dict[str, Dict[str, Di
     return [build_reference_cache(reference) for reference in references]
 
 
+# Reference path -> (modification time, in-memory cache) map of get_reference_caches().
+REFERENCE_CACHES: Dict[str, Tuple[float, Dict[str, Dict[str, Dict[str, List[HouseNumberRange]]]]]] = {}
+REFERENCE_CACHES_LOCK = threading.Lock()
+
+
+def get_reference_caches(references: List[str]) -> List[Dict[str, Dict[str, Dict[str, List[HouseNumberRange]]]]]:
+    """Same as build_reference_caches(), but keeps the result in memory for the lifetime of the
+    process, so it's loaded only once until the reference changes. Concurrent callers wait for a single
+    load, instead of loading their own copy."""
+    ret = []
+    with REFERENCE_CACHES_LOCK:
+        for reference in references:
+            mtime = os.path.getmtime(reference)
+            if reference not in REFERENCE_CACHES or REFERENCE_CACHES[reference][0] != mtime:
+                REFERENCE_CACHES[reference] = (mtime, build_reference_cache(reference))
+            ret.append(REFERENCE_CACHES[reference][1])
+    return ret
+
+
 def split_house_number(house_number: str) -> Tuple[int, str]:
     """Splits house_number into a numerical and a remainder part."""
     match = re.search(r"^([0-9]*)([^0-9].*|)$", house_number)
@@ -522,6 +542,13 @@ def process_csv_body(fun: Callable[[Iterable[str]], List[str]], data: str) -> st
     return '\n'.join(result)
 
 
+def get_percent(done_count: int, todo_count: int) -> str:
+    """Formats the ratio of done items, in percents."""
+    if done_count > 0 or todo_count > 0:
+        return "%.2f" % (done_count / (done_count + todo_count) * 100)
+    return "100.00"
+
+
 def get_array_nth(arr: Sequence[str], index: int) -> str:
     """Gets the nth element of arr, returns en empty string on error."""
     return arr[index] if len(arr) > index else ''
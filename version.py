@@ -0,0 +1,2 @@
+"""The version module allows tracking the last reload of the app server."""
+VERSION = ''
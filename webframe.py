@@ -322,13 +322,31 @@ def get_request_uri(environ: Dict[str, Any], relations: areas.Relations) -> str:
         # Relation aliases.
         aliases = relations.get_aliases()
         tokens = request_uri.split("/")
-        relation_name = tokens[-2]
-        if relation_name in aliases:
-            request_uri = request_uri.replace(relation_name, aliases[relation_name])
+        index = get_relation_name_index(tokens)
+        if tokens[index] in aliases:
+            # Only rewrite the relation name, not e.g. a street name containing it.
+            tokens[index] = aliases[tokens[index]]
+            request_uri = "/".join(tokens)
 
     return request_uri
 
 
+def get_relation_name(request_uri: str) -> str:
+    """
+    Finds the relation name in a relation-specific request URI, e.g.
+    /osm/missing-housenumbers/ormezo/view-result or /osm/missing-housenumbers/ormezo/street/<name>.
+    """
+    tokens = request_uri.split("/")
+    return tokens[get_relation_name_index(tokens)]
+
+
+def get_relation_name_index(tokens: List[str]) -> int:
+    """Finds the index of the relation name in the tokens of a relation-specific request URI."""
+    if len(tokens) > 3 and tokens[-2] == "street":
+        return -3
+    return -2
+
+
 def check_existing_relation(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
     """Prevents serving outdated data from a relation that has been renamed."""
     doc = yattag.doc.Doc()
@@ -339,8 +357,7 @@ def check_existing_relation(relations: areas.Relations, request_uri: str) -> yat
             and not request_uri.startswith(prefix + "/missing-housenumbers/"):
         return doc
 
-    tokens = request_uri.split("/")
-    relation_name = tokens[-2]
+    relation_name = get_relation_name(request_uri)
     if relation_name in relations.get_names():
         return doc
 
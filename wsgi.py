@@ -28,7 +28,8 @@ import yattag
 from i18n import translate as _
 import areas
 import config
-import overpass_query
+import dataset_cache
+import update_jobs
 import util
 import webframe
 
@@ -52,23 +53,11 @@ def handle_streets(relations: areas.Relations, request_uri: str) -> yattag.doc.D
     doc = yattag.doc.Doc()
     doc.asis(webframe.get_toolbar(relations, "streets", relation_name, osmrelation).getvalue())
 
-    prefix = config.Config.get_uri_prefix()
     if action == "view-query":
         with doc.tag("pre"):
             doc.text(relation.get_osm_streets_query())
     elif action == "update-result":
-        query = relation.get_osm_streets_query()
-        try:
-            relation.get_files().write_osm_streets(overpass_query.overpass_query(query))
-            streets = relation.get_config().should_check_missing_streets()
-            if streets != "only":
-                doc.text(_("Update successful: "))
-                link = prefix + "/missing-housenumbers/" + relation_name + "/view-result"
-                doc.asis(util.gen_link(link, _("View missing house numbers")).getvalue())
-            else:
-                doc.text(_("Update successful."))
-        except urllib.error.HTTPError as http_error:
-            doc.asis(util.handle_overpass_error(http_error).getvalue())
+        doc.asis(update_jobs.handle_update(relation, "streets").getvalue())
     else:
         # assume view-result
         with relation.get_files().get_osm_streets_stream("r") as sock:
@@ -91,19 +80,11 @@ def handle_street_housenumbers(relations: areas.Relations, request_uri: str) ->
     doc = yattag.doc.Doc()
     doc.asis(webframe.get_toolbar(relations, "street-housenumbers", relation_name, osmrelation).getvalue())
 
-    prefix = config.Config.get_uri_prefix()
     if action == "view-query":
         with doc.tag("pre"):
             doc.text(relation.get_osm_housenumbers_query())
     elif action == "update-result":
-        query = relation.get_osm_housenumbers_query()
-        try:
-            relation.get_files().write_osm_housenumbers(overpass_query.overpass_query(query))
-            doc.text(_("Update successful: "))
-            link = prefix + "/missing-housenumbers/" + relation_name + "/view-result"
-            doc.asis(util.gen_link(link, _("View missing house numbers")).getvalue())
-        except urllib.error.HTTPError as http_error:
-            doc.asis(util.handle_overpass_error(http_error).getvalue())
+        doc.asis(update_jobs.handle_update(relation, "housenumbers").getvalue())
     else:
         # assume view-result
         if not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
@@ -135,13 +116,10 @@ def missing_housenumbers_view_turbo(relations: areas.Relations, request_uri: str
     return doc
 
 
-def missing_housenumbers_view_res(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
-    """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/view-result."""
-    tokens = request_uri.split("/")
-    relation_name = tokens[-2]
-
+def missing_housenumbers_check_input(relation: areas.Relation) -> yattag.doc.Doc:
+    """Checks if the inputs of missing house numbers are available, returns an empty doc if so."""
     doc = yattag.doc.Doc()
-    relation = relations.get_relation(relation_name)
+    relation_name = relation.get_name()
     prefix = config.Config.get_uri_prefix()
     if not os.path.exists(relation.get_files().get_osm_streets_path()):
         with doc.tag("div", id="no-osm-streets"):
@@ -153,11 +131,68 @@ def missing_housenumbers_view_res(relations: areas.Relations, request_uri: str)
             doc.text(_("No existing house numbers: "))
             link = prefix + "/street-housenumbers/" + relation_name + "/update-result"
             doc.asis(util.gen_link(link, _("Call Overpass to create")).getvalue())
-    elif not os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+    elif not areas.has_ref_housenumbers(relation):
         with doc.tag("div", id="no-ref-housenumbers"):
             doc.text(_("No missing house numbers: "))
             link = prefix + "/missing-housenumbers/" + relation_name + "/update-result"
             doc.asis(util.gen_link(link, _("Create from reference")).getvalue())
+    return doc
+
+
+def get_street_name_from_uri(request_uri: str) -> str:
+    """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/street/Kossuth utca."""
+    street_name = request_uri.split("/")[-1]
+    try:
+        # WSGI servers provide the path as latin-1 decoded bytes, we want UTF-8.
+        street_name = street_name.encode("latin-1").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        pass
+    return street_name
+
+
+def missing_housenumbers_view_street(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
+    """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/street/Kossuth utca."""
+    relation_name = webframe.get_relation_name(request_uri)
+    street_name = get_street_name_from_uri(request_uri)
+
+    doc = yattag.doc.Doc()
+    relation = relations.get_relation(relation_name)
+    missing_input = missing_housenumbers_check_input(relation)
+    if missing_input.getvalue():
+        doc.asis(missing_input.getvalue())
+        return doc
+
+    only_in_reference, in_both = areas.get_missing_housenumbers_for_street(relation, street_name)
+    todo_ranges = util.get_housenumber_ranges(only_in_reference)
+    done_count = len(util.get_housenumber_ranges(in_both))
+    if done_count > 0 or todo_ranges:
+        percent = "%.2f" % (done_count / (done_count + len(todo_ranges)) * 100)
+    else:
+        percent = "100.00"
+    with doc.tag("p"):
+        doc.text(_("OpenStreetMap is possibly missing the below {0} house numbers for {1} streets.")
+                 .format(str(len(todo_ranges)), str(1 if todo_ranges else 0)))
+        doc.text(_(" (existing: {0}, ready: {1}%).").format(str(done_count), str(percent)))
+    if todo_ranges:
+        table = [[util.html_escape(_("Street name")),
+                  util.html_escape(_("Missing count")),
+                  util.html_escape(_("House numbers"))]]
+        table.append(areas.get_missing_housenumbers_row(relation, street_name, todo_ranges))
+        doc.asis(util.html_table_from_list(table).getvalue())
+    return doc
+
+
+def missing_housenumbers_view_res(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
+    """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/view-result."""
+    tokens = request_uri.split("/")
+    relation_name = tokens[-2]
+
+    doc = yattag.doc.Doc()
+    relation = relations.get_relation(relation_name)
+    prefix = config.Config.get_uri_prefix()
+    missing_input = missing_housenumbers_check_input(relation)
+    if missing_input.getvalue():
+        doc.asis(missing_input.getvalue())
     else:
         ret = relation.write_missing_housenumbers()
         todo_street_count, todo_count, done_count, percent, table = ret
@@ -225,7 +260,7 @@ def missing_housenumbers_view_txt(relations: areas.Relations, request_uri: str)
         output += _("No existing streets")
     elif not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
         output += _("No existing house numbers")
-    elif not os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+    elif not areas.has_ref_housenumbers(relation):
         output += _("No reference house numbers")
     else:
         ongoing_streets, _ignore = relation.get_missing_housenumbers()
@@ -264,7 +299,7 @@ def missing_housenumbers_view_chkl(relations: areas.Relations, request_uri: str)
         output += _("No existing streets")
     elif not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
         output += _("No existing house numbers")
-    elif not os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+    elif not areas.has_ref_housenumbers(relation):
         output += _("No reference house numbers")
     else:
         ongoing_streets, _ignore = relation.get_missing_housenumbers()
@@ -310,34 +345,10 @@ def missing_streets_view_txt(relations: areas.Relations, request_uri: str) -> st
     return output
 
 
-def missing_housenumbers_update(relations: areas.Relations, relation_name: str) -> yattag.doc.Doc:
-    """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/update-result."""
-    references = config.Config.get_reference_housenumber_paths()
-    relation = relations.get_relation(relation_name)
-    relation.write_ref_housenumbers(references)
-    doc = yattag.doc.Doc()
-    doc.text(_("Update successful: "))
-    prefix = config.Config.get_uri_prefix()
-    link = prefix + "/missing-housenumbers/" + relation_name + "/view-result"
-    doc.asis(util.gen_link(link, _("View missing house numbers")).getvalue())
-    return doc
-
-
-def missing_streets_update(relations: areas.Relations, relation_name: str) -> yattag.doc.Doc:
-    """Expected request_uri: e.g. /osm/missing-streets/ujbuda/update-result."""
-    reference = config.Config.get_reference_street_path()
-    relation = relations.get_relation(relation_name)
-    relation.write_ref_streets(reference)
-    doc = yattag.doc.Doc()
-    with doc.tag("div", id="update-success"):
-        doc.text(_("Update successful."))
-    return doc
-
-
 def handle_missing_housenumbers(relations: areas.Relations, request_uri: str) -> yattag.doc.Doc:
     """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/view-[result|query]."""
     tokens = request_uri.split("/")
-    relation_name = tokens[-2]
+    relation_name = webframe.get_relation_name(request_uri)
     action = tokens[-1]
     date = None
 
@@ -346,15 +357,16 @@ def handle_missing_housenumbers(relations: areas.Relations, request_uri: str) ->
     doc = yattag.doc.Doc()
     doc.asis(webframe.get_toolbar(relations, "missing-housenumbers", relation_name, osmrelation).getvalue())
 
-    if action == "view-turbo":
+    if tokens[-2] == "street":
+        doc.asis(missing_housenumbers_view_street(relations, request_uri).getvalue())
+    elif action == "view-turbo":
         doc.asis(missing_housenumbers_view_turbo(relations, request_uri).getvalue())
     elif action == "view-query":
         with doc.tag("pre"):
-            with relation.get_files().get_ref_housenumbers_stream("r") as sock:
-                doc.text(sock.read())
-        date = get_last_modified(relation.get_files().get_ref_housenumbers_path())
+            doc.text(areas.get_ref_housenumbers_text(relation))
+        date = webframe.format_timestamp(get_ref_housenumbers_timestamp(relation))
     elif action == "update-result":
-        doc.asis(missing_housenumbers_update(relations, relation_name).getvalue())
+        doc.asis(update_jobs.handle_update(relation, "ref-housenumbers").getvalue())
     else:
         # assume view-result
         doc.asis(missing_housenumbers_view_res(relations, request_uri).getvalue())
@@ -382,7 +394,7 @@ def handle_missing_streets(relations: areas.Relations, request_uri: str) -> yatt
             with relation.get_files().get_ref_streets_stream("r") as sock:
                 doc.text(sock.read())
     elif action == "update-result":
-        doc.asis(missing_streets_update(relations, relation_name).getvalue())
+        doc.asis(update_jobs.handle_update(relation, "ref-streets").getvalue())
     else:
         # assume view-result
         doc.asis(missing_streets_view_result(relations, request_uri).getvalue())
@@ -405,10 +417,17 @@ def get_timestamp(path: str) -> float:
         return 0
 
 
+def get_ref_housenumbers_timestamp(relation: areas.Relation) -> float:
+    """Gets the timestamp of the reference house numbers of a relation, without a list in direct mode."""
+    if config.Config.get_bool("reference_housenumbers_direct"):
+        return max(get_timestamp(path) for path in config.Config.get_reference_housenumber_paths())
+    return get_timestamp(relation.get_files().get_ref_housenumbers_path())
+
+
 def ref_housenumbers_last_modified(relations: areas.Relations, name: str) -> str:
     """Gets the update date for missing house numbers."""
     relation = relations.get_relation(name)
-    t_ref = get_timestamp(relation.get_files().get_ref_housenumbers_path())
+    t_ref = get_ref_housenumbers_timestamp(relation)
     t_housenumbers = get_timestamp(relation.get_files().get_osm_housenumbers_path())
     return webframe.format_timestamp(max(t_ref, t_housenumbers))
 
@@ -733,12 +752,26 @@ def our_application_txt(
     return webframe.send_response(start_response, content_type, "200 OK", output, extra_headers)
 
 
+def handle_cache_stats(relations: areas.Relations, _request_uri: str) -> yattag.doc.Doc:
+    """Expected request_uri: e.g. /osm/cache-stats/."""
+    doc = yattag.doc.Doc()
+    doc.asis(webframe.get_toolbar(relations).getvalue())
+    table = [[util.html_escape(_("Statistic")), util.html_escape(_("Value"))]]
+    for key, value in dataset_cache.CACHE.get_stats().items():
+        table.append([util.html_escape(key), util.html_escape(str(value))])
+    doc.asis(util.html_table_from_list(table).getvalue())
+    doc.asis(webframe.get_footer().getvalue())
+    return doc
+
+
 HANDLERS = {
     "/streets/": handle_streets,
     "/missing-streets/": handle_missing_streets,
     "/street-housenumbers/": handle_street_housenumbers,
     "/missing-housenumbers/": handle_missing_housenumbers,
     "/housenumber-stats/": webframe.handle_stats,
+    "/jobs/": update_jobs.handle_job,
+    "/cache-stats/": handle_cache_stats,
 }
 
 
@@ -760,6 +793,7 @@ def our_application(
 
     language = util.setup_localization(environ)
 
+    dataset_cache.CACHE.set_budget(config.Config.get_int("dataset_cache_size"))
     relations = areas.Relations(config.Config.get_workdir())
 
     request_uri = webframe.get_request_uri(environ, relations)